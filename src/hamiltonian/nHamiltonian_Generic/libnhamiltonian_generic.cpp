@@ -402,6 +402,10 @@ void export_nhamiltonian_generic_objects(){
       .def("get_basis_transform", expt_get_basis_transform_v2)
       .def("get_time_overlap_adi", expt_get_time_overlap_adi_v1)
       .def("get_time_overlap_adi", expt_get_time_overlap_adi_v2)
+      .def("get_basis_transform_children", &nHamiltonian::get_basis_transform_children)
+      .def("get_time_overlap_adi_children", &nHamiltonian::get_time_overlap_adi_children)
+      .def("get_hvib_adi_children", &nHamiltonian::get_hvib_adi_children)
+      .def("get_hvib_dia_children", &nHamiltonian::get_hvib_dia_children)
       .def("get_time_overlap_dia", expt_get_time_overlap_dia_v1)
       .def("get_time_overlap_dia", expt_get_time_overlap_dia_v2)
       .def("get_ordering_adi", expt_get_ordering_adi_v1)
@@ -404,6 +404,12 @@ public:
   CMATRIX get_cum_phase_corr();
   CMATRIX get_cum_phase_corr(vector<int>& id_);
 
+  // Stacked matrices of all children: CMATRIX(nchildren * n, m), the child k occupies the rows k*n ... (k+1)*n-1
+  CMATRIX get_basis_transform_children();
+  CMATRIX get_time_overlap_adi_children();
+  CMATRIX get_hvib_adi_children();
+  CMATRIX get_hvib_dia_children();
+
 
 
   ///< In nHamiltonian_compute_diabatic.cpp
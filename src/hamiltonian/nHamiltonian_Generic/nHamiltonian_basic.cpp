@@ -1947,6 +1947,78 @@ CMATRIX nHamiltonian::get_cum_phase_corr(vector<int>& id_){
 
 
 
+///============= Stacked matrices of all children ================
+CMATRIX stack_children_matrices(vector<nHamiltonian*>& children, CMATRIX (nHamiltonian::*getter)(), std::string name){
+/**
+  Collect the matrices of a given type from all children Hamiltonians into a single matrix
+
+  children - the children Hamiltonians
+  getter - the function returning the matrix of a given child
+  name - the name of the calling function, for the error message
+
+  Returns: CMATRIX(nchildren * n, m) - the matrix of the child k (CMATRIX(n, m)) occupies the
+  rows k*n, ... (k+1)*n - 1, so the result can be reshaped to a (nchildren, n, m) array without copying
+*/
+  int nchildren = children.size();
+
+  if(nchildren==0){
+    cout<<"ERROR in "<<name<<": The Hamiltonian has no children\nExiting...\n";
+    exit(0);
+  }
+
+  CMATRIX x( (children[0]->*getter)() );
+  int n = x.n_rows;
+  int nelts = x.n_elts;
+
+  CMATRIX res(nchildren * n, x.n_cols);
+
+  for(int k=0; k<nchildren; k++){
+    if(k>0){ x = (children[k]->*getter)(); }
+    for(int a=0; a<nelts; a++){  res.M[k*nelts + a] = x.M[a];  }
+  }
+
+  return res;
+}
+
+
+CMATRIX nHamiltonian::get_basis_transform_children(){ 
+/**
+  Return the diabatic-to-adiabatic transformation matrices of all children, 
+  stacked into CMATRIX(nchildren * ndia, nadi)
+*/
+  CMATRIX (nHamiltonian::*getter)() = &nHamiltonian::get_basis_transform;
+  return stack_children_matrices(children, getter, "get_basis_transform_children");
+}
+
+CMATRIX nHamiltonian::get_time_overlap_adi_children(){ 
+/**
+  Return the time-overlap matrices in the adiabatic basis of all children, 
+  stacked into CMATRIX(nchildren * nadi, nadi)
+*/
+  CMATRIX (nHamiltonian::*getter)() = &nHamiltonian::get_time_overlap_adi;
+  return stack_children_matrices(children, getter, "get_time_overlap_adi_children");
+}
+
+CMATRIX nHamiltonian::get_hvib_adi_children(){ 
+/**
+  Return the vibronic Hamiltonian matrices in the adiabatic basis of all children, 
+  stacked into CMATRIX(nchildren * nadi, nadi)
+*/
+  CMATRIX (nHamiltonian::*getter)() = &nHamiltonian::get_hvib_adi;
+  return stack_children_matrices(children, getter, "get_hvib_adi_children");
+}
+
+CMATRIX nHamiltonian::get_hvib_dia_children(){ 
+/**
+  Return the vibronic Hamiltonian matrices in the diabatic basis of all children, 
+  stacked into CMATRIX(nchildren * ndia, ndia)
+*/
+  CMATRIX (nHamiltonian::*getter)() = &nHamiltonian::get_hvib_dia;
+  return stack_children_matrices(children, getter, "get_hvib_dia_children");
+}
+
+
+
 
 
 
@@ -21,6 +21,7 @@ __all__ = ["dynamics",
            "data_read",
            "data_savers",
            "data_stat",
+           "data_store",
            "data_visualize",
            "DFTB_methods",
            "dynamics_plotting",
@@ -43,12 +44,14 @@ __all__ = ["dynamics",
            "LoadPT",
            "LoadTRIPOS",
            "LoadUFF",
+           "local_scheduler",
            "namd",
            "normal_modes",
            "nve_md",
            "parse_gamess",
            "pdos",
            "probabilities",
+           "profiling",
            "psi4_methods",
            "QE_methods",
            "QE_utils",
@@ -16,6 +16,9 @@
        The assumption is that data are provided in a matrix form - not vectors, so we can handle the
        data of arbitrary dimensionality
 
+       The ACFs are computed with the zero-padded FFTs (Wiener-Khinchin theorem), in O(N log N)
+       operations, for many time series at once, see `acf_fft`
+
 
 .. moduleauthor:: Brendan Smith, Wei Li, Alexey V. Akimov
 
@@ -25,6 +28,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -33,6 +37,61 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 
 from . import units
 from . import data_stat
+from . import data_conv
+
+
+
+def acf_fft(X, opt=0):
+    """Computes the un-normalized autocorrelation functions of many time series at once
+
+    The correlation sums are obtained as the inverse FFT of the power spectra of the 
+    time series zero-padded to at least twice their length, so there is no periodic wrap-around
+
+    Args:
+        X ( np.array (..., N, ndof) ): the time series of real-valued ndof-dimensional vectors, 
+            the time is the second last axis
+        opt ( int ): selector of the convention to to compute ACF
+
+            * 0 : the chemist convention,  (1/(N-h)) Sum_{t=1,N-h} (Y[t]*Y[t+h])
+            * 1 : the statistician convention, (1/N) Sum_{t=1,N-h} (Y[t]*Y[t+h])
+
+    Returns:
+        np.array (..., N): the ACFs (also divided by ndof, as in `acf_mat`)
+
+    """
+
+    X = np.asarray(X, dtype=float)
+    sz, ndof = X.shape[-2], X.shape[-1]
+
+    nfft = 1
+    while nfft < 2*sz:
+        nfft *= 2
+
+    F = np.fft.rfft(X, n=nfft, axis=-2)
+    total = np.fft.irfft( np.sum( np.abs(F)**2, axis=-1 ), n=nfft, axis=-1 )[..., :sz]
+
+    if opt==0:
+        return total / ( (sz - np.arange(sz)) * ndof )  # less bias, chemistry adopted
+
+    return total / (sz*ndof)      # statistically-preferred option
+
+
+
+def _normalize(autocorr, dt):
+    """
+    Returns the lag times and the normalized ACF, in the format of `acf_mat`
+    """
+
+    sz = len(autocorr)
+
+    norm = 1.0
+    if math.fabs(autocorr[0])>0.0:
+        norm = 1.0/autocorr[0]
+
+    T = [ it*dt for it in range(0,sz) ]
+
+    return T, (norm * autocorr).tolist(), autocorr.tolist()
+
 
 
 def acf_mat(data, dt, opt=0):
@@ -59,35 +118,10 @@ def acf_mat(data, dt, opt=0):
 
     """
 
-    sz = len(data)    # For now, we will use the full data set 
-
-                      ###               how many elements we have in the time series
-                      ###  old comments we use only a half of the point, because of the 
-                      ###               poorer statistics we get otherwise
-    autocorr = []
-    ndof = data[0].num_of_rows
-
-    for i in range(0,sz):
-        total = 0.0
-        for j in range(0,sz-i):
-            total += (data[j].T()*data[j+i]).get(0)   # scalar product
-        if opt==0:
-            autocorr.append( total/((sz-i)*ndof) )  # less bias, chemistry adopted
-        elif opt==1:
-            autocorr.append( total/(sz*ndof) )      # statistically-preferred option
-
-    #normalize the ACF	
-    nautocorr = []
-    norm = 1.0
-    if math.fabs(autocorr[0])>0.0:
-        norm = 1.0/autocorr[0]
-
-    T = []
-    for it in range(0,sz):
-        T.append(it*dt)
-        nautocorr.append( norm * autocorr[it] )
+    # For now, we will use the full data set 
+    X = np.array( [ data_conv.nparray_view(x)[:, 0] for x in data ] )
 
-    return T, nautocorr, autocorr
+    return _normalize( acf_fft(X, opt), dt )
 
 
 
@@ -116,33 +150,8 @@ def acf_vec(data, dt, opt=0):
 
     """
 
-    sz = len(data)    # For now, we will use the full data set 
-
-                      ###               how many elements we have in the time series
-                      ###  old comments we use only a half of the point, because of the 
-                      ###               poorer statistics we get otherwise
-    autocorr = []
-    ndof = 3.0
-
-    for i in range(0,sz):
-        total = 0.0
-        for j in range(0,sz-i):
-            total += data[j]*data[j+i]  # scalar product
-        if opt==0:
-            autocorr.append( total/((sz-i)*ndof) )  # less bias, chemistry adopted
-        elif opt==1:
-            autocorr.append( total/(sz*ndof) )      # statistically-preferred option
-
-    #normalize the ACF	
-    nautocorr = []
-    norm = 1.0
-    if math.fabs(autocorr[0])>0.0:
-        norm = 1.0/autocorr[0]
-
-    T = []
-    for it in range(0,sz):
-        T.append(it*dt)
-        nautocorr.append( norm * autocorr[it] )
+    # For now, we will use the full data set 
+    X = np.array( [ [ x.x, x.y, x.z ] for x in data ] )
 
-    return T, nautocorr, autocorr
+    return _normalize( acf_fft(X, opt), dt )
 
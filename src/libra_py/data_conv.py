@@ -331,6 +331,42 @@ def list2MATRIX(data):
     return res
 
 
+def nparray_view(data):
+    """
+    Returns a 2D np.array that shares the memory with a MATRIX, CMATRIX, or IMATRIX object.
+    No data is copied, so this is the cheapest way to access the matrix elements from Python.
+    Modifying the elements of the returned array modifies the matrix and vice versa.
+
+    Args:
+        data ( MATRIX(N, M), CMATRIX(N, M), or IMATRIX(N, M) ): the matrix to be viewed
+
+    Returns:
+        2D np.array of shape ( N, M ): the view of the matrix elements, the dtype is
+            float, complex, or np.intc for MATRIX, CMATRIX, and IMATRIX, respectively
+
+    Note:
+        The view becomes invalid if the matrix is re-initialized (e.g. with `Init`).
+        Use `MATRIX2nparray` if an independent copy of the data is needed
+
+    """
+
+    N = data.num_of_rows
+    M = data.num_of_cols
+
+    if isinstance(data, CMATRIX):
+        dtype = complex
+    elif isinstance(data, IMATRIX):
+        dtype = np.intc
+    else:
+        dtype = float
+
+    if N * M == 0:
+        return np.zeros((N, M), dtype)
+
+    return np.frombuffer(data.buffer(), dtype=dtype).reshape(N, M)
+
+
+
 def nparray2MATRIX(data):
     """
     Converts 2D np.array of shape( N, M ) doubles into a MATRIX( N, M ) object
@@ -347,10 +383,7 @@ def nparray2MATRIX(data):
     M = data.shape[1]
     
     res = MATRIX(N,M)
-    
-    for n in range(0,N):
-        for m in range(0,M):
-            res.set(n, m, data[n][m].real)
+    nparray_view(res)[:, :] = np.real(data)
 
     return res
 
@@ -371,10 +404,7 @@ def nparray2CMATRIX(data):
     M = data.shape[1]
 
     res = CMATRIX(N,M)
-
-    for n in range(0,N):
-        for m in range(0,M):
-            res.set(n, m, data[n][m])
+    nparray_view(res)[:, :] = data
 
     return res
 
@@ -393,17 +423,33 @@ def MATRIX2nparray( data ):
     
     """
 
-    N = data.num_of_rows
-    M = data.num_of_cols
-    
-    res = []
-    
-    for n in range(0,N):
-        res.append( [] )
-        for m in range(0,M):
-            res[n].append(data.get(n,m))
+    return np.array(nparray_view(data))
+
+
+
+def matrices2nparray( data ):
+    """
+    Converts a list of K Libra MATRIX ( N, M ) or CMATRIX ( N, M ) objects (e.g. a CMATRIXList)
+    into a 3D np.array of shape( K, N, M )
+
+    Args:
+        data ( list of K MATRIX(N, M) or CMATRIX(N, M) ): data to be converted
+    Returns:
+        3D np.array: 3D np.array of shape( K, N, M )
+
+    """
+
+    K = len(data)
+    if K == 0:
+        return np.zeros((0, 0, 0))
+
+    x = nparray_view(data[0])
+    res = np.empty( (K,) + x.shape, x.dtype )
 
-    return np.array(res)
+    for k in range(K):
+        res[k] = nparray_view(data[k])
+
+    return res
 
 
 
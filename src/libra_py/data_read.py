@@ -30,6 +30,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 
 #import common_utils as comn
 import util.libutil as comn
+import libra_py.data_store as data_store
 
     
 def get_matrix(nrows, ncols, filename_re, filename_im, act_sp):
@@ -97,6 +98,10 @@ def get_data(params):
             * **params["data_im_prefix"]** ( string ): prefixes of the files with imaginary part of the data [Required!]
             * **params["data_re_suffix"]** ( string ): suffixes of the files with real part of the Hvib(t) [default: "_re"]
             * **params["data_im_suffix"]** ( string ): suffixes of the files with imaginary part of the Hvib(t) [default: "_im"]
+            * **params["store_filename"]** ( string or None ): the name of the HDF5 file with the data (see `data_store`).
+                If None, the data is read from the text files [default: None]
+            * **params["dataset_name"]** ( string or None ): the name of the dataset in the HDF5 file, 
+                None - `data_store.dataset_name(params["data_re_prefix"])` [default: None]
 
     Returns:
         list of CMATRIX objects: data: 
@@ -115,13 +120,27 @@ def get_data(params):
 
         >>> hvib = get_data({"data_dim":4, "isnap":0, "fsnap":10, "data_re_prefix":"Hvib", "data_im_prefix":"Hvib", "active_space":[0,1]})
 
+        The same, but the data is read from the dataset "Hvib" of the file "data.h5" (e.g. converted from the text files 
+        with `data_store.convert_text_data`):
+
+        >>> hvib = get_data({"data_dim":4, "isnap":0, "fsnap":10, "data_re_prefix":"Hvib", "data_im_prefix":"Hvib", "active_space":[0,1],
+                             "store_filename":"data.h5"})
+
 
     """
 
     critical_params = ["data_dim", "isnap", "fsnap", "data_re_prefix", "data_im_prefix"]
-    default_params = { "data_re_suffix":"_re", "data_im_suffix":"_im", "active_space":range(params["data_dim"])}
+    default_params = { "data_re_suffix":"_re", "data_im_suffix":"_im", "active_space":range(params["data_dim"]),
+                       "store_filename":None, "dataset_name":None }
     comn.check_input(params, default_params, critical_params)
 
+    if params["store_filename"]!=None:
+        name = params["dataset_name"]
+        if name==None:
+            name = data_store.dataset_name(params["data_re_prefix"])
+        return data_store.get_matrices(params["store_filename"], name, list(params["active_space"]), 
+                                       params["isnap"], params["fsnap"])
+
     ndim = params["data_dim"]  # the number of cols/row in the input files
 
     data = []
@@ -176,6 +195,11 @@ def get_data_sets(params):
         >>> params["data_im_prefix"] = "Hvib_"
         >>> params["data_im_suffix"] = "_im"
 
+        If the data sets are stored in the HDF5 files (see `data_store`), e.g. "/home/alexeyak/test/step3/res0/data.h5", 
+        also set:
+
+        >>> params["store_filename"] = "data.h5"
+
     """
 
     critical_params = [ "data_set_paths" ] 
@@ -188,6 +212,8 @@ def get_data_sets(params):
         prms = dict(params)    
         prms.update({"data_re_prefix": idata+params["data_re_prefix"] })
         prms.update({"data_im_prefix": idata+params["data_im_prefix"] })                
+        if "store_filename" in params and params["store_filename"]!=None:
+            prms.update({"store_filename": idata+params["store_filename"] })
 
         data_i = get_data(prms)  
         data.append(data_i)
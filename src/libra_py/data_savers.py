@@ -17,6 +17,7 @@
 
            * class mem_saver
            * class hdf5_saver
+           * class hdf5_buffered_saver
 
        List of functions:
 
@@ -26,6 +27,7 @@
            * save_hdf5_2D(saver, i, states)
            * save_hdf5_3D(saver, i, pops, dm_adi, dm_dia, q, p, Cadi, Cdia)
            * save_hdf5_4D(saver, i, tr, hvib_adi, hvib_dia, St, U, projector)
+           * save_hdf5_4D_batch(saver, i, hvib_adi, hvib_dia, St, U, projectors)
 
            # HEOM
            * heom_init_hdf5(saver, hdf5_output_level, _nsteps, _nquant)
@@ -58,6 +60,7 @@ import os
 import sys
 import math
 import copy
+import atexit
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -67,6 +70,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 import util.libutil as comn
 from . import units
 from . import data_read
+from . import data_conv
 
 
 class mem_saver:
@@ -100,6 +104,10 @@ class mem_saver:
         
         # "Numpy" data - elements are numpy arrays
         self.np_data = {}
+
+        # The range of records [first, last+1) of each numpy data set changed since 
+        # the last call of `save_new_data`
+        self.new_records = {}
         
         
         # Only initialize the "raw" data, don't touch the numpy
@@ -161,6 +169,7 @@ class mem_saver:
 
         if data_name in self.keywords and data_name in self.np_data.keys():
             self.np_data[data_name][istep] = _data
+            self._add_record(data_name, istep)
             
             
     def save_multi_scalar(self, istep, iscal, data_name, _data):
@@ -170,6 +179,7 @@ class mem_saver:
 
         if data_name in self.keywords and data_name in self.np_data.keys():            
             self.np_data[data_name][istep, iscal] = _data
+            self._add_record(data_name, istep)
 
         
     def save_matrix(self, istep, data_name, _data):
@@ -188,9 +198,8 @@ class mem_saver:
 
             nx, ny = _data.num_of_rows, _data.num_of_cols
 
-            for i in range(nx):
-                for j in range(ny):
-                    self.np_data[data_name][istep, i, j] = _data.get(i, j)
+            self.np_data[data_name][istep, 0:nx, 0:ny] = data_conv.nparray_view(_data)
+            self._add_record(data_name, istep)
 
 
     def save_multi_matrix(self, istep, imatrix, data_name, _data):
@@ -209,9 +218,40 @@ class mem_saver:
 
             nx, ny = _data.num_of_rows, _data.num_of_cols
 
-            for i in range(nx):
-                for j in range(ny):
-                    self.np_data[data_name][istep, imatrix, i, j] = _data.get(i, j)
+            self.np_data[data_name][istep, imatrix, 0:nx, 0:ny] = data_conv.nparray_view(_data)
+            self._add_record(data_name, istep)
+
+
+    def save_matrix_stack(self, istep, data_name, _data):
+        """          
+        Saves a whole series of matrices at once
+
+        Args:
+        
+          istep ( int ) :  index of the timestep for the data
+          data_name ( string ) : how to call this data set internally
+          _data ( 3D np.array of shape (nmat, nx, ny) ) : the actual data to save
+           
+        """
+
+        if data_name in self.keywords and data_name in self.np_data.keys():
+
+            nmat, nx, ny = _data.shape
+
+            self.np_data[data_name][istep, 0:nmat, 0:nx, 0:ny] = _data
+            self._add_record(data_name, istep)
+
+
+    def _add_record(self, data_name, istep):
+        """
+        Extends the range of the changed records of the data set `data_name` to include the record `istep`
+        """
+
+        if data_name in self.new_records:
+            first, last = self.new_records[data_name]
+            self.new_records[data_name] = (min(first, istep), max(last, istep+1))
+        else:
+            self.new_records[data_name] = (istep, istep+1)
                         
 
     
@@ -249,9 +289,61 @@ class mem_saver:
                     print(F"{data_name} is not in the list {self.np_data.keys()}" )
 
 
+    def save_new_data(self, filename, data_names, mode="a"):
+        """
+        To write into the HDF5 file only the records of the numpy data changed since the previous call, 
+        rather than all the data as `save_data` does, e.g. to save the data periodically during a long 
+        calculation. The data sets missing in the file are created with their full shapes; the records 
+        that have not been written yet are zeros
+
+        Args:
+            filename (string): the name of the HDF5 file where to save the data
+            data_names (list of strings): the list of the names of the data sets to save
+            mode ("w" or "a"): whether to start a new file or to update the existing one [ default: "a" ]
+
+        """
+
+        with h5py.File(filename, mode) as f:
+
+            for data_name in data_names:
+                if data_name in self.np_data.keys():
+                    x = self.np_data[data_name]
+
+                    if data_name in f and f[F"{data_name}/data"].shape != x.shape:
+                        del f[data_name]
+
+                    if data_name not in f:
+                        g = f.create_group(data_name)
+                        g.create_dataset("data", shape=x.shape, dtype=x.dtype)
+
+                    if data_name in self.new_records:
+                        first, last = self.new_records.pop(data_name)
+                        f[F"{data_name}/data"][first:last] = x[first:last]
+
+
+    def load_data(self, filename):
+        """
+        To read back the numpy data saved by `save_data` into the already initialized (see `add_dataset`) 
+        arrays, e.g. to continue the calculations that have been interrupted
+
+        Args:
+            filename (string): the name of the HDF5 file with the data
+
+        """
+
+        with h5py.File(filename, "r") as f:
+            for data_name in self.np_data.keys():
+                if data_name in f:
+                    x = f[F"{data_name}/data"]
+                    if x.shape == self.np_data[data_name].shape:
+                        self.np_data[data_name][:] = x[()]
+                    else:
+                        print(F"WARNING: the shape of the dataset {data_name} in the file {filename} is {x.shape}, expected {self.np_data[data_name].shape}, skipping it")
+
+
 class hdf5_saver:
 
-    def __init__(self, _filename, _keywords=[]):
+    def __init__(self, _filename, _keywords=[], _mode="w"):
         """
         The constructor of the class objects
 
@@ -261,6 +353,8 @@ class hdf5_saver:
                 the `data_name` argument in any of the `save_*` functions doesn't exist 
                 in the provided list of keywords, the data will not be actually saved into
                 the HDF5 file
+            _mode ( "w" or "a" ): whether to create a new file or to keep writing into
+                an existing one [ default: "w" ]
 
         Example:
             saver = hdf5_saver("data.hdf")
@@ -275,14 +369,29 @@ class hdf5_saver:
         self.r_compression_level = 4
         self.i_compression_level = 9
 
-        with h5py.File(self.filename, "w") as f:
-            g = f.create_group("default")
-            g.create_dataset("data", data=[])
+        with h5py.File(self.filename, _mode) as f:
+            if "default" not in f:
+                g = f.create_group("default")
+                g.create_dataset("data", data=[])
 
         print("HDF5 saver is initialized...")
         print(F"the datasets that can be saved are: {self.keywords}")
 
 
+    def flush(self):
+        """
+        Nothing to do here - every `save_*` call writes directly to the file
+        """
+        pass
+
+
+    def close(self):
+        """
+        Nothing to do here - the file is reopened and closed in every `save_*` call
+        """
+        pass
+
+
     def add_keywords(self, _keywords):
 
         for keyword in _keywords:
@@ -328,6 +437,10 @@ class hdf5_saver:
         """
 
         with h5py.File(self.filename, "a") as f:
+            if data_set_name in f:
+                # Reuse the existing dataset, e.g. when appending to an existing file
+                return
+
             g = f.create_group(data_set_name)
             g.attrs["dim"] = dim
             g.attrs["data_type"] = data_type
@@ -380,10 +493,7 @@ class hdf5_saver:
             nx, ny = data.num_of_rows, data.num_of_cols
 
             with h5py.File(self.filename, "a") as f:
-      
-                for i in range(nx):
-                    for j in range(ny):
-                        f[F"{data_name}/data"][istep, i, j] = data.get(i, j)
+                f[F"{data_name}/data"][istep, 0:nx, 0:ny] = data_conv.nparray_view(data)
 
 
 
@@ -402,9 +512,321 @@ class hdf5_saver:
             nx, ny = data.num_of_rows, data.num_of_cols
 
             with h5py.File(self.filename, "a") as f:
+                f[F"{data_name}/data"][istep, imatrix, 0:nx, 0:ny] = data_conv.nparray_view(data)
 
-                for i in range(nx):
-                    for j in range(ny):
-                        f[F"{data_name}/data"][istep, imatrix, i, j] = data.get(i, j)
 
 
+    def save_matrix_stack(self, istep, data_name, data):
+        """          
+          Add a whole series of matrices at once
+
+          istep ( int ) :  index of the timestep for the data
+          data_name ( string ) : how to call this data set internally
+          data ( 3D np.array of shape (nmat, nx, ny) ) : the actual data to save
+           
+        """
+
+        if data_name in self.keywords:
+
+            nmat, nx, ny = data.shape
+
+            with h5py.File(self.filename, "a") as f:
+                f[F"{data_name}/data"][istep, 0:nmat, 0:nx, 0:ny] = data
+
+
+
+class hdf5_buffered_saver:
+    """
+    This class is a faster alternative to the `hdf5_saver` class.
+
+    Unlike `hdf5_saver`, it keeps the HDF5 file open for the whole run and accumulates
+    the data for each dataset in an in-memory buffer that holds up to `buffer_size` consecutive
+    time steps. Once a step outside of the current buffer window is saved (or when `flush`
+    or `close` are called), the whole block is written into the file with a single write
+    operation. The datasets are chunked along the time axis, with chunks matching the buffer
+    window, so each flush writes exactly one chunk.
+
+    The buffer of a dataset is limited to `chunk_bytes` (4 MB), or to a single time step if
+    one step is larger than that: for the large datasets (e.g. the matrices of many trajectories)
+    the buffer window, and the chunk, hold fewer than `buffer_size` steps, so the memory used
+    by the saver stays bounded.
+
+    The file layout is the same as that of the `hdf5_saver`, so this class can be used as
+    a drop-in replacement for it. The data are flushed to disk at least every `buffer_size` steps
+    and at the interpreter exit, so if the calculations crash, at most `buffer_size` last steps
+    are lost.
+
+    Example of usage:
+
+        saver = hdf5_buffered_saver("data.hdf", ["time", "q"], 100)
+        saver.add_dataset("time", (nsteps,), "R")
+        saver.add_dataset("q", (nsteps, ntraj, ndof), "R")
+
+        for step in range(nsteps):
+            saver.save_scalar(step, "time", step*dt)
+            saver.save_matrix(step, "q", q.T())
+
+        saver.close()
+
+    """
+
+    def __init__(self, _filename, _keywords=[], _buffer_size=100, _mode="w"):
+        """
+        The constructor of the class objects
+
+        Args:
+            _filename ( string ): the name of the HDF5 file to be created
+            _keywords ( list of strings ): the names of the data to be added, if the
+                the `data_name` argument in any of the `save_*` functions doesn't exist
+                in the provided list of keywords, the data will not be actually saved into
+                the HDF5 file
+            _buffer_size ( int ): the maximal number of time steps kept in memory for each dataset
+                before they are written to the file; the buffer of a dataset is also limited to
+                `chunk_bytes` [ default: 100 ]
+            _mode ( "w" or "a" ): whether to create a new file or to keep writing into
+                an existing one [ default: "w" ]
+
+        """
+
+        self.keywords = list(_keywords)
+
+        self.filename = _filename
+        self.buffer_size = max(1, int(_buffer_size))
+        self.use_compression = 1
+        self.c_compression_level = 4
+        self.r_compression_level = 4
+        self.i_compression_level = 9
+
+        # Target size of a single chunk, and the maximal size of a buffer [ bytes ]
+        self.chunk_bytes = 4 * 1024 * 1024
+
+        # Per-dataset buffers, their lengths (the number of time steps), the index of the
+        # first step in the buffer window, and the range of the buffer rows modified since
+        # the last flush
+        self.buffers = {}
+        self.buffer_len = {}
+        self.buffer_start = {}
+        self.dirty = {}
+
+        self.f = h5py.File(self.filename, _mode)
+        if "default" not in self.f:
+            g = self.f.create_group("default")
+            g.create_dataset("data", data=[])
+
+        atexit.register(self.close)
+
+        print("Buffered HDF5 saver is initialized...")
+        print(F"the datasets that can be saved are: {self.keywords}")
+
+
+    def add_keywords(self, _keywords):
+
+        for keyword in _keywords:
+
+            if keyword not in self.keywords:
+                self.keywords.append(keyword)
+
+
+    def set_compression_level(self, _use_compression, _compression_level):
+        """
+        To control how much of data compression we want to exercise
+
+        """
+
+        self.use_compression = _use_compression;
+        self.c_compression_level = _compression_level[0]
+        self.r_compression_level = _compression_level[1]
+        self.i_compression_level = _compression_level[2]
+
+
+    def add_dataset(self, data_set_name, dim, data_type):
+        """
+
+        Args:
+
+            data_set_name ( string ): the name of the data set
+            dim  ( tuple ) : dimensions of the data set, the first dimension is the time axis
+            data_type ["C", "R", "I"] : for complex, real, or integer
+
+        See the `hdf5_saver.add_dataset` for an example of usage
+
+        """
+
+        dtypes = {"C":complex, "R":float, "I":int}
+        levels = {"C":self.c_compression_level, "R":self.r_compression_level, "I":self.i_compression_level}
+
+        if data_type not in dtypes.keys():
+            print(F"ERROR: the dtype = {data_type} is not allowed in add_dataset")
+            return
+
+        dtype = np.dtype(dtypes[data_type])
+
+        # Chunks span several time steps but contain complete "frames"; the buffer window
+        # is one chunk, so it is limited by `chunk_bytes` too
+        row_bytes = dtype.itemsize
+        for d in dim[1:]:
+            row_bytes = row_bytes * d
+        nt = max(1, min(self.buffer_size, dim[0], self.chunk_bytes // max(1, row_bytes)))
+        chunks = (nt,) + tuple(dim[1:])
+
+        if data_set_name in self.f:
+            # Reuse the existing dataset, e.g. when appending to an existing file
+            g = self.f[data_set_name]
+        else:
+            g = self.f.create_group(data_set_name)
+            g.attrs["dim"] = dim
+            g.attrs["data_type"] = data_type
+
+            if self.use_compression==1:
+                g.create_dataset("data", dim, dtype=dtype, maxshape=dim, chunks=chunks,
+                                 compression="gzip", compression_opts = levels[data_type])
+            else:
+                g.create_dataset("data", dim, dtype=dtype, maxshape=dim, chunks=chunks)
+
+        self.buffers[data_set_name] = np.zeros((nt,) + tuple(dim[1:]), dtype=dtype)
+        self.buffer_len[data_set_name] = nt
+        self.buffer_start[data_set_name] = None
+        self.dirty[data_set_name] = None
+
+
+    def _flush_dataset(self, data_name):
+        """
+        Writes the modified rows of the buffer of a given dataset to the file
+        """
+
+        if self.dirty[data_name] == None:
+            return
+
+        lo, hi = self.dirty[data_name]
+        start = self.buffer_start[data_name]
+        self.f[F"{data_name}/data"][start + lo : start + hi + 1] = self.buffers[data_name][lo : hi + 1]
+        self.dirty[data_name] = None
+
+
+    def _row(self, istep, data_name):
+        """
+        Returns the buffer row for the time step `istep`, moving the buffer window
+        (and flushing the previous one) if needed
+        """
+
+        start = self.buffer_start[data_name]
+        buf = self.buffers[data_name]
+        nt = self.buffer_len[data_name]
+
+        if start == None or istep < start or istep >= start + nt:
+
+            if self.dirty[data_name] != None:
+                self._flush_dataset(data_name)
+                self.f.flush()
+
+            # The new window begins at the block that contains istep; the rows that
+            # already exist in the file are loaded, so partial updates don't erase them
+            start = (istep // nt) * nt
+            ds = self.f[F"{data_name}/data"]
+            n = min(nt, ds.shape[0] - start)
+            buf[:n] = ds[start : start + n]
+            self.buffer_start[data_name] = start
+
+        indx = istep - start
+
+        if self.dirty[data_name] == None:
+            self.dirty[data_name] = (indx, indx)
+        else:
+            lo, hi = self.dirty[data_name]
+            self.dirty[data_name] = (min(lo, indx), max(hi, indx))
+
+        return indx
+
+
+    def save_scalar(self, istep, data_name, data):
+
+        if data_name in self.keywords and data_name in self.buffers.keys():
+            indx = self._row(istep, data_name)
+            self.buffers[data_name][indx] = data
+
+
+    def save_multi_scalar(self, istep, iscal, data_name, data):
+
+        if data_name in self.keywords and data_name in self.buffers.keys():
+            indx = self._row(istep, data_name)
+            self.buffers[data_name][indx, iscal] = data
+
+
+    def save_matrix(self, istep, data_name, data):
+        """
+          Add a matrix
+
+          istep ( int ) :  index of the timestep for the data
+          data_name ( string ) : how to call this data set internally
+          data ( (C)MATRIX(nx, ny) ) : the actual data to save
+
+        """
+
+        if data_name in self.keywords and data_name in self.buffers.keys():
+
+            nx, ny = data.num_of_rows, data.num_of_cols
+            indx = self._row(istep, data_name)
+            self.buffers[data_name][indx, 0:nx, 0:ny] = data_conv.nparray_view(data)
+
+
+    def save_multi_matrix(self, istep, imatrix, data_name, data):
+        """
+          Add a matrix
+
+          istep ( int ) :  index of the timestep for the data
+          imatrix ( int ) : index of the matrix in the series (e.g. trajectory index)
+          data_name ( string ) : how to call this data set internally
+          data ( (C)MATRIX(nx, ny) ) : the actual data to save
+
+        """
+
+        if data_name in self.keywords and data_name in self.buffers.keys():
+
+            nx, ny = data.num_of_rows, data.num_of_cols
+            indx = self._row(istep, data_name)
+            self.buffers[data_name][indx, imatrix, 0:nx, 0:ny] = data_conv.nparray_view(data)
+
+
+    def save_matrix_stack(self, istep, data_name, data):
+        """
+          Add a whole series of matrices at once
+
+          istep ( int ) :  index of the timestep for the data
+          data_name ( string ) : how to call this data set internally
+          data ( 3D np.array of shape (nmat, nx, ny) ) : the actual data to save
+
+        """
+
+        if data_name in self.keywords and data_name in self.buffers.keys():
+
+            nmat, nx, ny = data.shape
+            indx = self._row(istep, data_name)
+            self.buffers[data_name][indx, 0:nmat, 0:nx, 0:ny] = data
+
+
+    def flush(self):
+        """
+        Writes all the buffered data to the file and flushes the file to disk
+        """
+
+        if self.f == None:
+            return
+
+        for data_name in self.buffers.keys():
+            self._flush_dataset(data_name)
+
+        self.f.flush()
+
+
+    def close(self):
+        """
+        Writes all the buffered data and closes the file. It is safe to call this
+        function several times
+        """
+
+        if self.f == None:
+            return
+
+        self.flush()
+        self.f.close()
+        self.f = None
@@ -21,6 +21,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -29,6 +30,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 
 #import common_utils as comn
 import util.libutil as comn
+import libra_py.data_conv as data_conv
 
 
 
@@ -237,46 +239,12 @@ def mat_stat(X):
 
     """
 
-    N = len(X)
-    res = MATRIX(X[0]); res *= 0.0
-
-    #===== Average ====
-    for i in range(0,N):
-        res = res + X[i]
-    res = res / float(N)
-
-
-    #===== Std ========
-    res2 = MATRIX(X[0]); res2 *= 0.0
-
-    for a in range(0,res2.num_of_rows):
-        for b in range(0,res2.num_of_cols):
-        
-            tmp = 0.0
-            for i in range(0,N):
-                tmp = tmp + (X[i].get(a,b) - res.get(a,b))**2
-            tmp = math.sqrt( tmp / float(N) )
-
-            res2.set(a,b, tmp)
-
-    # Find maximal and minimal values
-    up_bound = MATRIX(X[0]); up_bound *= 0.0
-    dw_bound = MATRIX(X[0]); dw_bound *= 0.0
-
-
-    for a in range(0,res2.num_of_rows):
-        for b in range(0,res2.num_of_cols):
-
-            up_bound.set(a,b, X[0].get(a,b))
-            dw_bound.set(a,b, X[0].get(a,b))
-
-            for i in range(0,N):
-                xab = X[i].get(a,b)
-                if xab > up_bound.get(a,b):
-                    up_bound.set(a,b, xab)
-                if xab < dw_bound.get(a,b):
-                    dw_bound.set(a,b,xab)
+    x = data_conv.matrices2nparray(X)
 
+    res = data_conv.nparray2MATRIX( np.mean(x, axis=0) )
+    res2 = data_conv.nparray2MATRIX( np.std(x, axis=0) )
+    dw_bound = data_conv.nparray2MATRIX( np.min(x, axis=0) )
+    up_bound = data_conv.nparray2MATRIX( np.max(x, axis=0) )
 
     return res, res2, dw_bound, up_bound
 
@@ -511,4 +479,212 @@ def bootstrapping(X, nB, rnd):
 
 
 
+class running_stat:
+    """
+    Streaming (one-pass) mean, variance and bounds of a sequence of arrays of the same shape.
+    The samples can be added one at a time, with the Welford's algorithm, or in chunks, whose
+    statistics are merged with those accumulated so far (Chan et al.). Only the current mean,
+    the sum of the squared deviations, and the bounds are stored, not the samples themselves
+
+    Example of usage:
+
+        x = running_stat((ntraj, ndof))
+        for step in range(nsteps):
+            x.add( q_step )   # np.array of shape (ntraj, ndof)
+
+        print(x.mean, x.variance())
+
+        y = running_stat((nstates, nstates))
+        for chunk in chunks:
+            y.add_chunk( chunk )   # np.array of shape (nsamples, nstates, nstates)
+
+        print(y.mean, y.std(), y.min, y.max)
+
+    """
+
+    def __init__(self, shape=(), dtype=float):
+        """
+        Args:
+            shape ( tuple of ints ): the shape of each sample
+            dtype ( float or complex ): the type of the data
+
+        """
+
+        self.count = 0
+        self.mean = np.zeros(shape, dtype)
+        self.m2 = np.zeros(shape, float)
+        self.min = np.full(shape, np.inf, dtype)
+        self.max = np.full(shape, -np.inf, dtype)
+
+
+    def add(self, x):
+        """
+        Adds a new sample ( np.array of `shape` ) to the statistics
+        """
+
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+
+        # For complex data, this gives the variance defined as <|x - <x>|^2>
+        self.m2 += (np.conj(delta) * (x - self.mean)).real
+        self.min = np.minimum(self.min, x)
+        self.max = np.maximum(self.max, x)
+
+
+    def merge(self, count, mean, m2, xmin, xmax):
+        """
+        Merges the statistics of another set of samples into these statistics
+
+        Args:
+            count ( int ): the number of samples in the other set
+            mean ( np.array of `shape` ): the mean of the other set
+            m2 ( np.array of `shape` ): the sum of the squared deviations from the mean in the other set
+            xmin, xmax ( np.array of `shape` ): the bounds of the other set
+
+        """
+
+        if count==0:
+            return
+
+        n = self.count + count
+        delta = mean - self.mean
+
+        self.mean = self.mean + delta * (count / n)
+        self.m2 = self.m2 + m2 + (np.conj(delta) * delta).real * (self.count * count / n)
+        self.min = np.minimum(self.min, xmin)
+        self.max = np.maximum(self.max, xmax)
+        self.count = n
+
+
+    def add_chunk(self, X):
+        """
+        Adds the samples X ( np.array of shape (nsamples, `shape`) ) to the statistics
+        """
+
+        if X.shape[0]==0:
+            return
+
+        mean = np.mean(X, axis=0)
+        delta = X - mean
+        m2 = np.sum( (np.conj(delta) * delta).real, axis=0)
+
+        self.merge(X.shape[0], mean, m2, np.min(X, axis=0), np.max(X, axis=0))
+
+
+    def variance(self):
+        """
+        Returns the (population) variance of the data accumulated so far
+        """
+
+        if self.count == 0:
+            return np.zeros(self.m2.shape)
+
+        return self.m2 / self.count
+
+
+    def std(self):
+        """
+        Returns the (population) standard deviation of the data accumulated so far
+        """
+
+        return np.sqrt(self.variance())
+
+
+
+class running_histogram:
+    """
+    Streaming histogram of integer-valued data (e.g. active states of trajectories).
+    Each row of the histogram is updated independently, so one can accumulate the 
+    time spent by each trajectory in each state
+
+    Example of usage:
+
+        h = running_histogram(ntraj, nstates)
+        for step in range(nsteps):
+            h.add( states )   # list of ntraj ints
+
+        print(h.counts)
+
+    """
+
+    def __init__(self, nrows, nbins):
+        """
+        Args:
+            nrows ( int ): the number of rows (e.g. trajectories)
+            nbins ( int ): the number of bins (e.g. states)
+
+        """
+
+        self.count = 0
+        self.counts = np.zeros((nrows, nbins), int)
+
+
+    def add(self, x):
+        """
+        Adds the values ( list of `nrows` ints ) - one for each row
+        """
+
+        self.count += 1
+        self.counts[np.arange(self.counts.shape[0]), np.asarray(x, dtype=int)] += 1
+
+
+    def probabilities(self):
+        """
+        Returns the histogram normalized to 1 in each row
+        """
+
+        return self.counts / float(max(self.count, 1))
+
+
+
+class binned_average:
+    """
+    Streaming time-binned averages: the samples added at steps [k*bin_size, (k+1)*bin_size)
+    are averaged together into the k-th bin
+
+    Example of usage:
+
+        x = binned_average(nsteps, 10, (nstates,))
+        for step in range(nsteps):
+            x.add(step, pops)     # np.array of shape (nstates,)
+
+        print(x.average())        # np.array of shape (nsteps//10, nstates)
+
+    """
+
+    def __init__(self, nsteps, bin_size, shape=(), dtype=float):
+        """
+        Args:
+            nsteps ( int ): the total number of steps
+            bin_size ( int ): the number of steps in a bin
+            shape ( tuple of ints ): the shape of each sample
+            dtype ( float or complex ): the type of the data
+
+        """
+
+        self.bin_size = max(1, int(bin_size))
+        nbins = (nsteps + self.bin_size - 1) // self.bin_size
+
+        self.sums = np.zeros((nbins,) + tuple(shape), dtype)
+        self.counts = np.zeros(nbins, int)
+
+
+    def add(self, step, x):
+        """
+        Adds a sample ( np.array of `shape` ) taken at the step `step`
+        """
+
+        k = step // self.bin_size
+        self.sums[k] += x
+        self.counts[k] += 1
+
+
+    def average(self):
+        """
+        Returns the bin-averaged data, the bins with no samples contain zeros
+        """
+
+        cnt = np.maximum(self.counts, 1).reshape( (-1,) + (1,)*(self.sums.ndim - 1) )
 
+        return self.sums / cnt
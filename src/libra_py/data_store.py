@@ -0,0 +1,407 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 2 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#***********************************************************************************
+"""
+.. module:: data_store
+   :platform: Unix, Windows
+   :synopsis: This module implements the storage of time series of matrices (e.g. the vibronic Hamiltonians,
+       overlaps, and time-overlaps produced by the NBRA workflows) in a single HDF5 file, as an alternative
+       to the pairs of text files "<prefix><step>_re" and "<prefix><step>_im" for every time step
+
+       Every quantity is stored as a complex dataset of shape (nsteps, nrows, ncols) named after the quantity
+       (see `dataset_name`), indexed by the time step, so dataset[istep] is the matrix that would be stored
+       in the files "<prefix><istep>_re" and "<prefix><istep>_im". By default, the datasets are chunked along
+       the time axis and compressed, so they can be extended step by step (see `append_matrix`). The datasets
+       written without compression (see `save_matrices`) are stored contiguously and can be memory-mapped
+       (see `open_matrices`)
+
+       List of functions:
+
+           * dataset_name(prefix)
+           * append_matrix(filename, name, istep, X, compression="gzip", chunk_size=64)
+           * append_matrices(filename, name, istart, data, compression="gzip", chunk_size=64)
+           * write_matrix(X, prefix, istep, output_format=0, store_filename="data.h5", imag=True)
+           * save_matrices(filename, name, data, istart=0, compression="gzip", chunk_size=64)
+           * num_steps(filename, name)
+           * remove_matrices(filename, name)
+           * read_matrices(filename, name, act_sp=None, start=0, stop=None)
+           * get_matrices(filename, name, act_sp=None, start=0, stop=None)
+           * open_matrices(filename, name)
+           * convert_text_data(params)
+
+       Example of usage:
+
+           # Convert the text files res0/hvib_dia_0_re, res0/hvib_dia_0_im, ... into the file res0/data.h5
+           data_store.convert_text_data({"data_set_paths":["res0/"], "data_dim":10, "isnap":0, "fsnap":1000,
+                                         "data_re_prefix":"hvib_dia_", "data_im_prefix":"hvib_dia_",
+                                         "store_filename":"data.h5" })
+
+           # Read the 2 x 2 block of these Hamiltonians
+           hvib = data_store.get_matrices("res0/data.h5", "hvib_dia", [0, 1])
+
+.. moduleauthor:: Alexey V. Akimov
+
+"""
+
+import os
+import numpy as np
+import h5py
+
+import util.libutil as comn
+
+import libra_py.data_conv as data_conv
+
+
+
+def dataset_name(prefix):
+    """
+    Returns the name of the dataset corresponding to the files with a given prefix: the prefix
+    without the directory name and the trailing underscores, e.g. "res/hvib_dia_" -> "hvib_dia"
+
+    Args:
+        prefix ( string ): the prefix of the text files with the data
+
+    Returns:
+        string: the name of the dataset
+
+    """
+
+    return os.path.basename(prefix).rstrip("_")
+
+
+
+def _as_array(X):
+    """
+    Returns the complex np.array with the elements of a MATRIX, CMATRIX, or np.array `X`
+    """
+
+    if hasattr(X, "num_of_rows"):
+        X = data_conv.nparray_view(X)
+
+    # The datasets are complex, and h5py does not convert the real data into them
+    return np.asarray(X, dtype=complex)
+
+
+
+def append_matrix(filename, name, istep, X, compression="gzip", chunk_size=64):
+    """
+    Writes the matrix for the time step `istep` into the dataset `name` of the file `filename`.
+    The file and the dataset are created if they do not exist, and the dataset is extended if
+    needed, so this function can be called as the data are being computed. The time steps that
+    are skipped are filled with zeros
+
+    Args:
+        filename ( string ): the name of the HDF5 file
+        name ( string ): the name of the dataset
+        istep ( int ): the index of the time step
+        X ( MATRIX(nrows, ncols), CMATRIX(nrows, ncols), or 2D np.array ): the data to write
+        compression ( string or None ): the compression filter of a newly created dataset [ default: "gzip" ]
+        chunk_size ( int ): the number of time steps in a chunk of a newly created dataset [ default: 64 ]
+
+    """
+
+    x = _as_array(X)
+    nrows, ncols = x.shape
+
+    with h5py.File(filename, "a") as f:
+
+        if name not in f:
+            f.create_dataset(name, shape=(istep+1, nrows, ncols), maxshape=(None, nrows, ncols), dtype=complex,
+                             chunks=(chunk_size, nrows, ncols), compression=compression)
+
+        ds = f[name]
+        if ds.shape[0] <= istep:
+            ds.resize(istep+1, axis=0)
+
+        ds[istep] = x
+
+
+
+def append_matrices(filename, name, istart, data, compression="gzip", chunk_size=64):
+    """
+    Same as `append_matrix`, but writes the matrices for the time steps `istart`, `istart + 1`, ...
+
+    Args:
+        data ( list of MATRIX(nrows, ncols) or CMATRIX(nrows, ncols), or 3D np.array ): the data to write,
+            data[i] is the matrix for the time step `istart + i`
+
+    """
+
+    if isinstance(data, np.ndarray):
+        x = _as_array(data)
+    else:
+        x = _as_array( data_conv.matrices2nparray(data) )
+    nsteps, nrows, ncols = x.shape
+    istop = istart + nsteps
+
+    with h5py.File(filename, "a") as f:
+
+        if name not in f:
+            f.create_dataset(name, shape=(istop, nrows, ncols), maxshape=(None, nrows, ncols), dtype=complex,
+                             chunks=(chunk_size, nrows, ncols), compression=compression)
+
+        ds = f[name]
+        if ds.shape[0] < istop:
+            ds.resize(istop, axis=0)
+
+        ds[istart:istop] = x
+
+
+
+def write_matrix(X, prefix, istep, output_format=0, store_filename="data.h5", imag=True):
+    """
+    Writes the matrix for the time step `istep` into the text files, into the HDF5 file, or both
+
+    Args:
+        X ( CMATRIX(nrows, ncols) ): the data to write
+        prefix ( string ): the prefix of the text files, including the directory name, e.g. "res/hvib_dia_"
+        istep ( int ): the index of the time step
+        output_format ( int ): where to write the data:
+
+            - 0 - the text files "<prefix><istep>_re" and "<prefix><istep>_im" [ default ]
+            - 1 - the dataset `dataset_name(prefix)` of the HDF5 file `store_filename` in the 
+                same directory as the text files, see `append_matrix`
+            - 2 - both
+
+        store_filename ( string ): the name of the HDF5 file, without the directory [ default: "data.h5" ]
+        imag ( Boolean ): whether to write the text file with the imaginary part [ default: True ]
+
+    """
+
+    if output_format in [0, 2]:
+        X.real().show_matrix(F"{prefix}{istep}_re")
+        if imag:
+            X.imag().show_matrix(F"{prefix}{istep}_im")
+
+    if output_format in [1, 2]:
+        filename = os.path.join( os.path.dirname(prefix), store_filename )
+        append_matrix(filename, dataset_name(prefix), istep, X)
+
+
+
+def save_matrices(filename, name, data, istart=0, compression="gzip", chunk_size=64):
+    """
+    Writes the whole time series of matrices into the dataset `name` of the file `filename`, replacing
+    the dataset if it exists. The time steps before `istart` are filled with zeros (in the compressed
+    datasets, they take no space in the file)
+
+    Args:
+        filename ( string ): the name of the HDF5 file
+        name ( string ): the name of the dataset
+        data ( list of MATRIX(nrows, ncols) or CMATRIX(nrows, ncols), or 3D np.array ): the data to write,
+            data[i] is the matrix for the time step `istart + i`
+        istart ( int ): the index of the time step of the first matrix in `data` [ default: 0 ]
+        compression ( string or None ): the compression filter. If None, the dataset is stored contiguously,
+            so it can be memory-mapped (see `open_matrices`), but it can not be extended [ default: "gzip" ]
+        chunk_size ( int ): the number of time steps in a chunk, if the compression is used [ default: 64 ]
+
+    """
+
+    if isinstance(data, np.ndarray):
+        x = _as_array(data)
+    else:
+        x = _as_array( data_conv.matrices2nparray(data) )
+    nsteps, nrows, ncols = x.shape
+
+    with h5py.File(filename, "a") as f:
+
+        if name in f:
+            del f[name]
+
+        if compression==None:
+            # The contiguous storage is not initialized otherwise, so the steps before `istart` could
+            # hold the bytes left in the file by a removed dataset
+            ds = f.create_dataset(name, shape=(istart+nsteps, nrows, ncols), dtype=complex, fillvalue=0.0j)
+        else:
+            ds = f.create_dataset(name, shape=(istart+nsteps, nrows, ncols), dtype=complex, maxshape=(None, nrows, ncols),
+                                  chunks=(min(chunk_size, max(istart+nsteps, 1)), nrows, ncols), compression=compression)
+        ds[istart:] = x
+
+
+
+def num_steps(filename, name):
+    """
+    Returns the number of time steps in the dataset `name` of the file `filename`, or 0 if the file
+    or the dataset do not exist
+    """
+
+    if not os.path.isfile(filename):
+        return 0
+
+    with h5py.File(filename, "r") as f:
+        if name not in f:
+            return 0
+        return f[name].shape[0]
+
+
+
+def remove_matrices(filename, name):
+    """
+    Removes the dataset `name` from the file `filename`, if it exists
+    """
+
+    if not os.path.isfile(filename):
+        return
+
+    with h5py.File(filename, "a") as f:
+        if name in f:
+            del f[name]
+
+
+
+def read_matrices(filename, name, act_sp=None, start=0, stop=None):
+    """
+    Reads a range of time steps from the dataset `name` of the file `filename`, optionally
+    taking only the rows and columns of the active space
+
+    Args:
+        filename ( string ): the name of the HDF5 file
+        name ( string ): the name of the dataset
+        act_sp ( list of N ints ): the indices of the rows and columns to take, None - all [ default: None ]
+        start ( int ): the index of the first time step to read [ default: 0 ]
+        stop ( int ): the index of the time step after the last one to read, None - until the end [ default: None ]
+
+    Returns:
+        3D np.array (nsteps, N, N): the data, nsteps = stop - start
+
+    """
+
+    with h5py.File(filename, "r") as f:
+        ds = f[name]
+
+        if stop==None:
+            stop = ds.shape[0]
+
+        if act_sp==None:
+            return ds[start:stop]
+
+        act_sp = list(act_sp)
+        nact = len(act_sp)
+        res = np.empty( (stop - start, nact, nact), dtype=ds.dtype )
+
+        # Read by the blocks of chunks, to avoid keeping the full-size matrices for all steps in memory
+        blk = 1024
+        if ds.chunks!=None:
+            blk = max(ds.chunks[0], blk - blk % ds.chunks[0])
+
+        for i in range(start, stop, blk):
+            j = min(i + blk, stop)
+            x = ds[i:j]
+            res[i-start:j-start] = x[:, act_sp, :][:, :, act_sp]
+
+    return res
+
+
+
+def get_matrices(filename, name, act_sp=None, start=0, stop=None):
+    """
+    Same as `read_matrices`, but returns the data as Libra objects
+
+    Returns:
+        list of CMATRIX(N, N): the data for all time steps read
+
+    """
+
+    x = read_matrices(filename, name, act_sp, start, stop)
+
+    return [ data_conv.nparray2CMATRIX(x[i]) for i in range(x.shape[0]) ]
+
+
+
+def open_matrices(filename, name):
+    """
+    Provides access to the dataset `name` of the file `filename` without reading it into memory
+
+    Args:
+        filename ( string ): the name of the HDF5 file
+        name ( string ): the name of the dataset
+
+    Returns:
+        np.memmap or h5py.Dataset: the read-only np.memmap of shape (nsteps, nrows, ncols), if the dataset
+            is stored contiguously (see `save_matrices`); otherwise, the h5py.Dataset object, which reads
+            only the requested slices from the file (the file stays open while the object is in use)
+
+    """
+
+    f = h5py.File(filename, "r")
+    ds = f[name]
+
+    offset = ds.id.get_offset()
+    if offset==None or ds.size==0:
+        return ds
+
+    shape, dtype = ds.shape, ds.dtype
+    f.close()
+
+    return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+
+def convert_text_data(params):
+    """
+    Converts the data stored in the text files (one pair of the "_re" and "_im" files per time step, as read by
+    `data_read.get_data_sets`) into the HDF5 files, one file per data set
+
+    Args:
+        params ( dictionary ): parameters controlling the conversion
+
+            * **params["data_set_paths"]** ( list of strings ): the directories with the files of the data sets;
+                the HDF5 files are created in the same directories [ default: [""] ]
+            * **params["data_dim"]** ( int ): the dimension of the matrices in the files [Required!]
+            * **params["isnap"]** ( int ): index of the first file to read [Required!]
+            * **params["fsnap"]** ( int ): index of the file after the last one to read [Required!]
+            * **params["data_re_prefix"]** ( string ): prefix of the files with real part of the data [Required!]
+            * **params["data_im_prefix"]** ( string or None ): prefix of the files with imaginary part of the data,
+                None - the data is real [ default: same as "data_re_prefix" ]
+            * **params["data_re_suffix"]** ( string ): suffix of the files with real part of the data [default: "_re"]
+            * **params["data_im_suffix"]** ( string ): suffix of the files with imaginary part of the data [default: "_im"]
+            * **params["store_filename"]** ( string ): the name of the HDF5 file [ default: "data.h5" ]
+            * **params["dataset_name"]** ( string ): the name of the dataset [ default: `dataset_name(params["data_re_prefix"])` ]
+            * **params["compression"]** ( string or None ): the compression filter, see `save_matrices` [ default: "gzip" ]
+
+    Returns:
+        list of strings: the names of the HDF5 files written
+
+    """
+
+    critical_params = [ "data_dim", "isnap", "fsnap", "data_re_prefix" ]
+    default_params = { "data_set_paths":[""], "data_re_suffix":"_re", "data_im_suffix":"_im",
+                       "store_filename":"data.h5", "compression":"gzip" }
+    comn.check_input(params, default_params, critical_params)
+
+    # The defaults that depend on the other parameters, set once those are known to be defined
+    if "data_im_prefix" not in params:
+        params.update({"data_im_prefix": params["data_re_prefix"]})
+    if "dataset_name" not in params:
+        params.update({"dataset_name": dataset_name(params["data_re_prefix"])})
+
+    ndim = params["data_dim"]
+    nsteps = params["fsnap"] - params["isnap"]
+
+    res = []
+    for path in params["data_set_paths"]:
+
+        x = np.zeros( (nsteps, ndim, ndim), dtype=complex )
+
+        for i in range(nsteps):
+            step = params["isnap"] + i
+
+            filename = F"{path}{params['data_re_prefix']}{step}{params['data_re_suffix']}"
+            x[i].real = np.fromfile(filename, sep=" ", count=ndim*ndim).reshape(ndim, ndim)
+
+            if params["data_im_prefix"]!=None:
+                filename = F"{path}{params['data_im_prefix']}{step}{params['data_im_suffix']}"
+                x[i].imag = np.fromfile(filename, sep=" ", count=ndim*ndim).reshape(ndim, ndim)
+
+        store = path + params["store_filename"]
+        save_matrices(store, params["dataset_name"], x, params["isnap"], params["compression"])
+        res.append(store)
+
+    return res
+
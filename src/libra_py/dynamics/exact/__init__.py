@@ -10,5 +10,6 @@
 __all__ = ["compute",
            "plot",
            "save",
+           "soft",
           ]
 
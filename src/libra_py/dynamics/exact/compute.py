@@ -15,6 +15,7 @@
            * init_wfc(params, _potential, model_params )
            * run_dynamics(wfc, params, model_params, savers)
            * run_relaxation(_params, _potential, model_params)
+           * run_benchmark(_params, _potential, model_params, cases=None)
            * plot_mem(res, _params, model_params, plot_params)
            * plot_hdf5(plot_params)
 
@@ -50,8 +51,10 @@ import util.libutil as comn
 import libra_py.units as units
 import libra_py.data_outs as data_outs
 import libra_py.data_savers as data_savers
+import libra_py.profiling as profiling
 
 from . import save
+from . import soft
 
 
 
@@ -61,13 +64,18 @@ def init_wfc(params, _potential, model_params ):
     may not be needed for some of the methods, but it allows us to have a simple structure of the program
     
     istate = [rep, index_of_the_state]
+
+    params["engine"] selects the wavefunction object: 0 - the C++ `Wfcgrid2` [ default ], 
+    1 - the NumPy `soft.wfcgrid_soft`, which can only be propagated with the "SOFT" integrator,
+    but keeps the wavefunctions as contiguous arrays and uses the FFTs in any number of dimensions
     
     """
             
     critical_params = []
     default_params = { "nsteps":200, "dt":10.0, "progress_frequency":0.1,
                        "rmin":[-15.0], "rmax":[15.0], "dx":[0.1], "nstates":2,
-                       "x0":[0.0], "p0":[0.0], "istate":[1,0], "masses":[2000.0], "k":[0.001]
+                       "x0":[0.0], "p0":[0.0], "istate":[1,0], "masses":[2000.0], "k":[0.001],
+                       "engine":0
                       }
     comn.check_input(params, default_params, critical_params)
     
@@ -98,6 +106,30 @@ def init_wfc(params, _potential, model_params ):
     dx0 = Py2Cpp_double(dx0_tmp)    
         
         
+    if params["engine"]==1:
+        # The same initialization with the NumPy engine; the reciprocal-space wavefunctions
+        # are computed only when they are needed
+        wfc = soft.wfcgrid_soft(rmin, rmax, dx, nstates)
+        wfc.update_Hamiltonian(_potential, model_params)
+        wfc.update_propagator_H(0.5*dt)
+        wfc.add_wfc_Gau(x0, p0, dx0, istate[1], 1.0+0.0j, istate[0])
+
+        if istate[0]==0:
+            wfc.update_adiabatic()
+        elif istate[0]==1:
+            wfc.update_diabatic()
+
+        wfc.update_propagator_K(dt, masses)
+
+        print( "Norm (dia) = ", wfc.norm(0) )
+        print( "Norm (adi) = ", wfc.norm(1) )
+        print( "Ekin (dia) = ", wfc.e_kin(masses, 0) )
+        print( "Ekin (adi) = ", wfc.e_kin(masses, 1) )
+        print( "Epot (dia) = ", wfc.e_pot(0) )
+        print( "Epot (adi) = ", wfc.e_pot(1) )
+
+        return wfc
+
     
     # Here we initialize the grid and wavefunction
     wfc = Wfcgrid2( rmin, rmax,  dx, nstates)
@@ -142,7 +174,20 @@ def init_wfc(params, _potential, model_params ):
 
 
 
-def run_dynamics(wfc, params, model_params, savers):
+def run_dynamics(wfc, params, model_params, savers, prof=None):
+    """
+    Propagates the wavefunction `wfc` for `params["nsteps"]` steps, saving the data with the `savers`
+
+    The optional `prof` ( libra_py.profiling.profiler ) object accumulates the timings of the 
+    saving, integration, and the update of the wavefunction representations
+    """
+
+    if prof==None:
+        prof = profiling.profiler(0)
+
+    critical_params = []
+    default_params = { "engine":0 }
+    comn.check_input(params, default_params, critical_params)
     
     integrators_map = {"SOFT": 0,
                        "direct_dia": 1,
@@ -152,6 +197,11 @@ def run_dynamics(wfc, params, model_params, savers):
                        "Colbert_Miller_SOFT":5
                       }
     integrator_id = integrators_map[ params["integrator"] ]
+
+    if params["engine"]==1 and integrator_id!=0:
+        print(F"ERROR: the NumPy engine (engine = 1) can only be used with the SOFT integrator, not {params['integrator']}")
+        print("Exiting...")
+        sys.exit(0)
         
     nsteps = params["nsteps"]      
     print_freq = int(params["progress_frequency"]*nsteps)    
@@ -185,6 +235,7 @@ def run_dynamics(wfc, params, model_params, savers):
             print(F" step= {step}")
             
         # Save properties
+        prof.start("saving")
         if savers["hdf5_saver"] != None:            
             save.save_data_hdf5(step, wfc, savers["hdf5_saver"], params)
             
@@ -196,8 +247,13 @@ def run_dynamics(wfc, params, model_params, savers):
             prms = dict(params)
             prms["hdf5_output_level"] = prms["mem_output_level"]
             save.save_data_hdf5(step, wfc, savers["mem_saver"], prms)
+
+        if savers.get("wfc_saver") != None:
+            savers["wfc_saver"].save(step, wfc)
+        prof.stop("saving")
     
         #================ Integration ==================
+        prof.start("propagation")
     
         if integrator_id==0:  # SOFT            
             wfc.SOFT_propagate()      # evolve the diabatic wfc 
@@ -228,17 +284,26 @@ def run_dynamics(wfc, params, model_params, savers):
 
         elif integrator_id == 5: # Colbert-Miller_SOFT        
             wfc.Colbert_Miller_SOFT(expT, expV, 0)    
+        prof.stop("propagation")
             
             
         #============= Update other variables ================
-        if integrator_id in [0, 1, 3, 5]:
+        prof.start("update_representations")
+        if params["engine"]==1:
+            wfc.update_adiabatic()
+
+        elif integrator_id in [0, 1, 3, 5]:
             wfc.update_adiabatic()  
             
-        if integrator_id in [2, 4]:
+        if params["engine"]==0 and integrator_id in [2, 4]:
             wfc.update_diabatic()              
         
-        wfc.update_reciprocal(0)  # update reci of diabatic function
-        wfc.update_reciprocal(1)  # update reci of adiabatic function
+        if params["engine"]==0:
+            wfc.update_reciprocal(0)  # update reci of diabatic function
+            wfc.update_reciprocal(1)  # update reci of adiabatic function
+        prof.stop("update_representations")
+
+        prof.end_step()
         
 
 
@@ -257,10 +322,28 @@ def run_relaxation(_params, _potential, model_params):
                                 [1, [10], [100] ]
                               ]
 
+    # To accumulate the on-the-fly HDF5 output in memory and write it in blocks of 100 steps
+    _params["hdf5_buffer_size"] = 100
+
+    # To write the timing report "timing.txt" (1), and also the per-step timings into "data.hdf" (2)
+    _params["profiling_level"] = 1
+
+    # The wavefunctions (hdf5_output_level or mem_output_level >= 4) are written into the "wfc_snaps.hdf"
+    # file, see `save.wfc_snapshots`. To store them every 10 steps, on every other grid point, in single precision
+    _params["wfc_snap_stride"] = 10
+    _params["wfc_snap_downsample"] = 2
+    _params["wfc_snap_precision"] = "single"
+
     """
     
         
     params = dict(_params)                
+
+    critical_params = [  ]
+    default_params = { "hdf5_buffer_size":0, "profiling_level":0,
+                       "wfc_snap_stride":1, "wfc_snap_downsample":1, "wfc_snap_precision":"double" }
+    comn.check_input(params, default_params, critical_params)
+
     nstates = len(model_params["E_n"])
     nsteps = params["nsteps"]
     print_freq = int(params["progress_frequency"]*nsteps)    
@@ -308,7 +391,10 @@ def run_relaxation(_params, _potential, model_params):
     hdf5_output_level = params["hdf5_output_level"]
     
     if hdf5_output_level > 0:                
-        hdf5_saver = data_savers.hdf5_saver(F"{prefix}/data.hdf", properties_to_save) 
+        if params["hdf5_buffer_size"] > 0:
+            hdf5_saver = data_savers.hdf5_buffered_saver(F"{prefix}/data.hdf", properties_to_save, params["hdf5_buffer_size"]) 
+        else:
+            hdf5_saver = data_savers.hdf5_saver(F"{prefix}/data.hdf", properties_to_save) 
         hdf5_saver.set_compression_level(params["use_compression"], params["compression_level"])
         save.exact_init_hdf5(hdf5_saver, hdf5_output_level, nsteps, ndof, nstates, ngrid)
         if ncustom_pops > 0:
@@ -330,21 +416,109 @@ def run_relaxation(_params, _potential, model_params):
             save.exact_init_custom_hdf5(mem_saver, nsteps, ncustom_pops, nstates)  # boxed populations on adiabatic/diabatic states
 
                          
-    savers = {"hdf5_saver":hdf5_saver, "txt_saver":txt_saver, "mem_saver":mem_saver }
+    #====== Wavefunction snapshots =========
+    wfc_saver = None
+    if max(hdf5_output_level, mem_output_level) >= 4:
+        wfc_saver = save.wfc_snapshots(F"{prefix}/wfc_snaps.hdf", wfc, params)
+
+                         
+    savers = {"hdf5_saver":hdf5_saver, "txt_saver":txt_saver, "mem_saver":mem_saver, "wfc_saver":wfc_saver }
     
 
     #==================== Dynamics ======================    
+    prof = profiling.profiler(params["profiling_level"])
+
     start = time.time()                               
     
-    res = run_dynamics(wfc, params, model_params, savers)                     
+    res = run_dynamics(wfc, params, model_params, savers, prof)                     
     
     end = time.time()    
     print(F"Calculation time = {end - start} seconds")
-    
+
+    prof.start("saving_final")
+    if hdf5_saver != None:
+        hdf5_saver.close()
+
+    if wfc_saver != None:
+        wfc_saver.close()
     
     if mem_saver != None:        
         mem_saver.save_data( F"{prefix}/mem_data.hdf", properties_to_save, "w")
+    prof.stop("saving_final")
+
+    prof.add_saver("hdf5_saver", hdf5_saver)
+    prof.add_saver("mem_saver", mem_saver)
+    prof.write_summary(F"{prefix}/timing.txt")
+    prof.save_step_timings(F"{prefix}/data.hdf")
+
+    if mem_saver != None:        
         return mem_saver
 
-        
 
+
+def run_benchmark(_params, _potential, model_params, cases=None):
+    """
+    Runs the same calculation with several engines and integrators and compares their timings and results
+
+    Args:
+        _params ( dictionary ): the parameters of the calculations, see `run_relaxation`. The results of
+            the case `i` are stored in the "<prefix>/case_<i>" directory
+        _potential ( PyObject ): the Python function that computes the Hamiltonian, see `init_wfc`
+        model_params ( dictionary ): the parameters of the model
+        cases ( list of dictionaries ): the parameters that define each case, e.g. {"engine":0, "integrator":"SOFT"}.
+            None - compare the C++ and the NumPy SOFT engines, [ {"engine":0, "integrator":"SOFT"}, {"engine":1, "integrator":"SOFT"} ].
+            Note that the "Colbert_Miller_SOFT" integrator builds the dense Npts x Npts propagator, so it can only be
+            used with small grids [ default: None ]
+
+    Returns:
+        list of dictionaries: for each case - { "case", "time", "Etot_drift", "pop_diff" }, where "time" is the wall time
+            of the calculation [ units: s ], "Etot_drift" is the change of the total (diabatic) energy during the
+            calculation [ units: Ha ], and "pop_diff" is the maximal deviation of the diabatic populations from those of
+            the first case, over all time steps. The summary is also printed and written into the "<prefix>/benchmark.txt" file
+
+    """
+
+    params = dict(_params)
+
+    critical_params = [ ]
+    default_params = { "prefix":"out" }
+    comn.check_input(params, default_params, critical_params)
+
+    if cases==None:
+        cases = [ {"engine":0, "integrator":"SOFT"}, {"engine":1, "integrator":"SOFT"} ]
+
+    prefix = params["prefix"]
+    if not os.path.isdir(prefix):
+        os.mkdir(prefix)
+
+    res = []
+    pop_ref = None
+
+    for icase, case in enumerate(cases):
+        prms = dict(params)
+        prms.update(case)
+        prms.update({ "prefix":F"{prefix}/case_{icase}", "hdf5_output_level":0, "mem_output_level":2,
+                      "properties_to_save":[ "timestep", "time", "Etot_dia", "pop_dia" ] })
+
+        start = time.time()
+        mem_saver = run_relaxation(prms, _potential, model_params)
+        end = time.time()
+
+        etot = mem_saver.np_data["Etot_dia"]
+        pop = mem_saver.np_data["pop_dia"]
+        if pop_ref is None:
+            pop_ref = pop
+
+        # Compared over the common time steps, so the cases should use the same "dt"
+        n = min(pop.shape[0], pop_ref.shape[0])
+        res.append( { "case":case, "time":end - start, "Etot_drift":etot[-1] - etot[0],
+                      "pop_diff":float(np.max(np.abs(pop[:n] - pop_ref[:n]))) } )
+
+    f = open(F"{prefix}/benchmark.txt", "w")
+    for icase, r in enumerate(res):
+        line = F"case {icase} {r['case']}  time = {r['time']:.3f} s  Etot drift = {r['Etot_drift']:.3e} Ha  max pop_dia diff = {r['pop_diff']:.3e}"
+        print(line)
+        f.write(line + "\n")
+    f.close()
+
+    return res
@@ -14,9 +14,17 @@
        computed/produced during exact on the grid calculations. If you need to print out more 
        data, you shall add the corresponding info in these modules
 
+       The wavefunctions themselves (the output level 4) are not stored by the savers: they are written
+       as whole arrays, every few steps, into a separate file by the `wfc_snapshots` objects
+
+       List of classes:
+           * class wfc_snapshots
+
        List of functions:
            * exact_init_hdf5(saver, hdf5_output_level, _nsteps, _ndof, _nstates, _ngrid)
            * exact_init_custom_hdf5(saver, _nsteps, _ncustom_pops, _nstates)
+           * get_observables(wfc, masses, rep, level)
+           * get_psi(wfc, name)
            * save_data_hdf5(step, wfc, saver, params)
            * save_data_mem(step, wfc, saver, params)
 
@@ -39,12 +47,17 @@ import os
 import sys
 import math
 import copy
+import numpy as np
+import h5py
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
 elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 
+import util.libutil as comn
+import libra_py.data_conv as data_conv
+from . import soft
 
 #===================== Exact calculations output ====================
 
@@ -126,28 +139,52 @@ def exact_init_hdf5(saver, hdf5_output_level, _nsteps, _ndof, _nstates, _ngrid):
         # Density matrix computed in adiabatic rep
         saver.add_dataset("denmat_adi", (_nsteps, _nstates, _nstates), "C") 
 
+    # The wavefunctions ( hdf5_output_level>=4 ) are stored by the `wfc_snapshots`
 
-    if hdf5_output_level>=4:
 
-        # Wavefunction in diabatic rep
-        saver.add_dataset("PSI_dia", (_nsteps, _ngrid, _nstates, 1), "C") 
 
-        # Wavefunction in adiabatic rep
-        saver.add_dataset("PSI_adi", (_nsteps, _ngrid, _nstates, 1), "C") 
+def exact_init_custom_hdf5(saver, _nsteps, _ncustom_pops, _nstates):
 
-        # Reciprocal wavefunction in diabatic rep
-        saver.add_dataset("reciPSI_dia", (_nsteps, _ngrid, _nstates, 1), "C") 
+    # Custom populations indx
+    saver.add_dataset("custom_pops", (_nsteps, _ncustom_pops, _nstates, 1), "R") 
 
-        # Reciprocal wavefunction in adiabatic rep
-        saver.add_dataset("reciPSI_adi", (_nsteps, _ngrid, _nstates, 1), "C") 
 
 
 
-def exact_init_custom_hdf5(saver, _nsteps, _ncustom_pops, _nstates):
+def get_observables(wfc, masses, rep, level):
+    """
+    Computes the observables of the wavefunction in a given representation
 
-    # Custom populations indx
-    saver.add_dataset("custom_pops", (_nsteps, _ncustom_pops, _nstates, 1), "R") 
+    Each observable is computed only once: Etot is the sum of Ekin and Epot. With the NumPy engine
+    ( soft.wfcgrid_soft ) all of them are computed in one pass, see `soft.wfcgrid_soft.observables`
+
+    Args:
+        wfc ( Wfcgrid2 or soft.wfcgrid_soft ): the wavefunction
+        masses ( doubleList ): the masses of all the DOFs [ units: a.u. ]
+        rep ( int ): the representation: 0 - diabatic, 1 - adiabatic
+        level ( int ): the output level: 1 - energies and norm, 2 - also populations and moments,
+            3 - also density matrix
 
+    Returns:
+        dictionary: { "norm", "Ekin", "Epot", "Etot" } and, with the level >= 2, { "pop", "q", "q2", "p", "p2" },
+            and with the level >= 3, { "denmat" }
+
+    """
+
+    if isinstance(wfc, soft.wfcgrid_soft):
+        return wfc.observables(list(masses), rep, level)
+
+    res = { "norm": wfc.norm(rep), "Ekin": wfc.e_kin(masses, rep), "Epot": wfc.e_pot(rep) }
+    res["Etot"] = res["Ekin"] + res["Epot"]
+
+    if level>=2:
+        res.update({ "pop": wfc.get_pops(rep), "q": wfc.get_pow_q(rep, 1), "q2": wfc.get_pow_q(rep, 2),
+                     "p": wfc.get_pow_p(rep, 1), "p2": wfc.get_pow_p(rep, 2) })
+
+    if level>=3:
+        res["denmat"] = wfc.get_den_mat(rep)
+
+    return res
 
 
 
@@ -156,32 +193,23 @@ def save_data_hdf5(step, wfc, saver, params):
     dt = params["dt"]    
     masses = Py2Cpp_double(params["masses"])
     hdf5_output_level = params["hdf5_output_level"]
+
+    if hdf5_output_level>=1:
+        obs = [ get_observables(wfc, masses, rep, hdf5_output_level) for rep in [0, 1] ]
     
     if hdf5_output_level>=1:
         saver.save_scalar(step, "timestep", step) 
         saver.save_scalar(step, "time", step * dt)        
-        saver.save_scalar(step, "Ekin_dia", wfc.e_kin(masses, 0)) 
-        saver.save_scalar(step, "Ekin_adi", wfc.e_kin(masses, 1))         
-        saver.save_scalar(step, "Epot_dia", wfc.e_pot(0)) 
-        saver.save_scalar(step, "Epot_adi", wfc.e_pot(1))         
-        saver.save_scalar(step, "Etot_dia", wfc.e_tot(masses, 0)) 
-        saver.save_scalar(step, "Etot_adi", wfc.e_tot(masses, 1))                 
-        saver.save_scalar(step, "norm_dia", wfc.norm(0) )
-        saver.save_scalar(step, "norm_adi", wfc.norm(1) )
+        for rep, suff in [ (0, "dia"), (1, "adi") ]:
+            for name in ["Ekin", "Epot", "Etot", "norm"]:
+                saver.save_scalar(step, F"{name}_{suff}", obs[rep][name])
         
         
     if hdf5_output_level>=2:    
 
-        saver.save_matrix(step, "pop_dia", wfc.get_pops(0) ) 
-        saver.save_matrix(step, "pop_adi", wfc.get_pops(1) )     
-        saver.save_matrix(step, "q_dia", wfc.get_pow_q(0, 1) ) 
-        saver.save_matrix(step, "q_adi", wfc.get_pow_q(1, 1) )         
-        saver.save_matrix(step, "q2_dia", wfc.get_pow_q(0, 2) ) 
-        saver.save_matrix(step, "q2_adi", wfc.get_pow_q(1, 2) )         
-        saver.save_matrix(step, "p_dia", wfc.get_pow_p(0, 1) ) 
-        saver.save_matrix(step, "p_adi", wfc.get_pow_p(1, 1) )         
-        saver.save_matrix(step, "p2_dia", wfc.get_pow_p(0, 2) ) 
-        saver.save_matrix(step, "p2_adi", wfc.get_pow_p(1, 2) ) 
+        for rep, suff in [ (0, "dia"), (1, "adi") ]:
+            for name in ["pop", "q", "q2", "p", "p2"]:
+                saver.save_matrix(step, F"{name}_{suff}", obs[rep][name])
 
         if "custom_pops" in params.keys():
             ncustom_pops = len(params["custom_pops"])
@@ -195,28 +223,9 @@ def save_data_hdf5(step, wfc, saver, params):
         
         
     if hdf5_output_level>=3:                
-        saver.save_matrix(step, "denmat_dia", wfc.get_den_mat(0) ) 
-        saver.save_matrix(step, "denmat_adi", wfc.get_den_mat(1) ) 
-        
+        saver.save_matrix(step, "denmat_dia", obs[0]["denmat"] ) 
+        saver.save_matrix(step, "denmat_adi", obs[1]["denmat"] ) 
         
-    if hdf5_output_level>=4:                
-        """
-        This is a REALLY-REALLY bad option to go since it is soo time-consuming
-        """
-        
-        for ipt in range(wfc.Npts):
-            saver.save_multi_matrix(step, ipt, "PSI_dia", wfc.PSI_dia[ipt]) 
-            
-        for ipt in range(wfc.Npts):            
-            saver.save_multi_matrix(step, ipt, "PSI_adi", wfc.PSI_adi[ipt]) 
-            
-        for ipt in range(wfc.Npts):
-            saver.save_multi_matrix(step, ipt, "reciPSI_dia", wfc.reciPSI_dia[ipt]) 
-            
-        for ipt in range(wfc.Npts):            
-            saver.save_multi_matrix(step, ipt, "reciPSI_adi", wfc.reciPSI_adi[ipt])             
-
-
             
 
 def save_data_mem(step, wfc, saver, params):
@@ -224,41 +233,154 @@ def save_data_mem(step, wfc, saver, params):
     dt = params["dt"]    
     masses = Py2Cpp_double(params["masses"])
     mem_output_level = params["mem_output_level"]
-    
+
+    if mem_output_level>=1:
+        obs = [ get_observables(wfc, masses, rep, mem_output_level) for rep in [0, 1] ]
     
     if mem_output_level>=1:         
         saver.add_data("timestep", step)
         saver.add_data("time", step * dt)
-        saver.add_data("Ekin_dia", wfc.e_kin(masses, 0) )
-        saver.add_data("Ekin_adi", wfc.e_kin(masses, 1) )
-        saver.add_data("Epot_dia", wfc.e_pot(0) )
-        saver.add_data("Epot_adi", wfc.e_pot(1) )
-        saver.add_data("Etot_dia", wfc.e_tot(masses, 0) )
-        saver.add_data("Etot_adi", wfc.e_tot(masses, 1) )
-        saver.add_data("norm_dia", wfc.norm(0) )
-        saver.add_data("norm_adi", wfc.norm(1) )
+        for rep, suff in [ (0, "dia"), (1, "adi") ]:
+            for name in ["Ekin", "Epot", "Etot", "norm"]:
+                saver.add_data(F"{name}_{suff}", obs[rep][name])
 
     if mem_output_level>=2:        
-        saver.add_data("pop_dia", wfc.get_pops(0) ) 
-        saver.add_data("pop_adi", wfc.get_pops(1) )     
-        saver.add_data("q_dia", wfc.get_pow_q(0, 1) ) 
-        saver.add_data("q_adi", wfc.get_pow_q(1, 1) )         
-        saver.add_data("q2_dia", wfc.get_pow_q(0, 2) ) 
-        saver.add_data("q2_adi", wfc.get_pow_q(1, 2) )         
-        saver.add_data("p_dia", wfc.get_pow_p(0, 1) ) 
-        saver.add_data("p_adi", wfc.get_pow_p(1, 1) )         
-        saver.add_data("p2_dia", wfc.get_pow_p(0, 2) ) 
-        saver.add_data("p2_adi", wfc.get_pow_p(1, 2) )         
+        for rep, suff in [ (0, "dia"), (1, "adi") ]:
+            for name in ["pop", "q", "q2", "p", "p2"]:
+                saver.add_data(F"{name}_{suff}", obs[rep][name])
 
     if mem_output_level>=3:        
-        saver.add_data("denmat_dia", wfc.get_den_mat(0) )  
-        saver.add_data("denmat_adi", wfc.get_den_mat(1) )         
-        
-    if mem_output_level>=4:                
-        saver.add_data("PSI_dia", wfc.PSI_dia) 
-        saver.add_data("PSI_adi", wfc.PSI_adi) 
-        saver.add_data("reciPSI_dia", wfc.reciPSI_dia) 
-        saver.add_data("reciPSI_adi", wfc.reciPSI_adi) 
-        
+        saver.add_data("denmat_dia", obs[0]["denmat"] )  
+        saver.add_data("denmat_adi", obs[1]["denmat"] )         
+
+
+
+def get_psi(wfc, name):
+    """
+    Returns the whole wavefunction as one array
+
+    Args:
+        wfc ( Wfcgrid2 or soft.wfcgrid_soft ): the wavefunction
+        name ( string ): which wavefunction: "PSI_dia", "PSI_adi", "reciPSI_dia", or "reciPSI_adi"
+
+    Returns:
+        np.array (nstates, npts[0], ..., npts[ndof-1]): the wavefunction on the real or reciprocal grid
+
+    """
+
+    rep = { "dia":0, "adi":1 }[ name.split("_")[1] ]
+
+    if isinstance(wfc, soft.wfcgrid_soft):
+        if name.startswith("reci"):
+            return wfc.reciprocal(rep)
+        return wfc.psi(rep)
+
+    # Wfcgrid2: the list of CMATRIX(nstates, 1), one per grid point, the last DOF changing the fastest
+    psi = data_conv.matrices2nparray( getattr(wfc, name) )
+
+    return np.moveaxis( psi.reshape( list(wfc.npts) + [wfc.nstates] ), -1, 0)
+
+
+
+class wfc_snapshots:
+    """
+    Writes the wavefunctions, as whole arrays, into an HDF5 file every `stride` steps, optionally on
+    a coarser grid and in single precision - the snapshots for making the movies of the wavefunctions
+
+    The file contains:
+
+        * "step" ( nsnaps ): the indices of the steps of the snapshots
+        * "time" ( nsnaps ): the times of the snapshots [ units: a.u. ]
+        * "rgrid_<idof>", "kgrid_<idof>": the coordinates of the (downsampled) real and reciprocal grids
+            for every DOF [ units: a.u. ]
+        * "PSI_dia", "PSI_adi", "reciPSI_dia", "reciPSI_adi" ( nsnaps, nstates, n_0, ... , n_{ndof-1} ):
+            the wavefunctions - only those listed in the "properties_to_save"
+
+    """
+
+    names = ["PSI_dia", "PSI_adi", "reciPSI_dia", "reciPSI_adi"]
+
+    def __init__(self, filename, wfc, params):
+        """
+        Args:
+            filename ( string ): the name of the HDF5 file
+            wfc ( Wfcgrid2 or soft.wfcgrid_soft ): the wavefunction
+            params ( dictionary ): the parameters of the calculation, of which these are used:
+
+                * **params["nsteps"]** ( int ): the number of steps of the calculation [ required ]
+                * **params["dt"]** ( double ): the time step [ units: a.u., required ]
+                * **params["properties_to_save"]** ( list of strings ): the wavefunctions to store are those
+                    in this list [ required ]
+                * **params["wfc_snap_stride"]** ( int ): the wavefunctions are stored every this many steps [ default: 1 ]
+                * **params["wfc_snap_downsample"]** ( int or list of ints ): only every this many grid points
+                    are stored - the same for all the DOFs or for each DOF [ default: 1 ]
+                * **params["wfc_snap_precision"]** ( string ): "double" - complex128, "single" - complex64 [ default: "double" ]
+                * **params["use_compression"]** ( int ): 1 - compress the data with gzip [ default: 0 ]
+                * **params["compression_level"]** ( list of ints ): the gzip compression level is the first one [ default: [0, 0, 0] ]
+
+        """
+
+        critical_params = [ "nsteps", "dt", "properties_to_save" ]
+        default_params = { "wfc_snap_stride":1, "wfc_snap_downsample":1, "wfc_snap_precision":"double",
+                           "use_compression":0, "compression_level":[0, 0, 0] }
+        comn.check_input(params, default_params, critical_params)
+
+        ndof = wfc.ndof
+        npts = list(wfc.npts)
+
+        self.stride = max(1, params["wfc_snap_stride"])
+        self.dt = params["dt"]
+
+        ds = params["wfc_snap_downsample"]
+        if not isinstance(ds, (list, tuple)):
+            ds = [ds] * ndof
+        self.grid_slices = tuple([ slice(0, npts[idof], max(1, ds[idof])) for idof in range(ndof) ])
+
+        dtype = { "double": np.complex128, "single": np.complex64 }[ params["wfc_snap_precision"] ]
+
+        self.to_save = [ name for name in self.names if name in params["properties_to_save"] ]
+
+        nsnaps = (params["nsteps"] + self.stride - 1) // self.stride
+        shape = [ wfc.nstates ] + [ len(range(npts[idof])[self.grid_slices[idof]]) for idof in range(ndof) ]
+
+        compression = None
+        if params["use_compression"]==1:
+            compression = "gzip"
+
+        self.f = h5py.File(filename, "w")
+
+        self.f.create_dataset("step", data = np.arange(0, params["nsteps"], self.stride))
+        self.f.create_dataset("time", data = np.arange(0, params["nsteps"], self.stride) * self.dt)
+
+        for idof in range(ndof):
+            if isinstance(wfc, soft.wfcgrid_soft):
+                r, k = wfc.rgrid[idof], wfc.kgrid[idof]
+            else:
+                r = wfc.rmin[idof] + wfc.dr[idof] * np.arange(npts[idof])
+                k = wfc.kmin[idof] + wfc.dk[idof] * np.arange(npts[idof])
+            self.f.create_dataset(F"rgrid_{idof}", data = r[ self.grid_slices[idof] ])
+            self.f.create_dataset(F"kgrid_{idof}", data = k[ self.grid_slices[idof] ])
+
+        # One snapshot per chunk, so each snapshot is written (and read) at once
+        for name in self.to_save:
+            self.f.create_dataset(name, (nsnaps, *shape), dtype=dtype, chunks=(1, *shape), compression=compression)
+
+
+    def save(self, step, wfc):
+        """
+        Writes the wavefunctions of the step `step`, if it is one of the snapshots
+        """
+
+        if step % self.stride != 0:
+            return
+
+        isnap = step // self.stride
+        for name in self.to_save:
+            psi = get_psi(wfc, name)
+            self.f[name][isnap] = psi[ (slice(None),) + self.grid_slices ]
+
+
+    def close(self):
 
+        self.f.close()
 
@@ -0,0 +1,506 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 3 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#***********************************************************************************
+"""
+.. module:: soft
+   :platform: Unix, Windows
+   :synopsis: This module implements the NumPy version of the split-operator Fourier transform (SOFT)
+       propagation of the wavefunctions on the N-dimensional grids. It is an alternative to the C++ `Wfcgrid2`
+       class: the grids, the initial wavefunctions, and the observables are defined in the same way, but the
+       wavefunctions are kept as the contiguous np.arrays of shape (nstates, N1, ..., Nd) rather than as the
+       lists of Npts small CMATRIX(nstates, 1) objects, the local (potential) propagators of all the grid points
+       are computed by one batched diagonalization, and the kinetic propagation is done by the multidimensional
+       FFTs. The memory and the cost of a step scale as Npts * nstates^2 and Npts * log(Npts), so grids
+       of any dimensionality can be used
+
+       The grid points are ordered in the same way as in `Wfcgrid2` - the index along the last dimension
+       changes the fastest, so the np.array of shape (nstates, Npts) obtained by reshaping a wavefunction
+       lists the grid points in the same order as the `Wfcgrid2.PSI_dia` list
+
+       List of classes:
+           * class wfcgrid_soft
+
+       List of functions:
+           * grid_size(xmin, xmax, dx)
+
+.. moduleauthor:: Alexey V. Akimov
+
+"""
+
+__author__ = "Alexey V. Akimov"
+__copyright__ = "Copyright 2020 Alexey V. Akimov"
+__credits__ = ["Alexey V. Akimov"]
+__license__ = "GNU-3"
+__version__ = "1.0"
+__maintainer__ = "Alexey V. Akimov"
+__email__ = "alexvakimov@gmail.com"
+__url__ = "https://quantum-dynamics-hub.github.io/libra/index.html"
+
+
+import sys
+import math
+import numpy as np
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+import libra_py.data_conv as data_conv
+
+
+
+def grid_size(xmin, xmax, dx):
+    """
+    Returns the number of the grid points along one dimension: the smallest power of 2 (at least 4) that
+    encloses the interval [xmin, xmax] with the spacing dx, the same as in `Wfcgrid2`
+    """
+
+    sz = int((xmax - xmin)/dx) + 1
+
+    n = 4
+    while sz > n:
+        n *= 2
+
+    return n
+
+
+
+class wfcgrid_soft:
+    """
+    The wavefunction on an N-dimensional grid, propagated with the SOFT method
+
+    Attributes:
+        nstates ( int ): the number of electronic states
+        ndof ( int ): the number of nuclear DOFs
+        npts ( list of ints ): the number of grid points along each dimension
+        Npts ( int ): the total number of grid points
+        rmin, dr ( np.array (ndof) ): the lower boundaries of the grids and the grid spacings [ units: Bohr ]
+        rgrid ( list of np.arrays (npts[idof]) ): the coordinates of the grid points along each dimension [ units: Bohr ]
+        kgrid ( list of np.arrays (npts[idof]) ): the wavevectors of the reciprocal-space grid, kmin + n * dk,
+            with kmin = -0.5/dr and dk = 1/(npts * dr), as in `Wfcgrid2` (the momenta are p = 2 * pi * k) [ units: Bohr^-1 ]
+        PSI_dia, PSI_adi ( np.array (nstates, N1, ..., Nd), complex ): the diabatic and adiabatic wavefunctions
+        Hdia ( np.array (nstates, nstates, N1, ..., Nd), complex ): the diabatic Hamiltonians of all grid points [ units: Ha ]
+        Eadi ( np.array (nstates, N1, ..., Nd) ): the adiabatic energies of all grid points [ units: Ha ]
+        U ( np.array (nstates, nstates, N1, ..., Nd), complex ): the diabatic-to-adiabatic transformations, Hdia * U = U * Eadi
+        expH ( np.array (nstates, nstates, N1, ..., Nd), complex ): the local propagators, see `update_propagator_H`
+        expK ( np.array (N1, ..., Nd), complex ): the reciprocal-space propagator, see `update_propagator_K`
+
+    """
+
+    def __init__(self, rmin, rmax, dx, nstates):
+        """
+        Args:
+            rmin ( list of doubles ): the lower boundaries of the grid in all dimensions [ units: Bohr ]
+            rmax ( list of doubles ): the upper boundaries of the grid in all dimensions [ units: Bohr ]
+            dx ( list of doubles ): the grid spacings in all dimensions [ units: Bohr ]
+            nstates ( int ): the number of electronic states
+
+        """
+
+        self.nstates = nstates
+        self.ndof = len(rmin)
+        self.rmin = np.array(list(rmin), dtype=float)
+        self.dr = np.array(list(dx), dtype=float)
+        self.npts = [ grid_size(rmin[idof], rmax[idof], dx[idof]) for idof in range(self.ndof) ]
+        self.Npts = int(np.prod(self.npts))
+
+        self.rgrid = [ self.rmin[idof] + self.dr[idof] * np.arange(self.npts[idof]) for idof in range(self.ndof) ]
+        self.kgrid = [ -0.5/self.dr[idof] + np.arange(self.npts[idof]) / (self.npts[idof] * self.dr[idof]) for idof in range(self.ndof) ]
+
+        # The wavevectors in the order of the FFT output
+        self.kfft = [ np.fft.fftfreq(self.npts[idof], self.dr[idof]) for idof in range(self.ndof) ]
+
+        self.dV = float(np.prod(self.dr))
+        self.dK = float(np.prod( 1.0 / (np.array(self.npts) * self.dr) ))
+        self.axes = tuple(range(1, self.ndof+1))
+
+        shape = tuple([nstates] + self.npts)
+        self.PSI_dia = np.zeros(shape, dtype=complex)
+        self.PSI_adi = np.zeros(shape, dtype=complex)
+
+        self.Hdia = None
+        self.Eadi = None
+        self.U = None
+        self.expH = None
+        self.expK = None
+
+        print(F"Grid dimensions: {self.npts}, the total number of points: {self.Npts}")
+
+
+    def _axis(self, x, idof):
+        """
+        Returns the 1D array `x` along the dimension idof reshaped for broadcasting with the (N1, ..., Nd) arrays
+        """
+
+        shape = [1] * self.ndof
+        shape[idof] = self.npts[idof]
+
+        return x.reshape(shape)
+
+
+    def _ksq_over_mass(self, mass):
+        """
+        Returns the np.array (N1, ..., Nd): sum_idof k_idof^2 / mass_idof, in the order of the FFT output
+        """
+
+        mass = np.array(list(mass), dtype=float)
+
+        res = np.zeros(self.npts)
+        for idof in range(self.ndof):
+            res = res + self._axis(self.kfft[idof]**2 / mass[idof], idof)
+
+        return res
+
+
+    def _apply(self, M, psi):
+        """
+        Applies the point-wise matrices M (nstates, nstates, N1, ..., Nd) to the wavefunction psi (nstates, N1, ..., Nd)
+        """
+
+        return np.einsum("ij...,j...->i...", M, psi)
+
+
+    def psi(self, rep):
+        """
+        Returns the wavefunction in the diabatic (rep = 0) or adiabatic (rep = 1) representation
+        """
+
+        if rep==0:
+            return self.PSI_dia
+        return self.PSI_adi
+
+
+    def update_Hamiltonian(self, py_funct, params):
+        """
+        Computes the diabatic Hamiltonians at all grid points and their adiabatic energies and eigenvectors
+
+        Args:
+            py_funct ( PyObject ): the Python function that computes the Hamiltonian, called as
+                py_funct(q, params), where q is MATRIX(ndof, 1) with the coordinates of the grid point.
+                It should return an object with the `ham_dia` ( CMATRIX(nstates, nstates) ) attribute
+            params ( dictionary ): the parameters of the model
+
+        """
+
+        nst = self.nstates
+        H = np.zeros( (nst, nst, self.Npts), dtype=complex)
+
+        q = MATRIX(self.ndof, 1)
+        for ipt, point in enumerate(np.ndindex(*self.npts)):
+            for idof in range(self.ndof):
+                q.set(idof, 0, self.rgrid[idof][point[idof]])
+
+            obj = py_funct(q, params)
+            H[:, :, ipt] = data_conv.nparray_view(obj.ham_dia)
+
+        self.Hdia = H.reshape( [nst, nst] + self.npts )
+
+        # Batched diagonalization: Hdia * U = U * Eadi, at all the points at once
+        E, U = np.linalg.eigh( np.moveaxis(H, -1, 0) )
+
+        self.Eadi = np.moveaxis(E, 0, -1).reshape( [nst] + self.npts )
+        self.U = np.moveaxis(U, 0, -1).reshape( [nst, nst] + self.npts )
+
+
+    def update_propagator_H(self, dt):
+        """
+        Computes the local propagators exp(-i * Hdia * dt) for all the grid points, from the
+        adiabatic energies and eigenvectors computed by `update_Hamiltonian`
+
+        Args:
+            dt ( double ): the time step, e.g. half of the integration time step for the SOFT [ units: a.u. ]
+
+        """
+
+        phase = np.exp(-1.0j * dt * self.Eadi)
+
+        self.expH = np.einsum("ik...,k...,jk...->ij...", self.U, phase, self.U.conj())
+
+
+    def update_propagator_K(self, dt, mass):
+        """
+        Computes the reciprocal-space propagator exp(-i * T * dt), T = sum_idof p_idof^2 / (2 * mass_idof)
+
+        Args:
+            dt ( double ): the integration time step [ units: a.u. ]
+            mass ( list of doubles ): the masses of all the DOFs [ units: a.u. ]
+
+        """
+
+        self.expK = np.exp(-1.0j * (2.0 * math.pi**2 * dt) * self._ksq_over_mass(mass))
+
+
+    def add_wfc_Gau(self, x0, px0, dx0, init_state, weight, rep):
+        """
+        Adds the Gaussian wavepacket, the same as `Wfcgrid2.add_wfc_Gau`:
+
+        G(x) = weight * prod_{k} [ (1/(2.0*pi*dx0[k]^2))^(1/4) * exp(-((x[k]-x0[k])/(2*dx0[k]))^2 + i*(x[k]-x0[k])*px0[k]) ]
+
+        Args:
+            x0 ( list of doubles ): the center of the wavepacket [ units: Bohr ]
+            px0 ( list of doubles ): the momentum of the wavepacket [ units: a.u. ]
+            dx0 ( list of doubles ): the widths of the wavepacket [ units: Bohr ]
+            init_state ( int ): the index of the state to which the wavepacket is added
+            weight ( complex ): the amplitude of the wavepacket
+            rep ( int ): the representation: 0 - diabatic, 1 - adiabatic
+
+        """
+
+        g = np.ones(self.npts, dtype=complex) * weight
+
+        for idof in range(self.ndof):
+            x = self.rgrid[idof] - x0[idof]
+            nrm = (1.0/(2.0 * math.pi * dx0[idof]**2))**0.25
+            g = g * self._axis( nrm * np.exp( -(0.5 * x / dx0[idof])**2 + 1.0j * px0[idof] * x ), idof)
+
+        self.psi(rep)[init_state] += g
+
+
+    def update_adiabatic(self):
+        """
+        Updates the adiabatic wavefunction from the diabatic one: psi_adi = U.T() * psi_dia at every point
+        """
+
+        self.PSI_adi = np.einsum("ai...,a...->i...", self.U, self.PSI_dia)
+
+
+    def update_diabatic(self):
+        """
+        Updates the diabatic wavefunction from the adiabatic one: psi_dia = U.conj() * psi_adi at every point
+        """
+
+        self.PSI_dia = np.einsum("ai...,i...->a...", self.U.conj(), self.PSI_adi)
+
+
+    def SOFT_propagate(self):
+        """
+        Propagates the diabatic wavefunction for one time step:
+
+            psi <- expH * IFFT[ expK * FFT[ expH * psi ] ]
+
+        The `update_propagator_H` should have been called with the half of the time step, and the
+        `update_propagator_K` with the time step. The adiabatic wavefunction is not updated
+
+        """
+
+        psi = self._apply(self.expH, self.PSI_dia)
+        psi = np.fft.ifftn( self.expK * np.fft.fftn(psi, axes=self.axes), axes=self.axes)
+        self.PSI_dia = self._apply(self.expH, psi)
+
+
+    def reciprocal(self, rep):
+        """
+        Returns the wavefunction in the reciprocal space, defined in the same way as the `Wfcgrid2.reciPSI_dia`
+        and `Wfcgrid2.reciPSI_adi`: psi(k) = Integral [ psi(r) * exp(-2*pi*i*k*r) dr ], on the `kgrid` points
+
+        Args:
+            rep ( int ): the representation: 0 - diabatic, 1 - adiabatic
+
+        Returns:
+            np.array (nstates, N1, ..., Nd), complex: the reciprocal-space wavefunction
+
+        """
+
+        res = np.fft.fftn(self.psi(rep), axes=self.axes)
+
+        for idof in range(self.ndof):
+            phase = self.dr[idof] * np.exp(-2.0j * math.pi * self.kfft[idof] * self.rmin[idof])
+            res = res * self._axis(phase, idof)[None]
+
+        return np.fft.fftshift(res, axes=self.axes)
+
+
+    def _density(self, rep):
+        """
+        Returns the probability density summed over all states, np.array (N1, ..., Nd)
+        """
+
+        psi = self.psi(rep)
+
+        return np.sum( psi.real**2 + psi.imag**2, axis=0)
+
+
+    def _reci_density(self, rep):
+        """
+        Returns the reciprocal-space probability density summed over all states, |psi(k)|^2, in the order of the FFT output
+        """
+
+        psi_k = np.fft.fftn(self.psi(rep), axes=self.axes)
+
+        return np.sum( psi_k.real**2 + psi_k.imag**2, axis=0) * self.dV**2
+
+
+    def norm(self, rep):
+        """
+        Returns the norm of the wavefunction, <psi|psi>, in the given representation
+        """
+
+        return float(np.sum(self._density(rep))) * self.dV
+
+
+    def e_kin(self, mass, rep):
+        """
+        Returns the kinetic energy, <psi|T|psi> / <psi|psi>, in the given representation [ units: Ha ]
+        """
+
+        res = 2.0 * math.pi**2 * np.sum( self._ksq_over_mass(mass) * self._reci_density(rep) ) * self.dK
+
+        return float(res) / self.norm(rep)
+
+
+    def e_pot(self, rep):
+        """
+        Returns the potential energy, <psi|V|psi> / <psi|psi>, in the given representation [ units: Ha ]
+        """
+
+        psi = self.psi(rep)
+        nrm = np.sum(self._density(rep))
+
+        if rep==0:
+            res = np.sum( np.einsum("i...,ij...,j...->...", psi.conj(), self.Hdia, psi).real )
+        else:
+            res = np.sum( self.Eadi * (psi.real**2 + psi.imag**2) )
+
+        return float(res / nrm)
+
+
+    def e_tot(self, mass, rep):
+        """
+        Returns the total energy, <psi|T+V|psi> / <psi|psi>, in the given representation [ units: Ha ]
+        """
+
+        return self.e_kin(mass, rep) + self.e_pot(rep)
+
+
+    def observables(self, mass, rep, level=3):
+        """
+        Computes all the observables of a given representation at once: the probability densities are
+        computed in one pass over the grid, the reciprocal-space ones - with one FFT, and the moments of
+        the coordinates and momenta - from the 1D marginal densities
+
+        Args:
+            mass ( list of doubles ): the masses of all the DOFs [ units: a.u. ]
+            rep ( int ): the representation: 0 - diabatic, 1 - adiabatic
+            level ( int ): which observables to compute, the same as the output levels of `save.save_data_hdf5` [ default: 3 ]
+
+        Returns:
+            dictionary: the values of the `norm`, `e_kin`, `e_pot`, and `e_tot` ( "norm", "Ekin", "Epot", "Etot" );
+                with the level >= 2 - also of the `get_pops(rep)` ( "pop" ) and `get_pow_q(rep, n)`, `get_pow_p(rep, n)`
+                for n = 1, 2 ( "q", "q2", "p", "p2" ); with the level >= 3 - also of the `get_den_mat(rep)` ( "denmat" )
+
+        """
+
+        psi = self.psi(rep)
+        dens = psi.real**2 + psi.imag**2
+        rho = np.sum(dens, axis=0)
+        nrm = np.sum(rho)
+
+        rho_k = self._reci_density(rep)
+
+        if rep==0:
+            epot = np.sum( np.einsum("i...,ij...,j...->...", psi.conj(), self.Hdia, psi).real )
+        else:
+            epot = np.sum( self.Eadi * dens )
+
+        res = { "norm": float(nrm) * self.dV,
+                "Ekin": float( 2.0 * math.pi**2 * np.sum( self._ksq_over_mass(mass) * rho_k ) * self.dK / (nrm * self.dV) ),
+                "Epot": float(epot / nrm) }
+        res["Etot"] = res["Ekin"] + res["Epot"]
+
+        if level>=2:
+            res["pop"] = data_conv.nparray2MATRIX( np.sum( dens.reshape(self.nstates, self.Npts), axis=1).reshape(self.nstates, 1) * self.dV )
+
+            q = np.zeros( (2, self.ndof, 1), dtype=complex)
+            p = np.zeros( (2, self.ndof, 1), dtype=complex)
+            for idof in range(self.ndof):
+                others = tuple([ i for i in range(self.ndof) if i!=idof ])
+                marg = np.sum(rho, axis=others)
+                marg_k = np.sum(rho_k, axis=others)
+                pk = 2.0 * math.pi * self.kfft[idof]
+
+                for n in [1, 2]:
+                    q[n-1, idof, 0] = np.sum( self.rgrid[idof]**n * marg ) / nrm
+                    p[n-1, idof, 0] = np.sum( pk**n * marg_k ) * self.dK / (nrm * self.dV)
+
+            res.update({ "q": data_conv.nparray2CMATRIX(q[0]), "q2": data_conv.nparray2CMATRIX(q[1]),
+                         "p": data_conv.nparray2CMATRIX(p[0]), "p2": data_conv.nparray2CMATRIX(p[1]) })
+
+        if level>=3:
+            res["denmat"] = self.get_den_mat(rep)
+
+        return res
+
+
+    def get_pow_q(self, rep, n):
+        """
+        Returns the expectation values of the coordinates, <psi|r^n|psi> / <psi|psi>, as CMATRIX(ndof, 1)
+        """
+
+        rho = self._density(rep)
+        nrm = np.sum(rho)
+
+        res = np.zeros( (self.ndof, 1), dtype=complex)
+        for idof in range(self.ndof):
+            res[idof, 0] = np.sum( self._axis(self.rgrid[idof]**n, idof) * rho ) / nrm
+
+        return data_conv.nparray2CMATRIX(res)
+
+
+    def get_pow_p(self, rep, n):
+        """
+        Returns the expectation values of the momenta, <psi|(-i*d/dr)^n|psi> / <psi|psi>, as CMATRIX(ndof, 1)
+        """
+
+        rho_k = self._reci_density(rep)
+        nrm = np.sum(self._density(rep)) * self.dV
+
+        res = np.zeros( (self.ndof, 1), dtype=complex)
+        for idof in range(self.ndof):
+            p = 2.0 * math.pi * self.kfft[idof]
+            res[idof, 0] = np.sum( self._axis(p**n, idof) * rho_k ) * self.dK / nrm
+
+        return data_conv.nparray2CMATRIX(res)
+
+
+    def get_den_mat(self, rep):
+        """
+        Returns the matrix sum_{points} psi * psi.H(), as CMATRIX(nstates, nstates), the same as `Wfcgrid2.get_den_mat`
+        """
+
+        psi = self.psi(rep).reshape(self.nstates, self.Npts)
+
+        return data_conv.nparray2CMATRIX( psi @ psi.conj().T )
+
+
+    def get_pops(self, rep, bmin=None, bmax=None):
+        """
+        Returns the populations of all states, as MATRIX(nstates, 1)
+
+        Args:
+            rep ( int ): the representation: 0 - diabatic, 1 - adiabatic
+            bmin, bmax ( list of doubles ): if given, only the points inside the box bmin <= r <= bmax are included,
+                for the first len(bmin) dimensions [ default: None ]
+
+        """
+
+        psi = self.psi(rep)
+        dens = psi.real**2 + psi.imag**2
+
+        if bmin!=None:
+            inside = np.ones(self.npts, dtype=bool)
+            for idof in range(min(self.ndof, len(bmin))):
+                r = self.rgrid[idof]
+                inside = inside & self._axis( (r >= bmin[idof]) & (r <= bmax[idof]), idof)
+            dens = dens * inside
+
+        pops = np.sum( dens.reshape(self.nstates, self.Npts), axis=1) * self.dV
+
+        return data_conv.nparray2MATRIX( pops.reshape(self.nstates, 1) )
+
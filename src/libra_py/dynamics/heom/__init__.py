@@ -8,7 +8,9 @@
 #***********************************************************/
 
 __all__ = ["compute",
+           "kernels",
            "plot",
            "save",
+           "scan",
           ]
 
@@ -15,6 +15,11 @@
        https://github.com/subotnikgroup/HEOM_Amber
 
        List of functions:
+           * update_filters(rho_scaled, params, aux_memory)
+           * transform_adm(rho, rho_scaled, aux_memory, params, direction)
+           * extract_adms(rho_scaled, nquant, indices, factors)
+           * run_dynamics_active(params, rho_init, _savers, prof, print_freq)
+           * finalize_savers(params, _savers, prof)
            * run_dynamics(dyn_params, Ham, rho_init)
 
 .. moduleauthors:: Alexey V. Akimov
@@ -38,6 +43,7 @@ import sys
 import math
 import copy
 import time
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -47,19 +53,30 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 
 import util.libutil as comn
 import libra_py.units as units
+import libra_py.profiling as profiling
+import libra_py.data_conv as data_conv
 from . import save
+from . import kernels
 
-def aux_print_matrices(step, x):
+def aux_print_matrices(step, x, indices=None):
+    """
+    Prints the matrices x - a list of CMATRIX or a 3D np.array; indices - the labels of the matrices
+    (their indices in the hierarchy), None - 0, 1, ...
+    """
     print(F"= step = {step} =")
     nmat = len(x)
-    nrows = x[0].num_of_rows
-    ncols = x[0].num_of_cols
+    if indices==None:
+        indices = list(range(nmat))
     for imat in range(nmat):
-        print(F"== imat = {imat} ==")
-        for row in range(nrows):
+        print(F"== imat = {indices[imat]} ==")
+        if hasattr(x[imat], "shape"):
+            mat = x[imat]
+        else:
+            mat = data_conv.nparray_view(x[imat])
+        for row in range(mat.shape[0]):
             line = ""
-            for col in range(ncols):
-                line = line + F"{x[imat].get(row, col)}  "
+            for col in range(mat.shape[1]):
+                line = line + F"{mat[row, col]}  "
             print(line)
 
 
@@ -95,7 +112,9 @@ def update_filters(rho_scaled, params, aux_memory):
     # Filtering of the densities - defines the list of nonzero derivatives, params["nonzero"]
     params["nonzero"] = filter(aux_memory["rho_unpacked_scaled"], trash, params["adm_tolerance"], params["do_zeroing"])
 
-    pack_mtx(aux_memory["rho_unpacked_scaled"], rho_scaled)
+    # The ADMs are modified only if they are zeroed
+    if params["do_zeroing"]==1:
+        pack_mtx(aux_memory["rho_unpacked_scaled"], rho_scaled)
 
 
 
@@ -148,6 +167,153 @@ def transform_adm(rho, rho_scaled, aux_memory, params, direction):
         pack_mtx(aux_memory["rho_unpacked"], rho)
 
 
+def extract_adms(rho_scaled, nquant, indices, factors):
+    """
+    Returns the raw ADMs with the given indices, read directly from the packed storage of the scaled ADMs,
+    so the cost does not depend on the size of the hierarchy, unlike that of `transform_adm`
+
+    Args:
+        rho_scaled ( CMATRIX(nn_tot*nquant, nquant) ): all the scaled ADMs stacked on top of each other
+        nquant ( int ): the number of states
+        indices ( list of ints ): the indices of the ADMs to extract
+        factors ( np.array (len(indices)) ): the scaling factors of these ADMs, see `kernels.scaling_factors`
+
+    Returns:
+        np.array (len(indices), nquant, nquant), complex: the raw ADMs
+
+    """
+
+    x = data_conv.nparray_view(rho_scaled).reshape(-1, nquant, nquant)
+
+    return x[indices] * factors[:, None, None]
+
+
+
+def run_dynamics_active(params, rho_init, _savers, prof, print_freq):
+    """
+    Integrates the HEOM with the NumPy version of the equations of motion, see `kernels`. Only the
+    ADMs on the current params["adm_list"] are propagated and only those and the nonzero ADMs enter
+    the equations, so the cost of a step does not depend on the number of the filtered out ADMs.
+    The lists are updated every params["filter_after_steps"] steps, as in `run_dynamics`.
+
+    Args:
+        params ( dictionary ): the parameters of the dynamics, see `run_dynamics`, set up by it
+        rho_init ( CMATRIX(nstates, nstates) ): the initial density matrix
+        _savers ( dictionary ): the savers, see `save.init_heom_savers`
+        prof ( profiling.profiler ): the profiler
+        print_freq ( int ): the frequency of the progress printout [ in steps ]
+
+    """
+
+    tab = kernels.hierarchy_tables(params)
+    nn_tot = tab["nvec"].shape[0]
+    nquant = rho_init.num_of_cols
+    scl = kernels.scaling_factors(tab["nvec"], tab["c"], tab["do_scale"])
+    idx = [0] + list(params["adm_save_indices"])
+
+    dt = params["dt"]
+    integrator = params["integrator"]
+
+    # raw -> scaled
+    rho_scaled = np.zeros( (nn_tot, nquant, nquant), dtype=complex)
+    rho_scaled[0] = data_conv.nparray_view(rho_init) / scl[0]
+
+    #========== Filter scaled ADMs ======================
+    nonzero = np.ones(nn_tot, dtype=bool)
+    adm_list, nonzero = kernels.update_filters(rho_scaled, tab, nonzero, params["adm_tolerance"], 
+                                               params["adm_deriv_tolerance"], params["do_zeroing"])
+
+    h = dt  # the internal step of the adaptive integrator
+    nacc, nrej = 0, 0
+
+    start = time.time()
+    for step in range(params["nsteps"]):
+
+        #================ Saving and printout ===================
+        # scaled -> raw, only for the system's density matrix and the ADMs to save
+        prof.start("unpacking")
+        adms = rho_scaled[idx] * scl[idx, None, None]
+        denmat = data_conv.nparray2CMATRIX( adms[0] )
+        prof.stop("unpacking")
+
+        prof.start("saving")
+        save.save_heom_data(_savers, step, print_freq, params, [denmat], adms[1:])
+        prof.stop("saving")
+
+        if step%print_freq==0:
+            print(F" step= {step}")
+
+            if params["verbosity"]>=3:
+                print("nonzero = ", list(nonzero.astype(int)))
+                print("adm_list = ", list(adm_list))
+
+            if params["verbosity"]>=4:
+                print("ADMs")
+                aux_print_matrices(step, adms, idx)
+                print("Scaled ADMs")
+                aux_print_matrices(step, rho_scaled[idx], idx)
+
+
+        #============== Update the list of active equations = Filtering  ============
+        if step % params["filter_after_steps"] == 0:
+            prof.start("filtering")
+            adm_list, nonzero = kernels.update_filters(rho_scaled, tab, nonzero, params["adm_tolerance"], 
+                                                       params["adm_deriv_tolerance"], params["do_zeroing"])
+            prob = kernels.build_active(tab, adm_list, nonzero, rho_scaled)
+            prof.stop("filtering")
+
+
+        #================= Propagation for one timestep ==================================
+        prof.start("propagation")
+        y = rho_scaled[adm_list]
+        if integrator==1:
+            y, h, na, nr = kernels.rk45(y, dt, prob, h, params["rtol"], params["atol"], params["max_substeps"])
+            nacc, nrej = nacc + na, nrej + nr
+        else:
+            y = kernels.rk4(y, dt, prob)
+        rho_scaled[adm_list] = y
+        prof.stop("propagation")
+
+        prof.end_step()
+
+
+    end = time.time()
+    print(F"Calculations took {end - start} seconds")
+
+    if integrator==1 and params["verbosity"]>=1:
+        print(F"RK45: {nacc} accepted and {nrej} rejected internal steps")
+
+
+
+def finalize_savers(params, _savers, prof):
+    """
+    Closes the savers, writes the data kept in memory and the timing report
+
+    Returns:
+        mem_saver or None: the `mem_saver` object, if it is used
+
+    """
+
+    prefix = params["prefix"]
+
+    prof.start("saving_final")
+    if _savers["hdf5_saver"] != None:
+        _savers["hdf5_saver"].close()
+
+    # For the mem_saver - store all the results into HDF5 format only at the end of the simulation
+    if _savers["mem_saver"] != None:
+        _savers["mem_saver"].save_data( F"{prefix}/mem_data.hdf", params["properties_to_save"], "w")
+    prof.stop("saving_final")
+
+    prof.add_saver("hdf5_saver", _savers["hdf5_saver"])
+    prof.add_saver("mem_saver", _savers["mem_saver"])
+    prof.write_summary(F"{prefix}/timing.txt")
+    prof.save_step_timings(F"{prefix}/data.hdf")
+
+    return _savers["mem_saver"]
+
+
+
 def run_dynamics(dyn_params, Ham, rho_init):
 
     """
@@ -232,6 +398,30 @@ def run_dynamics(dyn_params, Ham, rho_init):
             * **dyn_params["num_threads"]** ( int )
                 The number of OMP threads to use to parallelize the calculations [ default: 1 ]
 
+            * **dyn_params["engine"]** ( int )
+                How to integrate the HEOM. Options are:
+
+                - 0 : the C++ equations of motion for the whole hierarchy, with the fixed-step RK4 [ default ]
+                - 1 : the NumPy equations of motion only for the active ADMs (those on the `adm_list`), see
+                      `run_dynamics_active` and `kernels`. The ADMs filtered out cost nothing, which gives large
+                      speedups for the deep hierarchies (LL ~ 10-20) in which most ADMs are filtered out
+
+            * **dyn_params["integrator"]** ( int )
+                The integrator used with `engine` = 1. Options are:
+
+                - 0 : RK4 with the time step `dt` [ default ]
+                - 1 : the adaptive Dormand-Prince RK45 with error control: the time step `dt` becomes the
+                      interval between the saved data, the internal steps are chosen automatically
+
+            * **dyn_params["rtol"]** ( float )
+                The relative tolerance of the RK45 integrator [ default: 1e-6 ]
+
+            * **dyn_params["atol"]** ( float )
+                The absolute tolerance of the RK45 integrator [ default: 1e-10 ]
+
+            * **dyn_params["max_substeps"]** ( int )
+                The maximal number of the internal RK45 steps per time step `dt` [ default: 10000 ]
+
             =============== Parameters for saving data ================
 
             * **dyn_params["prefix"]** ( string )
@@ -279,9 +469,23 @@ def run_dynamics(dyn_params, Ham, rho_init):
                     The density matrix evolution
                     *_output_level >= 3
 
+                - **adms** ( nadm x CMATRIX(nstates, nstates) )
+                    The (raw) ADMs of the tiers listed in `adm_save_tiers`, in the order of the hierarchy
+                    *_output_level >= 4
+
                 [ default: [ "timestep", "time", "denmat" ] ]
 
 
+            * **dyn_params["hierarchy"]** ( tuple of 3 intList2 or None )
+                The precomputed topology of the hierarchy, ( nvec, nvec_plus, nvec_minus ), as produced by
+                `gen_hierarchy` for nquant * (KK+1) modes and the depth LL - e.g. by `scan.get_hierarchy`, 
+                which can reuse it across the calculations. None - generate it here [ default: None ]
+
+            * **dyn_params["adm_save_tiers"]** ( list of ints )
+                The tiers of the hierarchy whose ADMs are saved in the "adms" dataset (and printed with the
+                verbosity >= 4). Only these ADMs and the system's density matrix are read from the hierarchy at
+                every step, so the cost of saving does not depend on the size of the hierarchy [ default: [] ]
+
             * **dyn_params["use_compression"]** ( int )
                 Whether to use the data compression (via gzip) when storing data to HDF5 files.
                 Options:
@@ -298,6 +502,25 @@ def run_dynamics(dyn_params, Ham, rho_init):
 
                 [ default: [0,0,0] ]
 
+            * **dyn_params["hdf5_buffer_size"]** ( int )
+                The number of timesteps for which the data saved with the `hdf5_output_level` option
+                are accumulated in memory before being written to the "data.hdf" file in one block.
+                With the values larger than 0, the file is kept open during the whole calculation, which
+                makes the on-the-fly saving much faster. If the calculations crash, at most this many last
+                steps are lost. The value of 0 selects the original saver that writes every step
+                directly into the file. [ default: 0 ]
+
+            * **dyn_params["profiling_level"]** ( int )
+                Whether to measure the costs of the different phases of the calculations (unpacking of the
+                scaled ADMs, saving, filtering, propagation). The report with the time and the number of calls 
+                of each phase, the amount of data kept by each saver and the peak memory is written into the 
+                "timing.txt" file in the `prefix` directory. See `libra_py.profiling`. Options:
+
+                - 0 : no profiling [ default ]
+                - 1 : write the timing report
+                - 2 : also write the per-step time of each phase into the "timings/<phase>/data" datasets
+                      of the "data.hdf" file in the `prefix` directory
+
 
 
         Ham ( CMATRIX(nstates, nstates) )
@@ -335,7 +558,10 @@ def run_dynamics(dyn_params, Ham, rho_init):
                        "prefix":"out",
                        "hdf5_output_level":0, "txt_output_level":0, "mem_output_level":3,
                        "properties_to_save": [ "timestep", "time", "denmat"],
-                       "use_compression":0, "compression_level":[0,0,0]
+                       "use_compression":0, "compression_level":[0,0,0],
+                       "hdf5_buffer_size":0, "profiling_level":0,
+                       "adm_save_tiers":[], "hierarchy":None,
+                       "engine":0, "integrator":0, "rtol":1e-6, "atol":1e-10, "max_substeps":10000
                      }
 
     comn.check_input(params, default_params, critical_params)
@@ -355,11 +581,19 @@ def run_dynamics(dyn_params, Ham, rho_init):
     KK = dyn_params["KK"]
     LL = dyn_params["LL"]
 
-    all_vectors = intList2()
-    vec_plus = intList2()
-    vec_minus = intList2()
-
-    gen_hierarchy(nquant * (KK+1), LL, params["verbosity"], all_vectors, vec_plus, vec_minus)
+    if params["hierarchy"]!=None:
+        # Precomputed, e.g. by `scan.get_hierarchy`
+        all_vectors, vec_plus, vec_minus = params["hierarchy"]
+        if len(all_vectors[0])!=nquant * (KK+1):
+            print(F"ERROR: the precomputed hierarchy is for {len(all_vectors[0])} modes, expected nquant*(KK+1) = {nquant * (KK+1)}")
+            print("Exiting...")
+            sys.exit(0)
+    else:
+        all_vectors = intList2()
+        vec_plus = intList2()
+        vec_minus = intList2()
+
+        gen_hierarchy(nquant * (KK+1), LL, params["verbosity"], all_vectors, vec_plus, vec_minus)
     params.update( { "nvec":all_vectors, "nvec_plus":vec_plus, "nvec_minus":vec_minus } )
 
     nn_tot = len(all_vectors)
@@ -383,6 +617,24 @@ def run_dynamics(dyn_params, Ham, rho_init):
         for k in range(KK+1):
             print(F" k = {k} gamma_matsubara[{k}] = {gamma_matsubara[k]}  c_matsubara[{k}] = {c_matsubara[k]}")
 
+    #============= ADMs to save ================
+    adm_save_indices = []
+    if len(params["adm_save_tiers"])>0:
+        adm_save_indices = [ n for n in range(nn_tot) if sum(all_vectors[n]) in params["adm_save_tiers"] ]
+    params.update({ "adm_save_indices": adm_save_indices })
+
+    #============= NumPy engine ================
+    if params["engine"]==1:
+        _savers = save.init_heom_savers(params, nquant)
+        prof = profiling.profiler(params["profiling_level"])
+
+        run_dynamics_active(params, rho_init, _savers, prof, print_freq)
+
+        mem_saver = finalize_savers(params, _savers, prof)
+        if mem_saver != None:
+            return mem_saver
+        return
+
     #============= Initialization ============
 
     rho = CMATRIX((nn_tot)*nquant, nquant)  # all rho matrices stacked on top of each other
@@ -441,6 +693,13 @@ def run_dynamics(dyn_params, Ham, rho_init):
     # Initialize savers
     _savers = save.init_heom_savers(params, nquant)
 
+    prof = profiling.profiler(params["profiling_level"])
+
+    # Only these ADMs are converted to the raw ones at every step: the system's density matrix and the ADMs to save
+    idx = [0] + adm_save_indices
+    idx_factors = kernels.scaling_factors(np.array([ list(all_vectors[n]) for n in idx ]), 
+                                          np.array(list(c_matsubara)), params["do_scale"])
+
     #============== Propagation =============
 
 
@@ -448,11 +707,16 @@ def run_dynamics(dyn_params, Ham, rho_init):
     for step in range(params["nsteps"]):
 
         #================ Saving and printout ===================
-        # scaled -> raw
-        transform_adm(rho, rho_scaled, aux_memory, params, -1)
+        # scaled -> raw, directly from the packed storage
+        prof.start("unpacking")
+        adms = extract_adms(rho_scaled, nquant, idx, idx_factors)
+        denmat = data_conv.nparray2CMATRIX( adms[0] )
+        prof.stop("unpacking")
 
         # Save the variables
-        save.save_heom_data(_savers, step, print_freq, params, aux_memory["rho_unpacked"])
+        prof.start("saving")
+        save.save_heom_data(_savers, step, print_freq, params, [denmat], adms[1:])
+        prof.stop("saving")
 
 
         if step%print_freq==0:
@@ -464,9 +728,9 @@ def run_dynamics(dyn_params, Ham, rho_init):
 
             if params["verbosity"]>=4:
                 print("ADMs")
-                aux_print_matrices(0, aux_memory["rho_unpacked"])
+                aux_print_matrices(step, adms, idx)
                 print("Scaled ADMs")
-                aux_print_matrices(0, aux_memory["rho_unpacked_scaled"])
+                aux_print_matrices(step, extract_adms(rho_scaled, nquant, idx, np.ones(len(idx))), idx)
 
 
 
@@ -476,21 +740,25 @@ def run_dynamics(dyn_params, Ham, rho_init):
 
             # To assess which equations to discard, lets estimate the time-derivatives of rho
             # for all the matrices
+            prof.start("filtering")
             params["adm_list"] = Py2Cpp_int( all_indices )
 
             update_filters(rho_scaled, params, aux_memory)
+            prof.stop("filtering")
 
 
         #================= Propagation for one timestep ==================================
+        prof.start("propagation")
         rho_scaled = RK4(rho_scaled, params["dt"], compute_heom_derivatives, params)
+        prof.stop("propagation")
+
+        prof.end_step()
 
 
     end = time.time()
     print(F"Calculations took {end - start} seconds")
 
+    mem_saver = finalize_savers(params, _savers, prof)
 
-    # For the mem_saver - store all the results into HDF5 format only at the end of the simulation
-    if _savers["mem_saver"] != None:
-        prefix = params["prefix"]
-        _savers["mem_saver"].save_data( F"{prefix}/mem_data.hdf", params["properties_to_save"], "w")
-        return _savers["mem_saver"]
+    if mem_saver != None:
+        return mem_saver
@@ -0,0 +1,432 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 3 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#***********************************************************************************
+"""
+.. module:: kernels
+   :platform: Unix, Windows
+   :synopsis: This module implements the NumPy version of the HEOM equations of motion, restricted
+       to the set of the active auxiliary density matrices (ADMs), and the integrators used with it.
+       The ADMs are kept as the np.array of shape (nn_tot, nquant, nquant). The equations are the same
+       as those of the C++ `compute_heom_derivatives` (Eq. 15, JCP 131, 094502 (2009)), but only the
+       equations of the ADMs on the params["adm_list"] are integrated, and only the ADMs on this list
+       and those with params["nonzero"] flags are stored in the state vector, so the cost of a step
+       is proportional to the number of the active ADMs rather than to the size of the hierarchy.
+
+       List of functions:
+           * hierarchy_tables(params)
+           * truncation_prefactor(params, gamma_matsubara, c_matsubara)
+           * scaling_factors(nvec, c_matsubara, do_scale)
+           * build_active(tables, act, nonzero, rho)
+           * derivatives(y, prob)
+           * update_filters(rho, tables, nonzero, adm_tolerance, adm_deriv_tolerance, do_zeroing)
+           * rk4(y, dt, prob)
+           * rk45(y, dt, prob, h, rtol, atol, max_substeps)
+
+.. moduleauthors:: Alexey V. Akimov
+
+"""
+
+__author__ = "Alexey V. Akimov"
+__copyright__ = "Copyright 2020 Alexey V. Akimov"
+__credits__ = ["Alexey V. Akimov"]
+__license__ = "GNU-3"
+__version__ = "1.0"
+__maintainer__ = "Alexey V. Akimov"
+__email__ = "alexvakimov@gmail.com"
+__url__ = "https://quantum-dynamics-hub.github.io/libra/index.html"
+
+
+import sys
+import math
+import numpy as np
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+import libra_py.units as units
+import libra_py.data_conv as data_conv
+
+
+
+def truncation_prefactor(params, gamma_matsubara, c_matsubara):
+    """
+    Computes the prefactor of the [Q_m, [Q_m, rho_n]] truncation terms, same as `compute_heom_derivatives`
+
+    Args:
+        params ( dictionary ): the parameters of the HEOM, see `compute.run_dynamics`
+        gamma_matsubara ( np.array (KK+1) ): the Matsubara frequencies [ units: a.u. ]
+        c_matsubara ( np.array (KK+1), complex ): the expansion coefficients of the bath correlation function
+
+    Returns:
+        complex: the truncation prefactor, 0 if params["truncation_scheme"] is 0
+
+    """
+
+    scheme = params["truncation_scheme"]
+    kB = units.boltzmann / units.hartree
+    pref = 0.0+0.0j
+
+    if scheme==1 or scheme==2:
+        # Ihizaki-Tanimura scheme for truncation, JPSJ 74 3131, 2005
+        pref = params["eta"] * kB * params["temperature"] / gamma_matsubara[0] + 0.0j
+        matsubara_sum = np.sum(c_matsubara / gamma_matsubara)
+
+        if scheme==1:
+            pref -= np.real(matsubara_sum)
+        else:
+            pref -= matsubara_sum
+
+    elif scheme==3 or scheme==4:
+        more = 200
+        gamma_ext, c_ext = doubleList(), complexList()
+        setup_bath(len(gamma_matsubara) - 1 + more, params["eta"], params["gamma"], params["temperature"], gamma_ext, c_ext)
+
+        sum_ext = np.sum( np.array(list(c_ext)) / np.array(list(gamma_ext)) )
+        sum_kk = np.sum(c_matsubara / gamma_matsubara)
+
+        pref = sum_ext - sum_kk
+        if scheme==4:
+            pref = np.real(pref) + 0.0j
+
+    return pref
+
+
+
+def hierarchy_tables(params):
+    """
+    Converts the HEOM hierarchy and the bath parameters into the np.arrays used by the other functions
+
+    Args:
+        params ( dictionary ): the parameters of the HEOM, see `compute.run_dynamics`, which should contain
+            the "Ham", "nvec", "nvec_plus", "nvec_minus", "gamma_matsubara", "c_matsubara", and "el_phon_couplings"
+            entries set up by `compute.run_dynamics`
+
+    Returns:
+        dictionary: the tables:
+
+            * **tables["nvec"]** ( np.array (nn_tot, nquant*(KK+1)), int ): the multi-index vectors of the ADMs
+            * **tables["plus"]**, **tables["minus"]** ( np.array (nn_tot, nquant, KK+1), int ): the indices of the
+                rho_n+ and rho_n- ADMs, nn_tot if there is no such ADM in the hierarchy
+            * **tables["coeff_plus"]** ( np.array (nn_tot, nquant, KK+1) ): the factors of the rho_n+ terms
+            * **tables["coeff_minus"]** ( np.array (nn_tot, nquant, KK+1) ): the factors of the rho_n- terms
+            * **tables["friction"]** ( np.array (nn_tot) ): sum_{m,k} n_mk * gamma_k
+            * **tables["c"]**, **tables["gamma"]** ( np.array (KK+1) ): the Matsubara terms
+            * **tables["Ham"]** ( np.array (nquant, nquant), complex ): the system's Hamiltonian
+            * **tables["Q"]** ( np.array (nquant, nquant, nquant), complex ): the system-bath coupling operators
+            * **tables["Q_diag"]** ( np.array (nquant, nquant) or None ): the diagonals of Q, if all of them are diagonal
+            * **tables["trunc"]** ( complex ): the truncation prefactor, see `truncation_prefactor`
+            * **tables["do_scale"]** ( int ): whether the scaled HEOM is used
+
+    """
+
+    nquant = params["Ham"].num_of_cols
+    gamma = np.array(list(params["gamma_matsubara"]))
+    c = np.array(list(params["c_matsubara"]), dtype=complex)
+    KK = len(gamma) - 1
+
+    nvec = np.array([ list(v) for v in params["nvec"] ], dtype=int)
+    nn_tot = nvec.shape[0]
+
+    plus = np.array([ list(v) for v in params["nvec_plus"] ], dtype=int).reshape(nn_tot, nquant, KK+1)
+    minus = np.array([ list(v) for v in params["nvec_minus"] ], dtype=int).reshape(nn_tot, nquant, KK+1)
+    plus[plus<0] = nn_tot
+    minus[minus<0] = nn_tot
+
+    n_mk = nvec.reshape(nn_tot, nquant, KK+1).astype(float)
+    abs_c = np.abs(c)
+
+    if params["do_scale"]==1:
+        coeff_plus = np.sqrt( (n_mk + 1.0) * abs_c[None, None, :] )
+        coeff_minus = np.zeros(n_mk.shape)
+        pos = abs_c > 1e-50
+        coeff_minus[:, :, pos] = np.sqrt( n_mk[:, :, pos] / abs_c[None, None, pos] )
+    else:
+        coeff_plus = np.ones(n_mk.shape)
+        coeff_minus = n_mk
+
+    Q = data_conv.matrices2nparray( [ params["el_phon_couplings"][m] for m in range(nquant) ] ).astype(complex)
+    Q_diag = None
+    if np.all( Q == np.einsum("mi,ij->mij", np.diagonal(Q, axis1=1, axis2=2), np.eye(nquant)) ):
+        Q_diag = np.diagonal(Q, axis1=1, axis2=2).copy()
+
+    return { "nvec":nvec, "plus":plus, "minus":minus, "coeff_plus":coeff_plus, "coeff_minus":coeff_minus,
+             "friction":np.einsum("nmk,k->n", n_mk, gamma),
+             "c":c, "gamma":gamma, "Ham":np.array(data_conv.nparray_view(params["Ham"]), dtype=complex),
+             "Q":Q, "Q_diag":Q_diag, "trunc":truncation_prefactor(params, gamma, c), "do_scale":params["do_scale"] }
+
+
+
+def scaling_factors(nvec, c_matsubara, do_scale):
+    """
+    Computes the factors converting the scaled ADMs (JCP 130, 084105, 2009) to the raw ones
+
+    Args:
+        nvec ( np.array (nadm, nquant*(KK+1)), int ): the multi-index vectors of the ADMs, e.g. tables["nvec"]
+            (see `hierarchy_tables`) or a subset of them
+        c_matsubara ( np.array (KK+1), complex ): the expansion coefficients of the bath correlation function
+        do_scale ( int ): whether the scaled HEOM is used
+
+    Returns:
+        np.array (nadm): f_n = sqrt( prod_{m,k} n_mk! * |c_k|^n_mk ), such that rho_n = f_n * rho_scaled_n,
+            or all ones if the scaled HEOM is not used
+
+    """
+
+    nn_tot = nvec.shape[0]
+
+    if do_scale!=1:
+        return np.ones(nn_tot)
+
+    KK = len(c_matsubara) - 1
+    abs_c = np.tile( np.abs(c_matsubara), nvec.shape[1] // (KK+1) )
+
+    f = np.ones(nn_tot)
+    for n in range(nn_tot):
+        for j in np.nonzero(nvec[n])[0]:
+            f[n] *= math.factorial(nvec[n, j]) * abs_c[j]**nvec[n, j]
+
+    return np.sqrt(f)
+
+
+
+def build_active(tables, act, nonzero, rho):
+    """
+    Sets up the problem of integrating the EOMs of the ADMs `act`. The ADMs that are flagged `nonzero`, but
+    are not on the `act` list, enter the EOMs as the constants - they are taken from `rho`
+
+    Args:
+        tables ( dictionary ): see `hierarchy_tables`
+        act ( np.array (na), int ): the indices of the ADMs whose EOMs are integrated
+        nonzero ( np.array (nn_tot), bool ): the flags of the ADMs that enter the EOMs of other ADMs
+        rho ( np.array (nn_tot, nquant, nquant), complex ): the current (scaled) ADMs
+
+    Returns:
+        dictionary: the problem, passed to the `derivatives`, `rk4`, and `rk45` functions
+
+    """
+
+    nn_tot = tables["nvec"].shape[0]
+    na = len(act)
+
+    is_act = np.zeros(nn_tot, dtype=bool)
+    is_act[act] = True
+    const = np.nonzero( nonzero & ~is_act )[0]
+    nc = len(const)
+
+    # The position of each ADM in the extended state vector [ y, constants, 0 ]
+    pos = np.full(nn_tot+1, na + nc, dtype=int)
+    pos[act] = np.arange(na)
+    pos[const] = na + np.arange(nc)
+
+    # Only the nonzero ADMs contribute to the EOMs of the others
+    nz = np.append(nonzero, False)
+    plus, minus = tables["plus"][act], tables["minus"][act]
+
+    return { "tables":tables, "act":act, "pos_plus":pos[plus], "pos_minus":pos[minus],
+             "coeff_plus":tables["coeff_plus"][act] * nz[plus],
+             "coeff_minus":tables["coeff_minus"][act] * nz[minus],
+             "friction":tables["friction"][act], "diag":nonzero[act].astype(float),
+             "const":np.concatenate( (rho[const], np.zeros((1,) + rho.shape[1:], dtype=complex)) ) }
+
+
+
+def derivatives(y, prob):
+    """
+    Computes the time-derivatives of the active ADMs
+
+    Args:
+        y ( np.array (na, nquant, nquant), complex ): the active (scaled) ADMs
+        prob ( dictionary ): see `build_active`
+
+    Returns:
+        np.array (na, nquant, nquant), complex: the time-derivatives of the active ADMs
+
+    """
+
+    tab = prob["tables"]
+    H, Q, Qd, c = tab["Ham"], tab["Q"], tab["Q_diag"], tab["c"]
+
+    z = np.concatenate( (y, prob["const"]) )
+
+    #============ Liouvillian, friction, and truncation ==============
+    dy = -1.0j * (H @ y - y @ H) - prob["friction"][:, None, None] * y
+
+    if tab["trunc"]!=0.0:
+        if Qd is not None:
+            w = np.sum( (Qd[:, :, None] - Qd[:, None, :])**2, axis=0 )
+            dy -= tab["trunc"] * w[None] * y
+        else:
+            comm = np.einsum("mij,njk->nmik", Q, y) - np.einsum("nij,mjk->nmik", y, Q)
+            dy -= tab["trunc"] * np.sum( np.einsum("mij,nmjk->nmik", Q, comm) - np.einsum("nmij,mjk->nmik", comm, Q), axis=1)
+
+    dy *= prob["diag"][:, None, None]
+
+    #============ rho_n+ and rho_n- terms ==============
+    s = np.einsum("nmk,nmkij->nmij", prob["coeff_plus"], z[prob["pos_plus"]])
+
+    zm = z[prob["pos_minus"]]
+    s1 = s + np.einsum("nmk,k,nmkij->nmij", prob["coeff_minus"], c, zm)
+    s2 = s + np.einsum("nmk,k,nmkij->nmij", prob["coeff_minus"], np.conj(c), zm)
+
+    if Qd is not None:
+        dy -= 1.0j * np.einsum("mi,nmij->nij", Qd, s1) - 1.0j * np.einsum("nmij,mj->nij", s2, Qd)
+    else:
+        dy -= 1.0j * np.einsum("mij,nmjk->nik", Q, s1) - 1.0j * np.einsum("nmij,mjk->nik", s2, Q)
+
+    return dy
+
+
+
+def update_filters(rho, tables, nonzero, adm_tolerance, adm_deriv_tolerance, do_zeroing):
+    """
+    Same as `compute.update_filters`: determines the ADMs whose time-derivatives are larger than
+    `adm_deriv_tolerance` (the EOMs to integrate) and the ADMs that are larger than `adm_tolerance`.
+    Only the nonzero ADMs and their neighbors in the hierarchy can have non-zero derivatives, so only
+    their derivatives are computed
+
+    Args:
+        rho ( np.array (nn_tot, nquant, nquant), complex ): the (scaled) ADMs, the ADMs found to be zero
+            are set to 0.0 if do_zeroing is 1
+        tables ( dictionary ): see `hierarchy_tables`
+        nonzero ( np.array (nn_tot), bool ): the current flags of the nonzero ADMs
+        adm_tolerance ( double ): the threshold for the ADMs' elements
+        adm_deriv_tolerance ( double ): the threshold for the ADMs' time-derivatives
+        do_zeroing ( int ): whether to set the zero ADMs to 0.0
+
+    Returns:
+        tuple: ( adm_list, nonzero ), where:
+
+            * adm_list ( np.array, int ): the indices of the ADMs whose EOMs are integrated
+            * nonzero ( np.array (nn_tot), bool ): the new flags of the nonzero ADMs
+
+    """
+
+    nn_tot = rho.shape[0]
+
+    src = np.nonzero(nonzero)[0]
+    cand = np.zeros(nn_tot+1, dtype=bool)
+    cand[src] = True
+    cand[ tables["plus"][src].ravel() ] = True
+    cand[ tables["minus"][src].ravel() ] = True
+    cand = np.nonzero(cand[:nn_tot])[0]
+
+    drho = derivatives(rho[cand], build_active(tables, cand, nonzero, rho))
+    adm_list = cand[ np.max(np.abs(drho), axis=(1, 2)) > adm_deriv_tolerance ]
+
+    nonzero = np.max(np.abs(rho), axis=(1, 2)) > adm_tolerance
+    if do_zeroing==1:
+        rho[~nonzero] = 0.0
+
+    return adm_list, nonzero
+
+
+
+def rk4(y, dt, prob):
+    """
+    Advances the active ADMs by one step of the classical 4-th order Runge-Kutta method
+
+    Args:
+        y ( np.array (na, nquant, nquant), complex ): the active ADMs
+        dt ( double ): the time step [ units: a.u. ]
+        prob ( dictionary ): see `build_active`
+
+    Returns:
+        np.array (na, nquant, nquant), complex: the ADMs at time t + dt
+
+    """
+
+    k1 = derivatives(y, prob)
+    k2 = derivatives(y + 0.5*dt*k1, prob)
+    k3 = derivatives(y + 0.5*dt*k2, prob)
+    k4 = derivatives(y + dt*k3, prob)
+
+    return y + (dt/6.0) * (k1 + 2.0*k2 + 2.0*k3 + k4)
+
+
+
+# Dormand-Prince 5(4) tableau
+_DP_A = [ [],
+          [1.0/5.0],
+          [3.0/40.0, 9.0/40.0],
+          [44.0/45.0, -56.0/15.0, 32.0/9.0],
+          [19372.0/6561.0, -25360.0/2187.0, 64448.0/6561.0, -212.0/729.0],
+          [9017.0/3168.0, -355.0/33.0, 46732.0/5247.0, 49.0/176.0, -5103.0/18656.0],
+          [35.0/384.0, 0.0, 500.0/1113.0, 125.0/192.0, -2187.0/6784.0, 11.0/84.0] ]
+_DP_E = [ 71.0/57600.0, 0.0, -71.0/16695.0, 71.0/1920.0, -17253.0/339200.0, 22.0/525.0, -1.0/40.0 ]
+
+
+def rk45(y, dt, prob, h, rtol, atol, max_substeps):
+    """
+    Advances the active ADMs by the time dt with the embedded Dormand-Prince 5(4) method, using as many
+    internal steps as needed to keep the local error estimate below the tolerance:
+
+        sqrt( mean( ( |err| / (atol + rtol * max(|y|, |y_new|)) )^2 ) ) <= 1
+
+    Args:
+        y ( np.array (na, nquant, nquant), complex ): the active ADMs
+        dt ( double ): the time interval [ units: a.u. ]
+        prob ( dictionary ): see `build_active`
+        h ( double ): the initial internal step, e.g. the one returned by the previous call [ units: a.u. ]
+        rtol ( double ): the relative tolerance
+        atol ( double ): the absolute tolerance
+        max_substeps ( int ): the maximal number of the internal steps (accepted and rejected)
+
+    Returns:
+        tuple: ( y, h, nacc, nrej ), where:
+
+            * y ( np.array (na, nquant, nquant), complex ): the ADMs at time t + dt
+            * h ( double ): the suggested size of the next internal step [ units: a.u. ]
+            * nacc ( int ): the number of the accepted internal steps
+            * nrej ( int ): the number of the rejected internal steps
+
+    """
+
+    if y.shape[0]==0:
+        return y, h, 0, 0
+
+    t = 0.0
+    nacc, nrej = 0, 0
+    k = [ derivatives(y, prob) ]
+
+    while t < dt * (1.0 - 1e-12):
+
+        if nacc + nrej >= max_substeps:
+            print(F"Error in rk45: the number of internal steps exceeds max_substeps = {max_substeps}")
+            print("Consider increasing the tolerances or max_substeps")
+            sys.exit(0)
+
+        # The step is shortened to end exactly at t + dt, the suggested one is kept for the next call
+        hs = min(h, dt - t)
+
+        k = k[:1]
+        for i in range(1, 7):
+            yi = y + hs * sum( [ a * k[j] for j, a in enumerate(_DP_A[i]) if a!=0.0 ] )
+            k.append( derivatives(yi, prob) )
+
+        y_new = yi  # the 5-th order solution, the last stage of the FSAL scheme
+        err = hs * sum( [ e * k[j] for j, e in enumerate(_DP_E) if e!=0.0 ] )
+
+        sc = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+        err_norm = math.sqrt( np.mean( (np.abs(err) / sc)**2 ) )
+
+        if err_norm <= 1.0:
+            t = t + hs
+            y = y_new
+            k = [ k[6] ]
+            nacc += 1
+            fac = 5.0 if err_norm==0.0 else min(5.0, 0.9 * err_norm**(-0.2))
+            h = min(h, hs * fac) if hs < h else hs * fac
+        else:
+            nrej += 1
+            h = hs * max(0.2, 0.9 * err_norm**(-0.2))
+
+    return y, h, nacc, nrej
+
@@ -15,10 +15,10 @@
        data, you shall add the corresponding info in these modules
 
        List of functions:
-           * init_heom_data(saver, hdf5_output_level, _nsteps, _nquant)
+           * init_heom_data(saver, hdf5_output_level, _nsteps, _nquant, _nadm=0)
            * init_heom_savers(params, nquant)
-           * save_heom_hdf5(step, saver, params, denmat)
-           * save_heom_data(_savers, step, print_freq, params, rho_unpacked)
+           * save_heom_hdf5(step, saver, params, denmat, adms=None)
+           * save_heom_data(_savers, step, print_freq, params, rho_unpacked, adms=None)
 
 .. moduleauthor:: Alexey V. Akimov
   
@@ -55,7 +55,7 @@ import libra_py.data_savers as data_savers
 
 #===================== HEOM output ====================
 
-def init_heom_data(saver, hdf5_output_level, _nsteps, _nquant):
+def init_heom_data(saver, hdf5_output_level, _nsteps, _nquant, _nadm=0):
 
     if hdf5_output_level>=1:
         # Time axis (integer steps)
@@ -69,6 +69,10 @@ def init_heom_data(saver, hdf5_output_level, _nsteps, _nquant):
         # System's density matrix
         saver.add_dataset("denmat", (_nsteps, _nquant, _nquant), "C") 
 
+    if hdf5_output_level>=4 and _nadm>0:
+        # Selected ADMs
+        saver.add_dataset("adms", (_nsteps, _nadm, _nquant, _nquant), "C") 
+
 
 
 
@@ -84,6 +88,7 @@ def init_heom_savers(params, nquant):
         os.mkdir(prefix)
 
     properties_to_save = params["properties_to_save"]
+    nadm = len(params["adm_save_indices"])
 
 
     _savers = {"hdf5_saver":None, "txt_saver":None, "mem_saver":None }
@@ -92,9 +97,12 @@ def init_heom_savers(params, nquant):
     hdf5_output_level = params["hdf5_output_level"]
     
     if hdf5_output_level > 0:                
-        _savers["hdf5_saver"] = data_savers.hdf5_saver(F"{prefix}/data.hdf", properties_to_save) 
+        if params["hdf5_buffer_size"] > 0:
+            _savers["hdf5_saver"] = data_savers.hdf5_buffered_saver(F"{prefix}/data.hdf", properties_to_save, params["hdf5_buffer_size"]) 
+        else:
+            _savers["hdf5_saver"] = data_savers.hdf5_saver(F"{prefix}/data.hdf", properties_to_save) 
         _savers["hdf5_saver"].set_compression_level(params["use_compression"], params["compression_level"])
-        init_heom_data(_savers["hdf5_saver"], hdf5_output_level, params["nsteps"], nquant)
+        init_heom_data(_savers["hdf5_saver"], hdf5_output_level, params["nsteps"], nquant, nadm)
 
     #====== TXT ========
     if params["txt_output_level"] > 0:
@@ -105,7 +113,7 @@ def init_heom_savers(params, nquant):
 
     if mem_output_level > 0:
         _savers["mem_saver"] =  data_savers.mem_saver(properties_to_save)
-        init_heom_data(_savers["mem_saver"], mem_output_level, params["nsteps"], nquant)
+        init_heom_data(_savers["mem_saver"], mem_output_level, params["nsteps"], nquant, nadm)
 
     return _savers                         
     
@@ -114,7 +122,7 @@ def init_heom_savers(params, nquant):
 
 
 
-def save_heom_hdf5(step, saver, params, denmat):
+def save_heom_hdf5(step, saver, params, denmat, adms=None):
     
     dt = params["dt"]    
     hdf5_output_level = params["hdf5_output_level"]
@@ -131,9 +139,13 @@ def save_heom_hdf5(step, saver, params, denmat):
         # Average adiabatic density matrices
         saver.save_matrix(step, "denmat", denmat) 
 
+    if hdf5_output_level>=4 and adms is not None and len(adms)>0:
+        # Selected ADMs, np.array (nadm, nquant, nquant)
+        saver.save_matrix_stack(step, "adms", adms) 
+
 
 
-def save_heom_data(_savers, step, print_freq, params, rho_unpacked):
+def save_heom_data(_savers, step, print_freq, params, rho_unpacked, adms=None):
 
     #================ Saving the data ==================
 
@@ -142,7 +154,7 @@ def save_heom_data(_savers, step, print_freq, params, rho_unpacked):
         
     # Save properties
     if _savers["hdf5_saver"] != None:            
-        save_heom_hdf5(step, _savers["hdf5_saver"], params, rho_unpacked[0])
+        save_heom_hdf5(step, _savers["hdf5_saver"], params, rho_unpacked[0], adms)
         
     if _savers["txt_saver"] != None:            
         pass
@@ -150,6 +162,6 @@ def save_heom_data(_savers, step, print_freq, params, rho_unpacked):
     if _savers["mem_saver"] != None:            
         prms = dict(params)
         prms["hdf5_output_level"] = prms["mem_output_level"]
-        save_heom_hdf5(step, _savers["mem_saver"], prms, rho_unpacked[0])
+        save_heom_hdf5(step, _savers["mem_saver"], prms, rho_unpacked[0], adms)
 
     
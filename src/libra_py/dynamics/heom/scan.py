@@ -0,0 +1,320 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 3 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#***********************************************************************************
+"""
+.. module:: scan
+   :platform: Unix
+   :synopsis: This module implements the HEOM calculations for many sets of parameters (temperatures,
+       bath parameters, system's Hamiltonians, etc.) at once. The topology of the hierarchy depends only
+       on the number of states, the number of Matsubara terms, and the depth of the hierarchy, so it is
+       generated once for each such combination, stored on disk, and shared by all the calculations.
+       The calculations are distributed over a pool of forked processes. The results of every calculation
+       are stored in a separate group of the "scan.hdf" file, together with the summary of the populations
+       of all the calculations
+
+       List of functions:
+           * hierarchy_filename(cache_dir, nquant, KK, LL)
+           * get_hierarchy(nquant, KK, LL, cache_dir=None, verbosity=-1)
+           * parameter_grid(axes)
+           * run_scan(dyn_params, points, rho_init, nprocs=1)
+
+.. moduleauthors:: Alexey V. Akimov
+
+"""
+
+__author__ = "Alexey V. Akimov"
+__copyright__ = "Copyright 2020 Alexey V. Akimov"
+__credits__ = ["Alexey V. Akimov"]
+__license__ = "GNU-3"
+__version__ = "1.0"
+__maintainer__ = "Alexey V. Akimov"
+__email__ = "alexvakimov@gmail.com"
+__url__ = "https://quantum-dynamics-hub.github.io/libra/index.html"
+
+
+import os
+import sys
+import itertools
+import concurrent.futures
+import multiprocessing as mp
+import numpy as np
+import h5py
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+import util.libutil as comn
+import libra_py.data_conv as data_conv
+from . import compute
+
+
+# The hierarchies generated (or loaded) by this process: { (nquant, KK, LL): ( nvec, nvec_plus, nvec_minus ) }
+_hierarchies = {}
+
+
+def hierarchy_filename(cache_dir, nquant, KK, LL):
+    """
+    Returns the name of the file where the hierarchy for given nquant, KK, and LL is stored
+    """
+
+    return os.path.join(cache_dir, F"hierarchy_nq{nquant}_KK{KK}_LL{LL}.npz")
+
+
+
+def _to_intList2(x):
+    """
+    Converts a 2D np.array of ints into intList2
+    """
+
+    res = intList2()
+    for row in x:
+        res.append( Py2Cpp_int( [ int(i) for i in row ] ) )
+
+    return res
+
+
+
+def get_hierarchy(nquant, KK, LL, cache_dir=None, verbosity=-1):
+    """
+    Returns the topology of the hierarchy, as generated by `gen_hierarchy`, for the given number of states,
+    Matsubara terms, and the depth of the hierarchy. The topology is generated only once per process and,
+    if the `cache_dir` is given, only once at all: it is then stored in a file, see `hierarchy_filename`
+
+    Args:
+        nquant ( int ): the number of states
+        KK ( int ): the number of the Matsubara terms is KK+1
+        LL ( int ): the depth of the hierarchy
+        cache_dir ( string or None ): the directory where the hierarchies are stored, None - don't store them [ default: None ]
+        verbosity ( int ): the verbosity level of `gen_hierarchy` [ default: -1 ]
+
+    Returns:
+        tuple: ( nvec, nvec_plus, nvec_minus ) - intList2 objects that can be given to `compute.run_dynamics`
+            as dyn_params["hierarchy"]
+
+    """
+
+    key = (nquant, KK, LL)
+    if key in _hierarchies:
+        return _hierarchies[key]
+
+    filename = None
+    if cache_dir!=None:
+        filename = hierarchy_filename(cache_dir, nquant, KK, LL)
+
+    if filename!=None and os.path.isfile(filename):
+        data = np.load(filename)
+        res = ( _to_intList2(data["nvec"]), _to_intList2(data["nvec_plus"]), _to_intList2(data["nvec_minus"]) )
+
+    else:
+        res = ( intList2(), intList2(), intList2() )
+        gen_hierarchy(nquant * (KK+1), LL, verbosity, res[0], res[1], res[2])
+
+        if filename!=None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            # Write to a temporary file first, so the incomplete file is never used
+            tmp = filename + ".tmp.npz"
+            np.savez(tmp, nvec=np.array([ list(v) for v in res[0] ], dtype=int),
+                          nvec_plus=np.array([ list(v) for v in res[1] ], dtype=int),
+                          nvec_minus=np.array([ list(v) for v in res[2] ], dtype=int) )
+            os.replace(tmp, filename)
+
+    _hierarchies[key] = res
+
+    return res
+
+
+
+def parameter_grid(axes):
+    """
+    Generates all the combinations of the parameters
+
+    Args:
+        axes ( dictionary ): { name: list of values }, e.g. { "temperature":[100.0, 300.0], "eta":[0.001, 0.002] }
+
+    Returns:
+        list of dictionaries: the points of the scan, e.g. [ {"temperature":100.0, "eta":0.001},
+            {"temperature":100.0, "eta":0.002}, ... ] - the last parameter changes the fastest
+
+    """
+
+    names = list(axes.keys())
+
+    return [ dict(zip(names, values)) for values in itertools.product( *[ axes[name] for name in names ] ) ]
+
+
+
+# The calculations run by the worker processes in `run_scan`. The workers are forked, so they inherit this list
+# (with the Libra objects in it) from the parent process and only the index of the job needs to be sent to them
+_scan_jobs = []
+
+
+def _run_scan_job(ijob):
+    """
+    Runs the HEOM calculation for one point of the scan
+
+    Returns:
+        dictionary: { "time", "denmat" } - np.arrays of the time axis and the system's density matrices
+    """
+
+    job = _scan_jobs[ijob]
+
+    mem_saver = compute.run_dynamics(job["dyn_params"], job["Ham"], job["rho_init"])
+
+    return { "time": np.array(mem_saver.np_data["time"]), "denmat": np.array(mem_saver.np_data["denmat"]) }
+
+
+
+def _scalar_params(point):
+    """
+    Returns the names and values of the parameters of the scan point that can be stored as the numbers
+    """
+
+    return { key: val for key, val in point.items() if isinstance(val, (int, float)) and not isinstance(val, bool) }
+
+
+
+def run_scan(dyn_params, points, rho_init, nprocs=1):
+    """
+    Runs the HEOM calculations, `compute.run_dynamics`, for many sets of the parameters
+
+    Args:
+        dyn_params ( dictionary ): the common parameters of all the calculations, see `compute.run_dynamics`.
+            In addition to those, the following parameters are used:
+
+            * **dyn_params["Ham"]** ( CMATRIX(nquant, nquant) ): the system's Hamiltonian, used by the points
+                that do not define their own [ default: None ]
+
+            * **dyn_params["hierarchy_dir"]** ( string or None ): the directory where the hierarchies are stored,
+                see `get_hierarchy`, None - "<prefix>/hierarchies" [ default: None ]
+
+            The "prefix" parameter defines the directory where the results are stored: the summary file
+            "<prefix>/scan.hdf" and the directories "<prefix>/point_<i>" with the results of the individual
+            calculations. The density matrices are always kept in memory (the "mem_output_level" is at least 3),
+            since they are needed for the summary
+
+        points ( list of dictionaries ): the parameters specific to each calculation - they replace the
+            corresponding parameters in `dyn_params`. Besides the parameters of `compute.run_dynamics`, each
+            point can define its own system's Hamiltonian, point["Ham"] ( CMATRIX(nquant, nquant) ).
+            See also `parameter_grid`
+
+        rho_init ( CMATRIX(nquant, nquant) ): the initial density matrix, the same for all the calculations
+        nprocs ( int ): the number of the calculations run concurrently [ default: 1 ]
+
+    Returns:
+        np.array (npoints, nsteps, nquant): the populations of all the states versus time for all the points,
+            also stored in the "populations" dataset of the "<prefix>/scan.hdf" file. If the points have different
+            numbers of steps or states, the missing values are set to NaN
+
+    The "scan.hdf" file contains:
+
+        * "populations" ( npoints, nsteps, nquant ): the populations, as returned
+        * "time" ( npoints, nsteps ): the time axes of all the points [ units: a.u. ]
+        * "parameters/<name>" ( npoints ): the values of the numerical parameter <name> defined by the points,
+              NaN for the points that don't define it
+        * "point_<i>/time", "point_<i>/denmat", "point_<i>/populations", "point_<i>/Ham": the results and the
+              Hamiltonian of the point i; the numerical parameters of the point are stored as the attributes of the group
+
+    """
+
+    global _scan_jobs
+
+    params = dict(dyn_params)
+
+    critical_params = [ ]
+    default_params = { "prefix":"out", "Ham":None, "hierarchy_dir":None, "KK":0, "LL":10, "verbosity":-1,
+                       "mem_output_level":3, "properties_to_save": [ "timestep", "time", "denmat"] }
+    comn.check_input(params, default_params, critical_params)
+
+    prefix = params["prefix"]
+    if not os.path.isdir(prefix):
+        os.makedirs(prefix)
+
+    hierarchy_dir = params["hierarchy_dir"]
+    if hierarchy_dir==None:
+        hierarchy_dir = os.path.join(prefix, "hierarchies")
+
+    params["mem_output_level"] = max(3, params["mem_output_level"])
+    params["properties_to_save"] = list(params["properties_to_save"])
+    for name in ["time", "denmat"]:
+        if name not in params["properties_to_save"]:
+            params["properties_to_save"].append(name)
+
+    #========== Set up the calculations, the hierarchies are generated in the parent process ===========
+    jobs = []
+    for ipoint, point in enumerate(points):
+        prms = dict(params)
+        prms.update(point)
+
+        Ham = prms.pop("Ham")
+        prms.pop("hierarchy_dir")
+        if Ham is None:
+            print(F"ERROR: the system's Hamiltonian is not defined for the point {ipoint}")
+            print("Exiting...")
+            sys.exit(0)
+
+        prms["hierarchy"] = get_hierarchy(Ham.num_of_cols, prms["KK"], prms["LL"], hierarchy_dir, prms["verbosity"])
+        prms["prefix"] = os.path.join(prefix, F"point_{ipoint}")
+
+        jobs.append( { "dyn_params":prms, "Ham":Ham, "rho_init":rho_init } )
+
+    #========== Run the calculations ===========
+    _scan_jobs = jobs
+
+    if nprocs<=1 or len(jobs)<=1:
+        results = [ _run_scan_job(ijob) for ijob in range(len(jobs)) ]
+    else:
+        ctx = mp.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nprocs, mp_context=ctx) as executor:
+            results = list( executor.map(_run_scan_job, range(len(jobs))) )
+
+    _scan_jobs = []
+
+    #========== Store the results ===========
+    npoints = len(points)
+    nsteps = max( [ res["denmat"].shape[0] for res in results ] + [0] )
+    nquant = max( [ res["denmat"].shape[1] for res in results ] + [0] )
+
+    populations = np.full( (npoints, nsteps, nquant), np.nan )
+    times = np.full( (npoints, nsteps), np.nan )
+
+    names = []
+    for point in points:
+        for name in _scalar_params(point).keys():
+            if name not in names:
+                names.append(name)
+
+    with h5py.File(os.path.join(prefix, "scan.hdf"), "w") as f:
+
+        for ipoint, res in enumerate(results):
+            pops = np.real( np.diagonal(res["denmat"], axis1=1, axis2=2) )
+            n, nq = pops.shape
+            populations[ipoint, 0:n, 0:nq] = pops
+            times[ipoint, 0:n] = res["time"]
+
+            g = f.create_group(F"point_{ipoint}")
+            g.create_dataset("time", data = res["time"])
+            g.create_dataset("denmat", data = res["denmat"])
+            g.create_dataset("populations", data = pops)
+            g.create_dataset("Ham", data = data_conv.nparray_view(jobs[ipoint]["Ham"]))
+            for name, val in _scalar_params(points[ipoint]).items():
+                g.attrs[name] = val
+
+        f.create_dataset("populations", data = populations)
+        f.create_dataset("time", data = times)
+
+        g = f.create_group("parameters")
+        for name in names:
+            g.create_dataset(name, data = np.array([ _scalar_params(point).get(name, np.nan) for point in points ], dtype=float))
+
+    return populations
+
@@ -37,6 +37,9 @@ import os
 import sys
 import math
 import copy
+import multiprocessing as mp
+import concurrent.futures
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -47,8 +50,10 @@ import util.libutil as comn
 import libra_py.units as units
 import libra_py.data_outs as data_outs
 import libra_py.data_savers as data_savers
+import libra_py.data_conv as data_conv
 import libra_py.tsh as tsh
 import libra_py.tsh_stat as tsh_stat
+import libra_py.profiling as profiling
 #import libra_py.dynamics as dynamics_io
 
 from . import save
@@ -752,11 +757,39 @@ def run_dynamics(_q, _p, _iM, _Cdia, _Cadi, _projectors, _states, _dyn_params, c
                 The larger the value, the higher the compression. [ default: [0, 0, 0] ]
 
 
+            * **dyn_params["hdf5_buffer_size"]** ( int ): the number of timesteps for which the data saved with the 
+                `hdf5_output_level` option are accumulated in memory before being written to the "data.hdf" file in one block
+
+                - 0: don't buffer, write every piece of data directly into the file [ default ]
+                - N > 0: keep the file open during the whole calculation and write the data in blocks of N timesteps. This 
+                     is much faster than the unbuffered saving, but if the calculations crash, at most N last steps are lost
+
+
             * **dyn_params["progress_frequency"]** ( double ):  at what intervals print out some "progress" messages. For
                 instance, if you have `nsteps = 100` and `progress_frequency = 0.1`, the code will notify you every 10 steps. [ default : 0.1 ]
 
-                Note: this doesn't affect the frequency of the data saving to the file - at this point, we save the information for every
-                timestep
+                Note: this doesn't affect the frequency of the data saving to the file - see `save_every`
+
+
+            * **dyn_params["save_every"]** ( int or dictionary ): how often to save the data of each output level 
+                (see `hdf5_output_level`). The data of step `i` are saved only if `i % stride == 0`, so the saved datasets 
+                have `ceil(nsteps/stride)` records and the "time" dataset contains the actual times of the saved records
+
+                - N: save the data of all levels every N steps [ default: 1 ]
+                - {level: N}: set the stride for each level separately, e.g. {1:1, 3:10, 4:100}. The levels not listed
+                     are saved every step
+
+
+            * **dyn_params["analysis_every"]** ( int ): how often to feed the data to the on-the-fly reducers, 
+                see `properties_to_reduce` [ default: 1 ]. The density matrices, populations and energies are 
+                computed only at the steps where they are either saved or reduced
+
+
+            * **dyn_params["ensemble_stat_method"]** ( int ): how to compute the ensemble-averaged energies and SH populations:
+
+                - 0: trajectory by trajectory, in a Python loop [ default ]
+                - 1: for all trajectories at once, using the stacked numpy arrays of the Hamiltonians and amplitudes.
+                     The results are the same, but this is much faster for large ensembles
 
                                                                                                                           
             * **dyn_params["properties_to_save"]** ( list of string ): describes what properties to save to the HDF5 files. Note that
@@ -770,7 +803,57 @@ def run_dynamics(_q, _p, _iM, _Cdia, _Cadi, _projectors, _states, _dyn_params, c
                 ] 
 
 
+            * **dyn_params["properties_to_reduce"]** ( list of string ): the properties whose statistics is accumulated 
+                on the fly (every `analysis_every` steps), without storing the data for every step and every trajectory. 
+                The results are written into the "reduced_data.hdf" file in the `prefix` directory at the end of the 
+                calculations. Can include:
+
+                - "states_hist": the fraction of time each trajectory spends on each adiabatic state, (ntraj, nadi)
+                - "SH_pop_binned": the SH populations averaged over time bins, (nbins, nadi)
+                - "SE_pop_binned": the SE adiabatic populations averaged over time bins, (nbins, nadi)
+                - "E_binned": the ensemble-averaged Ekin, Epot, and Etot averaged over time bins, (nbins, 3)
+                - "q_stat", "p_stat": trajectory-resolved time-averaged coordinates and momenta 
+                     and their variances, (ntraj, nnucl)
+                - "hvib_adi_stat", "hvib_dia_stat": trajectory-resolved time-averaged vibronic Hamiltonians 
+                     and the variances of their elements, (ntraj, nadi, nadi) and (ntraj, ndia, ndia)
+
+                [ default: [] ]
+
+
+            * **dyn_params["reduction_bin"]** ( int ): the number of steps in a time bin for the "*_binned" reducers [ default: 1 ]
+
+
+            * **dyn_params["checkpoint_every"]** ( int ): how often to write the complete state of the dynamics (coordinates,
+                momenta, amplitudes, projectors, active states, thermostats, reducers and the random numbers generator state)
+                into the "checkpoint.hdf" file in the `prefix` directory. The data accumulated by the savers so far are 
+                written to the disk at the same time 
+
+                - 0: don't write the checkpoints [ default ]
+                - N > 0: write the checkpoint every N steps
+
+
+            * **dyn_params["restart_from"]** ( string ): the name of the checkpoint file (see `checkpoint_every`) to continue
+                the interrupted calculations from. The data are appended to the "data.hdf" and "mem_data.hdf" files in 
+                the `prefix` directory, so the parameters of the restarted calculations shall be the same as those 
+                of the interrupted ones. The initial conditions passed to this function are ignored [ default: None ]
+
+
+            * **dyn_params["profiling_level"]** ( int ): whether to measure the costs of the different phases of the 
+                calculations (Hamiltonian initialization, analysis, saving, reduction, time-overlaps, propagation - including
+                the Hamiltonian updates, checkpoints). The report with the time and the number of calls of each phase, the 
+                amount of data kept by each saver and the peak memory is written into the "timing.txt" file in the `prefix` 
+                directory. See `libra_py.profiling`
+
+                - 0: no profiling [ default ]
+                - 1: write the timing report
+                - 2: also write the per-step time of each phase into the "timings/<phase>/data" datasets of 
+                  the "data.hdf" file in the `prefix` directory
+
+
         compute_model ( PyObject ): the pointer to the Python function that performs the Hamiltonian calculations
+            It can also be a `libra_py.models.batched.batched_model` object, to evaluate the model for 
+            all trajectories in one call of a vectorized model function (the object is still called for 
+            every trajectory, but returns the precomputed results)
 
         _model_params ( dictionary ): contains the selection of a model and the parameters 
             for that model Hamiltonian
@@ -870,8 +953,10 @@ def run_dynamics(_q, _p, _iM, _Cdia, _Cadi, _projectors, _states, _dyn_params, c
     #================= Variables specific to Python version: saving ================
     default_params.update( { "nsteps":1, "prefix":"out",
                              "hdf5_output_level":-1, "mem_output_level":-1, "txt_output_level":-1,
-                             "use_compression":0, "compression_level":[0,0,0], 
-                             "progress_frequency":0.1,
+                             "use_compression":0, "compression_level":[0,0,0], "hdf5_buffer_size":0,
+                             "progress_frequency":0.1, "ensemble_stat_method":0,
+                             "save_every":1, "analysis_every":1, "properties_to_reduce":[], "reduction_bin":1,
+                             "checkpoint_every":0, "restart_from":None, "profiling_level":0,
                              "properties_to_save":[ "timestep", "time", "Ekin_ave", "Epot_ave", "Etot_ave", 
                                    "dEkin_ave", "dEpot_ave", "dEtot_ave", "states", "SH_pop", "SH_pop_raw",
                                    "D_adi", "D_adi_raw", "D_dia", "D_dia_raw", "q", "p", "Cadi", "Cdia", 
@@ -895,6 +980,14 @@ def run_dynamics(_q, _p, _iM, _Cdia, _Cadi, _projectors, _states, _dyn_params, c
     compression_level = dyn_params["compression_level"]
     ensemble = dyn_params["ensemble"]
     time_overlap_method = dyn_params["time_overlap_method"]
+    ensemble_stat_method = dyn_params["ensemble_stat_method"]
+    analysis_every = dyn_params["analysis_every"]
+    checkpoint_every = dyn_params["checkpoint_every"]
+
+    if ensemble_stat_method not in [0, 1]:
+        print(F"ERROR in run_dynamics: \
+              the ensemble_stat_method is = {ensemble_stat_method}, but should be 0 or 1" )
+        sys.exit(0)
     
     ndia = Cdia.num_of_rows
     nadi = Cadi.num_of_rows
@@ -905,104 +998,200 @@ def run_dynamics(_q, _p, _iM, _Cdia, _Cadi, _projectors, _states, _dyn_params, c
         dyn_params["quantum_dofs"] = list(range(nnucl))
 
 
+    prof = profiling.profiler(dyn_params["profiling_level"])
+
     # Initialize savers
     _savers = save.init_tsh_savers(dyn_params, model_params, nsteps, ntraj, nnucl, nadi, ndia)
+    _reducers = save.init_tsh_reducers(dyn_params, nsteps, ntraj, nnucl, nadi, ndia)
+
+    # Strides of saving the data of each output level
+    s123 = [ save.get_save_every(dyn_params["save_every"], level) for level in [1, 2, 3] ]
+    s4 = save.get_save_every(dyn_params["save_every"], 4)
+    save_level = max(hdf5_output_level, mem_output_level)
+    print_freq = max(1, int(dyn_params["progress_frequency"]*nsteps))    
+
+
+    therm = ThermostatList();
+    if ensemble==1:
+        for traj in range(ntraj):
+            therm.append( Thermostat( dyn_params["thermostat_params"] ) )
+            therm[traj].set_Nf_t( len(dyn_params["thermostat_dofs"]) )
+            therm[traj].init_nhc()
+
+
+    # ======= Restart from a checkpoint ======= 
+    istart = 0
+    if dyn_params["restart_from"]!=None:
+        istart, q, p, Cdia, Cadi, _projectors, _states, U_restart, rng_state = save.load_tsh_checkpoint(dyn_params["restart_from"], therm, _reducers)
+
+        states = intList()
+        projectors = CMATRIXList()       
+        for tr in range(ntraj):
+            states.append(_states[tr])
+            projectors.append(_projectors[tr])
+
+        rnd.set_state(rng_state)
+        print(F"Restarting the calculations from the step {istart} using the checkpoint {dyn_params['restart_from']}")
 
 
     # ======= Hierarchy of Hamiltonians =======
+    prof.start("hamiltonian_init")
     ham = nHamiltonian(ndia, nadi, nnucl)
     ham.add_new_children(ndia, nadi, nnucl, ntraj)
     ham.init_all(2,1)
-    model_params.update({"timestep":0})
+    model_params.update({"timestep":istart})
     
     update_Hamiltonian_q(dyn_params, q, projectors, ham, compute_model, model_params)
     update_Hamiltonian_p(dyn_params, ham, p, iM)  
+    prof.stop("hamiltonian_init")
 
 
-    U = []
-    for tr in range(ntraj):
-        U.append(ham.get_basis_transform(Py2Cpp_int([0, tr]) ))
+    # Diabatic-to-adiabatic transformations of all trajectories, np.array (ntraj, ndia, nadi)
+    U = tsh_stat.get_children_matrices(ham, "basis_transform", ntraj)
 
-
-    therm = ThermostatList();
-    if ensemble==1:
-        for traj in range(ntraj):
-            therm.append( Thermostat( dyn_params["thermostat_params"] ) )
-            therm[traj].set_Nf_t( len(dyn_params["thermostat_dofs"]) )
-            therm[traj].init_nhc()
+    if istart > 0:
+        U = U_restart
 
                 
     # Do the propagation
-    for i in range(nsteps):
+    for i in range(istart, nsteps):
     
-        #============ Compute and output properties ===========        
-        # Amplitudes, Density matrix, and Populations
-        if rep_tdse==0:
-            # Diabatic to raw adiabatic
-            ham.ampl_dia2adi(Cdia, Cadi, 0, 1) 
-            # Raw adiabatic to dynamically-consistent adiabatic
-            Cadi = dynconsyst_to_raw(Cadi, projectors)
-
-        elif rep_tdse==1:
-            ham.ampl_adi2dia(Cdia, Cadi, 0, 1)
-
-        dm_dia, dm_adi, dm_dia_raw, dm_adi_raw, = tsh_stat.compute_dm(ham, Cdia, Cadi, projectors, rep_tdse, 1)        
-        pops, pops_raw = tsh_stat.compute_sh_statistics(nadi, states, projectors)
+        if i%print_freq==0:
+            print(F" step= {i}")
 
-
-        # Energies 
-        Ekin, Epot, Etot, dEkin, dEpot, dEtot = 0.0, 0.0, 0.0,  0.0, 0.0, 0.0
-        Etherm, E_NHC = 0.0, 0.0
-        if force_method in [0, 1]:
-            Ekin, Epot, Etot, dEkin, dEpot, dEtot = tsh_stat.compute_etot_tsh(ham, p, Cdia, Cadi, projectors, states, iM, rep_tdse)
-        elif force_method in [2]:
-            Ekin, Epot, Etot, dEkin, dEpot, dEtot = tsh_stat.compute_etot(ham, p, Cdia, Cadi, projectors, iM, rep_tdse)
-
-        for bath in therm:
-            Etherm += bath.energy()
-        Etherm = Etherm / float(ntraj)
-        E_NHC = Etot + Etherm
+        #============ Compute and output properties ===========        
+        do_save = save_level>=1 and any( [ i % s == 0 for s in s123 ] )
+        do_save4 = save_level>=4 and i % s4 == 0
+        do_reduce = len(_reducers)>0 and i % analysis_every == 0
+
+        # Vibronic Hamiltonians of all trajectories - fetched once and shared by all the savers and reducers
+        hvib_adi, hvib_dia = None, None
+        if do_save4:
+            hvib_adi = tsh_stat.get_children_matrices(ham, "hvib_adi", ntraj)
+            hvib_dia = tsh_stat.get_children_matrices(ham, "hvib_dia", ntraj)
+
+        if do_save or do_reduce:
+            prof.start("analysis")
+
+            # Amplitudes, Density matrix, and Populations
+            if rep_tdse==0:
+                # Diabatic to raw adiabatic
+                ham.ampl_dia2adi(Cdia, Cadi, 0, 1) 
+                # Raw adiabatic to dynamically-consistent adiabatic
+                Cadi = dynconsyst_to_raw(Cadi, projectors)
+
+            elif rep_tdse==1:
+                ham.ampl_adi2dia(Cdia, Cadi, 0, 1)
+
+            dm_dia, dm_adi, dm_dia_raw, dm_adi_raw, = tsh_stat.compute_dm(ham, Cdia, Cadi, projectors, rep_tdse, 1)        
+
+            if ensemble_stat_method==0:
+                pops, pops_raw = tsh_stat.compute_sh_statistics(nadi, states, projectors)
+            elif ensemble_stat_method==1:
+                pops, pops_raw = tsh_stat.compute_sh_statistics_batch(nadi, states, projectors)
+
+
+            # Energies 
+            Ekin, Epot, Etot, dEkin, dEpot, dEtot = 0.0, 0.0, 0.0,  0.0, 0.0, 0.0
+            Etherm, E_NHC = 0.0, 0.0
+            if force_method in [0, 1]:
+                if ensemble_stat_method==0:
+                    Ekin, Epot, Etot, dEkin, dEpot, dEtot = tsh_stat.compute_etot_tsh(ham, p, Cdia, Cadi, projectors, states, iM, rep_tdse)
+                elif ensemble_stat_method==1:
+                    Ekin, Epot, Etot, dEkin, dEpot, dEtot = tsh_stat.compute_etot_tsh_batch(ham, p, Cdia, Cadi, projectors, states, iM, rep_tdse)
+            elif force_method in [2]:
+                if ensemble_stat_method==0:
+                    Ekin, Epot, Etot, dEkin, dEpot, dEtot = tsh_stat.compute_etot(ham, p, Cdia, Cadi, projectors, iM, rep_tdse)
+                elif ensemble_stat_method==1:
+                    Ekin, Epot, Etot, dEkin, dEpot, dEtot = tsh_stat.compute_etot_batch(ham, p, Cdia, Cadi, projectors, iM, rep_tdse)
+
+            for bath in therm:
+                Etherm += bath.energy()
+            Etherm = Etherm / float(ntraj)
+            E_NHC = Etot + Etherm
+
+            prof.stop("analysis")
 
         
-
-        save.save_tsh_data_123(_savers, dyn_params, 
-                       i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC, states,
-                       pops, pops_raw, dm_adi, dm_adi_raw, dm_dia, dm_dia_raw, q, p, Cadi, Cdia  )
+        if do_save:
+            prof.start("saving")
+            save.save_tsh_data_123(_savers, dyn_params, 
+                           i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC, states,
+                           pops, pops_raw, dm_adi, dm_adi_raw, dm_dia, dm_dia_raw, q, p, Cadi, Cdia  )
+            prof.stop("saving")
+
+        if do_reduce:
+            prof.start("reduction")
+            save.update_tsh_reducers(_reducers, i, ham, states, pops, dm_adi, Ekin, Epot, Etot, q, p, hvib_adi, hvib_dia)
+            prof.stop("reduction")
 
     
-        for tr in range(ntraj):
-            if time_overlap_method==0:
-                x = ham.get_basis_transform(Py2Cpp_int([0, tr]) )            
-                St = U[tr].H() * x
-                U[tr] = CMATRIX(x)
+        # Time-overlaps of all trajectories: St[tr] = U[tr]^+ * x[tr]
+        prof.start("time_overlaps")
+        St = None
+        if time_overlap_method==0:
+            x = tsh_stat.get_children_matrices(ham, "basis_transform", ntraj)
+            if do_save4:
+                St = np.conj(U).transpose(0, 2, 1) @ x
+            U = x
+
+        elif time_overlap_method==1 and do_save4:
+            St = tsh_stat.get_children_matrices(ham, "time_overlap_adi", ntraj)
+        prof.stop("time_overlaps")
 
-            elif time_overlap_method==1:                
-                St = ham.get_time_overlap_adi(Py2Cpp_int([0, tr]) ) 
 
+        if do_save4:
+            prof.start("saving_4D")
+            proj = data_conv.matrices2nparray(projectors)
 
             if hdf5_output_level>=4: 
-                hvib_adi = ham.get_hvib_adi(Py2Cpp_int([0, tr])) 
-                hvib_dia = ham.get_hvib_dia(Py2Cpp_int([0, tr])) 
-                save.save_hdf5_4D(_savers["hdf5_saver"], i, tr, hvib_adi, hvib_dia, St, U[tr], projectors[tr])
+                save.save_hdf5_4D_batch(_savers["hdf5_saver"], i//s4, hvib_adi, hvib_dia, St, U, proj)
 
             if mem_output_level>=4: 
-                hvib_adi = ham.get_hvib_adi(Py2Cpp_int([0, tr])) 
-                hvib_dia = ham.get_hvib_dia(Py2Cpp_int([0, tr])) 
-                save.save_hdf5_4D(_savers["mem_saver"], i, tr, hvib_adi, hvib_dia, St, U[tr], projectors[tr])
+                save.save_hdf5_4D_batch(_savers["mem_saver"], i//s4, hvib_adi, hvib_dia, St, U, proj)
+            prof.stop("saving_4D")
 
 
 
         #============ Propagate ===========        
         model_params.update({"timestep":i})        
         
+        prof.start("propagation")
         if rep_tdse==0:
             compute_dynamics(q, p, iM, Cdia, projectors, states, ham, compute_model, model_params, dyn_params, rnd, therm)
         elif rep_tdse==1:
             compute_dynamics(q, p, iM, Cadi, projectors, states, ham, compute_model, model_params, dyn_params, rnd, therm)
+        prof.stop("propagation")
+
+
+        #============ Checkpoint ===========        
+        if checkpoint_every > 0 and (i+1) % checkpoint_every == 0 and i+1 < nsteps:
+            prof.start("checkpoint")
+            save.flush_tsh_savers(_savers, dyn_params)
+            save.save_tsh_checkpoint(F"{prefix}/checkpoint.hdf", i+1, q, p, Cdia, Cadi, projectors, states, U, therm, _reducers, rnd.get_state())
+            prof.stop("checkpoint")
 
+        prof.end_step()
+
+
+    prof.start("saving_final")
+    save.close_tsh_savers(_savers)
+    save.save_tsh_reducers(_reducers, F"{prefix}/reduced_data.hdf")
+
+    if _savers["mem_saver"]!=None:
+        if checkpoint_every > 0:
+            # The earlier records are already in the file
+            _savers["mem_saver"].save_new_data( F"{prefix}/mem_data.hdf", properties_to_save)
+        else:
+            _savers["mem_saver"].save_data( F"{prefix}/mem_data.hdf", properties_to_save, "w")
+    prof.stop("saving_final")
+
+    prof.add_saver("hdf5_saver", _savers["hdf5_saver"])
+    prof.add_saver("mem_saver", _savers["mem_saver"])
+    prof.write_summary(F"{prefix}/timing.txt")
+    prof.save_step_timings(F"{prefix}/data.hdf")
 
     if _savers["mem_saver"]!=None:
-        _savers["mem_saver"].save_data( F"{prefix}/mem_data.hdf", properties_to_save, "w")
         return _savers["mem_saver"]
 
 
@@ -1642,4 +1831,202 @@ def run_multiple_sets(init_cond, _dyn_params, compute_model, _model_params, _ini
     return res
 
 
+# The jobs run by the worker processes in `run_dynamics_parallel` and `run_multiple_sets_parallel`.
+# The workers are forked, so they inherit this list (with the Libra objects in it) from the parent 
+# process and only the index of the job needs to be sent to them
+_parallel_jobs = []
+
+
+def _run_dynamics_job(ijob):
+    """
+    Runs the `ijob`-th job of the `_parallel_jobs` list in a worker process
+    """
+
+    job = _parallel_jobs[ijob]
+
+    rnd = Random(job["seed"])
+
+    if job["type"]=="batch":
+        run_dynamics(job["q"], job["p"], job["iM"], job["Cdia"], job["Cadi"], job["projectors"], job["states"], 
+                     job["dyn_params"], job["compute_model"], job["model_params"], rnd)
+
+    elif job["type"]=="set":
+        q, p, iM = init_nuclear_dyn_var(job["q0"], job["p0"], job["M0"], job["init_nucl"], rnd)
+        generic_recipe(q, p, iM, job["dyn_params"], job["compute_model"], job["model_params"], job["init_elec"], rnd)
+
+    return job["dyn_params"]["prefix"]
+
+
+
+def _run_parallel_jobs(jobs, nprocs):
+    """
+    Runs the list of jobs on a pool of `nprocs` forked processes
+    """
+
+    global _parallel_jobs
+    _parallel_jobs = jobs
+
+    ctx = mp.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nprocs, mp_context=ctx) as executor:
+        prefixes = list( executor.map(_run_dynamics_job, range(len(jobs))) )
+
+    _parallel_jobs = []
+
+    return prefixes
+
+
+
+def get_batch_seeds(seed, nbatches, rnd):
+    """
+    Returns the seeds for the random number generators of the independent batches of calculations
+
+    Args:
+        seed ( int or None ): the base seed. If None, it is drawn from the `rnd` generator
+        nbatches ( int ): the number of batches
+        rnd ( Random ): random numbers generator object
+
+    Returns:
+        list of ints: the seeds `seed`, `seed + 1`, ... `seed + nbatches - 1`, so the results of the 
+            calculations with a given `seed` are reproducible 
+
+    """
+
+    if seed==None:
+        seed = int(rnd.uniform(0.0, 1.0e+8))
+
+    return [ seed + ibatch for ibatch in range(nbatches) ]
+
+
+
+def run_dynamics_parallel(_q, _p, _iM, _Cdia, _Cadi, _projectors, _states, _dyn_params, compute_model, _model_params, rnd):
+    """
+    Splits the ensemble of trajectories into independent batches, runs `run_dynamics` for them on a pool 
+    of processes and merges the results into the files of the same layout as produced by running all the 
+    trajectories together with `run_dynamics`. Each batch uses its own reproducibly-seeded random numbers 
+    generator, so the result does not depend on the number of processes, but only on `nbatches` and `random_seed`
+
+    Args: 
+        _q, _p, _iM, _Cdia, _Cadi, _projectors, _states: same as in `run_dynamics`
+
+        _dyn_params ( dictionary ): same as in `run_dynamics`, in addition can contain:
+
+            * **_dyn_params["nprocs"]** ( int ): the number of processes to use [ default: 1 ]
+
+            * **_dyn_params["nbatches"]** ( int ): the number of batches into which the ensemble of trajectories is 
+                split [ default: same as `nprocs` ]
+
+            * **_dyn_params["random_seed"]** ( int ): the base seed of the random numbers generators of all batches,
+                the batch `k` uses the seed `random_seed + k` [ default: None - draw it from `rnd` ]
+
+            * **_dyn_params["restart_from"]** ( anything ): if not None, each batch `k` is restarted from its own 
+                checkpoint file `prefix/batch_k/checkpoint.hdf` [ default: None ]
+
+        compute_model ( PyObject ): the pointer to the Python function that performs the Hamiltonian calculations.
+            Note: it is called in the worker processes, so it is better to not rely on any global state modified 
+            after this function is called
+
+        _model_params ( dictionary ): same as in `run_dynamics`
+
+        rnd ( Random ): random numbers generator object, only used to draw the base seed, if it is not given
+
+    Returns:
+        None: the data of the batch `k` are in the `prefix/batch_k` directory, the merged data - in the 
+            `prefix` directory: "data.hdf", "mem_data.hdf", and "reduced_data.hdf", depending on which of 
+            them are produced by `run_dynamics`
+
+    Note: 
+        The workers are started with the "fork" method, so this function is only available on Unix-like systems
+
+    """
+
+    dyn_params = dict(_dyn_params)
+    comn.check_input(dyn_params, {"prefix":"out", "nprocs":1, "nbatches":-1, "random_seed":None, "force_method":1,
+                                  "restart_from":None }, [ ])
+
+    prefix = dyn_params["prefix"]
+    nprocs = dyn_params["nprocs"]
+    nbatches = dyn_params["nbatches"]
+    if nbatches <= 0:
+        nbatches = nprocs
+
+    ntraj = _q.num_of_cols
+    nbatches = min(nbatches, ntraj)
+
+    if not os.path.isdir(prefix):
+        os.mkdir(prefix)
+
+    # Trajectory indices of each batch
+    batches = np.array_split(np.arange(ntraj), nbatches)
+    seeds = get_batch_seeds(dyn_params["random_seed"], nbatches, rnd)
+
+    q, p = data_conv.nparray_view(_q), data_conv.nparray_view(_p)
+    Cdia, Cadi = data_conv.nparray_view(_Cdia), data_conv.nparray_view(_Cadi)
+
+    jobs = []
+    for ibatch, trajs in enumerate(batches):
+        params = dict(dyn_params)
+        params.update({"prefix":F"{prefix}/batch_{ibatch}", "ntraj":len(trajs)})
+        if dyn_params["restart_from"]!=None:
+            params.update({"restart_from":F"{prefix}/batch_{ibatch}/checkpoint.hdf"})
+
+        jobs.append( { "type":"batch", "seed":seeds[ibatch],
+                       "q":data_conv.nparray2MATRIX(q[:, trajs]), "p":data_conv.nparray2MATRIX(p[:, trajs]), 
+                       "iM":MATRIX(_iM),
+                       "Cdia":data_conv.nparray2CMATRIX(Cdia[:, trajs]), "Cadi":data_conv.nparray2CMATRIX(Cadi[:, trajs]),
+                       "projectors":[ CMATRIX(_projectors[tr]) for tr in trajs ],
+                       "states":[ _states[tr] for tr in trajs ],
+                       "dyn_params":params, "compute_model":compute_model, "model_params":dict(_model_params) } )
+
+    prefixes = _run_parallel_jobs(jobs, nprocs)
+
+    # Merge the results
+    ntrajs = [ len(trajs) for trajs in batches ]
+    tsh = dyn_params["force_method"] in [0, 1]
+
+    for name in ["data.hdf", "mem_data.hdf"]:
+        if os.path.isfile(F"{prefixes[0]}/{name}"):
+            save.merge_tsh_data( [ F"{pref}/{name}" for pref in prefixes ], ntrajs, F"{prefix}/{name}", tsh)
+
+    if os.path.isfile(F"{prefixes[0]}/reduced_data.hdf"):
+        save.merge_tsh_reducers( [ F"{pref}/reduced_data.hdf" for pref in prefixes ], ntrajs, F"{prefix}/reduced_data.hdf")
+
+
+
+def run_multiple_sets_parallel(init_cond, _dyn_params, compute_model, _model_params, _init_nucl, _init_elec, rnd, nprocs=1, random_seed=None):
+    """
+    The same as `run_multiple_sets`, but the sets of initial conditions are distributed over a pool
+    of `nprocs` processes. The set `k` is computed with its own random numbers generator seeded with 
+    `random_seed + k`, so the results are reproducible and don't depend on the number of processes
+
+    Args:
+        init_cond, _dyn_params, compute_model, _model_params, _init_nucl, _init_elec: same as in `run_multiple_sets`
+
+        rnd ( Random ): random numbers generator object, only used to draw the base seed, if it is not given
+        nprocs ( int ): the number of processes to use [ default: 1 ]
+        random_seed ( int ): the base seed of the random numbers generators of all sets [ default: None - draw it from `rnd` ]
+
+    Returns:
+        list of strings: the output directories of all sets, with the data saved by `run_dynamics`
+
+    Note: 
+        The workers are started with the "fork" method, so this function is only available on Unix-like systems
+
+    """
+
+    seeds = get_batch_seeds(random_seed, len(init_cond), rnd)
+
+    jobs = []
+    for icond_indx, icond in enumerate(init_cond):
+
+        output_prefix = _dyn_params[icond_indx]["prefix"]
+        dyn_params = dict(_dyn_params[icond_indx])
+        dyn_params.update({"prefix":F"{output_prefix}_{icond_indx}"})
+
+        jobs.append( { "type":"set", "seed":seeds[icond_indx],
+                       "q0":icond[0], "p0":icond[1], "M0":icond[2], "init_nucl":_init_nucl[icond_indx], 
+                       "init_elec":_init_elec[icond_indx], "dyn_params":dyn_params, 
+                       "compute_model":compute_model[icond_indx], "model_params":_model_params[icond_indx] } )
+
+    return _run_parallel_jobs(jobs, nprocs)
+
 
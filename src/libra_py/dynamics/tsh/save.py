@@ -46,47 +46,91 @@ import util.libutil as comn
 #import libra_py.units as units
 #import libra_py.data_outs as data_outs
 import libra_py.data_savers as data_savers
+import libra_py.data_conv as data_conv
+import libra_py.data_stat as data_stat
+import libra_py.tsh_stat as tsh_stat
+import h5py
+import numpy as np
 
 
 #===================== TSH calculations output ====================
 
-def init_tsh_data(saver, hdf5_output_level, _nsteps, _ntraj, _ndof, _nadi, _ndia):
+def get_save_every(save_every, level):
+    """
+    Returns the stride (in the number of steps) with which the data of a given output level 
+    (1, 2, 3, or 4, see the `hdf5_output_level` description in `run_dynamics`) are saved
+
+    Args:
+        save_every ( int or dict ): the same stride for all levels or the dictionary 
+            {level: stride}, the levels not included in the dictionary are saved every step
+        level ( int ): the output level
+
+    Returns:
+        int: the stride
+
+    """
+
+    if isinstance(save_every, dict):
+        return save_every.get(level, 1)
+
+    return save_every
+
+
+
+def get_nrecords(nsteps, stride):
+    """
+    Returns the number of records saved from `nsteps` steps of dynamics with the stride `stride`
+    """
+
+    return (nsteps + stride - 1) // stride
+
+
+
+def init_tsh_data(saver, hdf5_output_level, _nsteps, _ntraj, _ndof, _nadi, _ndia, save_every=1):
     """
     saver - can be either hdf5_saver or mem_saver
 
+    save_every ( int or dict ): the stride with which the data of each output level are saved, 
+        see `get_save_every`. The time axis of each dataset has only as many records as needed
+
     """
 
+    nsteps1 = get_nrecords(_nsteps, get_save_every(save_every, 1))
+    nsteps2 = get_nrecords(_nsteps, get_save_every(save_every, 2))
+    nsteps3 = get_nrecords(_nsteps, get_save_every(save_every, 3))
+    nsteps4 = get_nrecords(_nsteps, get_save_every(save_every, 4))
+
     if hdf5_output_level>=1:
 
         # Time axis (integer steps)
-        saver.add_dataset("timestep", (_nsteps,) , "I")  
+        saver.add_dataset("timestep", (nsteps1,) , "I")  
 
         # Time axis
-        saver.add_dataset("time", (_nsteps,) , "R")  
+        saver.add_dataset("time", (nsteps1,) , "R")  
         
         # Average kinetic energy
-        saver.add_dataset("Ekin_ave", (_nsteps,) , "R")  
+        saver.add_dataset("Ekin_ave", (nsteps1,) , "R")  
         
         # Average potential energy
-        saver.add_dataset("Epot_ave", (_nsteps,) , "R")  
+        saver.add_dataset("Epot_ave", (nsteps1,) , "R")  
         
         # Average total energy
-        saver.add_dataset("Etot_ave", (_nsteps,) , "R")  
+        saver.add_dataset("Etot_ave", (nsteps1,) , "R")  
         
         # Fluctuation of average kinetic energy
-        saver.add_dataset("dEkin_ave", (_nsteps,) , "R")  
+        saver.add_dataset("dEkin_ave", (nsteps1,) , "R")  
         
         # Fluctuation of average potential energy
-        saver.add_dataset("dEpot_ave", (_nsteps,) , "R")  
+        saver.add_dataset("dEpot_ave", (nsteps1,) , "R")  
         
         # Fluctuation of average total energy
-        saver.add_dataset("dEtot_ave", (_nsteps,) , "R")  
+        saver.add_dataset("dEtot_ave", (nsteps1,) , "R")  
 
         # Thermostat energy 
-        saver.add_dataset("Etherm", (_nsteps,) , "R")  
+        saver.add_dataset("Etherm", (nsteps1,) , "R")  
 
         # System + thermostat energy
-        saver.add_dataset("E_NHC", (_nsteps,) , "R")  
+        saver.add_dataset("E_NHC", (nsteps1,) , "R")  
 
 
 
@@ -94,62 +138,62 @@ def init_tsh_data(saver, hdf5_output_level, _nsteps, _ntraj, _ndof, _nadi, _ndia
     if hdf5_output_level>=2:
 
         # Trajectory-resolved instantaneous adiabatic states
-        saver.add_dataset("states", (_nsteps, _ntraj), "I") 
+        saver.add_dataset("states", (nsteps2, _ntraj), "I") 
 
 
     if hdf5_output_level>=3:
 
         # Average adiabatic SH populations (dynamically-consistent)
-        saver.add_dataset("SH_pop", (_nsteps, _nadi, 1), "R") 
+        saver.add_dataset("SH_pop", (nsteps3, _nadi, 1), "R") 
 
         # Average adiabatic SH populations (raw)
-        saver.add_dataset("SH_pop_raw", (_nsteps, _nadi, 1), "R") 
+        saver.add_dataset("SH_pop_raw", (nsteps3, _nadi, 1), "R") 
 
 
         # Average adiabatic density matrices (dynamically-consistent)
-        saver.add_dataset("D_adi", (_nsteps, _nadi, _nadi), "C") 
+        saver.add_dataset("D_adi", (nsteps3, _nadi, _nadi), "C") 
 
         # Average adiabatic density matrices (raw)
-        saver.add_dataset("D_adi_raw", (_nsteps, _nadi, _nadi), "C") 
+        saver.add_dataset("D_adi_raw", (nsteps3, _nadi, _nadi), "C") 
 
 
         # Average diabatic density matrices (dynamically-consistent)
-        saver.add_dataset("D_dia", (_nsteps, _ndia, _ndia), "C") 
+        saver.add_dataset("D_dia", (nsteps3, _ndia, _ndia), "C") 
 
         # Average diabatic density matrices (raw)
-        saver.add_dataset("D_dia_raw", (_nsteps, _ndia, _ndia), "C") 
+        saver.add_dataset("D_dia_raw", (nsteps3, _ndia, _ndia), "C") 
 
 
 
         # Trajectory-resolved coordinates
-        saver.add_dataset("q", (_nsteps, _ntraj, _ndof), "R") 
+        saver.add_dataset("q", (nsteps3, _ntraj, _ndof), "R") 
 
         # Trajectory-resolved momenta
-        saver.add_dataset("p", (_nsteps, _ntraj, _ndof), "R") 
+        saver.add_dataset("p", (nsteps3, _ntraj, _ndof), "R") 
 
         # Trajectory-resolved adiabatic TD-SE amplitudes
-        saver.add_dataset("Cadi", (_nsteps, _ntraj, _nadi), "C") 
+        saver.add_dataset("Cadi", (nsteps3, _ntraj, _nadi), "C") 
 
         # Trajectory-resolved diabatic TD-SE amplitudes
-        saver.add_dataset("Cdia", (_nsteps, _ntraj, _ndia), "C") 
+        saver.add_dataset("Cdia", (nsteps3, _ntraj, _ndia), "C") 
 
 
     if hdf5_output_level>=4:
 
         # Trajectory-resolved vibronic Hamiltoninans in the adiabatic representation
-        saver.add_dataset("hvib_adi", (_nsteps, _ntraj, _nadi, _nadi), "C") 
+        saver.add_dataset("hvib_adi", (nsteps4, _ntraj, _nadi, _nadi), "C") 
 
         # Trajectory-resolved vibronic Hamiltoninans in the diabatic representation
-        saver.add_dataset("hvib_dia", (_nsteps, _ntraj, _ndia, _ndia), "C") 
+        saver.add_dataset("hvib_dia", (nsteps4, _ntraj, _ndia, _ndia), "C") 
 
         # Trajectory-resolved time-overlaps of the adiabatic states
-        saver.add_dataset("St", (_nsteps, _ntraj, _nadi, _nadi), "C") 
+        saver.add_dataset("St", (nsteps4, _ntraj, _nadi, _nadi), "C") 
 
         # Trajectory-resolved diabatic-to-adiabatic transformation matrices 
-        saver.add_dataset("basis_transform", (_nsteps, _ntraj, _ndia, _nadi), "C") 
+        saver.add_dataset("basis_transform", (nsteps4, _ntraj, _ndia, _nadi), "C") 
 
         # Trajectory-resolved projector matrices (from the raw adiabatic to consistent adiabatic)
-        saver.add_dataset("projector", (_nsteps, _ntraj, _nadi, _nadi), "C") 
+        saver.add_dataset("projector", (nsteps4, _ntraj, _nadi, _nadi), "C") 
 
 
 
@@ -177,13 +221,21 @@ def init_tsh_savers(params, model_params, nsteps, ntraj, nnucl, nadi, ndia):
 
     _savers = {"hdf5_saver":None, "txt_saver":None, "mem_saver":None }
 
+    # When restarting, keep writing into the files produced by the interrupted run
+    mode = "w"
+    if params["restart_from"]!=None and os.path.isfile(F"{prefix}/data.hdf"):
+        mode = "a"
+
     #====== HDF5 ========
     hdf5_output_level = params["hdf5_output_level"]
     
     if hdf5_output_level > 0:                
-        _savers["hdf5_saver"] = data_savers.hdf5_saver(F"{prefix}/data.hdf", properties_to_save) 
+        if params["hdf5_buffer_size"] > 0:
+            _savers["hdf5_saver"] = data_savers.hdf5_buffered_saver(F"{prefix}/data.hdf", properties_to_save, params["hdf5_buffer_size"], mode) 
+        else:
+            _savers["hdf5_saver"] = data_savers.hdf5_saver(F"{prefix}/data.hdf", properties_to_save, mode) 
         _savers["hdf5_saver"].set_compression_level(params["use_compression"], params["compression_level"])
-        init_tsh_data(_savers["hdf5_saver"], hdf5_output_level, nsteps, ntraj, nnucl, nadi, ndia)
+        init_tsh_data(_savers["hdf5_saver"], hdf5_output_level, nsteps, ntraj, nnucl, nadi, ndia, params["save_every"])
 
 
     #====== TXT ========
@@ -195,7 +247,13 @@ def init_tsh_savers(params, model_params, nsteps, ntraj, nnucl, nadi, ndia):
 
     if mem_output_level > 0:
         _savers["mem_saver"] =  data_savers.mem_saver(properties_to_save)
-        init_tsh_data(_savers["mem_saver"], mem_output_level, nsteps, ntraj, nnucl, nadi, ndia)
+        init_tsh_data(_savers["mem_saver"], mem_output_level, nsteps, ntraj, nnucl, nadi, ndia, params["save_every"])
+
+        if params["restart_from"]!=None and os.path.isfile(F"{prefix}/mem_data.hdf"):
+            _savers["mem_saver"].load_data(F"{prefix}/mem_data.hdf")
+        elif params["checkpoint_every"] > 0:
+            # Start a new file, the checkpoints only add the new records to it, see `flush_tsh_savers`
+            _savers["mem_saver"].save_new_data(F"{prefix}/mem_data.hdf", properties_to_save, "w")
 
 
     return _savers                         
@@ -204,41 +262,75 @@ def init_tsh_savers(params, model_params, nsteps, ntraj, nnucl, nadi, ndia):
 
 
 
-def save_hdf5_1D(saver, i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC):
+def flush_tsh_savers(_savers, params):
+    """
+    Writes out all the data accumulated by the savers so far: the buffered data of the HDF5 saver 
+    are flushed to the "data.hdf" file and the records of the memory saver added since the previous 
+    flush are written to the "mem_data.hdf" file in the `params["prefix"]` directory
+
+    """
+
+    if _savers["hdf5_saver"]!=None:
+        _savers["hdf5_saver"].flush()
+
+    if _savers["mem_saver"]!=None:
+        prefix = params["prefix"]
+        _savers["mem_saver"].save_new_data( F"{prefix}/mem_data.hdf", params["properties_to_save"])
+
+
+
+def close_tsh_savers(_savers):
+    """
+    Writes out any data still kept in the buffers of the on-the-fly savers
+    and closes the corresponding files
+
+    """
+
+    if _savers["hdf5_saver"]!=None:
+        _savers["hdf5_saver"].close()
+
+
+
+def save_hdf5_1D(saver, i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC, stride=1):
     """
     saver - can be either hdf5_saver or mem_saver
 
+    stride ( int ): the data of the step `i` are saved in the record `i//stride`, 
+        the "timestep" and "time" datasets still contain the actual step and time
+
     """
 
+    irec = i // stride
+
     # Timestep 
-    saver.save_scalar(i, "timestep", i) 
+    saver.save_scalar(irec, "timestep", i) 
 
     # Actual time
-    saver.save_scalar(i, "time", dt*i)  
+    saver.save_scalar(irec, "time", dt*i)  
 
     # Average kinetic energy
-    saver.save_scalar(i, "Ekin_ave", Ekin)  
+    saver.save_scalar(irec, "Ekin_ave", Ekin)  
 
     # Average potential energy
-    saver.save_scalar(i, "Epot_ave", Epot)  
+    saver.save_scalar(irec, "Epot_ave", Epot)  
 
     # Average total energy
-    saver.save_scalar(i, "Etot_ave", Etot)  
+    saver.save_scalar(irec, "Etot_ave", Etot)  
 
     # Fluctuation of average kinetic energy
-    saver.save_scalar(i, "dEkin_ave", dEkin)  
+    saver.save_scalar(irec, "dEkin_ave", dEkin)  
 
     # Fluctuation of average potential energy
-    saver.save_scalar(i, "dEpot_ave", dEpot)  
+    saver.save_scalar(irec, "dEpot_ave", dEpot)  
 
     # Fluctuation average total energy
-    saver.save_scalar(i, "dEtot_ave", dEtot)  
+    saver.save_scalar(irec, "dEtot_ave", dEtot)  
 
     # Thermostat energy 
-    saver.save_scalar(i, "Etherm", Etherm)  
+    saver.save_scalar(irec, "Etherm", Etherm)  
 
     # System + thermostat energy
-    saver.save_scalar(i, "E_NHC", E_NHC)  
+    saver.save_scalar(irec, "E_NHC", E_NHC)  
 
 
 
@@ -340,6 +432,26 @@ def save_hdf5_4D(saver, i, tr, hvib_adi, hvib_dia, St, U, projector):
 
 
 
+def save_hdf5_4D_batch(saver, i, hvib_adi, hvib_dia, St, U, projectors):
+    """
+    Same as `save_hdf5_4D`, but saves the data of all trajectories at once
+
+    saver - can be either hdf5_saver, hdf5_buffered_saver, or mem_saver
+    hvib_adi ( 3D np.array (ntraj, nadi, nadi) ), hvib_dia ( 3D np.array (ntraj, ndia, ndia) ), 
+    St ( 3D np.array (ntraj, nadi, nadi) ), U ( 3D np.array (ntraj, ndia, nadi) ), 
+    projectors ( 3D np.array (ntraj, nadi, nadi) ) - the stacked matrices of all trajectories,
+    see `tsh_stat.get_children_matrices`
+
+    """
+
+    saver.save_matrix_stack(i, "hvib_adi", hvib_adi) 
+    saver.save_matrix_stack(i, "hvib_dia", hvib_dia) 
+    saver.save_matrix_stack(i, "St", St) 
+    saver.save_matrix_stack(i, "basis_transform", U) 
+    saver.save_matrix_stack(i, "projector", projectors) 
+
+
+
 def save_tsh_data_123(_savers, params, 
                       i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC, states,
                       pops, pops_raw, dm_adi, dm_adi_raw, dm_dia, dm_dia_raw, q, p, Cadi, Cdia
@@ -348,38 +460,403 @@ def save_tsh_data_123(_savers, params,
     hdf5_output_level = params["hdf5_output_level"]
     mem_output_level = params["mem_output_level"]
 
-    nsteps = params["nsteps"]
-    print_freq = int(params["progress_frequency"]*nsteps)    
+    s1 = get_save_every(params["save_every"], 1)
+    s2 = get_save_every(params["save_every"], 2)
+    s3 = get_save_every(params["save_every"], 3)
 
+    
+    if i%s1==0:
+        if hdf5_output_level>=1 and _savers["hdf5_saver"]!=None:
+            save_hdf5_1D(_savers["hdf5_saver"], i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC, s1)
 
-    if i%print_freq==0:
-        print(F" step= {i}")
+        if mem_output_level>=1 and _savers["mem_saver"]!=None:
+            save_hdf5_1D(_savers["mem_saver"], i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC, s1)
 
-    
-    if hdf5_output_level>=1 and _savers["hdf5_saver"]!=None:
-        save_hdf5_1D(_savers["hdf5_saver"], i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC)
 
-    if mem_output_level>=1 and _savers["mem_saver"]!=None:
-        save_hdf5_1D(_savers["mem_saver"], i, dt, Ekin, Epot, Etot, dEkin, dEpot, dEtot, Etherm, E_NHC)
 
 
+    if i%s2==0:
+        if hdf5_output_level>=2 and _savers["hdf5_saver"]!=None:
+            save_hdf5_2D(_savers["hdf5_saver"], i//s2, states)
+
+        if mem_output_level>=2 and _savers["mem_saver"]!=None:
+            save_hdf5_2D(_savers["mem_saver"], i//s2, states)
+
+
+
+
+    if i%s3==0:
+        if hdf5_output_level>=3 and _savers["hdf5_saver"]!=None: 
+            save_hdf5_3D(_savers["hdf5_saver"], i//s3, pops, pops_raw, dm_adi, dm_adi_raw, dm_dia, dm_dia_raw, q, p, Cadi, Cdia)
+
+        if mem_output_level>=3 and _savers["mem_saver"]!=None: 
+            save_hdf5_3D(_savers["mem_saver"], i//s3, pops, pops_raw, dm_adi, dm_adi_raw, dm_dia, dm_dia_raw, q, p, Cadi, Cdia)
+
+
+
+
+def init_tsh_reducers(params, nsteps, ntraj, nnucl, nadi, ndia):
+    """
+    Creates the on-the-fly reducers of the TSH data - these accumulate the statistics of 
+    the properties listed in `params["properties_to_reduce"]` instead of storing them for every 
+    step and every trajectory
+
+    Args:
+        params ( dictionary ): the parameters of `run_dynamics`, uses the keys:
+            "properties_to_reduce", "reduction_bin"
+        nsteps ( int ): the number of steps of dynamics
+        ntraj ( int ): the number of trajectories
+        nnucl ( int ): the number of nuclear DOFs
+        nadi ( int ): the number of adiabatic states
+        ndia ( int ): the number of diabatic states
+
+    Returns:
+        dictionary: { name : reducer object } for each of the requested properties
+
+    """
+
+    props = params["properties_to_reduce"]
+    nbin = params["reduction_bin"]
+
+    reducers = {}
+
+    # Fraction of the time each trajectory spends in each adiabatic state
+    if "states_hist" in props:
+        reducers["states_hist"] = data_stat.running_histogram(ntraj, nadi)
+
+    # Time-binned SH populations
+    if "SH_pop_binned" in props:
+        reducers["SH_pop_binned"] = data_stat.binned_average(nsteps, nbin, (nadi,))
+
+    # Time-binned SE (adiabatic) populations
+    if "SE_pop_binned" in props:
+        reducers["SE_pop_binned"] = data_stat.binned_average(nsteps, nbin, (nadi,))
+
+    # Time-binned ensemble-averaged energies: Ekin, Epot, Etot
+    if "E_binned" in props:
+        reducers["E_binned"] = data_stat.binned_average(nsteps, nbin, (3,))
+
+    # Trajectory-resolved mean and variance of coordinates and momenta
+    if "q_stat" in props:
+        reducers["q_stat"] = data_stat.running_stat((ntraj, nnucl))
+
+    if "p_stat" in props:
+        reducers["p_stat"] = data_stat.running_stat((ntraj, nnucl))
+
+    # Trajectory-resolved mean and variance of the vibronic Hamiltonians
+    if "hvib_adi_stat" in props:
+        reducers["hvib_adi_stat"] = data_stat.running_stat((ntraj, nadi, nadi), complex)
+
+    if "hvib_dia_stat" in props:
+        reducers["hvib_dia_stat"] = data_stat.running_stat((ntraj, ndia, ndia), complex)
+
+    return reducers
+
+
+
+def update_tsh_reducers(reducers, i, ham, states, pops, dm_adi, Ekin, Epot, Etot, q, p, hvib_adi=None, hvib_dia=None):
+    """
+    Adds the data of the step `i` to all the reducers created by `init_tsh_reducers`
+
+    The stacked vibronic Hamiltonians `hvib_adi` and `hvib_dia` ( 3D np.arrays (ntraj, n, n) ) can be
+    given, if already available, otherwise they are taken from `ham` when needed
+
+    """
+
+    if "states_hist" in reducers:
+        reducers["states_hist"].add(states)
+
+    if "SH_pop_binned" in reducers:
+        reducers["SH_pop_binned"].add(i, data_conv.nparray_view(pops)[:, 0])
+
+    if "SE_pop_binned" in reducers:
+        reducers["SE_pop_binned"].add(i, np.diag(data_conv.nparray_view(dm_adi)).real)
+
+    if "E_binned" in reducers:
+        reducers["E_binned"].add(i, np.array([Ekin, Epot, Etot]))
+
+    if "q_stat" in reducers:
+        reducers["q_stat"].add( data_conv.nparray_view(q).T )
+
+    if "p_stat" in reducers:
+        reducers["p_stat"].add( data_conv.nparray_view(p).T )
+
+    ntraj = len(states)
+
+    if "hvib_adi_stat" in reducers:
+        if hvib_adi is None:
+            hvib_adi = tsh_stat.get_children_matrices(ham, "hvib_adi", ntraj)
+        reducers["hvib_adi_stat"].add( hvib_adi )
+
+    if "hvib_dia_stat" in reducers:
+        if hvib_dia is None:
+            hvib_dia = tsh_stat.get_children_matrices(ham, "hvib_dia", ntraj)
+        reducers["hvib_dia_stat"].add( hvib_dia )
+
+
+
+def save_tsh_reducers(reducers, filename):
+    """
+    Writes the data accumulated by the reducers into the HDF5 file `filename`. 
+    Each reducer `name` is saved as a group with the datasets:
+
+        * running_stat: "name/mean", "name/variance", "name/count"
+        * running_histogram: "name/data" - the normalized histogram, "name/count"
+        * binned_average: "name/data" - the binned averages, "name/bin_size"
+
+    """
+
+    if len(reducers)==0:
+        return
+
+    with h5py.File(filename, "w") as f:
+        for name, red in reducers.items():
+            g = f.create_group(name)
+
+            if isinstance(red, data_stat.running_stat):
+                g.create_dataset("mean", data=red.mean)
+                g.create_dataset("variance", data=red.variance())
+                g.create_dataset("count", data=red.count)
+
+            elif isinstance(red, data_stat.running_histogram):
+                g.create_dataset("data", data=red.probabilities())
+                g.create_dataset("count", data=red.count)
+
+            elif isinstance(red, data_stat.binned_average):
+                g.create_dataset("data", data=red.average())
+                g.create_dataset("bin_size", data=red.bin_size)
+
 
 
-    if hdf5_output_level>=2 and _savers["hdf5_saver"]!=None:
-        save_hdf5_2D(_savers["hdf5_saver"], i, states)
 
-    if mem_output_level>=2 and _savers["mem_saver"]!=None:
-        save_hdf5_2D(_savers["mem_saver"], i, states)
+# The dynamical variables of the Thermostat objects, stored in the checkpoints
+thermostat_state_vars = ["s_t", "s_r", "s_b", "ksi_t", "ksi_r", "ksi_b", "G_t", "G_r", "G_b"]
+
+
+def save_tsh_checkpoint(filename, istep, q, p, Cdia, Cadi, projectors, states, U, therm, reducers, rng_state):
+    """
+    Writes the complete state of the TSH dynamics into a binary (HDF5) file, so that the calculations 
+    can be continued from this point (see the `restart_from` option of `run_dynamics`). The file is 
+    first written under a temporary name and then renamed, so an interruption during the writing 
+    doesn't destroy the previous checkpoint
+
+    Args:
+        filename ( string ): the name of the checkpoint file
+        istep ( int ): the index of the step from which the calculations shall be continued
+        q, p ( MATRIX(nnucl, ntraj) ): coordinates and momenta
+        Cdia ( CMATRIX(ndia, ntraj) ), Cadi ( CMATRIX(nadi, ntraj) ): amplitudes of electronic states
+        projectors ( list of ntraj CMATRIX(nadi, nadi) ): cumulative phase correction and state tracking matrices
+        states ( list of ntraj ints ): the active states
+        U ( 3D np.array (ntraj, ndia, nadi) ): the diabatic-to-adiabatic transformations at the previous step
+        therm ( ThermostatList ): thermostats of all trajectories
+        reducers ( dictionary ): the on-the-fly reducers, see `init_tsh_reducers`
+        rng_state ( string ): the state of the random numbers generator, see `Random.get_state`
+
+    """
+
+    tmp_name = F"{filename}.tmp"
+
+    with h5py.File(tmp_name, "w") as f:
+        f.attrs["step"] = istep
+        f.attrs["rng_state"] = rng_state
+
+        f.create_dataset("q", data=data_conv.nparray_view(q))
+        f.create_dataset("p", data=data_conv.nparray_view(p))
+        f.create_dataset("Cdia", data=data_conv.nparray_view(Cdia))
+        f.create_dataset("Cadi", data=data_conv.nparray_view(Cadi))
+        f.create_dataset("projectors", data=data_conv.matrices2nparray(projectors))
+        f.create_dataset("states", data=np.array(list(states), dtype=int))
+        f.create_dataset("U", data=U)
+
+        g = f.create_group("therm")
+        g.create_dataset("s_var", data=np.array([ bath.s_var for bath in therm ]))
+        g.create_dataset("Ps", data=np.array([ bath.Ps for bath in therm ]))
+        for var in thermostat_state_vars:
+            g.create_dataset(var, data=np.array([ list(getattr(bath, var)) for bath in therm ]))
+
+        g = f.create_group("reducers")
+        for name, red in reducers.items():
+            gr = g.create_group(name)
+            for key, val in vars(red).items():
+                gr.create_dataset(key, data=val)
+
+    os.replace(tmp_name, filename)
+
+
+
+def load_tsh_checkpoint(filename, therm, reducers):
+    """
+    Reads the state of the TSH dynamics saved by `save_tsh_checkpoint`
+
+    Args:
+        filename ( string ): the name of the checkpoint file
+        therm ( ThermostatList ): the initialized thermostats - their dynamical variables are 
+            updated by this function
+        reducers ( dictionary ): the initialized on-the-fly reducers - their accumulated 
+            data are updated by this function
+
+    Returns:
+        tuple: ( istep, q, p, Cdia, Cadi, projectors, states, U, rng_state ), see `save_tsh_checkpoint`
+
+    """
+
+    with h5py.File(filename, "r") as f:
+        istep = int(f.attrs["step"])
+        rng_state = str(f.attrs["rng_state"])
+
+        q = data_conv.nparray2MATRIX(f["q"][()])
+        p = data_conv.nparray2MATRIX(f["p"][()])
+        Cdia = data_conv.nparray2CMATRIX(f["Cdia"][()])
+        Cadi = data_conv.nparray2CMATRIX(f["Cadi"][()])
+        projectors = [ data_conv.nparray2CMATRIX(x) for x in f["projectors"][()] ]
+        states = [ int(x) for x in f["states"][()] ]
+        U = f["U"][()]
+
+        g = f["therm"]
+        for i in range(len(therm)):
+            therm[i].s_var = float(g["s_var"][i])
+            therm[i].Ps = float(g["Ps"][i])
+            for var in thermostat_state_vars:
+                setattr(therm[i], var, Py2Cpp_double(list(g[var][i])) )
+
+        g = f["reducers"]
+        for name, red in reducers.items():
+            for key in g[name].keys():
+                val = g[F"{name}/{key}"][()]
+                setattr(red, key, val if isinstance(val, np.ndarray) else val.item())
+
+    return istep, q, p, Cdia, Cadi, projectors, states, U, rng_state
+
+
+
+# The datasets of the TSH output that contain the trajectory-resolved data, the index of trajectory is 
+# the axis 1 of such datasets (the axis 0 is time)
+traj_resolved_data = ["states", "q", "p", "Cadi", "Cdia", "hvib_adi", "hvib_dia", "St", "basis_transform", "projector"]
+
+# The ensemble fluctuations (standard deviations) of the energies and the corresponding averages
+energy_fluctuations = {"dEkin_ave":"Ekin_ave", "dEpot_ave":"Epot_ave", "dEtot_ave":"Etot_ave"}
+
+
+def merge_tsh_data(filenames, ntrajs, filename, tsh=True):
+    """
+    Merges the HDF5 files (e.g. "data.hdf" or "mem_data.hdf") produced by `run_dynamics` for several 
+    independent batches of trajectories into a single file of the same layout, as if all the 
+    trajectories were run together
+
+      * the trajectory-resolved data (`traj_resolved_data`) are concatenated along the trajectory axis
+      * the ensemble fluctuations of energies are combined from the batch averages and fluctuations
+      * all other ensemble-averaged data (energies, populations, density matrices) are averaged with 
+        the weights proportional to the number of trajectories in each batch
+      * the time axes ("timestep", "time") are taken from the first file
+      * the per-step timings ("timings/<phase>", see `profiling.profiler.save_step_timings`) are summed, 
+        giving the total time spent in each phase by all the batches
+      * the datasets missing in some of the files are skipped
+
+    Args:
+        filenames ( list of strings ): the names of the files for all batches
+        ntrajs ( list of ints ): the number of trajectories in each batch
+        filename ( string ): the name of the resulting file
+        tsh ( Boolean ): whether the total energy fluctuation is computed as in `tsh_stat.compute_etot_tsh` 
+            (True) or as in `tsh_stat.compute_etot` (False)
+
+    """
+
+    w = np.array(ntrajs, dtype=float) / float(sum(ntrajs))
+
+    fin = [ h5py.File(name, "r") for name in filenames ]
+
+    # All the datasets "<name>/data", including the nested ones, such as "timings/<phase>/data"
+    names = []
+    def _add_name(key, obj):
+        if isinstance(obj, h5py.Dataset) and key.endswith("/data"):
+            names.append( key[:-len("/data")] )
+    fin[0].visititems(_add_name)
+
+    with h5py.File(filename, "w") as f:
+        for name in names:
+            if not all( [ F"{name}/data" in fi for fi in fin ] ):
+                continue
+
+            data = [ fi[F"{name}/data"][()] for fi in fin ]
+
+            if name in ["timestep", "time", "default"]:
+                res = data[0]
+
+            elif name.startswith("timings/"):
+                res = sum(data)
+
+            elif name in traj_resolved_data:
+                res = np.concatenate(data, axis=1)
+
+            elif name in energy_fluctuations.keys():
+                ave_name = energy_fluctuations[name]
+                ave = [ fi[F"{ave_name}/data"][()] for fi in fin ]
+                ave_tot = sum( [ w[k] * ave[k] for k in range(len(fin)) ] )
+
+                if name=="dEtot_ave" and not tsh:
+                    # Ehrenfest: dEtot^2 = dEkin^2 + dEpot^2 for each batch and for the whole ensemble
+                    var_k = [ fi["dEkin_ave/data"][()]**2 for fi in fin ]
+                    var_p = [ fi["dEpot_ave/data"][()]**2 for fi in fin ]
+                    ekin = [ fi["Ekin_ave/data"][()] for fi in fin ]
+                    epot = [ fi["Epot_ave/data"][()] for fi in fin ]
+                    ekin_tot = sum( [ w[k] * ekin[k] for k in range(len(fin)) ] )
+                    epot_tot = sum( [ w[k] * epot[k] for k in range(len(fin)) ] )
+                    res = sum( [ w[k] * ( var_k[k] + var_p[k] + (ekin[k] - ekin_tot)**2 + (epot[k] - epot_tot)**2 ) 
+                                 for k in range(len(fin)) ] )
+                else:
+                    res = sum( [ w[k] * ( data[k]**2 + (ave[k] - ave_tot)**2 ) for k in range(len(fin)) ] )
+
+                res = np.sqrt(res)
+
+            else:
+                res = sum( [ w[k] * data[k] for k in range(len(fin)) ] )
+
+            f.create_dataset(F"{name}/data", data=res)
+
+    for fi in fin:
+        fi.close()
+
+
+
+def merge_tsh_reducers(filenames, ntrajs, filename):
+    """
+    Merges the files with the on-the-fly reduced data (see `save_tsh_reducers`) produced by `run_dynamics` 
+    for several independent batches of trajectories into a single file of the same layout
+
+      * the trajectory-resolved statistics ("states_hist", "q_stat", "p_stat", "hvib_adi_stat", "hvib_dia_stat")
+        are concatenated along the trajectory axis
+      * the time-binned ensemble averages ("SH_pop_binned", "SE_pop_binned", "E_binned") are averaged with the 
+        weights proportional to the number of trajectories in each batch
+
+    Args:
+        filenames ( list of strings ): the names of the files for all batches
+        ntrajs ( list of ints ): the number of trajectories in each batch
+        filename ( string ): the name of the resulting file
+
+    """
+
+    w = np.array(ntrajs, dtype=float) / float(sum(ntrajs))
 
+    fin = [ h5py.File(name, "r") for name in filenames ]
 
+    with h5py.File(filename, "w") as f:
+        for name in fin[0].keys():
+            g = f.create_group(name)
 
+            for dset in fin[0][name].keys():
+                data = [ fi[F"{name}/{dset}"][()] for fi in fin ]
 
-    if hdf5_output_level>=3 and _savers["hdf5_saver"]!=None: 
-        save_hdf5_3D(_savers["hdf5_saver"], i, pops, pops_raw, dm_adi, dm_adi_raw, dm_dia, dm_dia_raw, q, p, Cadi, Cdia)
+                if dset in ["count", "bin_size"]:
+                    res = data[0]
+                elif name.endswith("_binned"):
+                    res = sum( [ w[k] * data[k] for k in range(len(fin)) ] )
+                else:
+                    res = np.concatenate(data, axis=0)
 
-    if mem_output_level>=3 and _savers["mem_saver"]!=None: 
-        save_hdf5_3D(_savers["mem_saver"], i, pops, pops_raw, dm_adi, dm_adi_raw, dm_dia, dm_dia_raw, q, p, Cadi, Cdia)
+                g.create_dataset(dset, data=res)
 
+    for fi in fin:
+        fi.close()
 
 
 
@@ -13,6 +13,11 @@
    :synopsis: 
        This module implements the functionality to compute Fourier Transforms
 
+       The transforms on the user-defined frequency grids (`ft`, `ft2`) are evaluated for
+       all frequencies at once with the chirp-z (Bluestein) algorithm, see `dft_grid`, which costs
+       O((N+M) log(N+M)) operations for N time points and M frequencies and works on the batches
+       of time series (e.g. all matrix elements of a matrix time series)
+
 .. moduleauthor:: Alexey V. Akimov
 
 """
@@ -21,6 +26,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 #if sys.platform=="cygwin":
 #    from cyglibra_core import *
@@ -29,6 +35,81 @@ import copy
 
 
 
+def dft_grid(X, wmin, dw, npoints, dt):
+    """Computes the sums  F[..., k] = Sum_{t=0,N-1} X[..., t] * exp(i * w_k * t * dt),  w_k = wmin + k * dw
+
+    The chirp-z (Bluestein) algorithm is used: with  n*k = ( n^2 + k^2 - (k-n)^2 ) / 2,  the sums are
+    expressed via a convolution, computed with the zero-padded FFTs
+
+    Args:
+        X ( np.array (..., N) ): the time series, the transform is done along the last axis
+        wmin ( float ): the first frequency of the grid
+        dw ( float ): the spacing of the frequency grid
+        npoints ( int ): the number of the frequency points, M
+        dt ( float ): the time step
+
+    Returns:
+        np.array (..., M) of complex: the sums F
+
+    """
+
+    X = np.asarray(X)
+    N = X.shape[-1]
+    M = npoints
+
+    if N==0 or M<=0:
+        return np.zeros( X.shape[:-1] + (max(M, 0),), dtype=complex)
+
+    a = dw * dt
+    n = np.arange(N)
+    k = np.arange(M)
+
+    L = 1
+    while L < N + M - 1:
+        L *= 2
+
+    u = X * np.exp( 1j * (wmin * dt * n + 0.5 * a * n.astype(float)**2) )
+
+    v = np.zeros(L, dtype=complex)
+    v[:M] = np.exp( -0.5j * a * k.astype(float)**2 )
+    v[L-N+1:] = np.exp( -0.5j * a * (n[1:][::-1]).astype(float)**2 )    # negative indices: -(N-1), ..., -1
+
+    conv = np.fft.ifft( np.fft.fft(u, n=L, axis=-1) * np.fft.fft(v), axis=-1 )[..., :M]
+
+    return np.exp( 0.5j * a * k.astype(float)**2 ) * conv
+
+
+
+def ft_batch(X, wspan, dw, dt):
+    """Batched version of `ft`: the cos-transforms of many time series at once
+
+    Args:
+        X ( np.array (..., N) ): data time-series, the transforms are done along the last axis
+        wspan ( float ): is the range (the maximal value) of frequencies we want to compute
+        dw ( float ): is the distance between the nearby points on the frequency scale
+        dt ( float ): is the time step
+
+    Returns: 
+        tuple: (W, J): where
+
+            W ( np.array (npoints,) ): frequencies
+            J ( np.array (..., npoints) ): amplitudes of the cos-transform
+
+    """
+
+    X = np.asarray(X, dtype=float)
+    npoints = int(wspan/dw)
+
+    W = np.arange(npoints) * dw
+
+    # the t = 0 term is taken to be 1, as for the normalized ACFs
+    C = np.real( dft_grid(X, 0.0, dw, npoints, dt) )
+    J = dt * ( 1.0 + 2.0 * ( C - X[..., :1] ) )
+
+    return W, J
+
+
+
 def ft(X, wspan, dw, dt):  
     """Discrete Fourier transform
 
@@ -50,24 +131,10 @@ def ft(X, wspan, dw, dt):
     """
 
     ############### based on the code from Pyxaid ###################
-    sz=len(X)    # the # of input points
-    npoints = int(wspan/dw)   # the # of output points    
-
-    J = [0.0] * npoints   # FT
-    W = [0.0] * npoints   # frequencies
-
-    for iw in range(0,npoints):
-        w = iw * dw
+    # J(w) = dt * ( 1 + 2 * Sum_{t=1,N-1} cos(w*t) * X[t] )
+    W, J = ft_batch(X, wspan, dw, dt)
 
-        J[iw] = 1.0  # corresponds to it = 0
-        for it in range(1,sz):
-            t = it * dt
-            J[iw] += 2.0*math.cos(w * t)*X[it]
-
-        W[iw] = w
-        J[iw] *= dt
-
-    return W, J
+    return W.tolist(), J.tolist()
 
 
 
@@ -94,35 +161,17 @@ def ft2(X, wmin, wmax, dw, dt):
     """
 
     ############### based on the code from Pyxaid ###################
-    sz=len(X)    # the # of input points
     npoints = int((wmax-wmin)/dw)   # the # of output points    
 
-    J_re = [0.0] * npoints   # FT
-    J_im = [0.0] * npoints   # FT
-    J = [0.0] * npoints   # FT
-    I = [0.0] * npoints   # FT intensities
-    I2 = [0.0] * npoints  # FT intensities squared
-    W = [0.0] * npoints   # frequencies
+    F = dt * dft_grid( np.asarray(X, dtype=float), wmin, dw, npoints, dt)
 
-    for iw in range(0,npoints):
-        w = wmin + iw * dw
+    W = wmin + np.arange(npoints) * dw
+    J_re = np.real(F)
+    J_im = np.imag(F)
+    I = np.abs(F)
+    I2 = I**2
 
-        J_re[iw] = 0.0  
-        J_im[iw] = 0.0  
-        for it in range(0,sz):
-            t = it * dt
-            J_re[iw] += math.cos(w * t)*X[it]
-            J_im[iw] += math.sin(w * t)*X[it]
-
-        J_re[iw] *= dt
-        J_im[iw] *= dt
-
-        W[iw] = w
-        J[iw] = J_re[iw] + 1j*J_im[iw]
-        I[iw] = abs(J[iw])
-        I2[iw] = I[iw]**2
-
-    return W, J, I, I2, J_re, J_im
+    return W.tolist(), F.tolist(), I.tolist(), I2.tolist(), J_re.tolist(), J_im.tolist()
 
 
 
@@ -155,20 +204,11 @@ def py_cft(X, dt):
     dv = 1.0/(N*dt)
     dw = 2.0*math.pi*dv
 
-    W = [0.0] * N   # frequencies
-    C = [0.0] * N   # FT
-    S = [0.0] * N   # FT
-
-    for iw in range(0,N):
-        w = iw * dw
-
-        C[iw], S[iw] = 0.0, 0.0
-        for it in range(0,N):
-            t = it * dt            
-            C[iw] += math.cos(w * t)*X[it]   
-            S[iw] -= math.sin(w * t)*X[it]
-
-        W[iw] = w
+    # The frequencies w_k = k * 2*pi/(N*dt) are those of the FFT
+    F = np.fft.fft( np.asarray(X, dtype=float) )
 
-    return W, C, S
+    W = np.arange(N) * dw
+    C = np.real(F)
+    S = np.imag(F)
 
+    return W.tolist(), C.tolist(), S.tolist()
@@ -16,6 +16,9 @@
        and their Fourier spectra (influence spectra) of the time-series of matrices (e.g.
        of the "vibronic" Hamiltonian data sampled along the MD trajectories)
 
+       The ACFs and spectra of all the time series (e.g. of all the matrix elements) are
+       computed at once with the FFT-based `acf.acf_fft` and `ft.ft_batch`, see `spectra_batch`
+
 .. moduleauthor:: Wei Li and Alexey V. Akimov
 
 
@@ -27,6 +30,7 @@ import math
 import os
 import sys
 import unittest
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -39,6 +43,64 @@ from . import units
 from . import data_stat
 from . import acf
 from . import ft
+from . import data_conv
+
+
+
+def spectra_batch(X, params):
+    """Computes the ACFs and their FTs for many data series at once
+
+    Args:
+        X ( np.array (nseries, nsteps, ndof) ): the data series of real-valued ndof-dimensional vectors
+        params ( Python dictionary ): controlling the parameters, see `recipe1`. In addition:
+
+            * **params["window"]** ( int ): the window function applied to the normalized ACF
+                before the Fourier transform
+
+                * 0 : no window [ default ]
+                * 1 : Hann window, 0.5 * ( 1 + cos(pi * t / t_max) ), suppresses the ripples
+                      due to the finite length of the ACF
+
+    Returns:
+        tuple: (T, norm_acf, raw_acf, W, J, J2), the same quantities as in `recipe1`, but as np.arrays:
+            T ( nsteps ), norm_acf and raw_acf ( nseries, nsteps ), W ( npoints ), J and J2 ( nseries, npoints )
+
+    """
+
+    critical_params = [ ] 
+    default_params = { "dt":1.0, "wspan":3000.0, "dw":1.0, "do_center":True, "acf_type":0, "window":0 }
+    comn.check_input(params, default_params, critical_params)
+
+    dt = params["dt"] * units.fs2au            # convert to  atomic units of time
+    wspan = params["wspan"] * units.inv_cm2Ha  # convert to Ha (atomic units)
+    dw = params["dw"] * units.inv_cm2Ha        # convert to Ha (atomic units)
+
+    X = np.asarray(X, dtype=float)
+    nsteps = X.shape[1]
+
+    if params["do_center"]:
+        X = X - np.mean(X, axis=1, keepdims=True)
+
+    #=========== ACFs ==============
+    raw_acf = acf.acf_fft(X, params["acf_type"])
+
+    norm = np.ones( (raw_acf.shape[0], 1) )
+    nz = np.abs(raw_acf[:, 0]) > 0.0
+    norm[nz, 0] = 1.0 / raw_acf[nz, 0]
+    norm_acf = norm * raw_acf
+
+    T = np.arange(nsteps) * dt / units.fs2au    # convert to fs
+
+    #=========== FT =============
+    x = norm_acf
+    if params["window"]==1 and nsteps>1:
+        x = norm_acf * 0.5 * ( 1.0 + np.cos( math.pi * np.arange(nsteps) / float(nsteps - 1) ) )
+
+    W, J = ft.ft_batch(x, wspan, dw, dt)
+    W = W / units.inv_cm2Ha
+    J2 = (1.0/(2.0*math.pi)) * J * J
+
+    return T, norm_acf, raw_acf, W, J, J2
 
 
 
@@ -84,67 +146,98 @@ def recipe1(data, params):
     critical_params = [ ] 
     default_params = { "dt":1.0, "wspan":3000.0, "dw":1.0, "do_output":False, 
                        "acf_filename":"acf.txt", "spectrum_filename":"spectrum.txt",
-                       "do_center":True, "acf_type":0, "data_type":0 }
+                       "do_center":True, "acf_type":0, "data_type":0, "window":0 }
     comn.check_input(params, default_params, critical_params)
 
-
-    dt = params["dt"] * units.fs2au            # convert to  atomic units of time
-    wspan = params["wspan"] * units.inv_cm2Ha  # convert to Ha (atomic units)
-    dw = params["dw"] * units.inv_cm2Ha        # convert to Ha (atomic units)
     do_output = params["do_output"]
-    acf_filename = params["acf_filename"]
-    spectrum_filename = params["spectrum_filename"]
-    do_center = params["do_center"]
-    acf_type = params["acf_type"]
     data_type = params["data_type"]
-    
 
-    #========
-    data_new = data
-    if do_center:
-        if data_type==0:
-            data_new = data_stat.mat_center_data(data)
-        elif data_type==1:
-            data_new = data_stat.vec_center_data(data)
 
-    #=========== ACFs ==============
-    T, norm_acf, raw_acf = None, None, None
+    #======== Data series as an array (nsteps, ndof) ========
     if data_type==0:
-        T, norm_acf, raw_acf = acf.acf_mat( data_new , dt, acf_type)
+        X = np.array( [ data_conv.nparray_view(x)[:, 0] for x in data ] )
     elif data_type==1:
-        T, norm_acf, raw_acf = acf.acf_vec( data_new , dt, acf_type)
+        X = np.array( [ [ x.x, x.y, x.z ] for x in data ] )
     else:
         print("Error: data_type = ", data_type, " is not known\n")
         sys.exit(0)
 
+    T, norm_acf, raw_acf, W, J, J2 = spectra_batch(X[None], params)
+    T, norm_acf, raw_acf = T.tolist(), norm_acf[0].tolist(), raw_acf[0].tolist()
+    W, J, J2 = W.tolist(), J[0].tolist(), J2[0].tolist()
+
+    if do_output:
+        _write_spectra(params["acf_filename"], params["spectrum_filename"], T, norm_acf, raw_acf, W, J, J2)
+
+    return T, norm_acf, raw_acf, W, J, J2
+
+
+
+def _write_spectra(acf_filename, spectrum_filename, T, norm_acf, raw_acf, W, J, J2):
+    """
+    Prints out the ACF and the spectrum computed by `recipe1` into the files
+    """
+
+    f = open(acf_filename,"w")
+    for it in range(0,len(T)):
+        f.write("%8.5f  %8.5f  %8.5f  \n" % (T[it] , norm_acf[it], raw_acf[it]))
+    f.close()
+
+    f = open(spectrum_filename,"w")
+    for iw in range(0,len(W)):
+        f.write("%8.5f  %8.5f  %8.5f\n" % (W[iw], J[iw], J2[iw] ) )
+    f.close()
+
 
-    sz = len(T)
-    for it in range(0,sz):
-        T[it] = T[it]/units.fs2au  # convert to fs
+
+def _select_freqs(W, J, J2, params1):
+    """
+    Finds the `params1["nfreqs"]` highest peaks of the spectrum J2 and returns the list of 
+    the frequencies and amplitudes, see `compute_mat_elt`
+    """
+
+    nfreqs = params1["nfreqs"]
+    do_output = params1["do_output"]
+    logname = params1["logname"]
+
+    #===== Determine all frequencies (peaks) and sort them (in accending manner) ====
+    out = data_stat.find_maxima(J2, params1)
 
     if do_output:
-        f = open(acf_filename,"w")
-        for it in range(0,sz):
-            f.write("%8.5f  %8.5f  %8.5f  \n" % (T[it] , norm_acf[it], raw_acf[it]))
-        f.close()
+        lgfile = open(logname, "a")
+        lgfile.write("Maximal peaks in the file "+params1["spectrum_filename"]+"\n")
 
+    # Reduce the number of frequencies to the maximal number available
+    if nfreqs > len(out):
+        nfreqs = len(out)
 
-    #=========== FT =============
-    W, J = ft.ft(norm_acf, wspan, dw, dt)
-    sz = len(W)
+    szo = len(out) - 1
 
-    J2 = []
-    for iw in range(0,sz):
-        W[iw] = W[iw]/units.inv_cm2Ha
-        J2.append( (1.0/(2.0*math.pi))*J[iw]*J[iw] )
+    #==== Compute the intensities and normalized intensities, do the output =========
+    freqs = []
+    norm = 0.0
+    for i in range(0,nfreqs):
+        indx = out[szo-i][0]
+        norm = norm + abs(J[indx])
+       
+    for i in range(0,nfreqs):
+        indx = out[szo-i][0]
+        freqs.append( [W[indx], J[indx], J[indx]/norm ] )
 
+        if do_output:
+            lgfile.write("index= %3i  frequency= %8.5f  amplitude= %8.5f normalized_amplitude= %8.5f \n" % (i, W[indx], J[indx], J[indx]/norm) )
     if do_output:
-        f = open(spectrum_filename,"w")
-        for iw in range(0,sz):
-            f.write("%8.5f  %8.5f  %8.5f\n" % (W[iw], J[iw], J2[iw] ) )
-        f.close()
+        lgfile.close()    
+    
+        lgfile = open(logname, "a")
+        for a in freqs:
+            lgfile.write(" ========= Mode = %5i =========== \n" % (freqs.index(a)) )
+            lgfile.write(" omega = E/hbar = %8.5f [cm^-1] \n" % (a[0])   )
+            lgfile.write(" Amplitude = %8.5f \n" % (a[1]) )
+            lgfile.write(" Normalized amplitude = %8.5f \n" % (a[2]))
+        lgfile.close()
 
-    return T, norm_acf, raw_acf, W, J, J2
+    return freqs
 
 
 
@@ -200,15 +293,11 @@ def compute_mat_elt(X, a, b, params):
     comn.check_input(params, default_params, critical_params)
 
     # Local variables and dimensions
-    nfreqs = params["nfreqs"]
-    do_output = params["do_output"] 
     filename = params["filename"]
-    logname = params["logname"]
 
 
     #========= Collect info in a different format =======
     nsteps = len(X)    
-    sz = X[0].num_of_rows
     data_ab = []
     for n in range(0,nsteps):
         xi = MATRIX(1,1)
@@ -225,45 +314,8 @@ def compute_mat_elt(X, a, b, params):
 
     T, norm_acf, raw_acf, W, J, J2 = recipe1(data_ab, params1)   # T is in fs, W is in cm^-1
  
-    
-    #===== Determine all frequencies (peaks) and sort them (in accending manner) ====
-    out = data_stat.find_maxima(J2, params1)
-
-    if do_output:
-        lgfile = open(logname, "a")
-        lgfile.write("Maximal peaks in the file "+params1["spectrum_filename"]+"\n")
-
-    # Reduce the number of frequencies to the maximal number available
-    if nfreqs > len(out):
-        nfreqs = len(out)
+    freqs = _select_freqs(W, J, J2, params1)
 
-    szo = len(out) - 1
-
-    #==== Compute the intensities and normalized intensities, do the output =========
-    freqs = []
-    norm = 0.0
-    for i in range(0,nfreqs):
-        indx = out[szo-i][0]
-        norm = norm + abs(J[indx])
-       
-    for i in range(0,nfreqs):
-        indx = out[szo-i][0]
-        freqs.append( [W[indx], J[indx], J[indx]/norm ] )
-
-        if do_output:
-            lgfile.write("index= %3i  frequency= %8.5f  amplitude= %8.5f normalized_amplitude= %8.5f \n" % (i, W[indx], J[indx], J[indx]/norm) )
-    if do_output:
-        lgfile.close()    
-    
-        lgfile = open(logname, "a")
-        for a in freqs:
-            lgfile.write(" ========= Mode = %5i =========== \n" % (freqs.index(a)) )
-            lgfile.write(" omega = E/hbar = %8.5f [cm^-1] \n" % (a[0])   )
-            lgfile.write(" Amplitude = %8.5f \n" % (a[1]) )
-            lgfile.write(" Normalized amplitude = %8.5f \n" % (a[2]))
-        lgfile.close()
-
-   
     return  freqs, T, norm_acf, raw_acf, W, J, J2
 
 
@@ -292,26 +344,21 @@ def compute_all(X, params):
     """
 
     critical_params = [ ] 
-    default_params = { "filename":"influence_spectra_" }
+    default_params = { "filename":"influence_spectra_", "nfreqs":1, "logname":"out.log", "do_output":0 }
     comn.check_input(params, default_params, critical_params)
 
 
-    params_re = dict(params)
-    params_re.update({"filename":params["filename"]+"_re_"})
-
-    params_im = dict(params)
-    params_im.update({"filename":params["filename"]+"_im_"})
-    
+    # The time series to analyze: the real parts of the diagonal elements and
+    # the imaginary parts of the off-diagonal elements, x[i, j, step]
+    x = data_conv.matrices2nparray(X)
+    nsteps, nstates = x.shape[0], x.shape[1]
 
-    # Split the X array into two arrays - real and imaginary parts
-    X_re, X_im = [], []
-    nsteps = len(X)
-    for step in range(0,nsteps):
-        X_re.append(X[step].real())
-        X_im.append(X[step].imag())
+    diag = np.identity(nstates, dtype=bool)
+    x = np.where(diag[None, :, :], np.real(x), np.imag(x)).transpose(1, 2, 0)
 
-    # Do the calculations for each matrix element
-    nstates = X[0].num_of_cols   
+    # The ACFs and spectra of all matrix elements at once
+    T_all, norm_acf_all, raw_acf_all, W_all, J_all, J2_all = spectra_batch( x.reshape(nstates*nstates, nsteps, 1), dict(params) )
+    T_all, W_all = T_all.tolist(), W_all.tolist()
 
     freqs = [ [ [] for i in range(0,nstates)] for j in range(0,nstates)]
     T = [ [ [] for i in range(0,nstates)] for j in range(0,nstates)]
@@ -324,10 +371,27 @@ def compute_all(X, params):
  
     for i in range(0,nstates):
         for j in range(0,nstates):
+            k = i*nstates + j
+
+            T[i][j], W[i][j] = list(T_all), list(W_all)
+            norm_acf[i][j], raw_acf[i][j] = norm_acf_all[k].tolist(), raw_acf_all[k].tolist()
+            J[i][j], J2[i][j] = J_all[k].tolist(), J2_all[k].tolist()
+
+            # Same file names as produced by `compute_mat_elt`
+            params1 = dict(params)
             if i == j:
-                freqs[i][j], T[i][j],  norm_acf[i][j],  raw_acf[i][j],  W[i][j], J[i][j], J2[i][j] = compute_mat_elt(X_re, i, j, params_re)
+                params1["filename"] = params["filename"]+"_re_"
             else:
-                freqs[i][j], T[i][j],  norm_acf[i][j],  raw_acf[i][j],  W[i][j], J[i][j], J2[i][j] = compute_mat_elt(X_im, i, j, params_im)
+                params1["filename"] = params["filename"]+"_im_"
+            params1["acf_filename"] = params1["filename"]+"_acf_"+str(i)+"_"+str(j)+".txt"
+            params1["spectrum_filename"] = params1["filename"]+"_acf_"+str(i)+"_"+str(j)+".txt"
+            params1["verbose"] = 0
+
+            if params1["do_output"]:
+                _write_spectra(params1["acf_filename"], params1["spectrum_filename"], 
+                               T[i][j], norm_acf[i][j], raw_acf[i][j], W[i][j], J[i][j], J2[i][j])
+
+            freqs[i][j] = _select_freqs(W[i][j], J[i][j], J2[i][j], params1)
 
     return freqs, T,  norm_acf,  raw_acf,  W,  J, J2
 
@@ -0,0 +1,387 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 2 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#*
+#*********************************************************************************/
+"""
+.. module:: local_scheduler
+   :platform: Unix
+   :synopsis: This module implements a simple task scheduler for running many independent
+       calculations (e.g. the electronic structure calculations for the snapshots of an MD
+       trajectory) concurrently on a single computer, without any batch system.
+
+       Every task is a shell command executed in its own scratch directory. At most `nworkers`
+       tasks run at the same time, and the number of threads of each task is limited, so the
+       computer is not oversubscribed. The status of all the tasks is kept in a JSON manifest
+       file, so an interrupted run can be restarted: the completed tasks are not repeated.
+       The failed tasks are retried a given number of times.
+
+       The post-processing actions depend on one or several tasks and are executed by the
+       scheduler (in the calling process) as soon as all these tasks are completed, while the
+       remaining tasks are still running - e.g. the overlaps of the adjacent snapshots i and i+1
+       are computed as soon as both snapshots are done.
+
+       List of classes:
+
+           * class task_pool
+
+       List of functions:
+
+           * n_workers(nworkers, threads_per_job, max_load=1.0)
+
+       Example of usage:
+
+           pool = task_pool("scratch", nworkers=4, threads_per_job=2)
+           for i in range(10):
+               pool.add_task(F"snap_{i}", F"pw.x < x0.scf.{i}.in > x0.scf.{i}.out", inputs=[F"x0.scf.{i}.in"])
+           for i in range(9):
+               pool.add_post(F"pair_{i}", [F"snap_{i}", F"snap_{i+1}"], lambda key, i=i: process(i, i+1))
+           pool.run()
+
+.. moduleauthor:: Alexey V. Akimov
+
+"""
+
+import os
+import json
+import time
+import shutil
+import signal
+import subprocess
+
+
+
+def n_workers(nworkers, threads_per_job, max_load=1.0):
+    """
+    Returns the number of the tasks to run concurrently, such that the total number of threads
+    does not exceed the number of CPUs available times `max_load`
+
+    Args:
+        nworkers ( int ): the requested number of concurrent tasks
+        threads_per_job ( int ): the number of threads used by each task
+        max_load ( double ): the maximal allowed ratio of the number of threads to the number of CPUs [ default: 1.0 ]
+
+    Returns:
+        int: the number of concurrent tasks, at least 1
+
+    """
+
+    if hasattr(os, "sched_getaffinity"):
+        ncpus = len(os.sched_getaffinity(0))
+    else:
+        ncpus = os.cpu_count() or 1
+
+    nmax = int( max_load * ncpus ) // max(1, threads_per_job)
+
+    return max(1, min(nworkers, nmax))
+
+
+
+class task_pool:
+    """
+    Runs a set of shell commands concurrently, each in its own scratch directory, and the
+    post-processing actions that depend on them
+
+    The manifest file has the format:
+
+        { "tasks": { key: { "status": "pending" | "done" | "failed", "attempts": int,
+                            "returncode": int, "time": double } },
+          "post": { key: "done" } }
+
+    """
+
+    def __init__(self, scratch_dir, manifest=None, nworkers=1, threads_per_job=1, max_load=1.0,
+                 max_retries=1, timeout=None, poll_interval=0.1, keep_scratch=True, verbosity=0):
+        """
+        Args:
+            scratch_dir ( string ): the directory where the directories of the tasks are created
+            manifest ( string ): the name of the manifest file, None - "<scratch_dir>/manifest.json" [ default: None ]
+            nworkers ( int ): the maximal number of the concurrent tasks, see `n_workers` [ default: 1 ]
+            threads_per_job ( int ): the number of threads of each task, set as OMP_NUM_THREADS, MKL_NUM_THREADS,
+                and OPENBLAS_NUM_THREADS in the environment of the tasks [ default: 1 ]
+            max_load ( double ): the maximal ratio of the total number of threads to the number of CPUs [ default: 1.0 ]
+            max_retries ( int ): how many times a failed task is restarted [ default: 1 ]
+            timeout ( double ): the maximal time of a task, after which it is killed (together with all the
+                processes it started) and counted as failed,
+                None - no limit [ units: s, default: None ]
+            poll_interval ( double ): the time between the checks of the running tasks [ units: s, default: 0.1 ]
+            keep_scratch ( Boolean ): if False, the directory of a task is removed once all the
+                post-processing actions depending on it are done [ default: True ]
+            verbosity ( int ): the level of the output [ default: 0 ]
+
+        """
+
+        self.scratch_dir = os.path.abspath(scratch_dir)
+        self.manifest = manifest
+        if self.manifest==None:
+            self.manifest = os.path.join(self.scratch_dir, "manifest.json")
+
+        self.nworkers = n_workers(nworkers, threads_per_job, max_load)
+        self.threads_per_job = threads_per_job
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.keep_scratch = keep_scratch
+        self.verbosity = verbosity
+
+        self.tasks = {}     # key: { "command", "inputs", "prepare", "check" }
+        self.order = []     # the keys of the tasks, in the order they are started
+        self.posts = {}     # key: ( deps, func )
+        self.post_order = []
+
+        self.status = { "tasks":{}, "post":{} }
+        if os.path.isfile(self.manifest):
+            f = open(self.manifest, "r")
+            self.status = json.load(f)
+            f.close()
+
+
+    def task_dir(self, key):
+        """
+        Returns the name of the scratch directory of the task `key`
+        """
+
+        return os.path.join(self.scratch_dir, key)
+
+
+    def add_task(self, key, command, inputs=[], prepare=None, check=None):
+        """
+        Adds a task
+
+        Args:
+            key ( string ): the unique name of the task, also the name of its scratch directory
+            command ( string ): the shell command, executed in the scratch directory of the task
+            inputs ( list of strings ): the files copied into the scratch directory before the task is started [ default: [] ]
+            prepare ( function ): if not None, `prepare(dirname)` is called to create the input files in the
+                scratch directory `dirname` before the task is started [ default: None ]
+            check ( function ): if not None, `check(dirname)` is called after the command returns 0; the task
+                is counted as failed unless it returns True [ default: None ]
+
+        """
+
+        if key not in self.tasks:
+            self.order.append(key)
+        self.tasks[key] = { "command":command, "inputs":[ os.path.abspath(x) for x in inputs ],
+                            "prepare":prepare, "check":check }
+
+        if key not in self.status["tasks"] or self.status["tasks"][key]["status"]!="done":
+            self.status["tasks"][key] = { "status":"pending", "attempts":0, "returncode":None, "time":0.0 }
+
+
+    def add_post(self, key, deps, func):
+        """
+        Adds a post-processing action
+
+        Args:
+            key ( string ): the unique name of the action
+            deps ( list of strings ): the keys of the tasks the action depends on
+            func ( function ): the action, called as `func(key)` once all the tasks `deps` are done
+
+        """
+
+        if key not in self.posts:
+            self.post_order.append(key)
+        self.posts[key] = ( list(deps), func )
+
+
+    def save_manifest(self):
+        """
+        Writes the manifest file. The file is replaced atomically, so it is never left incomplete
+        """
+
+        tmp = self.manifest + ".tmp"
+        f = open(tmp, "w")
+        json.dump(self.status, f, indent=1)
+        f.close()
+        os.replace(tmp, self.manifest)
+
+
+    def done(self, key):
+        """
+        Returns True if the task `key` is completed successfully
+        """
+
+        return self.status["tasks"][key]["status"]=="done"
+
+
+    def failed(self):
+        """
+        Returns the list of the keys of the tasks that failed after all the retries
+        """
+
+        return [ key for key in self.order if self.status["tasks"][key]["status"]=="failed" ]
+
+
+    def _environment(self):
+
+        env = dict(os.environ)
+        for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+            env[var] = str(self.threads_per_job)
+
+        return env
+
+
+    def _start(self, key, env):
+
+        task = self.tasks[key]
+        dirname = self.task_dir(key)
+
+        # Every attempt starts from a clean directory
+        if os.path.isdir(dirname):
+            shutil.rmtree(dirname)
+        os.makedirs(dirname)
+
+        for filename in task["inputs"]:
+            shutil.copy(filename, dirname)
+        if task["prepare"]!=None:
+            task["prepare"](dirname)
+
+        # The task runs in its own process group (session), so the programs started by the shell
+        # can be killed together with it, see `run`
+        log = open(os.path.join(dirname, "task.log"), "w")
+        proc = subprocess.Popen(task["command"], shell=True, cwd=dirname, env=env,
+                                stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+        self.status["tasks"][key]["attempts"] += 1
+
+        if self.verbosity>0:
+            print(F"Started task {key}, attempt {self.status['tasks'][key]['attempts']}")
+
+        return proc, log, time.time()
+
+
+    def _kill(self, proc):
+
+        # Kill the whole process group: the shell and all the programs it started
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+        return proc.wait()
+
+
+    def _finish(self, key, returncode, t):
+
+        task = self.tasks[key]
+        st = self.status["tasks"][key]
+
+        ok = returncode==0
+        if ok and task["check"]!=None:
+            ok = bool( task["check"](self.task_dir(key)) )
+
+        st["returncode"] = returncode
+        st["time"] = t
+
+        if ok:
+            st["status"] = "done"
+        elif st["attempts"] > self.max_retries:
+            st["status"] = "failed"
+        else:
+            st["status"] = "pending"
+
+        if self.verbosity>0:
+            print(F"Finished task {key} with the return code {returncode}, status: {st['status']}")
+
+        return st["status"]=="pending"
+
+
+    def _run_posts(self):
+
+        for key in self.post_order:
+            if self.status["post"].get(key)=="done":
+                continue
+
+            deps, func = self.posts[key]
+            if all( [ self.done(dep) for dep in deps ] ):
+                if self.verbosity>0:
+                    print(F"Running the post-processing {key}")
+                func(key)
+                self.status["post"][key] = "done"
+                self.save_manifest()
+
+        if self.keep_scratch:
+            return
+
+        # Remove the directories no longer needed by any post-processing action
+        for key in self.order:
+            dirname = self.task_dir(key)
+            if not self.done(key) or not os.path.isdir(dirname):
+                continue
+
+            needed = [ k for k in self.post_order if key in self.posts[k][0] and self.status["post"].get(k)!="done" ]
+            if len(needed)==0:
+                shutil.rmtree(dirname)
+
+
+    def run(self):
+        """
+        Runs all the pending tasks and the post-processing actions, and returns when they are finished
+
+        Returns:
+            list of strings: the keys of the tasks that failed after all the retries
+
+        """
+
+        if not os.path.isdir(self.scratch_dir):
+            os.makedirs(self.scratch_dir)
+
+        env = self._environment()
+        queue = [ key for key in self.order if not self.done(key) ]
+        running = {}    # key: ( process, log, start time )
+
+        # The actions whose tasks were completed by a previous run
+        self._run_posts()
+
+        # The tasks run in their own sessions, so they do not get the SIGINT of the terminal: if the loop
+        # is interrupted (Ctrl-C, or an exception in a post-processing action), the running tasks are killed
+        # here, and they stay pending in the manifest, to be repeated by the next run
+        try:
+            while len(queue)>0 or len(running)>0:
+
+                while len(queue)>0 and len(running)<self.nworkers:
+                    key = queue.pop(0)
+                    running[key] = self._start(key, env)
+                self.save_manifest()
+
+                time.sleep(self.poll_interval)
+
+                for key in list(running.keys()):
+                    proc, log, t0 = running[key]
+                    returncode = proc.poll()
+
+                    if returncode==None and self.timeout!=None and time.time() - t0 > self.timeout:
+                        returncode = self._kill(proc)
+
+                    if returncode==None:
+                        continue
+
+                    log.close()
+                    del running[key]
+
+                    if self._finish(key, returncode, time.time() - t0):
+                        queue.append(key)
+
+                self.save_manifest()
+                self._run_posts()
+
+        finally:
+            for key in list(running.keys()):
+                proc, log, t0 = running.pop(key)
+                self._kill(proc)
+                log.close()
+                if self.verbosity>0:
+                    print(F"Killed the interrupted task {key}")
+            self.save_manifest()
+
+        failed = self.failed()
+        if len(failed)>0:
+            print(F"Warning: the following tasks failed: {failed}")
+
+        return failed
+
@@ -20,6 +20,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -27,6 +28,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 import util.libutil as comn
 import libra_py.units as units
+import libra_py.models.batched as batched
 
 
 class tmp:
@@ -476,3 +478,156 @@ def Holstein5(q, params, full_id):
     obj.dc1_dia = dc1_dia
 
     return obj
+
+
+
+def Holstein_batch(q, E_n, x_n, k_n, V, alpha=None, x_nm=None):
+    """
+    The common vectorized part of the `Holstein2_batch` - `Holstein5_batch` functions: 
+    the n-state model for all trajectories at once
+
+    H_nn = E_n + 0.5*k*(x-x_n)^2
+    H_n,m = V_n,m * exp(- alp_n,m * (x-x_nm)^2 )
+
+    Args:
+        q ( np.array of shape (nnucl, ntraj) ): coordinates of all trajectories, only the first DOF is used
+        E_n, x_n, k_n ( lists of n doubles ): see `Holstein5`
+        V ( np.array of shape (n, n) ): couplings, the diagonal elements are ignored
+        alpha, x_nm ( np.array of shape (n, n) ): see `Holstein5` [ default: zeros ]
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    nnucl, ntraj = q.shape
+    n = len(E_n)
+
+    E_n, x_n, k_n = np.array(E_n), np.array(x_n), np.array(k_n)
+    # The parameters may be given for more states than used, as the 4x4 defaults of `Holstein4` and `Holstein5`
+    V = np.array(V, dtype=float)[:n, :n] * (1.0 - np.identity(n))
+    alpha = np.zeros((n,n)) if alpha is None else np.array(alpha, dtype=float)[:n, :n]
+    x_nm = np.zeros((n,n)) if x_nm is None else np.array(x_nm, dtype=float)[:n, :n]
+
+    obj = batched.init_batch_obj(ntraj, nnucl, n)
+
+    x = q[0, :]
+    dx = x[:, None] - x_n[None, :]     # ntraj x n
+    dx_nm = x[:, None, None] - x_nm[None, :, :]     # ntraj x n x n
+    coup = V[None, :, :] * np.exp(-alpha[None, :, :] * dx_nm**2 )
+
+    idx = np.arange(n)
+
+    obj.ham_dia[:] = coup
+    obj.ham_dia[:, idx, idx] = E_n[None, :] + 0.5 * k_n[None, :] * dx**2
+
+    obj.d1ham_dia[:, 0] = -2.0 * alpha[None, :, :] * dx_nm * coup
+    obj.d1ham_dia[:, 0, idx, idx] = k_n[None, :] * dx
+
+    return obj
+
+
+
+def Holstein2_batch(q, params):
+    """
+    Vectorized version of `Holstein2` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (nnucl, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `Holstein2`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = ["E_n", "x_n", "k_n" ]
+    default_params = { "V":0.001 }
+    comn.check_input(params, default_params, critical_params)
+
+    n = len(params["E_n"])
+    V = np.zeros((n,n))
+    for i in range(n-1):
+        V[i,i+1] = V[i+1,i] = params["V"]
+
+    return Holstein_batch(q, params["E_n"], params["x_n"], params["k_n"], V)
+
+
+
+def Holstein3_batch(q, params):
+    """
+    Vectorized version of `Holstein3` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (nnucl, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `Holstein3`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = ["E_n", "x_n", "k_n", "V_n" ]
+    default_params = {"E_n":[0.0, 0.001, 0.001, 0.001], "x_n":[0.0, 1.0, 1.0, 1.0], "k_n":[0.001, 0.001, 0.001, 0.001], "V_n":[0.001, 0, 0] }
+    comn.check_input(params, default_params, critical_params)
+
+    n = len(params["E_n"])
+    V_n = params["V_n"]
+    V = np.zeros((n,n))
+    for i in range(n):
+        for k in range(n):
+            if k != i:
+                V[i,k] = V_n[abs(i-k)-1]
+
+    return Holstein_batch(q, params["E_n"], params["x_n"], params["k_n"], V)
+
+
+
+def Holstein4_batch(q, params):
+    """
+    Vectorized version of `Holstein4` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (nnucl, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `Holstein4`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = ["E_n", "x_n", "k_n" ]
+    default_params = { "V": [ [0.001, 0.001, 0.001, 0.001], [0.001, 0.001, 0.001, 0.001],
+                              [0.001, 0.001, 0.001, 0.001], [0.001, 0.001, 0.001, 0.001] ]
+                     }
+    comn.check_input(params, default_params, critical_params)
+
+    return Holstein_batch(q, params["E_n"], params["x_n"], params["k_n"], params["V"])
+
+
+
+def Holstein5_batch(q, params):
+    """
+    Vectorized version of `Holstein5` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (nnucl, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `Holstein5`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = ["E_n", "x_n", "k_n" ]
+    default_params = { "V": [ [0.001, 0.001, 0.001, 0.001], [0.001, 0.001, 0.001, 0.001],
+                              [0.001, 0.001, 0.001, 0.001], [0.001, 0.001, 0.001, 0.001] ],
+                       "alpha": [ [0.00, 0.00, 0.00, 0.00], [0.00, 0.00, 0.00, 0.00],
+                                  [0.00, 0.00, 0.00, 0.00], [0.00, 0.00, 0.00, 0.00] ],
+                       "x_nm": [ [0.00, 0.00, 0.00, 0.00], [0.00, 0.00, 0.00, 0.00],
+                                 [0.00, 0.00, 0.00, 0.00], [0.00, 0.00, 0.00, 0.00] ],
+                     }
+    comn.check_input(params, default_params, critical_params)
+
+    return Holstein_batch(q, params["E_n"], params["x_n"], params["k_n"], params["V"], params["alpha"], params["x_nm"])
+
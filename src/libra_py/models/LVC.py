@@ -19,6 +19,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -26,6 +27,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 import util.libutil as comn
 import libra_py.units as units
+import libra_py.models.batched as batched
 
 
 class tmp:
@@ -516,3 +518,54 @@ def get_LVC_set3():
 
     return params
 
+
+
+def LVC_batch(q, params):
+    """
+    Vectorized version of `LVC` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (ndof, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `LVC`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    Note: the derivatives of the diagonal el-ph coupling of the upper state and of the off-diagonal 
+        coupling are added to the elements (1,1) and (0,1), (1,0) of `d1ham_dia`, respectively, as 
+        follows from the Hamiltonian
+
+    """
+
+    critical_params = [ "omega", "d1", "d2", "coup", "mass", "Delta1", "Delta2" ] 
+    default_params = { }
+    comn.check_input(params, default_params, critical_params)
+
+    ndof, ntraj = q.shape
+
+    w = np.array(params["omega"])[:ndof]
+    d1 = np.array(params["d1"])[:ndof]
+    d2 = np.array(params["d2"])[:ndof]
+    c = np.array(params["coup"])[:ndof]
+    m = np.array(params["mass"])[:ndof]
+    sm = np.sqrt(m)
+
+    obj = batched.init_batch_obj(ntraj, ndof, 2)
+
+    # Diagonal bath
+    kq = (m*w*w)[:, None] * q    # ndof x ntraj
+    bath = 0.5 * np.sum( kq * q, axis=0 )
+
+    # El-ph couplings
+    x = sm[:, None] * q
+
+    obj.ham_dia[:, 0, 0] = params["Delta1"] + bath + np.dot(d1, x)
+    obj.ham_dia[:, 1, 1] = params["Delta2"] + bath + np.dot(d2, x)
+    obj.ham_dia[:, 0, 1] = obj.ham_dia[:, 1, 0] = np.dot(c, x)
+
+    obj.d1ham_dia[:, :, 0, 0] = kq.T + (sm*d1)[None, :]
+    obj.d1ham_dia[:, :, 1, 1] = kq.T + (sm*d2)[None, :]
+    obj.d1ham_dia[:, :, 0, 1] = obj.d1ham_dia[:, :, 1, 0] = (sm*c)[None, :]
+
+    return obj
+
@@ -21,6 +21,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -28,6 +29,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 import util.libutil as comn
 import libra_py.units as units
+import libra_py.models.batched as batched
 
 
 class tmp:
@@ -1002,3 +1004,229 @@ def model7(q, params):
     return obj
 
 
+
+
+
+def _two_level_batch(q, h0, h1, dh0, dh1, V):
+    """
+    Common part of the vectorized 2-level 1D models: 
+
+    Hdia = [ h0(x)  V  ]         d1ham_dia = [ dh0/dx   0    ]
+           [  V   h1(x)]                     [   0    dh1/dx ]
+
+    h0, h1, dh0, dh1 are the np.arrays of ntraj values, Sdia = I, Ddia = 0
+    """
+
+    nnucl, ntraj = q.shape
+    obj = batched.init_batch_obj(ntraj, nnucl, 2)
+
+    obj.ham_dia[:, 0, 0] = h0;   obj.ham_dia[:, 0, 1] = V
+    obj.ham_dia[:, 1, 0] = V;    obj.ham_dia[:, 1, 1] = h1
+
+    obj.d1ham_dia[:, 0, 0, 0] = dh0
+    obj.d1ham_dia[:, 0, 1, 1] = dh1
+
+    return obj
+
+
+
+def model1_batch(q, params):
+    """
+    Vectorized version of `model1` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (1, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `model1`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = [ ] 
+    default_params = {"x0":1.0, "k":0.01, "D":0.0, "V":0.005 }
+    comn.check_input(params, default_params, critical_params)
+
+    x0,k,D,V = params["x0"], params["k"], params["D"], params["V"]
+    x = q[0, :]
+
+    return _two_level_batch(q, k*x*x, k*(x-x0)**2 + D, 2.0*k*x, 2.0*k*(x-x0), V)
+
+
+
+def model2_batch(q, params):
+    """
+    Vectorized version of `model2` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (1, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `model2`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = [ ] 
+    default_params = {"x0":1.0, "k":0.01, "D":0.0, "V":0.005, "NAC":-0.1 }
+    comn.check_input(params, default_params, critical_params)
+
+    x0,k,D,V, nac = params["x0"], params["k"], params["D"], params["V"], params["NAC"]
+    x = q[0, :]
+
+    obj = _two_level_batch(q, k*x*x, k*(x-x0)**2 + D, 2.0*k*x, 2.0*k*(x-x0), V)
+    obj.dc1_dia[:, 0, 0, 1] =  nac
+    obj.dc1_dia[:, 0, 1, 0] = -nac
+
+    return obj
+
+
+
+def model3_batch(q, params):
+    """
+    Vectorized version of `model3` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (1, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `model3`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = [ ] 
+    default_params = {"x0":1.0, "k":0.01, "D":0.0, "V":0.005, "B":0.05 }
+    comn.check_input(params, default_params, critical_params)
+
+    x0,k,D,V,B = params["x0"], params["k"], params["D"], params["V"], params["B"]
+    x = q[0, :]
+
+    obj = _two_level_batch(q, k*x*x, k*(x-x0)**2 + D, 2.0*k*x, 2.0*k*(x-x0), V)
+
+    ex = B*np.exp(-(x-0.5*x0)**2)
+    d = -(x-0.5*x0)*ex
+
+    obj.ovlp_dia[:, 0, 1] = obj.ovlp_dia[:, 1, 0] = ex
+    obj.dc1_dia[:, 0, 0, 1] = obj.dc1_dia[:, 0, 1, 0] = d
+
+    return obj
+
+
+
+def model4_batch(q, params):
+    """
+    Vectorized version of `model4` - computes the Hamiltonians for all trajectories at once. 
+    The gap `D` is added to the second diabatic state, as in `model4a`
+
+    Args:
+        q ( np.array of shape (1, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `model4`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = [ ] 
+    default_params = {"k":0.01, "D":0.0, "V":0.005, "w":0.1 }
+    comn.check_input(params, default_params, critical_params)
+
+    k,D,V,w = params["k"], params["D"], params["V"], params["w"]
+    x = q[0, :]
+
+    return _two_level_batch(q, k*np.cos(x*w), k*np.sin(x*w) + D, -w*k*np.sin(x*w), w*k*np.cos(x*w), V)
+
+
+
+def model5_batch(q, params):
+    """
+    Vectorized version of `model5` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (2, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `model5`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    nnucl, ntraj = q.shape
+    obj = batched.init_batch_obj(ntraj, nnucl, 1)
+
+    x, y = q[0, :], q[1, :]
+    x2, y2 = x*x, y*y
+
+    obj.ham_dia[:, 0, 0] = 0.25*(x2*x2 + y2*y2) - 0.5*(x2 + y2)
+    obj.d1ham_dia[:, 0, 0, 0] = x*(x2 - 1.0)
+    obj.d1ham_dia[:, 1, 0, 0] = y*(y2 - 1.0)
+
+    return obj
+
+
+
+def model6_batch(q, params):
+    """
+    Vectorized version of `model6` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (1, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `model6`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = [ ] 
+    default_params = {"A0":0.01, "w0":0.1, "delta0":0.0, "B0":0.0,
+                      "A1":0.01, "w1":0.1, "delta1":0.0, "B1":0.0,
+                      "V01":0.005  }
+    comn.check_input(params, default_params, critical_params)
+
+    A0, A1 = params["A0"], params["A1"]
+    B0, B1 = params["B0"], params["B1"]
+    w0, w1 = params["w0"], params["w1"]
+    delta0, delta1 = params["delta0"], params["delta1"]
+    x = q[0, :]
+
+    return _two_level_batch(q, A0*np.cos(w0*x+delta0) + B0, A1*np.cos(w1*x+delta1) + B1, 
+                            -w0*A0*np.sin(w0*x+delta0), -w1*A1*np.sin(w1*x+delta1), params["V01"])
+
+
+
+def model7_batch(q, params):
+    """
+    Vectorized version of `model7` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (1, ntraj) ): coordinates of all trajectories
+        params ( dictionary ): model parameters, same as in `model7`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = [ ] 
+    default_params = {"A0":0.01, "w0":0.1, "delta0":0.0, "B0":0.0,
+                      "A1":0.01, "w1":0.1, "delta1":0.0, "B1":0.0,
+                      "A2":0.01, "w2":0.1, "delta2":0.0, "B2":0.0,
+                      "V01":0.005,  "V02":0.005, "V12":0.005  }
+    comn.check_input(params, default_params, critical_params)
+
+    nnucl, ntraj = q.shape
+    obj = batched.init_batch_obj(ntraj, nnucl, 3)
+
+    x = q[0, :]
+    for i in range(3):
+        A, B, w, delta = params[F"A{i}"], params[F"B{i}"], params[F"w{i}"], params[F"delta{i}"]
+        obj.ham_dia[:, i, i] = A*np.cos(w*x+delta) + B
+        obj.d1ham_dia[:, 0, i, i] = -w*A*np.sin(w*x+delta)
+
+    for (i, j) in [(0,1), (0,2), (1,2)]:
+        obj.ham_dia[:, i, j] = obj.ham_dia[:, j, i] = params[F"V{i}{j}"]
+
+    return obj
+
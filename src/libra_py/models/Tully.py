@@ -18,6 +18,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -25,6 +26,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 import util.libutil as comn
 import libra_py.units as units
+import libra_py.models.batched as batched
 
 
 class tmp:
@@ -431,3 +433,62 @@ def chain_potential(q, params, full_id):
     
     return obj
 
+
+
+def chain_potential_batch(q, params):
+    """
+    Vectorized version of `chain_potential` - computes the Hamiltonians for all trajectories at once
+
+    Args:
+        q ( np.array of shape (ndof, ntraj) ): coordinates of all trajectories, ndof >= 2
+        params ( dictionary ): model parameters, same as in `chain_potential`
+
+    Returns:
+        PyObject: the object with the stacked diabatic properties, see `libra_py.models.batched`
+
+    """
+
+    critical_params = ["E_n", "x_n", "k_n" ]
+    default_params = { "V": [ [0.001, 0.001, 0.001, 0.001], [0.001, 0.001, 0.001, 0.001],
+                              [0.001, 0.001, 0.001, 0.001], [0.001, 0.001, 0.001, 0.001] ],
+                       "a":0.25, "U0":0.06665
+                     }
+    comn.check_input(params, default_params, critical_params)
+
+    E_n = np.array(params["E_n"])
+    x_n = np.array(params["x_n"])
+    k_n = np.array(params["k_n"])
+    nstates = len(E_n)
+    V = np.array(params["V"], dtype=float)[:nstates, :nstates] * (1.0 - np.identity(nstates))
+
+    a  = params["a"]
+    U0 = params["U0"]
+    a2 =  U0*a**2
+    a3 = -U0*a**3
+    a4 = 0.58*U0*a**4
+
+    ndof, ntraj = q.shape
+    obj = batched.init_batch_obj(ntraj, ndof, nstates)
+    idx = np.arange(nstates)
+
+    #========= Classical (bath) contributions =========    
+    d = (q[:-1, :] - q[1:, :]).T      # ntraj x (ndof-1)
+    H_bath = np.sum( a2*d**2 + a3*d**3 + a4*d**4, axis=1 )
+    dH_bath = 2.0*a2*d + 3.0*a3*d**2 + 4.0*a4*d**3
+
+    g = np.zeros( (ntraj, ndof) )
+    g[:, :-1] += dH_bath
+    g[:, 1:] -= dH_bath
+
+    #========== Quantum system ==================    
+    x = q[0, :]
+    dx = x[:, None] - x_n[None, :]
+
+    obj.ham_dia[:] = V
+    obj.ham_dia[:, idx, idx] = H_bath[:, None] + E_n[None, :] + 0.5*k_n[None, :]*dx**2
+
+    obj.d1ham_dia[:, :, idx, idx] = g[:, :, None]
+    obj.d1ham_dia[:, 0, idx, idx] += k_n[None, :] * dx
+
+    return obj
+
@@ -7,7 +7,8 @@
 # * http://www.gnu.org/copyleft/gpl.txt
 #***********************************************************/
 
-__all__ = ["Beswick_Jortner",
+__all__ = ["batched",
+           "Beswick_Jortner",
            "Faist_Levine",
            "Henon_Heiles",
            "Holstein",
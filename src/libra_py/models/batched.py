@@ -0,0 +1,174 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 2 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#***********************************************************************************
+"""
+.. module:: models_batched
+   :platform: Unix, Windows
+   :synopsis: This module implements the batched model Hamiltonians interface: the model function
+       is called once for all trajectories and returns the stacked diabatic properties as numpy arrays
+
+       A batched model function has the signature:
+
+           obj = compute_model_batch(q, params)
+
+       where:
+
+           * q ( np.array of shape (nnucl, ntraj) ): coordinates of all trajectories
+           * params ( dictionary ): model parameters
+
+       and the returned object contains the members (all but `ham_dia` are optional):
+
+           * obj.ham_dia ( np.array of shape (ntraj, ndia, ndia) ): diabatic Hamiltonians
+           * obj.ovlp_dia ( np.array of shape (ntraj, ndia, ndia) ): overlaps of the diabatic states
+           * obj.d1ham_dia ( np.array of shape (ntraj, nnucl, ndia, ndia) ): derivatives of the diabatic Hamiltonians
+           * obj.dc1_dia ( np.array of shape (ntraj, nnucl, ndia, ndia) ): derivative couplings in the diabatic basis
+           * obj.nac_dia ( np.array of shape (ntraj, ndia, ndia) ): nonadiabatic couplings in the diabatic basis
+           * obj.hvib_dia ( np.array of shape (ntraj, ndia, ndia) ): vibronic Hamiltonians in the diabatic basis
+
+       To use it with the dynamics, wrap it into the `batched_model` object, which can be used as a regular
+       `compute_model` function. Note that the dynamics drivers still request the Hamiltonian of every trajectory
+       separately, so the per-trajectory Python call and the conversion of its results to CMATRIX objects remain;
+       only the evaluation of the model itself is done once for all trajectories:
+
+           compute_model = batched_model( Holstein.Holstein2_batch )
+           res = tsh_dynamics.run_dynamics(q, p, iM, Cdia, Cadi, projectors, states, dyn_params, compute_model, model_params, rnd)
+
+.. moduleauthor:: Alexey V. Akimov
+
+"""
+
+import sys
+import numpy as np
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+import libra_py.data_conv as data_conv
+
+
+class tmp:
+    pass
+
+
+
+def init_batch_obj(ntraj, nnucl, nstates):
+    """
+    Creates the object to be returned by a batched model function
+
+    Args:
+        ntraj ( int ): the number of trajectories
+        nnucl ( int ): the number of nuclear DOFs
+        nstates ( int ): the number of diabatic states
+
+    Returns:
+        PyObject: obj, with the members `ham_dia`, `d1ham_dia`, `dc1_dia` initialized to zeros and
+            `ovlp_dia` initialized to identity matrices, see the module description for their shapes
+
+    """
+
+    obj = tmp()
+    obj.ham_dia = np.zeros( (ntraj, nstates, nstates), dtype=complex )
+    obj.ovlp_dia = np.zeros( (ntraj, nstates, nstates), dtype=complex )
+    obj.ovlp_dia[:] = np.identity(nstates)
+    obj.d1ham_dia = np.zeros( (ntraj, nnucl, nstates, nstates), dtype=complex )
+    obj.dc1_dia = np.zeros( (ntraj, nnucl, nstates, nstates), dtype=complex )
+
+    return obj
+
+
+
+def get_trajectory_obj(res, itraj):
+    """
+    Extracts the properties of a given trajectory from the results of a batched model function,
+    in the format returned by the regular (one trajectory at a time) model functions
+
+    Args:
+        res ( PyObject ): the object returned by a batched model function
+        itraj ( int ): the index of the trajectory
+
+    Returns:
+        PyObject: obj, with the members `ham_dia`, `ovlp_dia`, `nac_dia`, `hvib_dia` ( CMATRIX(ndia, ndia) )
+            and `d1ham_dia`, `dc1_dia` ( CMATRIXList of nnucl CMATRIX(ndia, ndia) ) - only those available in `res`
+
+    """
+
+    obj = tmp()
+
+    for name in ["ham_dia", "ovlp_dia", "nac_dia", "hvib_dia"]:
+        if hasattr(res, name):
+            setattr(obj, name, data_conv.nparray2CMATRIX( getattr(res, name)[itraj] ) )
+
+    for name in ["d1ham_dia", "dc1_dia"]:
+        if hasattr(res, name):
+            x = getattr(res, name)[itraj]
+            lst = CMATRIXList()
+            for k in range(x.shape[0]):
+                lst.append( data_conv.nparray2CMATRIX( x[k] ) )
+            setattr(obj, name, lst)
+
+    return obj
+
+
+
+class batched_model:
+    """
+    Makes a batched model function (see the module description) usable as a regular `compute_model`
+    function of the dynamics drivers, with the signature `compute_model(q, params, full_id)`
+
+    The batched function is called for all trajectories whenever the coordinates of the requested trajectory
+    (or the model parameters object) differ from those used in the last batched call; otherwise, the
+    precomputed results are returned. So when the Hamiltonians of all the trajectories are updated for
+    the same q, the model is evaluated once per update. Since the properties of each trajectory depend only
+    on its own coordinates, comparing only the column of the requested trajectory is enough to never return
+    the stale results, even if only some of the trajectories are updated, and it keeps the cost of every
+    call independent of the number of trajectories
+
+    The object is still called by the dynamics once per trajectory, and each call converts the results
+    of that trajectory into CMATRIX objects, see `get_trajectory_obj`
+
+    """
+
+    def __init__(self, compute_model_batch):
+        """
+        Args:
+            compute_model_batch ( PyObject ): the batched model function
+
+        """
+
+        self.compute_model_batch = compute_model_batch
+        self.q = None
+        self.params = None
+        self.res = None
+
+
+    def __call__(self, q, params, full_id):
+        """
+        Args:
+            q ( MATRIX(nnucl, ntraj) ): coordinates of all trajectories
+            params ( dictionary ): model parameters
+            full_id ( intList ): the full id of the Hamiltonian to compute, the last index is the trajectory
+
+        Returns:
+            PyObject: the properties of the trajectory `full_id[-1]`, see `get_trajectory_obj`
+
+        """
+
+        Id = Cpp2Py(full_id)
+        indx = Id[-1]
+
+        x = data_conv.nparray_view(q)
+
+        if self.res is None or params is not self.params or self.q.shape != x.shape or not np.array_equal(self.q[:, indx], x[:, indx]):
+            self.q = np.array(x)
+            self.params = params
+            self.res = self.compute_model_batch(self.q, params)
+
+        return get_trajectory_obj(self.res, indx)
+
@@ -0,0 +1,244 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 2 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#***********************************************************************************
+"""
+.. module:: profiling
+   :platform: Unix, Windows
+   :synopsis: This module implements a lightweight instrumentation of the dynamics drivers:
+       the wall-clock time and the number of calls of each phase of the calculations, the
+       amount of data kept by each saver, and the peak memory of the process
+
+       List of classes:
+
+           * class profiler
+
+       List of functions:
+
+           * saver_nbytes(saver)
+           * peak_memory()
+
+       Example of usage:
+
+           prof = profiler(1)
+
+           for step in range(nsteps):
+               prof.start("propagation")
+               ...
+               prof.stop("propagation")
+               prof.end_step()
+
+           prof.add_saver("hdf5_saver", saver)
+           prof.write_summary("out/timing.txt")
+
+.. moduleauthor:: Alexey V. Akimov
+
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import h5py
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+def saver_nbytes(saver):
+    """
+    Returns the amount of data kept by a saver object
+
+    Args:
+        saver ( mem_saver, hdf5_saver, or hdf5_buffered_saver ): the saver object
+
+    Returns:
+        int: the total size of the numpy arrays of the `mem_saver`, or the size of the file
+            of the HDF5 savers [ bytes ], or 0 if the saver is None
+
+    """
+
+    if saver==None:
+        return 0
+
+    if hasattr(saver, "np_data"):
+        return int(sum( [ x.nbytes for x in saver.np_data.values() ] ))
+
+    if hasattr(saver, "filename") and os.path.isfile(saver.filename):
+        return os.path.getsize(saver.filename)
+
+    return 0
+
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of the current process [ bytes ], or 0 if it can not be determined
+
+    """
+
+    if resource==None:
+        return 0
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on MacOS
+    if sys.platform=="darwin":
+        return int(maxrss)
+    return int(maxrss) * 1024
+
+
+
+class profiler:
+    """
+    Accumulates the timings of the named phases of a calculation
+
+    The profiling level is:
+
+        - 0: nothing is measured, all the methods return immediately
+        - 1: the total time and the number of calls of each phase
+        - 2: in addition, the time of each phase at every step (see `end_step`)
+
+    """
+
+    def __init__(self, level=1):
+        """
+        Args:
+            level ( int ): the profiling level, see the class description [ default: 1 ]
+
+        """
+
+        self.level = level
+        self.totals = {}
+        self.counts = {}
+        self.steps = {}
+        self.nsteps = 0
+        self.nbytes = {}
+
+        self._t0 = {}
+        self._step = {}
+        self._t_init = time.perf_counter()
+
+
+    def start(self, name):
+        """
+        Starts the timer of the phase `name`
+        """
+
+        if self.level<=0:
+            return
+
+        self._t0[name] = time.perf_counter()
+
+
+    def stop(self, name):
+        """
+        Stops the timer of the phase `name` and adds the elapsed time to its total
+        """
+
+        if self.level<=0:
+            return
+
+        dt = time.perf_counter() - self._t0.pop(name)
+
+        self.totals[name] = self.totals.get(name, 0.0) + dt
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+        if self.level>=2:
+            self._step[name] = self._step.get(name, 0.0) + dt
+
+
+    def end_step(self):
+        """
+        Records the times of all phases measured since the previous call (profiling level 2 only)
+        """
+
+        if self.level<2:
+            return
+
+        for name in self._step:
+            if name not in self.steps:
+                self.steps[name] = [0.0] * self.nsteps
+
+        for name in self.steps:
+            self.steps[name].append( self._step.get(name, 0.0) )
+
+        self._step = {}
+        self.nsteps += 1
+
+
+    def add_saver(self, name, saver):
+        """
+        Records the amount of data kept by the saver `name`, see `saver_nbytes`
+        """
+
+        if self.level<=0 or saver==None:
+            return
+
+        self.nbytes[name] = saver_nbytes(saver)
+
+
+    def summary(self):
+        """
+        Returns:
+            string: the timing report - the total time, number of calls, average time per call, and the
+                fraction of the total run time for each phase, the data sizes of the savers, and the peak memory
+
+        """
+
+        t_tot = time.perf_counter() - self._t_init
+
+        res = F"Total time = {t_tot:.3f} s\n\n"
+        res = res + F"{'phase':<24s} {'time, s':>12s} {'calls':>10s} {'ms/call':>12s} {'%':>8s}\n"
+        for name in sorted(self.totals, key=lambda x: -self.totals[x]):
+            t, n = self.totals[name], self.counts[name]
+            res = res + F"{name:<24s} {t:12.3f} {n:10d} {1000.0*t/n:12.4f} {100.0*t/max(t_tot, 1e-12):8.2f}\n"
+
+        if len(self.nbytes)>0:
+            res = res + F"\n{'saver':<24s} {'size, MB':>12s}\n"
+            for name, nb in self.nbytes.items():
+                res = res + F"{name:<24s} {nb/1024.0**2:12.3f}\n"
+
+        res = res + F"\nPeak memory = {peak_memory()/1024.0**2:.1f} MB\n"
+
+        return res
+
+
+    def write_summary(self, filename):
+        """
+        Writes the timing report (see `summary`) into the text file `filename`
+        """
+
+        if self.level<=0:
+            return
+
+        f = open(filename, "w")
+        f.write( self.summary() )
+        f.close()
+
+
+    def save_step_timings(self, filename):
+        """
+        Writes the per-step timings of all phases into the HDF5 file `filename` (appended, if the file exists)
+        as the datasets "timings/<phase>/data" of shape (nsteps,) [ units: s ]. Profiling level 2 only
+
+        """
+
+        if self.level<2:
+            return
+
+        with h5py.File(filename, "a") as f:
+            for name, data in self.steps.items():
+                key = F"timings/{name}/data"
+                if key in f:
+                    del f[key]
+                f.create_dataset(key, data=np.array(data))
+
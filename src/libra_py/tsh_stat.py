@@ -32,6 +32,7 @@ import os
 import sys
 import math
 import copy
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -42,6 +43,75 @@ import util.libutil as comn
 
 from . import units
 from . import probabilities
+from . import data_conv
+
+
+def compute_ekin(p, iM):
+    """Computes the kinetic energies of all trajectories
+
+    Args: 
+        p ( MATRIX(ndof, ntraj) ): nuclear momenta of multiple trajectories
+        iM ( MATRIX(ndof, 1) ): inverse masses for all nuclear DOFs
+
+    Returns: 
+        np.array of `ntraj` doubles: the kinetic energy of each trajectory
+
+    """
+
+    p_ = data_conv.nparray_view(p)
+    iM_ = data_conv.nparray_view(iM)
+
+    return 0.5 * np.sum(iM_ * p_**2, axis=0)
+
+
+
+def get_children_matrices(ham, name, ntraj):
+    """Collects the matrices of a given type from all the children Hamiltonians
+
+    Args: 
+        ham ( nHamiltonian ): object that handles Hamiltonian-related calculations with many trajectories
+        name ( string ): the type of the matrix, e.g. "ham_adi", "ham_dia", "ovlp_dia", "basis_transform",
+            such that the `ham.get_<name>` function exists
+        ntraj ( int ): the number of the children Hamiltonians (trajectories)
+
+    Returns: 
+        3D np.array of shape ( ntraj, n, m ): the matrices for all trajectories
+
+    Note:
+        For "basis_transform", "time_overlap_adi", "hvib_adi", and "hvib_dia" all the matrices are 
+        collected by a single call of `ham.get_<name>_children`, without a loop over trajectories
+
+    """
+
+    if hasattr(ham, F"get_{name}_children"):
+        x = data_conv.nparray_view( getattr(ham, F"get_{name}_children")() )
+        return x.reshape(ntraj, x.shape[0] // ntraj, x.shape[1])
+
+    getter = getattr(ham, F"get_{name}")
+
+    return data_conv.matrices2nparray( [ getter(Py2Cpp_int([0, traj])) for traj in range(ntraj) ] )
+
+
+
+def _energy_statistics(ekin, epot, tsh):
+    """Ensemble averages and standard deviations of the energies computed by the
+    `compute_etot_batch` and `compute_etot_tsh_batch` functions. The total energy fluctuation
+    is computed in the same way as in `compute_etot` (tsh = False) or `compute_etot_tsh` (tsh = True)
+    """
+
+    Ekin, Epot = np.mean(ekin), np.mean(epot)
+    Etot = Ekin + Epot
+
+    dEkin = np.mean( (ekin - Ekin)**2 )
+    dEpot = np.mean( (epot - Epot)**2 )
+
+    if tsh:
+        dEtot = np.mean( (ekin + epot - Etot)**2 )
+    else:
+        dEtot = dEkin + dEpot
+
+    return float(Ekin), float(Epot), float(Etot), math.sqrt(dEkin), math.sqrt(dEpot), math.sqrt(dEtot)
+
 
 
 def compute_etot(ham, p, Cdia, Cadi, projectors, iM, rep):
@@ -75,7 +145,6 @@ def compute_etot(ham, p, Cdia, Cadi, projectors, iM, rep):
     """
 
     ntraj = p.num_of_cols
-    ndof = p.num_of_rows
 
     epot, ekin = [], []    
     Epot, Ekin = 0.0, 0.0
@@ -88,6 +157,7 @@ def compute_etot(ham, p, Cdia, Cadi, projectors, iM, rep):
 
 
     C = CMATRIX(nst, 1)
+    ekin_all = compute_ekin(p, iM)
 
     for traj in range(0,ntraj):
 
@@ -102,10 +172,7 @@ def compute_etot(ham, p, Cdia, Cadi, projectors, iM, rep):
             epot.append( ham.Ehrenfest_energy_adi(C, Py2Cpp_int([0,traj])).real )
             Epot = Epot + epot[traj]
 
-        tmp = 0.0
-        for dof in range(0,ndof):
-            tmp = tmp + 0.5 * iM.get(dof, 0) * (p.get(dof, traj) ** 2)
-        ekin.append(tmp)
+        ekin.append(ekin_all[traj])
         Ekin = Ekin + ekin[traj]
 
     Ekin = Ekin / float(ntraj)
@@ -161,7 +228,6 @@ def compute_etot_tsh(ham, p, Cdia, Cadi, projectors, act_states, iM, rep):
     """
 
     ntraj = p.num_of_cols
-    ndof = p.num_of_rows
 
     epot, ekin = [], []    
     Epot, Ekin = 0.0, 0.0
@@ -178,6 +244,7 @@ def compute_etot_tsh(ham, p, Cdia, Cadi, projectors, act_states, iM, rep):
 
     #tsh_indx2vec(ham, states, act_states)
     states = tsh_indx2ampl(act_states, nst)
+    ekin_all = compute_ekin(p, iM)
 
     for traj in range(0,ntraj):
 
@@ -194,10 +261,7 @@ def compute_etot_tsh(ham, p, Cdia, Cadi, projectors, act_states, iM, rep):
             epot.append( ham.Ehrenfest_energy_adi(C, Py2Cpp_int([0,traj])).real )
             Epot = Epot + epot[traj]
 
-        tmp = 0.0
-        for dof in range(0,ndof):
-            tmp = tmp + 0.5 * iM.get(dof, 0) * (p.get(dof, traj) ** 2)
-        ekin.append(tmp)
+        ekin.append(ekin_all[traj])
         Ekin = Ekin + ekin[traj]
 
     Ekin = Ekin / float(ntraj)
@@ -221,6 +285,70 @@ def compute_etot_tsh(ham, p, Cdia, Cadi, projectors, act_states, iM, rep):
 
 
 
+def compute_etot_batch(ham, p, Cdia, Cadi, projectors, iM, rep):
+    """Computes the Ehrenfest energies - vectorized version
+
+    Same as `compute_etot`, but the energies of all trajectories are computed at once,
+    using the stacked arrays of the Hamiltonians and amplitudes, rather than in a loop
+    over trajectories. See `compute_etot` for the description of the arguments and of 
+    the returned values
+
+    """
+
+    ntraj = p.num_of_cols
+    ekin = compute_ekin(p, iM)
+
+    if rep==0:
+        C = data_conv.nparray_view(Cdia).T    # (ntraj, ndia)
+        H = get_children_matrices(ham, "ham_dia", ntraj)
+        S = get_children_matrices(ham, "ovlp_dia", ntraj)
+
+        norm = np.einsum("ti,tij,tj->t", C.conj(), S, C)
+        epot = ( np.einsum("ti,tij,tj->t", C.conj(), H, C) / norm ).real
+
+    elif rep==1:
+        # dyn-const -> raw
+        C = np.einsum("tij,jt->ti", data_conv.matrices2nparray(projectors), data_conv.nparray_view(Cadi))
+        H = get_children_matrices(ham, "ham_adi", ntraj)
+
+        norm = np.einsum("ti,ti->t", C.conj(), C)
+        epot = ( np.einsum("ti,tij,tj->t", C.conj(), H, C) / norm ).real
+
+    return _energy_statistics(ekin, epot, False)
+
+
+
+def compute_etot_tsh_batch(ham, p, Cdia, Cadi, projectors, act_states, iM, rep):
+    """Computes the TSH energies - vectorized version
+
+    Same as `compute_etot_tsh`, but the energies of all trajectories are computed at once,
+    using the stacked arrays of the Hamiltonians, rather than in a loop over trajectories. 
+    See `compute_etot_tsh` for the description of the arguments and of the returned values
+
+    """
+
+    ntraj = p.num_of_cols
+    ekin = compute_ekin(p, iM)
+    st = np.array(list(act_states), dtype=int)
+    trajs = np.arange(ntraj)
+
+    if rep==0:
+        H = get_children_matrices(ham, "ham_dia", ntraj)
+        S = get_children_matrices(ham, "ovlp_dia", ntraj)
+        epot = ( H[trajs, st, st] / S[trajs, st, st] ).real
+
+    elif rep==1:
+        # Amplitudes of the active states, dyn-const -> raw: C = P * e_{st}
+        C = data_conv.matrices2nparray(projectors)[trajs, :, st]   # (ntraj, nadi)
+        H = get_children_matrices(ham, "ham_adi", ntraj)
+
+        norm = np.einsum("ti,ti->t", C.conj(), C)
+        epot = ( np.einsum("ti,tij,tj->t", C.conj(), H, C) / norm ).real
+
+    return _energy_statistics(ekin, epot, True)
+
+
+
 def compute_dm(ham, Cdia, Cadi, projectors, rep, lvl):
     """
 
@@ -367,6 +495,33 @@ def compute_sh_statistics(nstates, istate, projectors):
 
 
 
+def compute_sh_statistics_batch(nstates, istate, projectors):
+    """
+
+    This function computes the SH statistics for an ensemble of trajectories - vectorized version
+    of the `compute_sh_statistics` function, see its description for the arguments and the returned values
+
+    """
+
+    ntraj = len(istate)
+    st = np.array(list(istate), dtype=int)
+
+    # Histogram of the active states
+    pops = np.bincount(st, minlength=nstates) / float(ntraj)
+
+    # diag( P * |st><st| * P.H() )_j = |P_{j,st}|^2
+    P = data_conv.matrices2nparray(projectors)
+    pops_raw = np.sum( np.abs(P[np.arange(ntraj), :, st])**2, axis=0) / float(ntraj)
+
+    coeff_sh = MATRIX(nstates, 1)
+    coeff_sh_raw = MATRIX(nstates, 1)
+    data_conv.nparray_view(coeff_sh)[:, 0] = pops
+    data_conv.nparray_view(coeff_sh_raw)[:, 0] = pops_raw
+
+    return coeff_sh, coeff_sh_raw
+
+
+
 def update_sh_pop(istate, nstates):  
     """
 
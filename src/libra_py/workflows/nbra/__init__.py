@@ -7,9 +7,11 @@
 # * http://www.gnu.org/copyleft/gpl.txt
 #***********************************************************/
 
-__all__ = ["compute_hprime",
+__all__ = ["cache",
+           "compute_hprime",
            "compute_properties",
            "decoherence_times",
+           "hvib_stat",
            "lz",
            "mapping",           
            "qsh", 
@@ -0,0 +1,193 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 2 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#*
+#*********************************************************************************/
+"""
+.. module:: cache
+   :platform: Unix, Windows
+   :synopsis: This module implements the storage of the precomputed per-timestep quantities of the
+       NBRA dynamics (energies, propagators, hopping probabilities, acceptance factors). Within the NBRA,
+       these depend only on the data set and the time step, but not on the stochastic trajectory, the
+       initial state, or the initial times, so they can be computed once and reused by all the trajectories
+       and all the subsequent runs with the same Hamiltonians
+
+       The tables are kept as the dictionaries { name: [ np.array for each data set ] }, where the first
+       dimension of every array is the time step index within the data set. If the cache directory is given,
+       the tables are saved as .npy files into a sub-directory named after the hash of the Hamiltonians and
+       of the parameters the tables depend on. The large arrays are memory-mapped when loaded.
+
+       By default, the hash is computed from the contents of all the Hamiltonians, which costs about as much
+       as one pass over them (e.g. ~1 s per GB). If the Hamiltonians were read from files, their names, sizes,
+       and modification times can be hashed instead, see `fingerprint`.
+
+       List of functions:
+
+           * fingerprint(H_vib, params, keys, files=None)
+           * save_tables(dirname, tables)
+           * load_tables(dirname, mmap_size)
+           * get_tables(H_vib, params, kind, keys, builder)
+
+.. moduleauthor:: Alexey V. Akimov
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+import util.libutil as comn
+
+import libra_py.data_conv as data_conv
+
+
+
+def fingerprint(H_vib, params, keys, files=None):
+    """
+    Computes the hash that identifies the tables computed for given Hamiltonians and parameters
+
+    Args:
+        H_vib ( list of lists of CMATRIX(nstates, nstates) ): the vibronic Hamiltonians for all data sets and time steps
+        params ( dictionary ): the parameters of the calculations
+        keys ( list of strings ): the names of the parameters the tables depend on
+        files ( list of strings or None ): the files the Hamiltonians were read from. If given, their names, sizes,
+            and modification times are hashed together with the number of steps and the first and last Hamiltonians
+            of each data set (which distinguish the different active spaces and time windows read from the
+            same files), instead of all the Hamiltonians [ default: None ]
+
+    Returns:
+        string: the hexadecimal SHA1 digest
+
+    """
+
+    h = hashlib.sha1()
+
+    for key in keys:
+        h.update( repr( (key, params[key]) ).encode() )
+
+    if files!=None:
+        for filename in files:
+            st = os.stat(filename)
+            h.update( repr( (os.path.abspath(filename), st.st_size, st.st_mtime_ns) ).encode() )
+
+    for idata in range(len(H_vib)):
+        h.update( repr( len(H_vib[idata]) ).encode() )
+        hams = H_vib[idata]
+        if files!=None:
+            hams = [ H_vib[idata][0], H_vib[idata][-1] ]
+        for ham in hams:
+            h.update( np.ascontiguousarray( data_conv.nparray_view(ham) ).tobytes() )
+
+    return h.hexdigest()
+
+
+
+def save_tables(dirname, tables):
+    """
+    Saves the tables into the directory `dirname`: the array for the data set `idata` of the table
+    `name` is stored in the file "<name>_<idata>.npy". The index file "tables.json" is written last,
+    so the directory with an incomplete set of tables is not used
+
+    Args:
+        dirname ( string ): the name of the directory, created if it does not exist
+        tables ( dictionary ): { name: [ np.array for each data set ] }
+
+    """
+
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    index = {}
+    for name, arrays in tables.items():
+        for idata, x in enumerate(arrays):
+            np.save( os.path.join(dirname, F"{name}_{idata}.npy"), x)
+        index[name] = len(arrays)
+
+    f = open(os.path.join(dirname, "tables.json"), "w")
+    json.dump(index, f)
+    f.close()
+
+
+
+def load_tables(dirname, mmap_size):
+    """
+    Loads the tables saved by `save_tables`
+
+    Args:
+        dirname ( string ): the name of the directory with the tables
+        mmap_size ( int ): the arrays stored in the files larger than this value are memory-mapped
+            (read-only) rather than read into memory [ units: bytes ]
+
+    Returns:
+        dictionary: { name: [ np.array for each data set ] }
+
+    """
+
+    f = open(os.path.join(dirname, "tables.json"), "r")
+    index = json.load(f)
+    f.close()
+
+    tables = {}
+    for name, ndata in index.items():
+        tables[name] = []
+        for idata in range(ndata):
+            filename = os.path.join(dirname, F"{name}_{idata}.npy")
+            mode = None
+            if os.path.getsize(filename) > mmap_size:
+                mode = "r"
+            tables[name].append( np.load(filename, mmap_mode=mode) )
+
+    return tables
+
+
+
+def get_tables(H_vib, params, kind, keys, builder):
+    """
+    Returns the precomputed tables: computes them by calling `builder(H_vib, params)` or, if the cache
+    directory is given and it already contains the tables computed for the same Hamiltonians and
+    parameters, loads them from there
+
+    Args:
+        H_vib ( list of lists of CMATRIX(nstates, nstates) ): the vibronic Hamiltonians for all data sets and time steps
+        params ( dictionary ): the parameters of the calculations, in particular:
+
+            * **params["cache_dir"]** ( string or None ): the directory where the tables are stored,
+                None - don't store the tables [ default: None ]
+
+            * **params["cache_mmap_size"]** ( int ): the size of the stored array above which it is
+                memory-mapped rather than read into memory [ units: bytes, default: 134217728 (128 MB) ]
+
+            * **params["cache_files"]** ( list of strings or None ): the files the Hamiltonians were read from,
+                e.g. the HDF5 stores of all data sets. If given, the tables are identified by these files rather than
+                by the contents of all the Hamiltonians, see `fingerprint`. None - hash all the Hamiltonians [ default: None ]
+
+        kind ( string ): the type of the tables, e.g. "step4" or "lz", the prefix of the sub-directory name
+        keys ( list of strings ): the names of the parameters the tables depend on
+        builder ( function ): the function computing the tables, returns { name: [ np.array for each data set ] }
+
+    Returns:
+        dictionary: { name: [ np.array for each data set ] }
+
+    """
+
+    critical_params = [ ]
+    default_params = { "cache_dir":None, "cache_mmap_size":134217728, "cache_files":None }
+    comn.check_input(params, default_params, critical_params)
+
+    if params["cache_dir"]==None:
+        return builder(H_vib, params)
+
+    key = fingerprint(H_vib, params, keys, params["cache_files"])
+    dirname = os.path.join(params["cache_dir"], F"{kind}_{key[:16]}")
+
+    if not os.path.isfile(os.path.join(dirname, "tables.json")):
+        save_tables(dirname, builder(H_vib, params))
+
+    return load_tables(dirname, params["cache_mmap_size"])
+
@@ -16,6 +16,7 @@ if sys.platform=="cygwin":
 elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 from libra_py import QE_utils
+from libra_py import data_store
 
 
 def compute_properties_onekpt(params, es_curr, es_next, curr_index):
@@ -28,6 +29,9 @@ def compute_properties_onekpt(params, es_curr, es_next, curr_index):
     \param[in] es_next A dictionary containing the data for the g-vectors and pw coefficients 
                      for the next timestep
     \param[in] curr_index This is index represents the current time step
+
+    The results are written as the text files or into the HDF5 file in the `rd` directory, 
+    as controlled by the params["output_format"] and params["store_filename"], see `data_store.write_matrix`
   
     Returns: The vibrionic Hamiltonian in Ha = a.u. of energy    
     """
@@ -36,6 +40,8 @@ def compute_properties_onekpt(params, es_curr, es_next, curr_index):
 
     rd = QE_utils.get_value(params,"rd",os.getcwd()+"../../res","s")   # of where the files will be printed out
     dt = QE_utils.get_value(params,"dt","41.34145","f") # time step in a.u - rescale NAC if actual dt is different
+    output_format = QE_utils.get_value(params,"output_format","0","i")
+    store_filename = QE_utils.get_value(params,"store_filename","data.h5","s")
 
     if nac_method == 0 or nac_method == 1 or nac_method == 3:
 
@@ -51,12 +57,10 @@ def compute_properties_onekpt(params, es_curr, es_next, curr_index):
         hvib = edia - 1.0j * CMATRIX(nac.real())  # explicitly drop of all the "complex" NACs
 
         #========== Print out ================
-        S.real().show_matrix("%s/S_dia_ks_%d_re" % (rd, curr_index))
-        St.real().show_matrix("%s/St_dia_ks_%d_re" % (rd, curr_index))
-        St.imag().show_matrix("%s/St_dia_ks_%d_im" % (rd, curr_index))
-        edia.real().show_matrix("%s/E_dia_ks_%d_re" % (rd, curr_index))
-        hvib.real().show_matrix("%s/hvib_dia_%d_re" % (rd, curr_index))
-        hvib.imag().show_matrix("%s/hvib_dia_%d_im" % (rd, curr_index))
+        data_store.write_matrix(S, "%s/S_dia_ks_" % (rd), curr_index, output_format, store_filename, False)
+        data_store.write_matrix(St, "%s/St_dia_ks_" % (rd), curr_index, output_format, store_filename)
+        data_store.write_matrix(edia, "%s/E_dia_ks_" % (rd), curr_index, output_format, store_filename, False)
+        data_store.write_matrix(hvib, "%s/hvib_dia_" % (rd), curr_index, output_format, store_filename)
 
 
     elif nac_method == 2 or nac_method == 3:
@@ -73,11 +77,9 @@ def compute_properties_onekpt(params, es_curr, es_next, curr_index):
         hvib = eadi - 1.0j * CMATRIX(nac.real())  # explicitly drop of all the "complex" NACs
 
         #========== Print out ================
-        S.real().show_matrix("%s/S_adi_ks_%d_re" % (rd, curr_index))
-        St.real().show_matrix("%s/St_adi_ks_%d_re" % (rd, curr_index))
-        St.imag().show_matrix("%s/St_adi_ks_%d_im" % (rd, curr_index))
-        eadi.real().show_matrix("%s/E_adi_ks_%d_re" % (rd, curr_index))
-        hvib.real().show_matrix("%s/hvib_adi_%d_re" % (rd, curr_index))
-        hvib.imag().show_matrix("%s/hvib_adi_%d_im" % (rd, curr_index))
+        data_store.write_matrix(S, "%s/S_adi_ks_" % (rd), curr_index, output_format, store_filename, False)
+        data_store.write_matrix(St, "%s/St_adi_ks_" % (rd), curr_index, output_format, store_filename)
+        data_store.write_matrix(eadi, "%s/E_adi_ks_" % (rd), curr_index, output_format, store_filename, False)
+        data_store.write_matrix(hvib, "%s/hvib_adi_" % (rd), curr_index, output_format, store_filename)
 
 
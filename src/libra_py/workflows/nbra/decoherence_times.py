@@ -30,8 +30,12 @@ if sys.platform=="cygwin":
 elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 
+import numpy as np
+
 from libra_py import units
 from libra_py import data_stat
+import libra_py.data_conv as data_conv
+from . import hvib_stat
 
 __all__ = ["decoherence_times2rates",
            "energy_gaps",
@@ -87,23 +91,12 @@ def energy_gaps(Hvib):
 
     """
 
-    nsteps = len(Hvib)
-    nstates = Hvib[0].num_of_cols
-    
-    dE = []
-    for step in range(0, nsteps):
-        dEij = MATRIX(nstates, nstates)
-
-        for i in range(0,nstates):
-            for j in range(i+1, nstates):
+    E = hvib_stat.energies(Hvib)
+    dE = np.abs( E[:, :, None] - E[:, None, :] )
 
-                deij = math.fabs(Hvib[step].get(i,i).real - Hvib[step].get(j,j).real)
-                dEij.set(i,j, deij)
-                dEij.set(j,i, deij)
+    return [ data_conv.nparray2MATRIX(x) for x in dE ]
 
-        dE.append(dEij)
 
-    return dE
 
 
 def energy_gaps_ave(Hvib, itimes, nsteps):
@@ -129,31 +122,9 @@ def energy_gaps_ave(Hvib, itimes, nsteps):
 
     """
     
-    ndata = len(Hvib)
-    nitimes = len(itimes)
-    nstates = Hvib[0][0].num_of_cols
-    
-    dE = []
-    for step in range(0, nsteps):
-        dEij = MATRIX(nstates, nstates)
-
-        for i in range(0,nstates):
-            for j in range(i+1, nstates):
-
-                deij = 0.0
-                for idata in range(0, ndata):
-                    for it_indx in range(0, nitimes): 
-                        it = itimes[it_indx]
+    dE = hvib_stat.gap_ave(Hvib, itimes, nsteps)
 
-                        deij = deij + math.fabs(Hvib[idata][it+step].get(i,i).real - Hvib[idata][it+step].get(j,j).real)
-                deij = deij/float(nitimes*ndata)
-
-                dEij.set(i,j, deij)
-                dEij.set(j,i, deij)
-
-        dE.append(dEij)
-
-    return dE
+    return [ data_conv.nparray2MATRIX(x) for x in dE ]
 
 
 
@@ -181,24 +152,12 @@ def decoherence_times(Hvib, verbosity=0):
 
     """
 
-    # Compute energy gaps
-    dE = energy_gaps(Hvib)
-    dE_ave, dE_std, dE_dw_bound, dE_up_bound = data_stat.mat_stat(dE)
+    # Statistics of the energy gaps
+    dE_stat, dE_fluct_std = hvib_stat.gap_stat([Hvib], [0], len(Hvib))
 
-    nstates = Hvib[0].num_of_cols
-    decoh_times = MATRIX(nstates, nstates)
-
-    for a in range(0,nstates):
-        for b in range(0,nstates):
-            if a==b:
-                decoh_times.set(a,a, 1.0e+10)
-            else:
-                de = dE_std.get(a,b)
-                if de>0.0:
-                      tau = math.sqrt(12.0/5.0) / de
-                      decoh_times.set(a,b, tau)
-
-    decoh_rates = decoherence_times2rates(decoh_times)
+    tau = hvib_stat.dephasing_times( dE_stat.std() )
+    decoh_times = data_conv.nparray2MATRIX(tau)
+    decoh_rates = data_conv.nparray2MATRIX( hvib_stat.dephasing_rates(tau) )
 
     if verbosity>0:
         print("Decoherence times matrix (a.u. of time):")
@@ -300,6 +259,7 @@ def decoherence_times_ave(Hvib, itimes, nsteps, verbosity=0):
             and potential different sections of the time-range
             where Hvib[idata][istep] is a CMATRIX object that represents a vibronic Hamiltonian
             from the data set ```idata``` at the time step ```istep```. 
+            Each data set can also be an array-like object, e.g. stored in an HDF5 file, see `hvib_stat.get_block`
 
         itimes ( list if ints ): initial times for averaging. The number ```itimes[idata]``` tells 
             which datapoint (timestep) of the time-series Hvib[idata] consider the beginning of 
@@ -322,59 +282,13 @@ def decoherence_times_ave(Hvib, itimes, nsteps, verbosity=0):
     """
 
 
-    # Compute energy gaps
-    ndata = len(Hvib)
-    nitimes = len(itimes)
-    nstates = Hvib[0][0].num_of_cols
-
-    # Compute a concatenated list of gap magnitudes for all sub-trajectories    
-    dE = []
-    for idata in range(0,ndata):
-        for it_indx in range(0,nitimes):
-            it = itimes[it_indx]
-
-            #========== Fluctuations for a given sub-trajectory ===========
-            de = []
-            for step in range(0,nsteps):
-                dEij = MATRIX(nstates, nstates)
-
-                for i in range(0,nstates):
-                    for j in range(i+1, nstates):
-
-                        deij = math.fabs(Hvib[idata][it+step].get(i,i).real - Hvib[idata][it+step].get(j,j).real)
-                        dEij.set(i,j, deij)
-                        dEij.set(j,i, deij)
-
-                de.append(dEij)
-
-            #============== Averages for this sub-trajectory ==================
-            # we only care about dE_ave, other outputs are not used here
-            dE_ave, dE_std, dE_dw_bound, dE_up_bound = data_stat.mat_stat(de)
-
-            #============== Subtract the sub-trajectory-specific average =============
-            for step in range(0,nsteps):
-                dE.append( de[step] - dE_ave)
-
-
-    # Compute the statistics of the obtained data set
-    # the dE_ave should be zero, considering the transformations above
-    # we only care about dE_std, other outputs are not used here
-    dE_ave, dE_std, dE_dw_bound, dE_up_bound = data_stat.mat_stat(dE)
-
+    # The fluctuations of the gaps around the average gaps of each sub-trajectory,
+    # pooled over all the sub-trajectories
+    dE_stat, dE_std = hvib_stat.gap_stat(Hvib, itimes, nsteps)
 
-    decoh_times = MATRIX(nstates, nstates)   
-
-    for a in range(0,nstates):
-        for b in range(0, nstates):
-            if a==b:
-                decoh_times.set(a,a, 1.0e+10)
-            else:
-                de = dE_std.get(a,b)
-                if de>0.0:
-                      tau = math.sqrt(12.0/5.0) / de
-                      decoh_times.set(a,b, tau)
-
-    decoh_rates = decoherence_times2rates(decoh_times)
+    tau = hvib_stat.dephasing_times(dE_std)
+    decoh_times = data_conv.nparray2MATRIX(tau)
+    decoh_rates = data_conv.nparray2MATRIX( hvib_stat.dephasing_rates(tau) )
 
     if verbosity>0:
         print("Decoherence times matrix (a.u. of time):")
@@ -0,0 +1,235 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 2 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#*
+#*********************************************************************************/
+"""
+.. module:: hvib_stat
+   :platform: Unix, Windows
+   :synopsis: This module implements the streaming statistics of the vibronic Hamiltonian time series:
+       the averages, standard deviations and bounds of the matrix elements and of the energy gaps, and
+       the pure-dephasing times. The time series are processed in chunks of time steps, so a data set
+       can be either a list of CMATRIX objects or an array-like object - a np.array, np.memmap, or
+       an h5py.Dataset of shape (nsteps, nstates, nstates), e.g. returned by `data_store.open_matrices` -
+       that is never read into memory as a whole
+
+       The statistics are accumulated by the `data_stat.running_stat` objects
+
+       List of functions:
+
+           * get_block(H, start, stop)
+           * energies(H, start=0, stop=None, chunk_size=1000)
+           * hvib_stat(H, chunk_size=1000)
+           * gap_ave(H_vib, itimes, nsteps, chunk_size=1000)
+           * gap_stat(H_vib, itimes, nsteps, chunk_size=1000)
+           * dephasing_times(dE_std)
+           * dephasing_rates(tau)
+
+.. moduleauthor:: Alexey V. Akimov
+
+"""
+
+import math
+import numpy as np
+
+import libra_py.data_conv as data_conv
+import libra_py.data_stat as data_stat
+
+
+
+def get_block(H, start, stop):
+    """
+    Reads a range of time steps of a data set
+
+    Args:
+        H ( list of CMATRIX(nstates, nstates) or array-like (nsteps, nstates, nstates) ): the data set
+        start ( int ): the index of the first time step
+        stop ( int ): the index of the time step after the last one
+
+    Returns:
+        np.array (stop-start, nstates, nstates): the matrices of the time steps start, ... , stop-1
+
+    """
+
+    if hasattr(H, "shape"):
+        return np.asarray( H[start:stop] )
+
+    return data_conv.matrices2nparray( [ H[i] for i in range(start, stop) ] )
+
+
+
+def energies(H, start=0, stop=None, chunk_size=1000):
+    """
+    Returns the energies of the states - the real parts of the diagonal elements of the vibronic Hamiltonians
+
+    Args:
+        H ( list of CMATRIX(nstates, nstates) or array-like (nsteps, nstates, nstates) ): the data set
+        start ( int ): the index of the first time step [ default: 0 ]
+        stop ( int ): the index of the time step after the last one, None - till the end [ default: None ]
+        chunk_size ( int ): the number of time steps read at once [ default: 1000 ]
+
+    Returns:
+        np.array (stop-start, nstates): the energies [ units: Ha ]
+
+    """
+
+    if stop==None:
+        stop = len(H)
+
+    E = []
+    for i in range(start, stop, chunk_size):
+        x = get_block(H, i, min(i + chunk_size, stop))
+        E.append( np.real( np.diagonal(x, axis1=1, axis2=2) ) )
+
+    if len(E)==0:
+        return np.zeros( (0, 0) )
+
+    return np.concatenate(E)
+
+
+
+def hvib_stat(H, chunk_size=1000):
+    """
+    Computes the statistics of the real and imaginary parts of the vibronic Hamiltonian matrix elements
+    over the time steps of one data set, see also `data_stat.mat_stat`
+
+    Args:
+        H ( list of CMATRIX(nstates, nstates) or array-like (nsteps, nstates, nstates) ): the data set
+        chunk_size ( int ): the number of time steps read at once [ default: 1000 ]
+
+    Returns:
+        tuple: ( re, im ) - the `data_stat.running_stat` objects with the statistics of the real and imaginary parts
+
+    """
+
+    re, im = data_stat.running_stat(), data_stat.running_stat()
+
+    nsteps = len(H)
+    for i in range(0, nsteps, chunk_size):
+        x = get_block(H, i, min(i + chunk_size, nsteps))
+        re.add_chunk( np.real(x) )
+        im.add_chunk( np.imag(x) )
+
+    return re, im
+
+
+
+def gap_ave(H_vib, itimes, nsteps, chunk_size=1000):
+    """
+    Computes the energy gaps at every time step, averaged over the data sets and initial times
+
+    Args:
+        H_vib ( list of data sets ): the vibronic Hamiltonians, see `get_block` for the supported data set types
+        itimes ( list of ints ): the initial times of the sub-trajectories in each data set
+        nsteps ( int ): the length of each sub-trajectory
+        chunk_size ( int ): the number of time steps read at once [ default: 1000 ]
+
+    Returns:
+        np.array (nsteps, nstates, nstates): dE, where dE[t, i, j] = < |E_i(t) - E_j(t)| > [ units: Ha ]
+
+    """
+
+    dE = None
+
+    for idata in range(len(H_vib)):
+        for it in itimes:
+            E = energies(H_vib[idata], it, it + nsteps, chunk_size)
+            de = np.abs( E[:, :, None] - E[:, None, :] )
+            if dE is None:
+                dE = de
+            else:
+                dE += de
+
+    return dE / float( len(H_vib) * len(itimes) )
+
+
+
+def gap_stat(H_vib, itimes, nsteps, chunk_size=1000):
+    """
+    Computes the statistics of the energy gaps |E_i - E_j| for all pairs of states
+
+    Args:
+        H_vib ( list of data sets ): the vibronic Hamiltonians, see `get_block` for the supported data set types
+        itimes ( list of ints ): the initial times of the sub-trajectories in each data set
+        nsteps ( int ): the length of each sub-trajectory
+        chunk_size ( int ): the number of time steps read at once [ default: 1000 ]
+
+    Returns:
+        tuple: ( stat, fluct_std ), where:
+
+            * stat ( data_stat.running_stat ): the statistics of the gaps over all the time steps of all the sub-trajectories
+            * fluct_std ( np.array (nstates, nstates) ): the standard deviation of the gap fluctuations around the
+                average gaps of each sub-trajectory, as used in `decoherence_times.decoherence_times_ave` [ units: Ha ]
+
+    """
+
+    stat = data_stat.running_stat()
+    var = 0.0
+
+    for idata in range(len(H_vib)):
+        for it in itimes:
+
+            sub = data_stat.running_stat()
+            for i in range(it, it + nsteps, chunk_size):
+                E = energies(H_vib[idata], i, min(i + chunk_size, it + nsteps), chunk_size)
+                de = np.abs( E[:, :, None] - E[:, None, :] )
+                sub.add_chunk(de)
+                stat.add_chunk(de)
+
+            var = var + sub.variance()
+
+    fluct_std = np.sqrt( var / float( len(H_vib) * len(itimes) ) )
+
+    return stat, fluct_std
+
+
+
+def dephasing_times(dE_std):
+    """
+    Computes the pure-dephasing times from the standard deviations of the energy gaps
+
+    Ref: Akimov, A. V; Prezhdo O. V. J. Phys. Chem. Lett. 2013, 4, 3857
+
+    Args:
+        dE_std ( np.array (nstates, nstates) ): the standard deviations of the gaps [ units: Ha ]
+
+    Returns:
+        np.array (nstates, nstates): tau, the dephasing times: tau_ij = sqrt(12/5) / dE_std_ij,
+            or 0 if dE_std_ij is 0, and the diagonal elements are set to 1e+10 [ units: a.u. ]
+
+    """
+
+    tau = np.zeros(dE_std.shape)
+    pos = dE_std > 0.0
+    tau[pos] = math.sqrt(12.0/5.0) / dE_std[pos]
+    np.fill_diagonal(tau, 1.0e+10)
+
+    return tau
+
+
+
+def dephasing_rates(tau):
+    """
+    Converts the dephasing times to the dephasing rates, see `decoherence_times.decoherence_times2rates`
+
+    Args:
+        tau ( np.array (nstates, nstates) ): the dephasing times [ units: a.u. ]
+
+    Returns:
+        np.array (nstates, nstates): the dephasing rates, 1/tau_ij for the positive off-diagonal times,
+            and 0 otherwise [ units: a.u.^-1 ]
+
+    """
+
+    rates = np.zeros(tau.shape)
+    pos = tau > 0.0
+    np.fill_diagonal(pos, False)
+    rates[pos] = 1.0 / tau[pos]
+
+    return rates
+
@@ -19,6 +19,7 @@ import cmath
 import math
 import os
 import sys
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -29,10 +30,11 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 import util.libutil as comn
 
 import libra_py.units as units
+import libra_py.data_conv as data_conv
 import libra_py.probabilities as prob
-import libra_py.tsh as tsh
-from . import decoherence_times
 from . import step4
+from . import cache
+from . import hvib_stat
 
 
 
@@ -79,6 +81,29 @@ def Belyaev_Lebedev(Hvib, params):
      
     """
 
+    E = hvib_stat.energies(Hvib)
+
+    P = Belyaev_Lebedev_batch(E, params)
+
+    return [ data_conv.nparray2MATRIX(P[n]) for n in range(P.shape[0]) ]
+
+
+
+
+def Belyaev_Lebedev_batch(E, params):
+    """
+    Computes the Landau-Zener hopping probabilities of `Belyaev_Lebedev` for all time steps at once
+
+    Args:
+        E ( np.array (nsteps, nstates) ): energies of the states along the trajectory [ units: Ha ]
+        params ( dictionary ): control parameters, see `Belyaev_Lebedev`
+
+    Returns:
+        np.array (nsteps, nstates, nstates): P, where P[n, i, j] - the probability to go from j to i
+            at the time step n. The first and the last steps have no hops: P[0] = P[nsteps-1] = I
+
+    """
+
     # Control parameters
     critical_params = [  ]
     default_params = { "T":300.0, "Boltz_opt_BL":1, "dt":41.0, "gap_min_exception":0, "target_space":1 }
@@ -92,139 +117,132 @@ def Belyaev_Lebedev(Hvib, params):
 
 
     # Data dimensions 
-    nsteps = len(Hvib)
-    nstates= Hvib[0].num_of_cols
-
+    nsteps, nstates = E.shape
 
-    # Pre-compute the energy gaps along the trajectory 
-    dE = decoherence_times.energy_gaps(Hvib)
+    P = np.zeros( (nsteps, nstates, nstates) )
+    P[:] = np.identity(nstates)
 
-
-    """
-    Compute the probabilities based on the LZ formula
-    P(i,j) - the convention is: the probability to go from j to i
-    This will make the Markov state propagation more convenient
-    """
+    if nsteps < 3:
+        return P
 
 
-    P = []
-    P.append( MATRIX(nstates, nstates) )
-    for i in range(0,nstates):    
-        P[0].set(i,i, 1.0)
+    # Energy gaps along the trajectory, dE[n, i, j] = |E_i(n) - E_j(n)|, for the previous (a), 
+    # current (b), and the next (c) step of every time step n = 1, ... , nsteps-2
+    dE = np.abs( E[:, :, None] - E[:, None, :] )
+    a, b, c = dE[:-2], dE[1:-1], dE[2:]
 
-    for n in range(1, nsteps-1):
-        P.append(MATRIX(nstates, nstates))
- 
+    # Target states i for each source state j, no self-transitions
+    ij = np.arange(nstates)
+    if target_space == 0:
+        targets = np.abs( ij[:, None] - ij[None, :] ) == 1
+    else:
+        targets = ij[:, None] != ij[None, :]
 
-        # Belyaev-Lebedev probabilities
-        # Find the minima of the |E_i - E_j| for all pair of i and j    
-        for j in range(0, nstates):      # source 
+    # The pairs of states passing through the minimum of the gap
+    denom = a - 2.0*b + c
+    is_min = (a > b) & (b < c) & (denom > 0.0) & targets[None, :, :]
+    denom = np.where(is_min, denom, 1.0)
 
+    # Interpolation is based on the 3-points Lagrange interpolant
+    # http://mathworld.wolfram.com/LagrangeInterpolatingPolynomial.html 
+    t_min = 0.5*(a - c)*dt/denom
 
-            # By doing this, we'll consider the transitions to only adjacent states
-            targets = []
+    if np.any( is_min & ( (t_min < -dt) | (t_min > dt) ) ):
+        print("Error determining t_min in the interpolation!\n")
+        print("Exiting...\n")
+        sys.exit(0)
 
-            if target_space == 0:
-                # Target states are only the states adjacent to the source state
+    gap_min = 0.5*(t_min*(t_min - dt)*a - 2.0*(t_min + dt)*(t_min - dt)*b + t_min*(t_min + dt)*c )/(dt*dt)
 
-                if j == 0:
-                    targets = [1]
-                elif j == nstates - 1:
-                    targets = [nstates - 2]
-                else:
-                    targets = [j-1, j+1]
+    if gap_min_exception==0:
+        gap_min = np.where(gap_min < 0.0, 0.0, gap_min)
+    elif gap_min_exception==1:
+        gap_min = np.where(gap_min < 0.0, b, gap_min)
 
-            elif target_space == 1:
-                # All states can be the potential targets
+    if np.any( is_min & ( (gap_min > a) | (gap_min > c) ) ):
+        print("Error: the extrapolated gap is larger than the bounding values!\n")
+        print("Exiting...\n")
+        sys.exit(0)
 
-                targets = range(0, nstates)
+    second_deriv = denom/(dt*dt)
+    argg = np.where(is_min, gap_min**3, 0.0) / second_deriv
+    p = np.exp(-0.5*math.pi*np.sqrt(argg) )
 
+    # Optionally, can correct transition probabilitieis to account for Boltzmann factor.
+    # Notice how we use gap_min rather than E_new - E_old in this case
+    up = E[1:-1, :, None] > E[1:-1, None, :]    # target above source
+    bf = np.where(up, step4.boltz_factors(gap_min, T, boltz_opt), 1.0)
 
+    Pn = np.where(is_min, p*bf, 0.0)            # Probability to go j->i
 
+    # Probability to stay on the source state, or the renormalization of the hopping probabilities
+    normalization = np.sum(Pn, axis=1)          # (nsteps-2, nstates): for every source state
+    stay = normalization < 1.0
+    Pn = Pn / np.where(stay, 1.0, normalization)[:, None, :]
+    Pn[:, ij, ij] = np.where(stay, 1.0 - normalization, 0.0)
 
-            # with how many other states, does the current (source) state has minima?
-            # apparently, this can not be more than 2
-            normalization = 0.0
+    P[1:-1] = Pn
             
-            #for i in targets:   # targets 
-            for i in targets:
+    return P
 
-                # Interpolation is based on the 3-points Lagrange interpolant
-                # http://mathworld.wolfram.com/LagrangeInterpolatingPolynomial.html 
 
-                if (dE[n-1].get(i,j)>dE[n].get(i,j) and dE[n].get(i,j)<dE[n+1].get(i,j)):
 
-                                        
-                    denom = dE[n-1].get(i,j) - 2.0*dE[n].get(i,j) + dE[n+1].get(i,j)                  
-                    if denom > 0.0:
-                       
-                        t_min = 0.5*(dE[n-1].get(i,j) - dE[n+1].get(i,j))*dt/denom
 
-                        if t_min<-dt or t_min > dt:
-                            print("Error determining t_min in the interpolation!\n")
-                            print("Exiting...\n")
-                            sys.exit(0)
+def precompute_tables(H_vib, params):
+    """
+    Computes the Belyaev-Lebedev hopping probabilities for all data sets, see `Belyaev_Lebedev_batch`. 
+    To be used with `cache.get_tables`
 
-                        gap_min = 0.5*(t_min*(t_min - dt)*dE[n-1].get(i,j) 
-                          - 2.0*(t_min + dt)*(t_min - dt)*dE[n].get(i,j) + 
-                                       t_min*(t_min + dt)*dE[n+1].get(i,j) )/(dt*dt)
+    Args:
+        H_vib ( list of lists of CMATRIX(nstates,nstates) ): vibronic Hamiltonians for all data sets and time steps
+        params ( dictionary ): control parameters, see `Belyaev_Lebedev`
 
-                        if gap_min<0.0:
-                            if gap_min_exception==0:
-                                gap_min = 0.0
-                            elif gap_min_exception==1:
-                                gap_min = dE[n].get(i,j)
+    Returns:
+        dictionary: { "P": [ np.array (nsteps_idata, nstates, nstates) for each data set ] }, the hopping 
+            probabilities, with the same convention as in `Belyaev_Lebedev`
 
-                        if gap_min > dE[n-1].get(i,j) or gap_min > dE[n+1].get(i,j):
-                            print("Error: the extrapolated gap is larger than the bounding values!\n")
-                            print("Exiting...\n")
-                            sys.exit(0)
+    """
 
-                        second_deriv = denom/(dt*dt)
+    tables = { "P":[] }
 
-                        argg = (gap_min**3) / second_deriv
+    for idata in range(len(H_vib)):
+        E = hvib_stat.energies(H_vib[idata])
+        tables["P"].append( Belyaev_Lebedev_batch(E, params) )
 
-                        p = math.exp(-0.5*math.pi*math.sqrt(argg) )
+    return tables
 
 
-                        # Optionally, can correct transition probabilitieis to 
-                        # account for Boltzmann factor
-                        if i!=j:
 
-                            E_new = Hvib[n].get(i,i).real  # target
-                            E_old = Hvib[n].get(j,j).real  # source
 
-                            bf = 1.0
-                            if E_new > E_old:
-                                # Notice how we use gap_min rather than E_new - E_old in this case
-                                bf = tsh.boltz_factor(gap_min, 0.0, T, boltz_opt)
+def hop_tables(P, E, T, boltz_opt):
+    """
+    Computes the quantities needed for the stochastic hops at every time step of every data set:
+    the cumulative hopping probabilities and the hop acceptance probabilities
 
-                            if bf>1.0:
-                                print("Error: Boltzmann scaling factor can not be larger 1.0 = ",bf)
-                                sys.exit(0)
+    Args:
+        P ( list of np.array (nsteps_idata, nstates, nstates) ): hopping probabilities for all data sets and 
+            time steps, P[idata][istep, i, j] - the probability to go from j to i
+        E ( list of np.array (nsteps_idata, nstates) ): energies of the states for all data sets and time steps [ units: Ha ]
+        T ( double ): temperature [ units: K ]
+        boltz_opt ( int ): the proposed hop acceptance criterion, see `tsh.boltz_factor`
 
+    Returns:
+        tuple: ( cum, boltz ), where:
 
-                            P[n].set(i,j, p*bf)      # Probability to go j->i
-                            normalization = normalization + p*bf
-                                 
+            * cum ( list of np.array (nsteps_idata, nstates, nstates) ): cum[idata][istep, j, i] - the 
+                probability to go from the state j to any of the states 0, ... , i 
+            * boltz ( list of np.array (nsteps_idata, nstates, nstates) ): boltz[idata][istep, j, i] - the
+                probability to accept the proposed hop from the state j to the state i
 
-            if normalization<1.0:
-                P[n].set(j,j, 1.0 - normalization)
-            else:
-                P[n].add(j,j, 0.0)
+    """
 
-                scl = 1.0/normalization
-                P[n].scale(-1, j, scl)
- 
-               
-       
+    cum, boltz = [], []
 
-    P.append( MATRIX(nstates, nstates) )
-    for i in range(0,nstates):    
-        P[nsteps-1].set(i,i, 1.0)
+    for idata in range(len(P)):
+        cum.append( np.cumsum( P[idata].transpose(0, 2, 1), axis=2 ) )
+        boltz.append( step4.boltz_factors( E[idata][:, None, :] - E[idata][:, :, None], T, boltz_opt ) )
 
-            
-    return P
+    return cum, boltz
 
 
 
@@ -371,6 +389,17 @@ def run(H_vib, params):
         * **params["extend_md"]** ( Boolean ) : whether or not to extend md time by resampling the NBRA hopping probabilities
         * **params["extend_md_time"]** ( int ) : length of the new dynamics trajectory, in units dt
         * **params["detect_SD_difference"]** ( Boolean ) : see if SD states differ by more than 1 electron, if so probability to zero [ default: False ]
+        * **params["cache_dir"]** ( string or None ) : the directory where the Belyaev-Lebedev probabilities are stored, 
+            so that the subsequent runs with the same Hamiltonians and parameters (but possibly different "ntraj", "istate",
+            or "init_times") can reuse them, None - compute them for this run only [ default: None ]. See `cache.get_tables`
+        * **params["cache_files"]** ( list of strings or None ) : the files the Hamiltonians were read from, used to identify
+            the stored tables instead of hashing all the Hamiltonians [ default: None ]. See `cache.fingerprint`
+        * **params["random_seed"]** ( int or None ) : the seed of the NumPy random numbers generator used for the hops
+            and for the resampling of the steps with "extend_md", None - a random seed [ default: None ]
+
+    The populations of all trajectories are evolved together: the Markov step is a batched product of the
+    probability matrices of all data sets/initial times with the populations, and the hops of all trajectories
+    are drawn at once from the cumulative probabilities, see `hop_tables`
 
     """
 
@@ -378,15 +407,16 @@ def run(H_vib, params):
     critical_params = [  ]
     default_params = { "dt":41.0, "ntraj":1, "nsteps":1, "istate":0, 
                        "Boltz_opt":1, "Boltz_opt_BL":1, "T":300.0,
+                       "gap_min_exception":0, "target_space":1,
                        "do_output":True, "outfile":"_out.txt", "do_return":True,
                        "evolve_Markov":True, "evolve_TSH":True, 
                        "extend_md":False, "extend_md_time":1,
                        "detect_SD_differences":False,
-                       "return_probabilities":False }
+                       "return_probabilities":False, "random_seed":None }
 
     comn.check_input(params, default_params, critical_params)
     
-    rnd = Random()
+    rng = np.random.default_rng(params["random_seed"])
 
     ndata = len(H_vib)
     nsteps = params["nsteps"]
@@ -407,67 +437,56 @@ def run(H_vib, params):
     res = MATRIX(nsteps, 3*nstates+5)
 
     #===== Precompute hopping probabilities ===
-    P = []
-    itimes = params["init_times"]
+    itimes = np.array(params["init_times"], dtype=int)
     nitimes = len(itimes)
 
-    for idata in range(0,ndata):
-        p = Belyaev_Lebedev(H_vib[idata], params)
-        P.append(p)
+    tables = cache.get_tables(H_vib, params, "lz", ["dt", "T", "Boltz_opt_BL", "gap_min_exception", "target_space"], precompute_tables)
+    P = [ np.array(p) for p in tables["P"] ]
+    E = [ hvib_stat.energies(H_vib[idata]) for idata in range(ndata) ]
 
     if detect_SD_difference == True:
-        P = adjust_SD_probabilities(P, params)  
+        P_mat = [ [ data_conv.nparray2MATRIX(p) for p in P[idata] ] for idata in range(ndata) ]
+        P_mat = adjust_SD_probabilities(P_mat, params)  
+        P = [ data_conv.matrices2nparray(P_mat[idata]) for idata in range(ndata) ]
 
-    # Check if to extend md time
-    # Check if to extend md time
+    # Check if to extend md time: the probabilities and energies of the new trajectory are
+    # those of the randomly chosen steps, the first step has no hops
     if extend_md == True:
 
-        rnd = Random()
-        P_ext = []
-        H_vib_ext = []
-
-        # For the first step, diagonal elements are 1
         for idata in range(0,ndata):
-            P_ext.append(     [ MATRIX(nstates, nstates) ] )
-            H_vib_ext.append( [ CMATRIX(nstates, nstates) ] )
-            for i in range(0,nstates):
-
-                P_ext[idata][0].set(i,i, 1.0)
-                rnd_step = rnd.uniform(0,nsteps)
-                H_vib_ext[idata][0] = CMATRIX( H_vib[idata][int(rnd_step)] )
+            steps = rng.integers(0, nsteps, extend_md_time)
+            P[idata] = P[idata][steps]
+            P[idata][0] = np.identity(nstates)
+            E[idata] = E[idata][steps]
 
-            for n in range(1, extend_md_time):
-
-                rnd_step = rnd.uniform(0,nsteps)
-                P_ext[idata].append( MATRIX(nstates, nstates) )
-                P_ext[idata][n] = MATRIX( P[idata][int(rnd_step)] )    
-                H_vib_ext[idata].append( CMATRIX(nstates, nstates) )
-                H_vib_ext[idata][n] = CMATRIX( H_vib[idata][int(rnd_step)] )
-
-        P = P_ext
-        H_vib = H_vib_ext
         nsteps = extend_md_time
         res = MATRIX(nsteps, 3*nstates+5)
 
 
+    # Cumulative hopping probabilities and hop acceptance probabilities - the same for all trajectories
+    cum, boltz = hop_tables(P, E, T, boltz_opt)
+
     #========== Initialize the DYNAMICAL VARIABLES  ===============
-    # State populations and active state indices
-    Pop, istate = [], []
-    Ntraj = ndata * nitimes * ntraj
+    # State populations and active state indices. The trajectory index is
+    # Tr = idata*(nitimes*ntraj) + it_indx*(ntraj) + tr, the data set/initial time group is Tr // ntraj
+    ngroups = ndata * nitimes
+    Ntraj = ngroups * ntraj
+    grp = np.arange(Ntraj) // ntraj
 
-    for tr in range(0,Ntraj):
-        istate.append(params["istate"])
-        Pop.append(CMATRIX(nstates, 1)); 
-        Pop[tr].set(params["istate"], 1.0, 0.0)
+    istate = np.full(Ntraj, params["istate"], dtype=int)
+    Pop = np.zeros( (Ntraj, nstates) )
+    Pop[:, params["istate"]] = 1.0
 
     #=============== Entering the DYNAMICS ========================
     for i in range(0,nsteps):  # over all evolution times
 
+        # Properties of all data sets/initial times at this step
+        Pg = np.concatenate( [ P[idata][itimes + i] for idata in range(ndata) ] )          # (ngroups, nstates, nstates)
+        Eg = np.concatenate( [ E[idata][itimes + i] for idata in range(ndata) ] )          # (ngroups, nstates)
+
         #============== Analysis of the Dynamics  =================
         # Compute the averages
-        #res_i = step4.traj_statistics(i, Coeff, istate, H_vib, itimes)
-        #res_i = step4.traj_statistics2(i, Pop, istate, H_vib, itimes)
-        res_i = step4.traj_statistics2_fast(i, Pop, istate, H_vib, itimes)
+        res_i = step4.traj_statistics2_batch(Eg, Pop, istate)
 
         # Print out into a file
         if do_output==True:
@@ -479,47 +498,29 @@ def run(H_vib, params):
             push_submatrix(res, res_i, Py2Cpp_int(list([i])), Py2Cpp_int(list(range(1,3*nstates+5))) )
 
         #=============== Propagation ==============================
-        for idata in range(0,ndata):   # over all data sets (MD trajectories)
-
-            for it_indx in range(0,nitimes): # over all initial times within each MD trajectory
-
-                it = itimes[it_indx]
-
-                for tr in range(0,ntraj):  # over all stochastic trajectories
-
-                    Tr = idata*(nitimes*ntraj) + it_indx*(ntraj) + tr
-
-                    #============== Propagation: TD-SE and surface hopping ==========
-        
-                    # Evolve the Markov process.
-                    # The convention is:
-                    # P(i,j) - the probability to go from j to i
-                    if evolve_Markov==True:
-                        Pop[Tr] = CMATRIX(P[idata][it+i]) * Pop[Tr]
-
-                    if evolve_TSH==True:        
-
-                        # Surface hopping 
-                        ksi  = rnd.uniform(0.0, 1.0)
-                        
-                        # Proposed hop:
-                        st_new = tsh.hop_py(istate[Tr], P[idata][it+i].T(), ksi)  
-                        
-                        # Accept the proposed hop with the Boltzmann probability
-                        E_new = H_vib[idata][it+i].get(st_new,st_new).real
-                        E_old = H_vib[idata][it+i].get(istate[Tr], istate[Tr]).real
-                        de = E_new - E_old
-                        
-                        if de>0.0:
-                            bf = tsh.boltz_factor(E_new, E_old, T, boltz_opt)
-                            ksi  = rnd.uniform(0.0, 1.0)
-                            if ksi < bf:
-                                istate[Tr] = st_new                  
-                        else:
-                            istate[Tr] = st_new
+        # Evolve the Markov process.
+        # The convention is:
+        # P(i,j) - the probability to go from j to i
+        if evolve_Markov==True:
+            Pop = np.einsum("gij,gtj->gti", Pg, Pop.reshape(ngroups, ntraj, nstates)).reshape(Ntraj, nstates)
+
+        if evolve_TSH==True:        
+
+            # Surface hopping. Proposed hops: same as tsh.hop_py(istate[Tr], P[idata][it+i].T(), ksi)
+            cumg = np.concatenate( [ cum[idata][itimes + i] for idata in range(ndata) ] )
+            ksi  = rng.random(Ntraj)
+            st_new = np.sum( cumg[grp, istate] < ksi[:, None], axis=1 )
+            st_new = np.where(st_new==nstates, istate, st_new)
+
+            # Accept the proposed hops up in energy with the Boltzmann probability
+            boltzg = np.concatenate( [ boltz[idata][itimes + i] for idata in range(ndata) ] )
+            de = Eg[grp, st_new] - Eg[grp, istate]
+            ksi  = rng.random(Ntraj)
+            accept = (de <= 0.0) | ( ksi < boltzg[grp, istate, st_new] )
+            istate = np.where(accept, st_new, istate)
 
     if return_probabilities == True:
-        return res, P
+        return res, [ [ data_conv.nparray2MATRIX(p) for p in P[idata] ] for idata in range(ndata) ]
     else:    
         return res, None
 
@@ -22,6 +22,7 @@
 import os
 import sys
 import math
+import numpy as np
 
 # Fisrt, we add the location of the library to test to the PYTHON path
 if sys.platform=="cygwin":
@@ -29,6 +30,7 @@ if sys.platform=="cygwin":
 elif sys.platform=="linux" or sys.platform=="linux2":
     from liblibra_core import *
 
+import libra_py.data_conv as data_conv
 #from libra_py import *
 
 
@@ -276,7 +278,6 @@ def ovlp_arb(SD1, SD2, S, use_minimal=True):
                 s.set(i,j,0.0,0.0)
 
     # Checking if the matrix is square
-    print("\nChecking if s is a square matrix ...")
     if s.num_of_rows != s.num_of_cols:
         print("\nWARNING: the matarix of Kohn-Sham orbitial overlaps is not a square matrix") 
         print("\nExiting now ..")
@@ -290,9 +291,164 @@ def ovlp_arb(SD1, SD2, S, use_minimal=True):
     return det(s)
 
 
+def sd_arrays(SD, nbasis, do_sort=True):
+    """Converts a list of SDs into the arrays of orbital indices and spins
+
+    Args:
+        SD ( list of lists of Nel ints ): a list of N SD determinants, such that:
+            SeeAlso: ```inp``` in the ```sd2indx(inp,nbasis)``` function
+
+        nbasis ( int ): the number of 1-el orbitals
+
+        do_sort ( Boolean ): whether to sort the orbital indices, see ```sd2indx```
+
+    Returns:
+        (np.array(N, Nel), np.array(N, Nel)): the indices of the orbitals, as returned by ```sd2indx```,
+            and the spins (+1 or -1) of the electrons, in the original order of the SD entries. These are
+            paired by position, exactly as done in ```ovlp_arb```
+
+    """
+
+    orbs = np.array( [ sd2indx(sd, nbasis, do_sort) for sd in SD ], dtype=int )
+    spins = np.sign( np.array(SD, dtype=int) )
+
+    return orbs, spins
+
+
+
+def _sd_blocks(S, o1, s1, o2, s2):
+    """
+    The matrices of overlaps of the orbitals of the pairs of SDs:
+
+    res[p, i, j] = S[o1[p,i], o2[p,j]] if s1[p,i] * s2[p,j] > 0, 0 otherwise
+
+    where o1, s1 are of shape (npairs, k) and o2, s2 - of shape (npairs, l)
+
+    """
+
+    return S[ o1[:, :, None], o2[:, None, :] ] * ( s1[:, :, None] * s2[:, None, :] > 0 )
+
+
+
+def _det_small(x):
+    """
+    Batched determinants of the matrices x of shape (npairs, k, k): the Slater rules for k = 1 and 2 
+    are used directly, the LU-based np.linalg.det otherwise
+
+    """
+
+    k = x.shape[1]
+
+    if k==0:
+        return np.ones(x.shape[0], dtype=x.dtype)
+    elif k==1:
+        return x[:, 0, 0]
+    elif k==2:
+        return x[:, 0, 0] * x[:, 1, 1] - x[:, 0, 1] * x[:, 1, 0]
+
+    return np.linalg.det(x)
+
+
+
+def _ovlp_full(S, o1, s1, o2, s2, n, m, max_rank=2):
+    """
+    Computes the overlaps <SD1(n[p])|SD2(m[p])> of the full SDs, for all pairs p
+
+    The block of orbital overlaps of the reference pair (SD1(0), SD2(0)) is inverted once. Every other pair
+    differs from the reference in the rows P (the SD1 orbitals that differ from those of SD1(0) at the same 
+    positions) and in the columns Q (same for SD2), so its block is a rank-(|P|+|Q|) update of the reference 
+    block, M = A + E_P X + Y E_Q^T, and by the matrix determinant lemma:
+
+    det(M) = det(A) * det( I + [ [ X A^-1 E_P, X A^-1 Y ], [ E_Q^T A^-1 E_P, E_Q^T A^-1 Y ] ] )
+
+    This is used for the pairs with up to `max_rank` changed orbitals in each of the SDs (single and double
+    excitations), batched over the pairs with the same numbers of changed orbitals. The remaining pairs, or all
+    of them if the reference block is (nearly) singular, are computed by the batched LU decomposition.
+
+    Args:
+        S ( np.array(K, K) ): the overlaps of the 1-el orbitals
+        o1, s1 ( np.array(N, Nel) ): the orbitals and spins of the SD1 set, see ```sd_arrays```
+        o2, s2 ( np.array(M, Nel) ): the orbitals and spins of the SD2 set, see ```sd_arrays```
+        n, m ( np.array(npairs) ): the indices of the SDs in the pairs
+        max_rank ( int ): the maximal number of changed orbitals per SD treated by the update formula
+
+    Returns:
+        np.array(npairs): the overlaps
+
+    """
+
+    npairs, nel = len(n), o1.shape[1]
+    res = np.zeros(npairs, dtype=complex)
+
+    A = _sd_blocks(S, o1[:1], s1[:1], o2[:1], s2[:1])[0]
+    detA = np.linalg.det(A) if nel>0 else 1.0
+    use_update = nel>0 and np.linalg.cond(A) < 1e+10
+
+    if use_update:
+        Ainv = np.linalg.inv(A)
+
+        # Excitation pattern of each SD relative to the reference one
+        dr = (o1 != o1[0]) | (s1 != s1[0])
+        dc = (o2 != o2[0]) | (s2 != s2[0])
+        k = dr.sum(axis=1)[n]
+        l = dc.sum(axis=1)[m]
+
+        todo = np.ones(npairs, dtype=bool)
+        for kk in range(0, min(max_rank, nel)+1):
+            for ll in range(0, min(max_rank, nel)+1):
+                grp = np.where( (k==kk) & (l==ll) )[0]
+                if len(grp)==0:
+                    continue
+                todo[grp] = False
+                ng, ng_ = n[grp], m[grp]
+
+                # Positions of the changed rows and columns
+                P = np.nonzero(dr[ng])[1].reshape(len(grp), kk)
+                Q = np.nonzero(dc[ng_])[1].reshape(len(grp), ll)
+
+                o1P = np.take_along_axis(o1[ng], P, axis=1)
+                s1P = np.take_along_axis(s1[ng], P, axis=1)
+                o2Q = np.take_along_axis(o2[ng_], Q, axis=1)
+                s2Q = np.take_along_axis(s2[ng_], Q, axis=1)
+
+                X = _sd_blocks(S, o1P, s1P, o2[ng_], s2[ng_]) - A[P]                          # (ng, kk, nel)
+                Y = _sd_blocks(S, o1[ng], s1[ng], o2Q, s2Q) - np.swapaxes(A.T[Q], 1, 2)       # (ng, nel, ll)
+                Y[ np.arange(len(grp))[:, None], P, :] = 0.0
+
+                XA = X @ Ainv
+                K = np.zeros( (len(grp), kk+ll, kk+ll), dtype=complex)
+                K[:, :kk, :kk] = np.take_along_axis(XA, np.broadcast_to(P[:, None, :], (len(grp), kk, kk)), axis=2)
+                K[:, :kk, kk:] = XA @ Y
+                K[:, kk:, :kk] = Ainv[ Q[:, :, None], P[:, None, :] ]
+                K[:, kk:, kk:] = Ainv[Q] @ Y
+                K = K + np.identity(kk+ll)
+
+                res[grp] = detA * _det_small(K)
+
+        rest = np.where(todo)[0]
+    else:
+        rest = np.arange(npairs)
+
+    if len(rest)>0:
+        res[rest] = np.linalg.det( _sd_blocks(S, o1[n[rest]], s1[n[rest]], o2[m[rest]], s2[m[rest]]) )
+
+    return res
+
+
+
 def ovlp_mat_arb(SD1, SD2, S, use_minimal=True):
     """Compute a matrix of overlaps in the SD basis 
 
+    The result is the same as that of calling ```ovlp_arb``` for every pair of SDs, but all pairs are
+    computed at once: 
+
+        - with use_minimal=True, the pairs of SDs that differ by k orbitals are grouped together and
+          the k x k determinants are computed for all of them at once (directly, for k = 1 and 2)
+
+        - with use_minimal=False, the overlaps of the singly and doubly excited (with respect to SD1[0] and 
+          SD2[0]) determinants are obtained by the rank-1 to rank-4 updates of the reference determinant,
+          see ```_ovlp_full```
+
     Args:
         SD1 ( list of lists of N ints ): a list of N SD determinants, such that:
             SD1[iSD] is a list of integers defining which orbitals are 
@@ -316,13 +472,58 @@ def ovlp_mat_arb(SD1, SD2, S, use_minimal=True):
     """
 
     N, M = len(SD1), len(SD2)
-    res = CMATRIX(N,M)
 
-    for n in range(0,N):
-        for m in range(0,M):
-            res.set(n,m, ovlp_arb(SD1[n], SD2[m], S, use_minimal))
+    # SDs with different numbers of electrons: the pair-by-pair calculation
+    if len( set( [len(sd) for sd in SD1] + [len(sd) for sd in SD2] ) ) > 1:
+        res = CMATRIX(N,M)
+        for n in range(0,N):
+            for m in range(0,M):
+                res.set(n,m, ovlp_arb(SD1[n], SD2[m], S, use_minimal))
+        return res
 
-    return res
+    nbasis = S.num_of_rows
+    s = np.array( data_conv.nparray_view(S), dtype=complex )
+    o1, s1 = sd_arrays(SD1, nbasis)
+    o2, s2 = sd_arrays(SD2, nbasis)
+    nel = o1.shape[1]
+
+    n, m = np.divmod( np.arange(N*M), M )
+    res = np.zeros(N*M, dtype=complex)
+
+    if use_minimal == True:
+        # Which orbitals of one SD are not present in the other one
+        out1 = ~np.any( o1[n][:, :, None] == o2[m][:, None, :], axis=2)
+        out2 = ~np.any( o2[m][:, :, None] == o1[n][:, None, :], axis=2)
+        k1, k2 = out1.sum(axis=1), out2.sum(axis=1)
+
+        if np.any(k1 != k2):
+            p = np.where(k1 != k2)[0][0]
+            print("\nWARNING: the matarix of Kohn-Sham orbitial overlaps is not a square matrix") 
+            print("\nExiting now ..")
+            print("SD1 = ", SD1[n[p]])
+            print("SD2 = ", SD2[m[p]])
+            sys.exit(0)
+
+        # The SDs made of the same orbitals: the full overlap
+        grp = np.where(k1==0)[0]
+        if len(grp)>0:
+            res[grp] = _ovlp_full(s, o1, s1, o2, s2, n[grp], m[grp])
+
+        # The SDs differing by k orbitals: k x k overlaps of the differing orbitals, with the
+        # spins of the first k electrons of each SD
+        for k in range(1, nel+1):
+            grp = np.where(k1==k)[0]
+            if len(grp)==0:
+                continue
+            i1 = np.argsort(~out1[grp], axis=1, kind="stable")[:, :k]
+            i2 = np.argsort(~out2[grp], axis=1, kind="stable")[:, :k]
+            x = _sd_blocks(s, np.take_along_axis(o1[n[grp]], i1, axis=1), s1[n[grp], :k],
+                              np.take_along_axis(o2[m[grp]], i2, axis=1), s2[m[grp], :k] )
+            res[grp] = _det_small(x)
+
+    else:
+        res = _ovlp_full(s, o1, s1, o2, s2, n, m)
 
+    return data_conv.nparray2CMATRIX( res.reshape(N, M) )
 
 
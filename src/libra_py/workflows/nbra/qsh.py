@@ -21,23 +21,88 @@
 """
 
 
-import cmath
-import math
-import os
-import sys
-
-if sys.platform=="cygwin":
-    from cyglibra_core import *
-elif sys.platform=="linux" or sys.platform=="linux2":
-    from liblibra_core import *
-
+import numpy as np
 
 #import libra_py.common_utils as comn
 import util.libutil as comn
 
 import libra_py.units as units
 import libra_py.influence_spectrum as influence_spectrum
-import libra_py.data_stat as data_stat
+import libra_py.data_conv as data_conv
+import libra_py.data_store as data_store
+from . import hvib_stat
+
+
+def freqs2arrays(freqs, Nfreqs):
+    """Converts the spectral info of all matrix elements into arrays
+
+    Args:
+        freqs ( list of lists of lists ): the spectral info, see `compute_freqs`
+        Nfreqs ( int ): the maximal number of frequencies to use for each matrix element
+
+    Returns:
+        tuple: ( W, A ), both np.array (nstates, nstates, Nfreqs): the frequencies [ units: cm^-1 ] and 
+            the normalized amplitudes of the modes. The elements with fewer than Nfreqs modes are padded 
+            with zero amplitudes
+
+    """
+
+    nstates = len(freqs)
+    W = np.zeros( (nstates, nstates, Nfreqs) )
+    A = np.zeros( (nstates, nstates, Nfreqs) )
+
+    for i in range(0,nstates):
+        for j in range(0,nstates):
+            for k in range(0, min(Nfreqs, len(freqs[i][j]))):
+                W[i,j,k] = freqs[i][j][k][0]
+                A[i,j,k] = freqs[i][j][k][2]
+
+    return W, A
+
+
+
+def _geometric_sum(theta, N):
+    """
+    Returns  Sum_{r=0,N-1} exp(i * theta * r) = exp(i*(N-1)*theta/2) * sin(N*theta/2) / sin(theta/2)
+    """
+
+    s = np.sin(0.5*theta)
+    small = np.abs(s) < 1e-14
+    ratio = np.sin(0.5*N*theta) / np.where(small, 1.0, s)
+
+    return np.where(small, float(N), np.exp(0.5j*(N-1)*theta) * ratio)
+
+
+
+def sines_deviation(A, theta, N):
+    """Computes the deviation of the sum of sines  f(r) = Sum_k A_k * sin(theta_k * r)  over the 
+    points r = 0, ... , N-1, in closed form:
+
+        dev = sqrt( ( Sum_r f(r)^2 - ( Sum_r f(r) )^2 ) / N )
+
+    where the sums over r are obtained from the geometric series:
+
+        Sum_r sin(a*r) = Im G(a),   Sum_r sin(a*r) * sin(b*r) = Re[ G(a-b) - G(a+b) ] / 2,
+        G(a) = Sum_r exp(i*a*r)
+
+    Args:
+        A ( np.array (..., K) ): the amplitudes
+        theta ( np.array (..., K) ): the phase increments per point
+        N ( int ): the number of points
+
+    Returns:
+        np.array (...): the deviations
+
+    """
+
+    S1 = np.sum( A * np.imag( _geometric_sum(theta, N) ), axis=-1 )
+
+    a, b = theta[..., :, None], theta[..., None, :]
+    G = 0.5 * np.real( _geometric_sum(a - b, N) - _geometric_sum(a + b, N) )
+    S2 = np.einsum("...k,...kl,...l->...", A, G, A)
+
+    return np.sqrt( np.maximum( (S2 - S1**2) / float(N), 0.0) )
+
 
 
 def compute_freqs(H_vib, params):
@@ -84,10 +149,6 @@ def compute_freqs(H_vib, params):
     comn.check_input(params, default_params, critical_params)
 
 
-    # Local variables and dimensions
-    nsteps = len(H_vib)    
-    nstates = H_vib[0].num_of_rows
-
     freqs, T,  norm_acf,  raw_acf,  W,  J, J2 = influence_spectrum.compute_all(H_vib, params)  # T in fs, W and freqs in cm^-1
 
     dt = params["dt"]
@@ -95,29 +156,9 @@ def compute_freqs(H_vib, params):
 
     
     # Ok, now we have the function - sum of sines, so let's compute the standard deviation
-    # This is a silly method - just do it numerically
-    dev = [ [ 0.0 for i in range(0,nstates)] for j in range(0,nstates)]
-        
-    for i in range(0,nstates):
-        for j in range(0,nstates):
-
-            # Adjust the number of frequencies
-            nfreqs = params["nfreqs"]            
-            if len(freqs[i][j]) < nfreqs:
-                nfreqs = len(freqs[i][j])
-
-            # Compute the variation of the QSH terms
-            fu_ave, fu2_ave = 0.0, 0.0
-            for r in range(0,1000000):
-
-                fu = 0.0
-                for k in range(0,nfreqs):
-                    fu = fu + freqs[i][j][k][2] * math.sin(conv*freqs[i][j][k][0]*r*dt)
-
-                fu_ave = fu_ave + fu
-                fu2_ave = fu2_ave + fu*fu
-
-            dev[i][j] = math.sqrt( (fu2_ave - fu_ave**2) / 1000000.0 ) 	
+    # over 1000000 time steps - this is done analytically
+    W, A = freqs2arrays(freqs, params["nfreqs"])
+    dev = sines_deviation(A, conv*W*dt, 1000000).tolist()
     
     return freqs, dev
 
@@ -152,45 +193,57 @@ def compute_qs_Hvib(Nfreqs, freqs, t,
 
     """
 
-    nstates = H_vib_re_ave.num_of_cols
-    conv = units.wavn2au
-    
-    Hvib_stoch_re = MATRIX(nstates,nstates)
-    Hvib_stoch_im = MATRIX(nstates,nstates)
+    W, A = freqs2arrays(freqs, Nfreqs)
+    stat = [ data_conv.nparray_view(x) for x in [ H_vib_re_ave, H_vib_re_std, dw_Hvib_re, up_Hvib_re, 
+                                                  H_vib_im_ave, H_vib_im_std, dw_Hvib_im, up_Hvib_im ] ]
 
-    fu = [ [ 0.0 for i in range(0,nstates)] for j in range(0,nstates)]
+    Hvib_stoch = compute_qs_Hvib_batch(np.array([t]), W, A, *stat, np.array(dev))
 
-    for i in range(0,nstates):
-        for j in range(0,nstates):
-            # Adjust the number of frequencies
-            nfreqs = Nfreqs
-            if len(freqs[i][j]) < Nfreqs:
-                nfreqs = len(freqs[i][j])
+    return data_conv.nparray2CMATRIX(Hvib_stoch[0])
 
-            for k in range(0,nfreqs):
-                fu[i][j] = fu[i][j] + freqs[i][j][k][2] * math.sin(conv*freqs[i][j][k][0]*t)
 
 
-    for i in range(0,nstates):
-        for j in range(0,nstates):
-            if i==j:
-                xab = H_vib_re_ave.get(i,j) + H_vib_re_std.get(i,j) * (fu[i][j]/dev[i][j] ) 
-                if xab < dw_Hvib_re.get(i,j):
-                    xab = dw_Hvib_re.get(i,j)
-                elif xab > up_Hvib_re.get(i,j):
-                    xab = up_Hvib_re.get(i,j)
-                Hvib_stoch_re.set(i,j,   xab )
-
-            elif i<j:
-                xab = H_vib_im_ave.get(i,j) + H_vib_im_std.get(i,j) * (fu[i][j]/dev[i][j] ) 
-                if xab < dw_Hvib_im.get(i,j):
-                    xab = dw_Hvib_im.get(i,j)
-                elif xab > up_Hvib_im.get(i,j):
-                    xab = up_Hvib_im.get(i,j)
-                Hvib_stoch_im.set(i,j,  -xab )
-                Hvib_stoch_im.set(j,i,   xab )
-
-    Hvib_stoch = CMATRIX(Hvib_stoch_re, Hvib_stoch_im)
+
+def compute_qs_Hvib_batch(t, W, A, 
+                          H_vib_re_ave, H_vib_re_std, dw_Hvib_re, up_Hvib_re, 
+                          H_vib_im_ave, H_vib_im_std, dw_Hvib_im, up_Hvib_im, 
+                          dev):
+    """Compute the QSH Hamiltonians for many times at once, see `compute_qs_Hvib`
+
+    Args:
+        t ( np.array (nt,) ): times at which we want to reconstruct the QSH [ units: a.u. ]
+        W ( np.array (nstates, nstates, nfreqs) ): frequencies of the modes [ units: cm^-1 ], see `freqs2arrays`
+        A ( np.array (nstates, nstates, nfreqs) ): normalized amplitudes of the modes, see `freqs2arrays`
+        H_vib_re_ave, H_vib_re_std, dw_Hvib_re, up_Hvib_re ( np.array (nstates, nstates) ): average, std,
+            minimal and maximal values of the real part of the direct Hamiltonian
+        H_vib_im_ave, H_vib_im_std, dw_Hvib_im, up_Hvib_im ( np.array (nstates, nstates) ): same for the
+            imaginary part
+        dev ( np.array (nstates, nstates) ): std of the sums of the modes, see `compute_freqs`
+
+    Returns: 
+        np.array (nt, nstates, nstates) of complex: the QSH vibronic Hamiltonians at the given times
+
+    """
+
+    nstates = W.shape[0]
+    conv = units.wavn2au
+
+    # Sums of the modes for all times and matrix elements
+    fu = np.einsum("ijk,tijk->tij", A, np.sin( conv * W[None] * t[:, None, None, None] ) )
+    fu = np.where(dev > 0.0, fu / np.where(dev > 0.0, dev, 1.0), 0.0)
+
+    # Energies: the diagonal of the real part
+    diag = np.arange(nstates)
+    x_re = np.clip( H_vib_re_ave + H_vib_re_std * fu, dw_Hvib_re, up_Hvib_re )
+
+    # Couplings: the upper triangle defines the anti-symmetric imaginary part
+    x_im = np.clip( H_vib_im_ave + H_vib_im_std * fu, dw_Hvib_im, up_Hvib_im )
+    upper = np.triu( np.ones( (nstates, nstates), dtype=bool), 1 )
+    im = np.where(upper, -x_im, 0.0)
+    im = im - np.swapaxes(im, 1, 2)
+
+    Hvib_stoch = 1j * im
+    Hvib_stoch[:, diag, diag] += x_re[:, diag, diag]
 
     return Hvib_stoch
 
@@ -237,16 +290,27 @@ def run(H_vib, params):
             * **params["qsh_Hvib_im_suffix"]** ( string ): suffixes of the output files with imaginary part
                 of the QSH vibronic Hamiltonian at time t
 
+            * **params["qsh_store_filename"]** ( string or None ): if not None, the QSH Hamiltonians of each data set 
+                are also written into the HDF5 file "<output_set_paths[idata]><qsh_store_filename>", as the dataset 
+                `data_store.dataset_name(params["qsh_Hvib_re_prefix"])`, so they can be read by `data_read.get_data_sets`
+                with the same "store_filename" [ default: None ]
+
+            * **params["return_Hvib"]** ( Boolean ): whether to return the QSH Hamiltonians as the CMATRIX objects, 
+                e.g. to pass them directly to `step4.run`. Set it to False if they are only written into the
+                files [ default: True ]
+
+            * **params["chunk_size"]** ( int ): the number of QSH Hamiltonians computed at once [ default: 1000 ]
+
     Returns: 
         ( list of lists ): qsh_H_vib, such as
             qsh_H_vib[idata][istep] - is a CMATRIX(nstates, nstates) object representing a vibronic Hamiltonian
-            predicted for the time step `istep` using the training dataset `idata`
+            predicted for the time step `istep` using the training dataset `idata`. The lists are empty
+            if params["return_Hvib"] is False
      
     """
 
     # General dimensions
     ndata = len(H_vib)
-    nstates = H_vib[0][0].num_of_cols
     output_set_paths = []
     for i in range(0,ndata): 
         output_set_paths.append( "QSH_%s" % (i) )
@@ -257,13 +321,15 @@ def run(H_vib, params):
                        "do_QSH_output":False,
                        "output_set_paths":output_set_paths,
                        "qsh_Hvib_re_prefix":"qsh_Hvib_", "qsh_Hvib_im_prefix":"qsh_Hvib_",
-                       "qsh_Hvib_re_suffix":"_re",   "qsh_Hvib_im_suffix":"_im" }
+                       "qsh_Hvib_re_suffix":"_re",   "qsh_Hvib_im_suffix":"_im",
+                       "qsh_store_filename":None, "return_Hvib":True, "chunk_size":1000 }
     comn.check_input(params, default_params, critical_params)
 
     # Local parameters
     nfreqs = params["nfreqs"]
     nsteps = params["nsteps"]
     dt = params["dt"]
+    chunk_size = params["chunk_size"]
 
     # Parameters for the undelying functions
     params1 = dict(params)
@@ -274,40 +340,37 @@ def run(H_vib, params):
 
     for idata in range(0,ndata):   # over all MD trajectories (data sets)
         
-        #======== Split complex-valued matrices into real and imaginary sets ============
-
-        H_vib_re = []  # list of MATRIX
-        H_vib_im = []  # list of MATRIX
-
-        nsteps0 = len(H_vib[idata])   
-        for i in range(0,nsteps0):
-            H_vib_re.append(H_vib[idata][i].real())
-            H_vib_im.append(H_vib[idata][i].imag())
-
-
-        #======== Analyze the Hvib time-seris  ============
-        H_vib_re_ave, H_vib_re_std, dw_Hvib_re, up_Hvib_re = data_stat.mat_stat(H_vib_re)
-        H_vib_im_ave, H_vib_im_std, dw_Hvib_im, up_Hvib_im = data_stat.mat_stat(H_vib_im)    
-
+        #======== Analyze the Hvib time-seris: real and imaginary parts ============
+        re, im = hvib_stat.hvib_stat(H_vib[idata])
         
         freqs, dev = compute_freqs(H_vib[idata], params1)   # freqs are in cm^-1
+        W, A = freqs2arrays(freqs, nfreqs)
 
         
-        #============= Output the resulting QSH Hamiltonians ===========================
+        #============= Compute and output the resulting QSH Hamiltonians ===========================
         Hvib = []
-        for i in range(0,nsteps):
-            # compute QSH Hvib at time t_i = i * dt
-            qs_Hvib = compute_qs_Hvib(nfreqs, freqs, i*dt, H_vib_re_ave, H_vib_re_std, dw_Hvib_re, 
-                            up_Hvib_re, H_vib_im_ave, H_vib_im_std, dw_Hvib_im, up_Hvib_im,  dev)
+        for istart in range(0, nsteps, chunk_size):
+            # compute QSH Hvib at times t_i = i * dt
+            t = np.arange(istart, min(istart + chunk_size, nsteps)) * dt
+            qs_Hvib = compute_qs_Hvib_batch(t, W, A, re.mean, re.std(), re.min, re.max,
+                                            im.mean, im.std(), im.min, im.max, np.array(dev))
+
+            if params["return_Hvib"]==True:
+                for x in qs_Hvib:
+                    Hvib.append( data_conv.nparray2CMATRIX(x) )
 
-            Hvib.append(CMATRIX(qs_Hvib))
+            if params["qsh_store_filename"]!=None:
+                data_store.append_matrices(params["output_set_paths"][idata] + params["qsh_store_filename"],
+                                           data_store.dataset_name(params["qsh_Hvib_re_prefix"]), istart, qs_Hvib)
 
             if params["do_QSH_output"]==True:
                 #============= Output the resulting QSH Hamiltonians ===========================
-                re_filename = prms["output_set_paths"][idata] + prms["qsh_Hvib_re_prefix"] + str(i) + prms["qsh_Hvib_re_suffix"]
-                im_filename = prms["output_set_paths"][idata] + prms["qsh_Hvib_im_prefix"] + str(i) + prms["qsh_Hvib_im_suffix"]        
-                qs_Hvib.real().show_matrix(re_filename)
-                qs_Hvib.imag().show_matrix(im_filename)
+                for k in range(len(t)):
+                    i = istart + k
+                    re_filename = params["output_set_paths"][idata] + params["qsh_Hvib_re_prefix"] + str(i) + params["qsh_Hvib_re_suffix"]
+                    im_filename = params["output_set_paths"][idata] + params["qsh_Hvib_im_prefix"] + str(i) + params["qsh_Hvib_im_suffix"]        
+                    data_conv.nparray2MATRIX( np.real(qs_Hvib[k]) ).show_matrix(re_filename)
+                    data_conv.nparray2MATRIX( np.imag(qs_Hvib[k]) ).show_matrix(im_filename)
 
         qsh_H_vib.append(Hvib)        
         
@@ -19,6 +19,7 @@
 
 import os
 import sys
+import shutil
 
 # Fisrt, we add the location of the library to test to the PYTHON path
 if sys.platform=="cygwin":
@@ -28,6 +29,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 from libra_py import QE_methods
 from libra_py import QE_utils
 from libra_py import units
+from libra_py import local_scheduler
 
 #import libra_py.common_utils as comn
 import util.libutil as comn
@@ -37,6 +39,162 @@ from . import compute_hprime
 
 
 
+def process_pair(params, curr_index):
+    """Computes the properties of interest (the overlaps, energies, and optionally the <i|H'|j> matrices)
+    for the pair of the adjacent snapshots curr_index and curr_index+1, using the results of the QE 
+    calculations stored in the "curr0" and "next0" (and "curr1" and "next1" for the SOC calculations)
+    sub-directories of the working directory params["wd"]
+
+    Args:
+        params ( dictionary ): Simulation control parameters, see `run`
+        curr_index ( int ): the index of the first snapshot of the pair
+
+    Returns:
+        None: but generates the files with couplings, energies and transition density matrices
+
+    """
+
+    rd = params["rd"]
+    dt = params["dt"]
+    wd = params["wd"]
+    nac_method = params["nac_method"]
+    compute_Hprime = params["compute_Hprime"]
+    verbosity = params["verbosity"]
+
+    # Update curr_index in params - this may be useful
+    params["curr_index"] = curr_index
+
+    # First see wether the calculation is what we wanted
+    info0, all_e_dum0, info1, all_e_dum1 = QE_methods.read_info(params)
+
+    # Read present and next electronic structure (es) in a formatted way
+    es_curr, es_next = QE_methods.read_wfc_grid(params) 
+
+    # Finally,  using the current and the next wavefunctions to compute the properties of interest
+
+    # For the non-relativistic and either spin or non-spin-polarized case
+
+    if nac_method == 0 or nac_method == 1 or nac_method == 3:
+        if ( info0["nspin"]==1 and info0["nk"]==1 ) or ( info0["nspin"]==2 and info0["nk"] == 2) : # Non-SOC case
+
+            # Only one k-point. For the spin-polarized case, the beta orbtials are as if they were computed using 2 K-points
+            # (nk = 2). However, they are not. This is just the QE format for expressing alpha and beta orbitals at a single K-point 
+            #if info0["nk"]==1 or info0["nk"] == 2:  
+
+            if verbosity>0:
+                print( "Computing various properies of the spin-diabatic (non-relativistic) KS orbitals using a single K-point")
+
+            # Compute various properties of the spin-diabatic (non-relativistic) KS orbitals at a single K-point 
+            compute_properties.compute_properties_onekpt(params, es_curr, es_next, curr_index)
+
+        else: 
+
+            # Compute various properies of the spin-diabatic (non-relativistic) KS orbitals using multiple K-point
+            if verbosity>0:
+                print( "Computing various properies of the spin-diabatic (non-relativistic) KS orbitals using multiple K-points")
+                print( "Warning: This capabilitiy is under development and not fully tested")
+
+            print ("This capability is temporarily disabled. Please use only a single K-point for now")
+            print ("Exiting now")
+            sys.exit(0)
+            #compute_properties.compute_properties_general(params, es_curr, es_next, curr_index)
+
+        if compute_Hprime == True:
+
+            # Compute the transition dipole moment along the nuclear trajectory
+            if verbosity>0:
+                print( "Computing the transition dipole moment along the nuclear trajectory")
+                print( "Warning: This capabilitiy is under development and not fully tested")
+
+            # C++ implementation
+            compute_hprime.compute_hprime_dia(es_curr, info0, "%s/0_Hprime_%d" % (rd, curr_index) )
+
+            # Python implementation
+            #compute_hprime.hprime_py(es_curr, info0, "%s/0_Hprime_%d" % (rd, curr_index) )
+
+
+    # For the relativistic case
+    if nac_method == 2 or nac_method == 3:
+
+        # Only one k-point
+        if info1["nk"]==1:
+
+            if verbosity>0:
+                print( "Computing various properies of the spin-adiabatic (relativistic) KS orbitals using a single K-point")
+
+            # Compute various properties of the spin-adiabatic (relativistic) KS orbitals at a single K-point              
+            compute_properties.compute_properties_onekpt(params, es_curr, es_next, curr_index)
+            #compute_properties.compute_properties_adi_gamma(params, es_curr, es_next, curr_index)
+
+        else:
+            print( "Multiple k-points scheme with SOC is not yet implemented")
+            sys.exit(0)
+
+
+    # Checking if spin-adiabtic and spin-diabatic cases were using the same sized P\plane wave basis
+    if  nac_method == 3:
+
+        print( "nac_method == 3: Entering check for whether the adiabatic and diabatic basis have the same number of plane waves")
+
+        # Check whether the adiabatic and diabatic basis have the same number of plane waves
+        # the reason why I used the read_qe_wfc_info is because I will need the ngw 
+        # to check the consistency 
+        # But the read_qe_index does not read it, so in order to avoid the changes in the Libra code, 
+        # I use the read_qe_wfc_info.
+
+        info_wfc0 = QE_methods.read_qe_wfc_info("%s/curr0/x0.export/wfc.1" % wd,0)
+        info_wfc1 = QE_methods.read_qe_wfc_info("%s/curr1/x1.export/wfc.1" % wd,0)
+
+        if info_wfc0["ngw"] != info_wfc1["ngw"]:
+            print( "Error: The number of plane waves of diabatic and adiabatic functions should be equal")
+            sys.exit(0)
+        else:
+            print( "Pass: The number of plane waves of diabatic and adiabatic functions are equal")
+
+        params1 = {"do_orth": 0, "root_directory": rd, "curr_index": curr_index, "print_overlaps": 1, "dt": dt}
+        compute_ovlps(coeff_curr0, coeff_next0, coeff_curr1, coeff_next1, e_curr0, e_next0, e_curr1, e_next1, params1)
+
+
+
+
+def copy_results(params, t, dir0, dir1):
+    """Copies the index files and the QE output of the snapshot t to the results directory params["rd"]
+
+    Args:
+        params ( dictionary ): Simulation control parameters, see `run`
+        t ( int ): the index of the snapshot
+        dir0 ( string ): the directory with the results of the calculations without SOC
+        dir1 ( string ): the directory with the results of the calculations with SOC
+
+    """
+
+    rd = params["rd"]
+    nac_method = params["nac_method"]
+    pdos_flg = params["pdos_flg"]
+
+    if nac_method == 0 or nac_method == 1 or nac_method==3:
+        # The input file template defined in params["prefix0"] should have   prefix = 'x0' !
+        os.system("cp %s/x0.export/index.xml %s/x0_index_%i.xml" % (dir0, rd, t))
+        os.system("cp %s/x0.save/data-file-schema.xml %s/x0_data-file-schema_%i.xml" % (dir0, rd, t))
+        os.system("cp %s/%s.%d.out %s/%s.%d.out" % (dir0, params["prefix0"], t, rd, params["prefix0"], t))
+
+        if pdos_flg == 1:
+            print ("Entering pdos_flag == 1: Outputting files necessary for computing pDOS calculations with projwfc.x")
+            print ("Warning: Crashes at this point may result from QE versioning. This flag is currently compatable with QE v6.2.1")
+            print ("Warning: This flag is tested only for non-relativisitic cases")
+
+            os.system("cp %s/x0.save/charge-density.dat %s/x0_charge-density_%i.dat" % (dir0, rd, t))
+            os.system("cp %s/x0.save/wfcdw1.dat %s/x0_wfcdw1_%i.dat" % (dir0, rd, t))
+            os.system("cp %s/x0.save/wfcup1.dat %s/x0_wfcup1_%i.dat" % (dir0, rd, t))
+
+    if nac_method == 2 or nac_method == 3:
+        # The input file template defined in params["prefix1"] should have   prefix = 'x1' !
+        os.system("cp %s/x1.export/index.xml %s/x1_index_%i.xml" % (dir1, rd, t))
+        os.system("cp %s/x1.save/data-file-schema.xml %s/x1_data-file-schema_%i.xml" % (dir1, rd, t))
+        os.system("cp %s/%s.%d.out %s/%s.%d.out" % (dir1, params["prefix1"], t, rd, params["prefix1"], t))
+
+
+
 def run(params):
     """This function is the main driver for the NAC calculations withing the workflows/nbra
 
@@ -61,7 +219,25 @@ def run(params):
             - 3 : spin-polarized and non-collinear calculation (SOC)
 
         * **params["compute_Hprime"]** ( Boolean ): the flag to compute the <i|H'|j> matrices [ default: False]
+        * **params["output_format"]** ( int ): how to write the S, St, E, and hvib matrices:
+
+            - 0 : as the text files, two per matrix and time step [default]
+            - 1 : into a single HDF5 file in the "rd" directory, see `libra_py.data_store`
+            - 2 : both
+
+        * **params["store_filename"]** ( string ): the name of the HDF5 file [ default: "data.h5" ]
         * **params["verbosity"]** ( int ): the verbosity level regarding the execution of the current function [default: 0]
+        * **params["use_scheduler"]** ( Boolean ): if True, the QE calculations for all the snapshots are run
+            concurrently on the local computer, see `run_pool`; otherwise, they are run one after another [ default: False ]
+        * **params["nprocs"]** ( int ): the maximal number of the concurrent QE calculations [ default: 1 ]
+        * **params["threads_per_job"]** ( int ): the number of OpenMP threads of each QE calculation [ default: 1 ]
+        * **params["scratch_dir"]** ( string ): the directory where the calculations for each snapshot are 
+            run [ default: "scratch" ]
+        * **params["max_retries"]** ( int ): how many times a failed calculation is restarted [ default: 1 ]
+        * **params["keep_scratch"]** ( Boolean ): whether to keep the directories of the snapshots once they are 
+            processed [ default: False ]
+        * **params["pool_inputs"]** ( list of strings ): the additional files copied into the directory of each
+            snapshot, e.g. the pseudopotentials, if they are given by relative paths [ default: [] ]
 
 
         ..seealso:: parameters of ::funct::```run_qe``` function
@@ -101,21 +277,19 @@ def run(params):
                        "nac_method":0,
                        "pdos_flg":0,
                        "compute_Hprime":False, 
-                       "verbosity":0
+                       "output_format":0, "store_filename":"data.h5",
+                       "verbosity":0,
+                       "use_scheduler":False, "nprocs":1, "threads_per_job":1, "scratch_dir":"scratch",
+                       "max_retries":1, "keep_scratch":False, "pool_inputs":[]
                      }
     comn.check_input(params, default_params, critical_params)
 
 
-    rd = params["rd"]
-
     start_indx = int(params["start_indx"]) 
     stop_indx  = int(params["stop_indx"]) 
-    dt = params["dt"]
     wd = params["wd"]
     nac_method = params["nac_method"]
-    compute_Hprime = params["compute_Hprime"]
     verbosity = params["verbosity"]    
-    pdos_flg = params["pdos_flg"]
 
     if verbosity>0:
         print( "Starting trajectory.run")
@@ -140,6 +314,11 @@ def run(params):
         sys.exit(0)
 
 
+    if params["use_scheduler"]==True:
+        run_pool(params)
+        return
+
+
 
     # Initialize variables
     curr_index = start_indx - 1
@@ -178,99 +357,7 @@ def run(params):
         
         if curr_index>=start_indx:
 
-            # Update curr_index in params - this may be useful
-            params["curr_index"] = curr_index
-
-            # First see wether the calculation is what we wanted
-            info0, all_e_dum0, info1, all_e_dum1 = QE_methods.read_info(params)
-
-            # Read present and next electronic structure (es) in a formatted way
-            es_curr, es_next = QE_methods.read_wfc_grid(params) 
-
-            # Finally,  using the current and the next wavefunctions to compute the properties of interest
-
-            # For the non-relativistic and either spin or non-spin-polarized case
-
-            if nac_method == 0 or nac_method == 1 or nac_method == 3:
-                if ( info0["nspin"]==1 and info0["nk"]==1 ) or ( info0["nspin"]==2 and info0["nk"] == 2) : # Non-SOC case
-
-                    # Only one k-point. For the spin-polarized case, the beta orbtials are as if they were computed using 2 K-points
-                    # (nk = 2). However, they are not. This is just the QE format for expressing alpha and beta orbitals at a single K-point 
-                    #if info0["nk"]==1 or info0["nk"] == 2:  
-
-                    if verbosity>0:
-                        print( "Computing various properies of the spin-diabatic (non-relativistic) KS orbitals using a single K-point")
-
-                    # Compute various properties of the spin-diabatic (non-relativistic) KS orbitals at a single K-point 
-                    compute_properties.compute_properties_onekpt(params, es_curr, es_next, curr_index)
-
-                else: 
-
-                    # Compute various properies of the spin-diabatic (non-relativistic) KS orbitals using multiple K-point
-                    if verbosity>0:
-                        print( "Computing various properies of the spin-diabatic (non-relativistic) KS orbitals using multiple K-points")
-                        print( "Warning: This capabilitiy is under development and not fully tested")
-
-                    print ("This capability is temporarily disabled. Please use only a single K-point for now")
-                    print ("Exiting now")
-                    sys.exit(0)
-                    #compute_properties.compute_properties_general(params, es_curr, es_next, curr_index)
-           
-                if compute_Hprime == True:
-
-                    # Compute the transition dipole moment along the nuclear trajectory
-                    if verbosity>0:
-                        print( "Computing the transition dipole moment along the nuclear trajectory")
-                        print( "Warning: This capabilitiy is under development and not fully tested")
-
-                    # C++ implementation
-                    compute_hprime.compute_hprime_dia(es_curr, info0, "%s/0_Hprime_%d" % (rd, curr_index) )
-
-                    # Python implementation
-                    #compute_hprime.hprime_py(es_curr, info0, "%s/0_Hprime_%d" % (rd, curr_index) )
-               
-
-            # For the relativistic case
-            if nac_method == 2 or nac_method == 3:
-
-                # Only one k-point
-                if info1["nk"]==1:
-
-                    if verbosity>0:
-                        print( "Computing various properies of the spin-adiabatic (relativistic) KS orbitals using a single K-point")
-
-                    # Compute various properties of the spin-adiabatic (relativistic) KS orbitals at a single K-point              
-                    compute_properties.compute_properties_onekpt(params, es_curr, es_next, curr_index)
-                    #compute_properties.compute_properties_adi_gamma(params, es_curr, es_next, curr_index)
-
-                else:
-                    print( "Multiple k-points scheme with SOC is not yet implemented")
-                    sys.exit(0)
-
-            
-            # Checking if spin-adiabtic and spin-diabatic cases were using the same sized P\plane wave basis
-            if  nac_method == 3:
-
-                print( "nac_method == 3: Entering check for whether the adiabatic and diabatic basis have the same number of plane waves")
-             
-                # Check whether the adiabatic and diabatic basis have the same number of plane waves
-                # the reason why I used the read_qe_wfc_info is because I will need the ngw 
-                # to check the consistency 
-                # But the read_qe_index does not read it, so in order to avoid the changes in the Libra code, 
-                # I use the read_qe_wfc_info.
-
-                info_wfc0 = QE_methods.read_qe_wfc_info("%s/curr0/x0.export/wfc.1" % wd,0)
-                info_wfc1 = QE_methods.read_qe_wfc_info("%s/curr1/x1.export/wfc.1" % wd,0)
-
-                if info_wfc0["ngw"] != info_wfc1["ngw"]:
-                    print( "Error: The number of plane waves of diabatic and adiabatic functions should be equal")
-                    sys.exit(0)
-                else:
-                    print( "Pass: The number of plane waves of diabatic and adiabatic functions are equal")
- 
-                params1 = {"do_orth": 0, "root_directory": rd, "curr_index": curr_index, "print_overlaps": 1, "dt": dt}
-                compute_ovlps(coeff_curr0, coeff_next0, coeff_curr1, coeff_next1, e_curr0, e_next0, e_curr1, e_next1, params1)
-
+            process_pair(params, curr_index)
             #-----------------------------------------------------------------
 
             # Remove current run, make next run to be the current one
@@ -287,27 +374,7 @@ def run(params):
        
       
         # Move the index files to the results directory, just don't copy the very last one - it is a repetition
-        #if t<stop_indx:
-        if nac_method == 0 or nac_method == 1 or nac_method==3:
-            # The input file template defined in params["prefix0"] should have   prefix = 'x0' !
-            os.system("cp %s/curr0/x0.export/index.xml %s/x0_index_%i.xml" % (wd, rd, t))
-            os.system("cp %s/curr0/x0.save/data-file-schema.xml %s/x0_data-file-schema_%i.xml" % (wd, rd, t))
-            os.system("cp %s/curr0/%s.%d.out %s/%s.%d.out" % (wd, params["prefix0"], t, rd, params["prefix0"], t))
-
-            if pdos_flg == 1:
-                print ("Entering pdos_flag == 1: Outputting files necessary for computing pDOS calculations with projwfc.x")
-                print ("Warning: Crashes at this point may result from QE versioning. This flag is currently compatable with QE v6.2.1")
-                print ("Warning: This flag is tested only for non-relativisitic cases")
-
-                os.system("cp %s/curr0/x0.save/charge-density.dat %s/x0_charge-density_%i.dat" % (wd, rd, t))
-                os.system("cp %s/curr0/x0.save/wfcdw1.dat %s/x0_wfcdw1_%i.dat" % (wd, rd, t))
-                os.system("cp %s/curr0/x0.save/wfcup1.dat %s/x0_wfcup1_%i.dat" % (wd, rd, t))
-
-        if nac_method == 2 or nac_method == 3:
-            # The input file template defined in params["prefix1"] should have   prefix = 'x1' !
-            os.system("cp %s/curr1/x1.export/index.xml %s/x1_index_%i.xml" % (wd, rd, t))
-            os.system("cp %s/curr1/x1.save/data-file-schema.xml %s/x1_data-file-schema_%i.xml" % (wd, rd, t))
-            os.system("cp %s/curr1/%s.%d.out %s/%s.%d.out" % (wd, params["prefix1"], t, rd, params["prefix1"], t))
+        copy_results(params, t, "%s/curr0" % wd, "%s/curr1" % wd)
       
     
         # ACHTUNG!!! Restoring wfc makes some complications, so we might need to destroy wfc objects
@@ -321,3 +388,115 @@ def run(params):
         t = t + 1
 
 
+
+def qe_commands(params, prefix, exp_prefix, t):
+    """Returns the shell commands running the QE calculation for the snapshot t and the export 
+    of its wavefunctions, same as in `QE_methods.run_qe`
+
+    Args:
+        params ( dictionary ): Simulation control parameters, see `QE_methods.run_qe`
+        prefix ( string ): the prefix of the scf input file, e.g. "x0.scf"
+        exp_prefix ( string ): the prefix of the export input file, e.g. "x0"
+        t ( int ): the index of the snapshot
+
+    Returns:
+        list of strings: the commands
+
+    """
+
+    exe, exe_export = params["EXE"], params["EXE_EXPORT"]
+    if params["BATCH_SYSTEM"]!=None:
+        exe = "%s -n %s %s" % (params["BATCH_SYSTEM"], params["NP"], exe)
+        exe_export = "%s -n %s %s" % (params["BATCH_SYSTEM"], params["NP"], exe_export)
+
+    return [ "%s < %s.%d.in > %s.%d.out" % (exe, prefix, t, prefix, t),
+             "%s < %s.exp.in > %s.exp.out" % (exe_export, exp_prefix, exp_prefix) ]
+
+
+
+def run_pool(params):
+    """Runs the QE calculations for the snapshots start_indx, ... , stop_indx concurrently on the local 
+    computer, each in its own directory "<scratch_dir>/snap_<t>", see `local_scheduler.task_pool`. 
+    The properties of each pair of the adjacent snapshots are computed by `process_pair` as soon as both 
+    calculations are done, while the other calculations are still running. 
+
+    The progress is stored in the file "<scratch_dir>/manifest.json", so the interrupted calculations 
+    can be restarted by calling this function again: only the unfinished snapshots and pairs are computed.
+
+    The number of the concurrent calculations is limited such that nprocs * NP * threads_per_job 
+    (NP - only if BATCH_SYSTEM is not None) does not exceed the number of CPUs
+
+    Args:
+        params ( dictionary ): Simulation control parameters, see `run` and `QE_methods.run_qe`
+
+    Returns:
+        list of strings: the names of the snapshot calculations that failed
+
+    """
+
+    critical_params = [ "EXE", "EXE_EXPORT" ] 
+    default_params = { "BATCH_SYSTEM":"srun", "NP":1, "prefix0":"x0.scf", "prefix1":"x1.scf" }
+    comn.check_input(params, default_params, critical_params)
+
+    start_indx = int(params["start_indx"]) 
+    stop_indx  = int(params["stop_indx"]) 
+    nac_method = params["nac_method"]
+    prefix0 = params["prefix0"]
+    prefix1 = params["prefix1"]
+
+    cpus_per_job = params["threads_per_job"]
+    if params["BATCH_SYSTEM"]!=None:
+        cpus_per_job = cpus_per_job * params["NP"]
+    nworkers = local_scheduler.n_workers(params["nprocs"], cpus_per_job)
+
+    pool = local_scheduler.task_pool(params["scratch_dir"], None, nworkers, params["threads_per_job"], 1.0,
+                                     params["max_retries"], None, 0.1, params["keep_scratch"], params["verbosity"])
+
+    def _check(dirname):
+        res = True
+        if nac_method == 0 or nac_method == 1 or nac_method == 3:
+            res = res and os.path.isfile("%s/x0.export/index.xml" % dirname)
+        if nac_method == 2 or nac_method == 3:
+            res = res and os.path.isfile("%s/x1.export/index.xml" % dirname)
+        return res
+
+    def _copy(key, t):
+        dirname = pool.task_dir("snap_%d" % t)
+        copy_results(params, t, dirname, dirname)
+
+    def _pair(key, curr_index):
+        # The working directory of this pair - links to the directories of the two snapshots
+        wd = os.path.join(pool.scratch_dir, "pair_%d" % curr_index)
+        if os.path.isdir(wd):
+            shutil.rmtree(wd)
+        os.makedirs(wd)
+
+        for name, t in [ ("curr0", curr_index), ("next0", curr_index+1), ("curr1", curr_index), ("next1", curr_index+1) ]:
+            os.symlink(pool.task_dir("snap_%d" % t), os.path.join(wd, name))
+
+        prms = dict(params)
+        prms["wd"] = wd
+        process_pair(prms, curr_index)
+
+        shutil.rmtree(wd)   # removes only the links
+
+    for t in range(start_indx, stop_indx+1):
+        inputs = list(params["pool_inputs"])
+        commands = []
+
+        if nac_method == 0 or nac_method == 1 or nac_method == 3:
+            inputs = inputs + [ "%s.%d.in" % (prefix0, t), "x0.exp.in" ]
+            commands = commands + qe_commands(params, prefix0, "x0", t)
+
+        if nac_method == 2 or nac_method == 3:
+            inputs = inputs + [ "%s.%d.in" % (prefix1, t), "x1.exp.in" ]
+            commands = commands + qe_commands(params, prefix1, "x1", t)
+
+        pool.add_task("snap_%d" % t, " && ".join(commands), inputs, None, _check)
+        pool.add_post("copy_%d" % t, ["snap_%d" % t], lambda key, t=t: _copy(key, t))
+
+    for t in range(start_indx, stop_indx):
+        pool.add_post("pair_%d" % t, ["snap_%d" % t, "snap_%d" % (t+1)], lambda key, t=t: _pair(key, t))
+
+    return pool.run()
+
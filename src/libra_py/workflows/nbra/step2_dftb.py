@@ -31,6 +31,8 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 from libra_py import DFTB_methods
 from libra_py import units
 from libra_py import data_io
+from libra_py import data_store
+from libra_py import local_scheduler
 import util.libutil as comn
 
 
@@ -227,36 +229,63 @@ def do_step(snap, params):
         os.system("cp %s dftb_in.hsd" % hs_in_file )
         os.system( "%s" % EXE )
 
-        # [0] is because we extract just the gamma-point
-        F = DFTB_methods.get_dftb_matrices("hamsqr1.dat")
-        S = DFTB_methods.get_dftb_matrices("oversqr.dat")   
-        
-        # Get the dimensions
-        ao_sz = F[0].num_of_cols        
-        ao_act_sp = list(range(0, ao_sz))
-    
-        mo_sz = ao_sz
-        mo_act_sp = list(range(0, mo_sz))
-    
-        if params["mo_active_space"] != None:
-            mo_sz = len(params["mo_active_space"])        
-            mo_act_sp = list(params["mo_active_space"])
-
-        # Solve the eigenvalue problem with the converged Fock matrix
-        # get the converged MOs
-        E = CMATRIX(ao_sz, ao_sz)
-        MO = CMATRIX(ao_sz, ao_sz)
-        solve_eigen(F[0], S[0], E, MO, 0)  
-
-        # Extract the E sub-matrix
-        E_sub = CMATRIX(mo_sz, mo_sz)
-        pop_submatrix(E, E_sub, mo_act_sp, mo_act_sp)  
-    
-        # Extract the MO sub-matrix
-        MO_sub = CMATRIX(ao_sz, mo_sz)
-        pop_submatrix(MO, MO_sub, ao_act_sp, mo_act_sp)  
+        return read_step(params, ".")
+
+
+
+def read_step(params, dirname):
+    """
+
+    Reads the H and S matrices produced by the DFTB+ calculations for one geometry (see `do_step`)
+    and computes the MOs
+
+    Args:
+        params ( dictionary ): the control parameters of the simulation
+
+            * **params["mo_active_space"]** ( list of ints or None ): indices of the MOs we care about 
+                The indexing starts from 0, not 1! If set to None - all MOs will be returned. [default: None]
+
+        dirname ( string ): the directory with the "hamsqr1.dat" and "oversqr.dat" files
+
+    Returns:
+        tuple: (Ei, MOi, Hi, Si), see `do_step`
+
+    """
+
+    critical_params = [ ] 
+    default_params = { "mo_active_space":None }
+    comn.check_input(params, default_params, critical_params)
+
+    # [0] is because we extract just the gamma-point
+    F = DFTB_methods.get_dftb_matrices(os.path.join(dirname, "hamsqr1.dat"))
+    S = DFTB_methods.get_dftb_matrices(os.path.join(dirname, "oversqr.dat"))
     
-        return E_sub, MO_sub, F, S
+    # Get the dimensions
+    ao_sz = F[0].num_of_cols        
+    ao_act_sp = list(range(0, ao_sz))
+
+    mo_sz = ao_sz
+    mo_act_sp = list(range(0, mo_sz))
+
+    if params["mo_active_space"] != None:
+        mo_sz = len(params["mo_active_space"])        
+        mo_act_sp = list(params["mo_active_space"])
+
+    # Solve the eigenvalue problem with the converged Fock matrix
+    # get the converged MOs
+    E = CMATRIX(ao_sz, ao_sz)
+    MO = CMATRIX(ao_sz, ao_sz)
+    solve_eigen(F[0], S[0], E, MO, 0)  
+
+    # Extract the E sub-matrix
+    E_sub = CMATRIX(mo_sz, mo_sz)
+    pop_submatrix(E, E_sub, mo_act_sp, mo_act_sp)  
+
+    # Extract the MO sub-matrix
+    MO_sub = CMATRIX(ao_sz, mo_sz)
+    pop_submatrix(MO, MO_sub, ao_act_sp, mo_act_sp)  
+
+    return E_sub, MO_sub, F, S
 
 
 
@@ -315,8 +344,25 @@ def do_ovlp(snap, params):
     os.system("cp %s dftb_in.hsd" % ovlp_in_file)
     os.system( "%s" % EXE )
 
+    return read_ovlp(".")
+
+
+
+def read_ovlp(dirname):
+    """
+
+    Reads the AO overlaps produced by the DFTB+ calculations for two geometries (see `do_ovlp`)
+
+    Args:
+        dirname ( string ): the directory with the "oversqr.dat" file
+
+    Returns:
+        CMATRIX(A, A): the matrix of the AO overlaps for two geometries, where A - is the size of the AO basis
+
+    """
+
     # Get the Hamiltonian    
-    Sbig = DFTB_methods.get_dftb_matrices("oversqr.dat")
+    Sbig = DFTB_methods.get_dftb_matrices(os.path.join(dirname, "oversqr.dat"))
     norbs = int(Sbig[0].num_of_cols/2)
     
     act_sp1 = list(range(0,norbs))
@@ -345,6 +391,11 @@ def run_step2(params):
             * **params["fsnap"]** ( int ): final frame  [ default: 1 ]
             * **params["out_dir"]** ( string ): the path to the directory that will collect all the results
                 If the directory doesn't exist, it will be created  [ default: "res" ]
+            * **params["output_format"]** ( int ): 0 - write the text files, 1 - write a single HDF5 file, 2 - both,
+                see `data_store.write_matrix` [ default: 0 ]
+            * **params["store_filename"]** ( string ): the name of the HDF5 file in the <out_dir> [ default: "data.h5" ]
+            * **params["use_scheduler"]** ( bool ): if True, the DFTB+ calculations are run concurrently on the
+                local computer, see ```run_step2_pool(params)``` [ default: False ]
         
             SeeAlso:  the description of the parameters in ```do_ovlp(i, params)``` and in ```do_step(i, params)```
 
@@ -356,15 +407,22 @@ def run_step2(params):
     """
 
     critical_params = [ ] 
-    default_params = { "dt":1.0*units.fs2au,  "isnap":0, "fsnap":1 , "out_dir":"res" }
+    default_params = { "dt":1.0*units.fs2au,  "isnap":0, "fsnap":1 , "out_dir":"res", 
+                       "output_format":0, "store_filename":"data.h5", "use_scheduler":False }
     comn.check_input(params, default_params, critical_params)
 
+    if params["use_scheduler"]==True:
+        run_step2_pool(params)
+        return
+
 
     # Get the parameters
     dt = params["dt"]
     isnap = params["isnap"]
     fsnap = params["fsnap"]
     out_dir = params["out_dir"]
+    output_format = params["output_format"]
+    store_filename = params["store_filename"]
 
 
     # Create <out_dir> directory if it does not exist yet
@@ -388,20 +446,150 @@ def run_step2(params):
 
         # Overlaps
         s = 0.5 * (U_prev.H() * Sao_prev[0] * U_prev  +  U_curr.H() * Sao_curr[0] * U_curr)
-        s.real().show_matrix("%s/S_%i_re" % (out_dir, i-1) )
-        s.imag().show_matrix("%s/S_%i_im" % (out_dir, i-1) )
+        data_store.write_matrix(s, "%s/S_" % (out_dir), i-1, output_format, store_filename)
 
         # Time-overlaps
-        TDM.real().show_matrix("%s/St_%i_re" % (out_dir, i-1) )
-        TDM.imag().show_matrix("%s/St_%i_im" % (out_dir, i-1) )
+        data_store.write_matrix(TDM, "%s/St_" % (out_dir), i-1, output_format, store_filename)
                 
         # Vibronic Hamiltonians
-        Hvib.real().show_matrix("%s/hvib_%i_re" % (out_dir, i-1) )
-        Hvib.imag().show_matrix("%s/hvib_%i_im" % (out_dir, i-1) )
+        data_store.write_matrix(Hvib, "%s/hvib_" % (out_dir), i-1, output_format, store_filename)
         
         # Current becomes the old 
         E_prev = CMATRIX(E_curr)
         U_prev = CMATRIX(U_curr)
+        Sao_prev = Sao_curr
+
+
+
+
+def run_step2_pool(params):
+    """
+
+    Same as ```run_step2(params)```, but the DFTB+ calculations for all the geometries and for all the pairs
+    of the adjacent geometries are run concurrently on the local computer, each in its own directory: 
+    "<scratch_dir>/snap_<i>" and "<scratch_dir>/ovlp_<i>", see `local_scheduler.task_pool`. The S, St, and hvib
+    matrices for the pair of geometries are computed as soon as all the calculations they need are done, 
+    while the others are still running.
+
+    The progress is stored in the file "<scratch_dir>/manifest.json", so an interrupted calculation can be
+    restarted by calling this function again: only the unfinished calculations are repeated.
+
+    The TD-DFTB energies ( params["do_tddftb"] = True ) are not supported.
+
+    Args:
+        params ( dictionary ): the control parameters of the simulation, same as in ```run_step2(params)```, and:
+        
+            * **params["nprocs"]** ( int ): the maximal number of the concurrent DFTB+ calculations [ default: 1 ]
+            * **params["threads_per_job"]** ( int ): the number of OpenMP threads of each DFTB+ calculation. The number of
+                the concurrent calculations is reduced so that nprocs * threads_per_job does not exceed the number of 
+                CPUs [ default: 1 ]
+            * **params["scratch_dir"]** ( string ): the directory where the calculations are run [ default: "scratch" ]
+            * **params["max_retries"]** ( int ): how many times a failed calculation is restarted [ default: 1 ]
+            * **params["keep_scratch"]** ( bool ): whether to keep the directories of the calculations once they are 
+                processed [ default: False ]
+            * **params["pool_inputs"]** ( list of strings ): the additional files copied into the directory of each 
+                calculation, e.g. the Slater-Koster files, if they are given by relative paths [ default: [] ]
+
+    Returns:
+        list of strings: the names of the calculations that failed
+
+    """
+
+    critical_params = [ ] 
+    default_params = { "dt":1.0*units.fs2au,  "isnap":0, "fsnap":1 , "out_dir":"res", 
+                       "output_format":0, "store_filename":"data.h5",
+                       "EXE":"dftb+", "md_file":"md.xyz", "sp_gen_file":"x1.gen", "ovlp_gen_file":"x2.gen", 
+                       "syst_spec":"C", "scf_in_file":"dftb_in_ham1.hsd", "hs_in_file":"dftb_in_ham2.hsd", 
+                       "ovlp_in_file":"dftb_in_overlaps.hsd",
+                       "nprocs":1, "threads_per_job":1, "scratch_dir":"scratch", "max_retries":1, 
+                       "keep_scratch":False, "pool_inputs":[], "verbosity":0 }
+    comn.check_input(params, default_params, critical_params)
+
+    # Get the parameters
+    dt = params["dt"]
+    isnap = params["isnap"]
+    fsnap = params["fsnap"]
+    out_dir = params["out_dir"]
+    output_format = params["output_format"]
+    store_filename = params["store_filename"]
+    EXE = params["EXE"]
+    md_file = params["md_file"]
+    syst_spec = params["syst_spec"]
+    scf_in = os.path.basename(params["scf_in_file"])
+    hs_in = os.path.basename(params["hs_in_file"])
+    ovlp_in = os.path.basename(params["ovlp_in_file"])
+
+    # Create <out_dir> directory if it does not exist yet
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    pool = local_scheduler.task_pool(params["scratch_dir"], None, params["nprocs"], params["threads_per_job"], 1.0,
+                                     params["max_retries"], None, 0.1, params["keep_scratch"], params["verbosity"])
+
+    def _make_sp(dirname, snap):
+        DFTB_methods.xyz_traj2gen_sp(md_file, os.path.join(dirname, params["sp_gen_file"]), snap, syst_spec)
+
+    def _make_ovlp(dirname, snap):
+        DFTB_methods.xyz_traj2gen_ovlp(md_file, os.path.join(dirname, params["ovlp_gen_file"]), snap, snap+1, syst_spec)
+
+    def _check_sp(dirname):
+        return os.path.isfile(os.path.join(dirname, "hamsqr1.dat")) and os.path.isfile(os.path.join(dirname, "oversqr.dat"))
+
+    def _check_ovlp(dirname):
+        return os.path.isfile(os.path.join(dirname, "oversqr.dat"))
+
+
+    # The MOs of the geometries, kept until both pairs containing the geometry are processed
+    mos = {}
+    pairs = list(range(isnap+1, fsnap-1))
+
+    def _get_mos(snap):
+        if snap not in mos:
+            mos[snap] = read_step(params, pool.task_dir("snap_%i" % snap))
+        return mos[snap]
+
+    def _release(snap, i):
+        needed = [ k for k in [snap, snap+1] if k in pairs and k!=i and pool.status["post"].get("pair_%i" % k)!="done" ]
+        if len(needed)==0 and snap in mos:
+            del mos[snap]
+
+    def _pair(key, i):
+        E_prev, U_prev, Hao_prev, Sao_prev = _get_mos(i-1)
+        E_curr, U_curr, Hao_curr, Sao_curr = _get_mos(i)
+        S = read_ovlp(pool.task_dir("ovlp_%i" % i))
+
+        TDM = U_prev.H() * S * U_curr
+        Hvib = 0.5*(E_prev + E_curr) - (0.5j/dt) * ( TDM - TDM.H() )
+
+        # Overlaps
+        s = 0.5 * (U_prev.H() * Sao_prev[0] * U_prev  +  U_curr.H() * Sao_curr[0] * U_curr)
+        data_store.write_matrix(s, "%s/S_" % (out_dir), i-1, output_format, store_filename)
+
+        # Time-overlaps
+        data_store.write_matrix(TDM, "%s/St_" % (out_dir), i-1, output_format, store_filename)
+                
+        # Vibronic Hamiltonians
+        data_store.write_matrix(Hvib, "%s/hvib_" % (out_dir), i-1, output_format, store_filename)
+
+        _release(i-1, i)
+        _release(i, i)
+
+
+    # The tasks are started in the order of the trajectory, so the pairs become ready as early as possible
+    inputs = list(params["pool_inputs"])
+
+    for i in range(isnap, fsnap-1):
+        command = "cp %s dftb_in.hsd && %s && cp %s dftb_in.hsd && %s" % (scf_in, EXE, hs_in, EXE)
+        pool.add_task("snap_%i" % i, command, inputs + [ params["scf_in_file"], params["hs_in_file"] ], 
+                      lambda dirname, i=i: _make_sp(dirname, i), _check_sp)
+
+        if i in pairs:
+            command = "cp %s dftb_in.hsd && %s" % (ovlp_in, EXE)
+            pool.add_task("ovlp_%i" % i, command, inputs + [ params["ovlp_in_file"] ], 
+                          lambda dirname, i=i: _make_ovlp(dirname, i), _check_ovlp)
+            pool.add_post("pair_%i" % i, ["snap_%i" % (i-1), "snap_%i" % i, "ovlp_%i" % i], lambda key, i=i: _pair(key, i))
+
+    return pool.run()
 
 
 
@@ -421,6 +609,9 @@ def run_step2_lz(params):
                 If the directory doesn't exist, it will be created  [ default: "res" ]
             * **params["get_midpoint_energy"]** ( bool ): if True, compute and read energies as Hvib = 0.5*(E_prev + E_curr) (As is done in Pyxaid NBRA)
                                                    if False, compute and read energies at everytime timestep  Hvib = E_curr
+            * **params["output_format"]** ( int ): 0 - write the text files, 1 - write a single HDF5 file, 2 - both,
+                see `data_store.write_matrix` [ default: 0 ]
+            * **params["store_filename"]** ( string ): the name of the HDF5 file in the <out_dir> [ default: "data.h5" ]
         
             SeeAlso:  the description of the parameters in ```do_step(i, params)```
 
@@ -432,7 +623,8 @@ def run_step2_lz(params):
     """
 
     critical_params = [ ]
-    default_params = { "dt":1.0*units.fs2au,  "isnap":0, "fsnap":1 , "out_dir":"res", "get_midpoint_energy":True }
+    default_params = { "dt":1.0*units.fs2au,  "isnap":0, "fsnap":1 , "out_dir":"res", "get_midpoint_energy":True,
+                       "output_format":0, "store_filename":"data.h5" }
     comn.check_input(params, default_params, critical_params)
 
 
@@ -442,6 +634,8 @@ def run_step2_lz(params):
     fsnap = params["fsnap"]
     out_dir = params["out_dir"]
     get_midpoint_energy = params["get_midpoint_energy"]
+    output_format = params["output_format"]
+    store_filename = params["store_filename"]
 
     # Create <out_dir> directory if it does not exist yet
     if os.path.isdir(out_dir):
@@ -459,7 +653,7 @@ def run_step2_lz(params):
   
             Hvib = E_curr
             # Vibronic Hamiltonians - Diag. elements only
-            Hvib.real().show_matrix("%s/hvib_%i_re" % (out_dir, i-1) )
+            data_store.write_matrix(Hvib, "%s/hvib_" % (out_dir), i-1, output_format, store_filename, False)
 
             # Current becomes the old 
             E_prev = CMATRIX(E_curr) 
@@ -470,5 +664,5 @@ def run_step2_lz(params):
             E_curr, U_curr, Hao_curr, Sao_curr = do_step(i, params)
             Hvib = E_curr
             # Vibronic Hamiltonians - Diag. elements only
-            Hvib.real().show_matrix("%s/hvib_%i_re" % (out_dir, i) )
+            data_store.write_matrix(Hvib, "%s/hvib_" % (out_dir), i, output_format, store_filename, False)
 
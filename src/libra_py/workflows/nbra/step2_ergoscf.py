@@ -28,6 +28,7 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 import util.libutil as comn
 from libra_py import ERGO_methods
 from libra_py import units
+from libra_py import data_store
 
 
 
@@ -357,6 +358,9 @@ def run_step2(params, run1, run2):
             following post-processing) are done withing the restricted or unrestricted formulation:
             - 0 : non-spin-polarized (restricted) [ default ] 
             - 1 : spin-polarized (unrestricted)
+        * **params["output_format"]** ( int ): 0 - write the text files, 1 - write a single HDF5 file, 2 - both,
+            see `data_store.write_matrix` [ default: 0 ]
+        * **params["store_filename"]** ( string ): the name of the HDF5 file in the <out_dir> [ default: "data.h5" ]
 
         SeeAlso:  the description of the parameters in ```do_ovlp(i, params)``` and in ```do_step(i, params)```
 
@@ -370,7 +374,8 @@ def run_step2(params, run1, run2):
     default_params = { "dt":1.0*units.fs2au,  "isnap":0, "fsnap":1, "out_dir":"res",
                        "EXE":"ergo",  "md_file":"md.xyz",
                        "mo_active_space":None, "mo_indexing_convention":"rel",
-                       "direct_MO":1,  "spinpolarized":0
+                       "direct_MO":1,  "spinpolarized":0,
+                       "output_format":0, "store_filename":"data.h5"
                      }
     comn.check_input(params, default_params, critical_params)
 
@@ -381,6 +386,8 @@ def run_step2(params, run1, run2):
     fsnap = params["fsnap"]
     out_dir = params["out_dir"]
     spinpolarized = params["spinpolarized"]
+    output_format = params["output_format"]
+    store_filename = params["store_filename"]
 
 
     # Create <out_dir> directory if it does not exist yet
@@ -417,16 +424,13 @@ def run_step2(params, run1, run2):
 
             # Overlaps
             s = 0.5 * (U_prev[spin].H() * S11 * U_prev[spin]  +  U_curr[spin].H() * S22 * U_curr[spin])
-            s.real().show_matrix(F"{out_dir}/S_{spin}{spin}_{i-1}_re" )
-            s.imag().show_matrix(F"{out_dir}/S_{spin}{spin}_{i-1}_im" )
+            data_store.write_matrix(s, F"{out_dir}/S_{spin}{spin}_", i-1, output_format, store_filename)
 
             # Time-overlaps
-            TDM.real().show_matrix(F"{out_dir}/St_{spin}{spin}_{i-1}_re" )
-            TDM.imag().show_matrix(F"{out_dir}/St_{spin}{spin}_{i-1}_im" )
+            data_store.write_matrix(TDM, F"{out_dir}/St_{spin}{spin}_", i-1, output_format, store_filename)
             
             # Vibronic Hamiltonians
-            Hvib.real().show_matrix(F"{out_dir}/hvib_{spin}{spin}_{i-1}_re" )
-            Hvib.imag().show_matrix(F"{out_dir}/hvib_{spin}{spin}_{i-1}_im" )
+            data_store.write_matrix(Hvib, F"{out_dir}/hvib_{spin}{spin}_", i-1, output_format, store_filename)
 
         
         # Current becomes the old 
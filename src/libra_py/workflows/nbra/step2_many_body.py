@@ -1067,9 +1067,7 @@ def run_step2_many_body( params ):
     for step in range( nsteps_this_job ):
         E_this_sd  = mapping.energy_mat_arb( sd_states_reindexed, E_ks_job[step], SD_energy_corr )
         nstates_sd = len(sd_states_reindexed)
-        e = np.zeros( nstates_sd )
-        for state in range(nstates_sd):
-            e[state] =  E_this_sd.get(state,state).real
+        e = np.array( np.diag( data_conv.nparray_view( E_this_sd ) ).real )
         reindex = np.argsort(e)
         E_sd_job.append(  CMATRIX(nstates_sd,nstates_sd) )
         sd_states_reindexed_sorted.append( [] )
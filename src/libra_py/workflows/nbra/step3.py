@@ -32,6 +32,8 @@ import sys
 import cmath
 import math
 import os
+import multiprocessing as mp
+import concurrent.futures
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -43,6 +45,8 @@ import util.libutil as comn
 import libra_py.tsh as tsh
 import libra_py.units as units
 import libra_py.data_read as data_read
+import libra_py.data_conv as data_conv
+import libra_py.data_store as data_store
 import libra_py.hungarian as hungarian
 
 
@@ -936,6 +940,170 @@ def compute_Hvib(basis, St_ks, E_ks, dE, dt):
 
 
 
+# The jobs run by the worker processes in `run`. The workers are forked, so they inherit this list 
+# (with the Libra objects in it) from the parent process and only the index of the job needs to be sent to them
+_step3_jobs = []
+
+
+def _map_jobs(func, jobs, nprocs):
+    """
+    Runs `func(ijob)` for all jobs of the `jobs` list on a pool of `nprocs` forked processes (or in
+    the current process, if nprocs is 1) and yields the results in the order of the jobs
+    """
+
+    global _step3_jobs
+    _step3_jobs = jobs
+
+    if nprocs<=1 or len(jobs)<=1:
+        for ijob in range(len(jobs)):
+            yield func(ijob)
+    else:
+        ctx = mp.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nprocs, mp_context=ctx) as executor:
+            for res in executor.map(func, range(len(jobs))):
+                yield res
+
+    _step3_jobs = []
+
+
+
+def _orthonormalization_job(ijob):
+    """
+    Orthonormalization of the KS orbitals (see `apply_normalization`) for the time steps [start, stop) of a data set
+
+    Returns:
+        np.array (stop - start, 2N, 2N): the corrected St matrices
+    """
+
+    job = _step3_jobs[ijob]
+    start, stop = job["start"], job["stop"]
+
+    St = job["St"][start:stop]
+    apply_normalization(job["S"][start:stop+1], St)
+
+    return data_conv.matrices2nparray(St)
+
+
+
+def _reordering_job(ijob):
+    """
+    State reordering and phase correction (see `apply_state_reordering` and `apply_phase_correction`)
+    for all time steps of a data set. These are done sequentially, because the permutations and the
+    phases are accumulated along the trajectory
+
+    Returns:
+        np.array (nsteps, 2N, 2N): the corrected St matrices
+    """
+
+    job = _step3_jobs[ijob]
+    params = job["params"]
+
+    if params["do_state_reordering"] > 0:
+        apply_state_reordering(job["St"], job["E"], params)
+
+    if params["do_phase_correction"] > 0:
+        apply_phase_correction(job["St"])
+
+    return data_conv.matrices2nparray(job["St"])
+
+
+
+def _hvib_job(ijob):
+    """
+    Constructs the Hvib in the basis of the CI states (see `compute_Hvib` and `sac_matrices`) for the 
+    time steps [start, stop) of a data set
+
+    Returns:
+        np.array (stop - start, nstates, nstates): the Hvib matrices
+    """
+
+    job = _step3_jobs[ijob]
+    params = job["params"]
+    S, St, E = job["S"], job["St"], job["E"]
+
+    res = []
+    for i in range(job["start"], job["stop"]):
+
+        # Construct the Hvib in the basis of Slater determinants (SDs)
+        hvib_sd = compute_Hvib(params["SD_basis"], St[i], E[i], params["SD_energy_corr"], params["dt"]) 
+
+        # Convert the Hvib to the basis of symmery-adapted configurations (SAC)
+        SD2CI = sac_matrices(params["CI_basis"], params["SD_basis"], S[i])
+        res.append( SD2CI.H() * hvib_sd * SD2CI )
+
+    return data_conv.matrices2nparray(res)
+
+
+
+def _hvib_output_done(params, idata, start, stop):
+    """
+    Checks whether the Hvib matrices for the time steps [start, stop) of the data set `idata` 
+    have already been written by `run`
+    """
+
+    path = params["output_set_paths"][idata]
+    do_output = params["do_output"]
+
+    if do_output in [1, 3]:
+        for i in range(start, stop):
+            re_filename = path + params["Hvib_re_prefix"] + str(i) + params["Hvib_re_suffix"]
+            im_filename = path + params["Hvib_im_prefix"] + str(i) + params["Hvib_im_suffix"]        
+            if not os.path.isfile(re_filename) or not os.path.isfile(im_filename):
+                return False
+
+    if do_output in [2, 3]:
+        name = data_store.dataset_name(params["Hvib_re_prefix"])
+        if data_store.num_steps(path + params["store_filename"], name) < stop:
+            return False
+
+    return do_output in [1, 2, 3]
+
+
+
+def _read_hvib_output(params, idata, start, stop, nstates):
+    """
+    Reads the Hvib matrices for the time steps [start, stop) of the data set `idata` written by `run`
+
+    Returns:
+        list of CMATRIX(nstates, nstates): the Hvib matrices
+    """
+
+    path = params["output_set_paths"][idata]
+
+    if params["do_output"] in [2, 3]:
+        return data_store.get_matrices(path + params["store_filename"], data_store.dataset_name(params["Hvib_re_prefix"]), 
+                                       None, start, stop)
+
+    res = []
+    for i in range(start, stop):
+        re_filename = path + params["Hvib_re_prefix"] + str(i) + params["Hvib_re_suffix"]
+        im_filename = path + params["Hvib_im_prefix"] + str(i) + params["Hvib_im_suffix"]        
+        res.append( data_read.get_matrix(nstates, nstates, re_filename, im_filename, list(range(nstates))) )
+
+    return res
+
+
+
+def _write_hvib_output(params, idata, start, Hvib):
+    """
+    Writes the Hvib matrices for the time steps [start, start + len(Hvib)) of the data set `idata`
+    """
+
+    path = params["output_set_paths"][idata]
+
+    if params["do_output"] in [1, 3]:
+        for i in range(len(Hvib)):
+            re_filename = path + params["Hvib_re_prefix"] + str(start + i) + params["Hvib_re_suffix"]
+            im_filename = path + params["Hvib_im_prefix"] + str(start + i) + params["Hvib_im_suffix"]        
+            Hvib[i].real().show_matrix(re_filename)
+            Hvib[i].imag().show_matrix(im_filename)
+
+    if params["do_output"] in [2, 3]:
+        data_store.append_matrices(path + params["store_filename"], data_store.dataset_name(params["Hvib_re_prefix"]), 
+                                   start, Hvib)
+
+
+
 def run(S_dia_ks, St_dia_ks, E_dia_ks, params):
     """
     The procedure to converts the results of QE calculations (KS orbital energies and
@@ -1037,7 +1205,25 @@ def run(S_dia_ks, St_dia_ks, E_dia_ks, params):
                 - 0 - don't do 
                 - 1 - do it [default]
 
-            * **params["do_output"]** ( int ): whether to print out the Hvib matrices ( = 1) to the files or not ( = 0).
+            * **params["do_output"]** ( int ): whether and how to print out the Hvib matrices:
+
+                - 0: don't print them out [default]
+                - 1: into the text files, see the parameters below
+                - 2: into the HDF5 file ```params["output_set_paths"][idata] + params["store_filename"]```, as the
+                    dataset named after ```params["Hvib_re_prefix"]```, see `data_store.dataset_name`
+                - 3: both 1 and 2
+
+            * **params["store_filename"]** ( string ): the name of the HDF5 file with the Hvib matrices [default: "data.h5"]
+
+            * **params["nprocs"]** ( int ): the number of processes to use. The orthogonalization and the construction 
+                of the Hvib matrices are distributed over the data sets and the chunks of time steps, the state reordering 
+                and phase correction - over the data sets [default: 1]
+
+            * **params["chunk_size"]** ( int ): the number of time steps in a chunk [default: 100]
+
+            * **params["restart"]** ( Boolean ): if True, the chunks of time steps for which the Hvib matrices have 
+                already been written (see ```params["do_output"]```) are not recomputed, but read from the files. 
+                If False, all the Hvib matrices are recomputed and the existing output is overwritten [default: False]
 
             * **params["Hvib_re_prefix"]** ( string ): common prefix of the output files with real part of the vibronic 
                 Hamiltonian at all times [default: "Hvib_"]
@@ -1067,14 +1253,13 @@ def run(S_dia_ks, St_dia_ks, E_dia_ks, params):
                        "do_orthogonalization":0,
                        "do_state_reordering":2, "state_reordering_alpha":0.0,
                        "do_phase_correction":1,
-                       "do_output":0,
+                       "do_output":0, "store_filename":"data.h5",
                        "Hvib_re_prefix":"Hvib_", "Hvib_im_prefix":"Hvib_",
                        "Hvib_re_suffix":"_re", "Hvib_im_suffix":"_im",
-
+                       "nprocs":1, "chunk_size":100, "restart":False
                      }
     comn.check_input(params, default_params, critical_params)
  
-    dt = params["dt"]
     do_orthogonalization = params["do_orthogonalization"]
     do_phase_correction = params["do_phase_correction"]
     do_state_reordering = params["do_state_reordering"]
@@ -1095,50 +1280,71 @@ def run(S_dia_ks, St_dia_ks, E_dia_ks, params):
 
 
 
+    nprocs = params["nprocs"]
+    chunk_size = max(1, params["chunk_size"])
+    restart = params["restart"]
+
+    # The chunks of time steps
+    chunks = [ (start, min(start + chunk_size, nsteps)) for start in range(0, nsteps, chunk_size) ]
+
+    # The chunks that are already done
+    done = [ [ restart and _hvib_output_done(params, idata, start, stop) for start, stop in chunks ] for idata in range(ndata) ]
+
+    # The data sets that need to be processed
+    todo = [ idata for idata in range(ndata) if not all(done[idata]) ]
+
+    if not restart and do_output in [2, 3]:
+        for idata in range(ndata):
+            data_store.remove_matrices(params["output_set_paths"][idata] + params["store_filename"], 
+                                       data_store.dataset_name(params["Hvib_re_prefix"]))
+
+
     #====== Calculations  ===============
-    H_vib = []
 
-    for idata in range(0,ndata):
+    # 1. Do the KS orbitals orthogonalization - independently for every pair of the adjacent time steps
+    if do_orthogonalization > 0:
+        jobs = []
+        for idata in todo:
+            for start in range(0, nsteps-1, chunk_size):
+                jobs.append( {"S":S_dia_ks[idata], "St":St_dia_ks[idata], "start":start, "stop":min(start + chunk_size, nsteps-1), 
+                              "idata":idata } )
 
-        # 1. Do the KS orbitals orthogonalization 
-        if do_orthogonalization > 0:
-            apply_normalization(S_dia_ks[idata], St_dia_ks[idata])
+        for res, job in zip(_map_jobs(_orthonormalization_job, jobs, nprocs), jobs):
+            for i in range(job["start"], job["stop"]):
+                data_conv.nparray_view(St_dia_ks[job["idata"]][i])[:, :] = res[i - job["start"]]
 
-        # 2. Apply state reordering to KS
-        if do_state_reordering > 0:
-            apply_state_reordering(St_dia_ks[idata], E_dia_ks[idata], params)
 
-        # 3. Apply phase correction to KS
-        if do_phase_correction > 0:
-            apply_phase_correction(St_dia_ks[idata])
-       
-        
-        Hvib = []
-        for i in range(0,nsteps):
-        
-            # 4. Construct the Hvib in the basis of Slater determinants (SDs)
-            hvib_sd = compute_Hvib(params["SD_basis"], St_dia_ks[idata][i], E_dia_ks[idata][i], params["SD_energy_corr"], dt) 
-      
-            # 5. Convert the Hvib to the basis of symmery-adapted configurations (SAC)
-            SD2CI = sac_matrices(params["CI_basis"], params["SD_basis"], S_dia_ks[idata][i])
-            hvib_ci = SD2CI.H() * hvib_sd * SD2CI
-            Hvib.append( hvib_ci )
+    # 2. Apply state reordering and 3. phase correction to KS - sequentially along each data set
+    if do_state_reordering > 0 or do_phase_correction > 0:
+        jobs = [ {"St":St_dia_ks[idata], "E":E_dia_ks[idata], "params":params, "idata":idata } for idata in todo ]
 
+        for res, job in zip(_map_jobs(_reordering_job, jobs, nprocs), jobs):
+            for i in range(nsteps):
+                data_conv.nparray_view(St_dia_ks[job["idata"]][i])[:, :] = res[i]
 
-        if do_output:
-            # Output the resulting Hamiltonians
-            for i in range(0,nsteps):
-                re_filename = params["output_set_paths"][idata] + params["Hvib_re_prefix"] + str(i) + params["Hvib_re_suffix"]
-                im_filename = params["output_set_paths"][idata] + params["Hvib_im_prefix"] + str(i) + params["Hvib_im_suffix"]        
-                Hvib[i].real().show_matrix(re_filename)
-                Hvib[i].imag().show_matrix(im_filename)
 
+    # 4.-5. Construct the Hvib in the basis of SACs - independently for every time step
+    H_vib = []
+    jobs = []
 
-        H_vib.append(Hvib)        
-        
-    return H_vib
+    for idata in range(ndata):
+        H_vib.append( [None] * nsteps )
 
+        for ichunk, (start, stop) in enumerate(chunks):
+            if done[idata][ichunk]:
+                H_vib[idata][start:stop] = _read_hvib_output(params, idata, start, stop, nstates)
+            else:
+                jobs.append( {"S":S_dia_ks[idata], "St":St_dia_ks[idata], "E":E_dia_ks[idata], "params":params, 
+                              "start":start, "stop":stop, "idata":idata } )
 
+    for res, job in zip(_map_jobs(_hvib_job, jobs, nprocs), jobs):
+        Hvib = [ data_conv.nparray2CMATRIX(x) for x in res ]
+        H_vib[job["idata"]][job["start"]:job["stop"]] = Hvib
+
+        if do_output:
+            _write_hvib_output(params, job["idata"], job["start"], Hvib)
+        
+    return H_vib
 
 
 def map_Hvib(H, basis, dE):
@@ -1169,7 +1375,7 @@ def pyxaid2libra(Hvib_pyxaid, params):
     #====== Defaults and local parameters ===============
 
     critical_params = [ "SD_basis", "SD_energy_corr", "CI_basis", "output_set_paths" ]
-    default_params = { "do_output":0,
+    default_params = { "do_output":0, "store_filename":"data.h5",
                        "Hvib_re_prefix":"Hvib_", "Hvib_im_prefix":"Hvib_",
                        "Hvib_re_suffix":"_re", "Hvib_im_suffix":"_im",
                      }
@@ -1227,7 +1433,7 @@ def pyxaid2libra(Hvib_pyxaid, params):
             Hvib.append( hvib_ci )
 
 
-        if do_output:
+        if do_output in [1, 3]:
             # Output the resulting Hamiltonians
             for i in range(0,nsteps):
                 re_filename = params["output_set_paths"][idata] + params["Hvib_re_prefix"] + str(i) + params["Hvib_re_suffix"]
@@ -1235,6 +1441,10 @@ def pyxaid2libra(Hvib_pyxaid, params):
                 Hvib[i].real().show_matrix(re_filename)
                 Hvib[i].imag().show_matrix(im_filename)
 
+        if do_output in [2, 3]:
+            data_store.save_matrices(params["output_set_paths"][idata] + params["store_filename"], 
+                                     data_store.dataset_name(params["Hvib_re_prefix"]), Hvib)
+
         H_vib.append(Hvib)        
         
     return H_vib
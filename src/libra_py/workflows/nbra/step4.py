@@ -44,6 +44,7 @@ import sys
 import cmath
 import math
 import os
+import numpy as np
 
 if sys.platform=="cygwin":
     from cyglibra_core import *
@@ -54,7 +55,9 @@ elif sys.platform=="linux" or sys.platform=="linux2":
 import util.libutil as comn
 
 import libra_py.data_read as data_read
+import libra_py.data_conv as data_conv
 from . import decoherence_times as dectim
+from . import cache
 import libra_py.tsh as tsh
 import libra_py.tsh_stat as tsh_stat
 import libra_py.units as units
@@ -544,6 +547,12 @@ def run(H_vib, params):
             * **params["outfile"]** ( string ): the name of the file where to print populations
                 and energies of states [default: "_out.txt"]    
 
+            * **params["engine"]** ( int ): selects the implementation of the calculations:
+
+                - 0 - propagate each trajectory separately [ default ]
+                - 1 - propagate all trajectories at once with NumPy arrays, see `run_vectorized`
+                    This is much faster for large ensembles and gives statistically equivalent results
+
     Returns: 
         MATRIX(nsteps, 3*nstates+5): the trajectory (and initial-condition)-averaged observables for every timesteps,
             the assumed format is: 
@@ -560,9 +569,12 @@ def run(H_vib, params):
     default_params = { "T":300.0, "ntraj":1,
                        "tdse_Ham":0, "sh_method":1, "decoherence_constants": 0, "decoherence_method":0, "dt":41.0, "Boltz_opt":3,
                        "Hvib_type":1,
-                       "istate":0, "init_times":[0], "outfile":"_out.txt" }
+                       "istate":0, "init_times":[0], "outfile":"_out.txt", "engine":0 }
     comn.check_input(params, default_params, critical_params)
 
+    if params["engine"]==1:
+        return run_vectorized(H_vib, params)
+
 
     rnd = Random()
 
@@ -585,19 +597,7 @@ def run(H_vib, params):
     #========== Compute PARAMETERS  ===============
     # Decoherence times
     # these are actually the dephasing rates!
-    tau, dephasing_rates = None, None
-
-    if params["decoherence_constants"] == 0 or params["decoherence_constants"]==20:
-        tau, dephasing_rates = dectim.decoherence_times_ave(H_vib, params["init_times"], nsteps, 1) 
-
-    elif params["decoherence_constants"] == 1 or params["decoherence_constants"]==21:
-        if params["decoherence_times"].num_of_cols != nstates:
-            print("Error: dimensions of the input decoherence times matrix are not consistent with \
-                   the dimensions of the Hamiltonian matrices (the number of states). Exiting...\n")
-            sys.exit(0)
-        else:
-            tau = MATRIX(params["decoherence_times"])
-            dephasing_rates = dectim.decoherence_times2rates(tau)
+    dephasing_rates = get_decoherence_rates(H_vib, params)
 
 
 
@@ -685,3 +685,543 @@ def run(H_vib, params):
     return res
 
 
+
+
+
+
+def get_decoherence_rates(H_vib, params):
+    """
+    Computes or takes the dephasing rates as prescribed by the `params["decoherence_constants"]`
+    parameter, see `run`
+
+    Returns:
+        MATRIX(nstates, nstates): the matrix of dephasing rates between all pairs of states [ units: a.u.^-1 ]
+
+    """
+
+    nstates = H_vib[0][0].num_of_cols
+    dephasing_rates = None
+
+    if params["decoherence_constants"] == 0 or params["decoherence_constants"]==20:
+        tau, dephasing_rates = dectim.decoherence_times_ave(H_vib, params["init_times"], params["nsteps"], 1) 
+
+    elif params["decoherence_constants"] == 1 or params["decoherence_constants"]==21:
+        if params["decoherence_times"].num_of_cols != nstates:
+            print("Error: dimensions of the input decoherence times matrix are not consistent with \
+                   the dimensions of the Hamiltonian matrices (the number of states). Exiting...\n")
+            sys.exit(0)
+        else:
+            tau = MATRIX(params["decoherence_times"])
+            dephasing_rates = dectim.decoherence_times2rates(tau)
+
+    return dephasing_rates
+
+
+
+def boltz_factors(dE, T, boltz_opt):
+    """
+    Vectorized version of `tsh.boltz_factor`
+
+    Args:
+        dE ( np.array ): the energy differences E_new - E_old [ units: Ha ]
+        T ( double ): temperature [ units: K ]
+        boltz_opt ( int ): the proposed hop acceptance criterion, see `tsh.boltz_factor`
+
+    Returns:
+        np.array of the same shape as `dE`: the probabilities of the proposed hops acceptance
+
+    """
+
+    up = dE > 0.0
+    x = np.where(up, dE, 0.0) / (units.kB * T)
+
+    if boltz_opt==1:
+        return np.where(up & (x <= 50.0), np.exp(-np.minimum(x, 50.0)), np.where(up, 0.0, 1.0))
+
+    elif boltz_opt==2:
+        y = np.sqrt(x)
+        D = np.vectorize(math.erf, otypes=[float])(y) - math.sqrt(4.0/math.pi) * y * np.exp(-x)
+        return np.where(up, 1.0 - D, 1.0)
+
+    elif boltz_opt==3:
+        return np.where(up, 1.0/(1.0 + np.exp(np.minimum(x, 700.0))), 1.0)
+
+    return np.ones(dE.shape)
+
+
+
+def propagators_batch(H, dt):
+    """
+    Computes the electronic propagators exp(-i * H * dt) for a stack of vibronic Hamiltonians
+
+    The Hamiltonians are interpreted in the same way as in `propagate_electronic`: the real part
+    is symmetric and the imaginary part is defined by the upper triangle, so the resulting Hamiltonian
+    is Hermitian and the propagators are unitary
+
+    Args:
+        H ( np.array (nmat, nstates, nstates) ): vibronic Hamiltonians [ units: Ha ]
+        dt ( double ): the integration time step [ units: a.u. of time ]
+
+    Returns:
+        np.array (nmat, nstates, nstates): the propagators
+
+    """
+
+    re = 0.5 * ( H.real + H.real.transpose(0, 2, 1) )
+    im = np.triu(H.imag, 1)
+    E, V = np.linalg.eigh( re + 1.0j * (im - im.transpose(0, 2, 1)) )
+
+    return np.matmul( V * np.exp(-1.0j * dt * E)[:, None, :], np.conj(V).transpose(0, 2, 1) )
+
+
+
+def Boltz_corr_Ham_batch(H, C, T, case=1):
+    """
+    Vectorized version of `tsh.Boltz_corr_Ham`
+
+    Args:
+        H ( np.array (ntraj, nstates, nstates) ): original vibronic Hamiltonians [units: a.u.]
+        C ( np.array (ntraj, nstates) ): amplitudes of the basis states
+        T ( double ): bath temperature [ units: K]
+        case ( int ): selection of the type of the Hamiltonian: 0 - diabatic, 1 - adiabatic [ default ]
+
+    Returns:
+        np.array (ntraj, nstates, nstates): the effective Hamiltonians
+
+    """
+
+    kT = units.kB * T
+    rho = np.abs(C)
+
+    E = np.real( np.diagonal(H, axis1=1, axis2=2) )
+    dE = E[:, None, :] - E[:, :, None]    # dE[t, j, k] = E_k - E_j
+    Hcorr = H * np.sqrt(2.0 / (1.0 + np.exp( np.minimum(-dE/kT, 700.0) ) ) )
+
+    A = rho[:, None, :] * Hcorr                        # rho_k * Hcorr_jk
+    B = rho[:, :, None] * Hcorr.transpose(0, 2, 1)     # rho_j * Hcorr_kj
+
+    h = np.triu( A - B if case==0 else A + B, 1)
+
+    return h + h.transpose(0, 2, 1)
+
+
+
+def hopping_batch(C, H, grp, istate, sh_method, do_collapse, ksi, ksi2, dt, T, boltz_opt, boltz_tab=None):
+    """
+    Vectorized version of `tsh.hopping` - the surface hopping and ID-A for many trajectories at once
+
+    Args:
+        C ( np.array (ntraj, nstates) ): amplitudes of all trajectories, changed in place if the 
+            wavefunctions collapse
+        H ( np.array (nham, nstates, nstates) ): vibronic Hamiltonians
+        grp ( np.array (ntraj,) of ints ): the index of the Hamiltonian in `H` for each trajectory
+        istate ( np.array (ntraj,) of ints ): the active states
+        sh_method ( int ): 0 - MSSH, 1 - FSSH
+        do_collapse ( int ): 0 - no decoherence, 1 - decoherence via ID-A
+        ksi, ksi2 ( np.array (ntraj,) ): random numbers in the interval [0.0, 1.0]
+        dt ( double ): the time interval for the surface hopping [ units: a.u. ]
+        T ( double ): temperature [ units: K ]
+        boltz_opt ( int ): the proposed hop acceptance criterion, see `tsh.hopping`
+        boltz_tab ( np.array (nham, nstates, nstates) ): the precomputed acceptance probabilities of the 
+            i -> j hops for each Hamiltonian in `H`, see `precompute_tables`. If None, they are computed 
+            from the energies [ default: None ]
+
+    Returns:
+        np.array (ntraj,) of ints: the active states after the hops
+
+    """
+
+    ntraj, nstates = C.shape
+    idx = np.arange(ntraj)
+
+    E = np.real( np.diagonal(H, axis1=1, axis2=2) )[grp]
+    ca = C[idx, istate]
+
+    #======== Hopping probabilities from the active states ======
+    if sh_method==0:
+        g = np.abs(C)**2
+        g = g / np.sum(g, axis=1)[:, None]
+
+    elif sh_method==1:
+        rho_aj = ca[:, None] * np.conj(C)
+        g = dt * np.imag( rho_aj * H[grp, :, istate] - H[grp, istate, :] * np.conj(rho_aj) )
+
+        a_aa = np.abs(ca)**2
+        g = np.where( (a_aa < 1e-8)[:, None], 0.0, g / np.maximum(a_aa, 1e-8)[:, None] )
+
+        if boltz_opt:
+            dE = E - E[idx, istate][:, None]
+            g = np.where(dE > 0.0, g * np.exp(-np.maximum(dE, 0.0)/(units.kB*T)), g)
+
+        g = np.maximum(g, 0.0)
+        g[idx, istate] = 0.0
+        g[idx, istate] = 1.0 - np.sum(g, axis=1)
+
+    else:
+        print(F"Error in hopping_batch: sh_method = {sh_method} is not supported\nExiting...\n")
+        sys.exit(0)
+
+    #======== Stochastic hops ======
+    nrm = np.sum(g, axis=1)
+    g = g / np.where(nrm > 0.0, nrm, 1.0)[:, None]
+    right = np.cumsum(g, axis=1)
+    left = right - g
+
+    inside = (left <= ksi[:, None]) & (ksi[:, None] <= right)
+    new_st = np.where( inside.any(axis=1), nstates - 1 - np.argmax(inside[:, ::-1], axis=1), istate )
+    new_st = np.where( nrm > 0.0, new_st, istate )
+
+    #======== ID-A ======
+    hop = new_st != istate
+    dE = E[idx, new_st] - E[idx, istate]
+    up = hop & (dE > 0.0)
+    if boltz_tab is None:
+        rejected = up & ( ksi2 >= boltz_factors(dE, T, boltz_opt) )
+    else:
+        rejected = up & ( ksi2 >= boltz_tab[grp, istate, new_st] )
+
+    res = np.where(rejected, istate, new_st)
+
+    if do_collapse:
+        C[up] = 0.0
+        C[idx[up], res[up]] = 1.0
+
+    return res
+
+
+
+def sdm_batch(C, dt, istate, rates):
+    """
+    Vectorized version of `sdm` - the simplified decay of mixing for many trajectories at once
+
+    Args:
+        C ( np.array (ntraj, nstates) ): amplitudes of all trajectories, changed in place
+        dt ( double ): the integration time step [ units: a.u. ]
+        istate ( np.array (ntraj,) of ints ): the active states
+        rates ( np.array (nstates, nstates) ): the dephasing rates [ units: a.u.^-1 ]
+
+    """
+
+    idx = np.arange(C.shape[0])
+
+    p_old = np.abs(C[idx, istate])**2
+
+    scl = np.exp(-dt * rates[:, istate].T)
+    scl[idx, istate] = 1.0
+    C1 = C * scl
+
+    inact = np.sum(np.abs(C1)**2, axis=1) - p_old
+    p_new = np.maximum(1.0 - inact, 0.0)
+    C1[idx, istate] *= np.sqrt( p_new / np.where(p_old > 0.0, p_old, 1.0) )
+
+    C[p_old > 0.0] = C1[p_old > 0.0]
+
+
+
+def dish_batch(C, istate, t_m, rates, E, T, boltz_opt, ksi1, ksi2, boltz_tab=None, grp=None):
+    """
+    Vectorized version of `tsh.dish_py` (with the coherence intervals computed as in `coherence_intervals`)
+    for many trajectories at once
+
+    Args:
+        C ( np.array (ntraj, nstates) ): amplitudes of all trajectories, changed in place
+        istate ( np.array (ntraj,) of ints ): the active states
+        t_m ( np.array (ntraj, nstates) ): the times each state resides in a coherence interval, changed in place [ units: a.u. ]
+        rates ( np.array (nstates, nstates) ): the dephasing rates [ units: a.u.^-1 ]
+        E ( np.array (ntraj, nstates) ): the energies of the states [ units: Ha ]
+        T ( double ): temperature [ units: K ]
+        boltz_opt ( int ): the proposed hop acceptance criterion, see `tsh.dish_py`
+        ksi1, ksi2 ( np.array (ntraj,) ): random numbers in the interval [0.0, 1.0]
+        boltz_tab ( np.array (nham, nstates, nstates) ): the precomputed acceptance probabilities of the 
+            i -> j hops, see `precompute_tables`. If None, they are computed from the energies `E` [ default: None ]
+        grp ( np.array (ntraj,) of ints ): the index of the table in `boltz_tab` for each trajectory [ default: None ]
+
+    Returns:
+        np.array (ntraj,) of ints: the active states after the decoherence events
+
+    """
+
+    ntraj, nstates = C.shape
+    idx = np.arange(ntraj)
+
+    # Coherence intervals
+    pop = np.abs(C)**2
+    summ = pop @ rates.T - pop * np.diag(rates)
+    tau_m = np.where(summ > 0.0, 1.0 / np.where(summ > 0.0, summ, 1.0), 1.0e+25)
+
+    # The first state that has evolved coherently for longer than its coherence interval
+    expired = t_m >= tau_m
+    has = expired.any(axis=1)
+    i = np.argmax(expired, axis=1)
+
+    p_i = pop[idx, i]
+    if boltz_tab is None:
+        boltz = boltz_factors(E[idx, i] - E[idx, istate], T, boltz_opt)
+    else:
+        boltz = boltz_tab[grp, istate, i]
+    do_collapse = has & (ksi1 < p_i) & (ksi2 < boltz)
+    do_project = has & ~do_collapse
+
+    # Project out of the state i
+    nrm = np.maximum(1.0 - p_i, 0.0)
+    nrm = np.where(nrm > 0.0, 1.0 / np.sqrt(np.where(nrm > 0.0, nrm, 1.0)), 0.0)
+    C1 = C * nrm[:, None]
+    C1[idx, i] = 0.0
+    C[do_project] = C1[do_project]
+
+    # Collapse onto the state i
+    C[do_collapse] = 0.0
+    C[idx[do_collapse], i[do_collapse]] = 1.0
+
+    t_m[idx[has], i[has]] = 0.0
+
+    return np.where(do_collapse, i, istate)
+
+
+
+def traj_statistics_batch(H, C, istate):
+    """
+    Vectorized version of `traj_statistics`
+
+    Args:
+        H ( np.array (ngroups, nstates, nstates) ): the Hamiltonians of all data sets/initial times at the current step
+        C ( np.array (ngroups * ntraj, nstates) ): the TD-SE amplitudes for all trajectories, 
+            ordered as in `traj_statistics`
+        istate ( np.array (ngroups * ntraj,) of ints ): the active states for all trajectories
+
+    Returns: 
+        MATRIX(1, 3*nstates+4): the trajectory (and initial-condition)-averaged observables,
+            in the same format as in `traj_statistics`
+
+    """
+
+    ngroups, nstates = H.shape[0], H.shape[1]
+    Ntraj = C.shape[0]
+    ntraj = Ntraj // ngroups
+
+    E = np.real( np.diagonal(H, axis1=1, axis2=2) )
+    Ere = H.real
+
+    x = C.real.reshape(ngroups, ntraj, nstates)
+    y = C.imag.reshape(ngroups, ntraj, nstates)
+
+    pop_se = np.mean(np.abs(C)**2, axis=0)
+    pop_sh = np.bincount(istate, minlength=nstates) / float(Ntraj)
+
+    # Tr( Re(rho) * Re(H) ),  Re(rho_ij) = x_i * x_j + y_i * y_j
+    en_se = ( np.einsum("gti,gji,gtj->", x, Ere, x) + np.einsum("gti,gji,gtj->", y, Ere, y) ) / float(Ntraj)
+    en_sh = np.mean( E[ np.arange(Ntraj) // ntraj, istate ] )
+
+    res = np.zeros( (1, 3*nstates+4) )
+    res[0, 0:3*nstates:3] = np.mean(E, axis=0)
+    res[0, 1:3*nstates:3] = pop_se
+    res[0, 2:3*nstates:3] = pop_sh
+    res[0, 3*nstates:] = [ en_se, en_sh, np.sum(pop_se), np.sum(pop_sh) ]
+
+    return data_conv.nparray2MATRIX(res)
+
+
+
+def traj_statistics2_batch(E, Pop, istate):
+    """
+    Vectorized version of `traj_statistics2_fast`
+
+    Args:
+        E ( np.array (ngroups, nstates) ): the energies of the states for all data sets/initial times at the current step
+        Pop ( np.array (ngroups * ntraj, nstates) ): the quantum populations for all trajectories, 
+            ordered as in `traj_statistics2_fast`
+        istate ( np.array (ngroups * ntraj,) of ints ): the active states for all trajectories
+
+    Returns: 
+        MATRIX(1, 3*nstates+4): the trajectory (and initial-condition)-averaged observables,
+            in the same format as in `traj_statistics2_fast`
+
+    """
+
+    ngroups, nstates = E.shape
+    Ntraj = Pop.shape[0]
+    ntraj = Ntraj // ngroups
+
+    pop_se = np.mean(Pop, axis=0)
+    pop_sh = np.bincount(istate, minlength=nstates) / float(Ntraj)
+
+    en_se = np.einsum("gti,gi->", Pop.reshape(ngroups, ntraj, nstates), E) / float(Ntraj)
+    en_sh = np.mean( E[ np.arange(Ntraj) // ntraj, istate ] )
+
+    res = np.zeros( (1, 3*nstates+4) )
+    res[0, 0:3*nstates:3] = np.mean(E, axis=0)
+    res[0, 1:3*nstates:3] = pop_se
+    res[0, 2:3*nstates:3] = pop_sh
+    res[0, 3*nstates:] = [ en_se, en_sh, np.sum(pop_se), np.sum(pop_sh) ]
+
+    return data_conv.nparray2MATRIX(res)
+
+
+
+def precompute_tables(H_vib, params):
+    """
+    Computes the quantities that depend only on the data set and the time step, but not on the
+    trajectory: the energies of the states, the electronic propagators, and the acceptance probabilities
+    of the hops between all pairs of states. See also `cache.get_tables`
+
+    Args: 
+        H_vib ( list of lists of CMATRIX objects ): the vibronic Hamiltonian for all data sets and all time-points
+        params ( dictionary ): the parameters "dt", "T", and "Boltz_opt", see `run`
+
+    Returns:
+        dictionary: the tables for all data sets idata:
+
+            * **"E"** ( list of np.array (nsteps_idata, nstates) ): the energies of the states [ units: Ha ]
+            * **"U"** ( list of np.array (nsteps_idata, nstates, nstates) ): the propagators, see `propagators_batch`
+            * **"boltz"** ( list of np.array (nsteps_idata, nstates, nstates) ): the probabilities to accept the
+                i -> j hops, see `boltz_factors`
+
+    """
+
+    tables = { "E":[], "U":[], "boltz":[] }
+
+    for idata in range(len(H_vib)):
+        H = data_conv.matrices2nparray(H_vib[idata])
+        E = np.real( np.diagonal(H, axis1=1, axis2=2) )
+
+        tables["E"].append( E )
+        tables["U"].append( propagators_batch(H, params["dt"]) )
+        tables["boltz"].append( boltz_factors(E[:, None, :] - E[:, :, None], params["T"], params["Boltz_opt"]) )
+
+    return tables
+
+
+
+def run_vectorized(H_vib, params):
+    """
+    The array-based version of `run`: the amplitudes, active states and coherence times of all the
+    `ndata x len(init_times) x ntraj` trajectories are stored in NumPy arrays and all the trajectories are 
+    propagated at once. All the trajectories of the same data set and initial time see the same 
+    Hamiltonian, so the propagator exp(-i * H_vib * dt) is computed only once per data set/initial time 
+    at every step (unless the Boltzmann-corrected Hamiltonian is used, see `params["tdse_Ham"]`).
+
+    The TD-SE is integrated exactly for the given Hamiltonian rather than with the symplectic 
+    splitting used by `propagate_electronic`, and the random numbers are generated by NumPy, 
+    so the results are the same as those of `run` only in a statistical sense.
+
+    Args: 
+        H_vib ( list of lists of CMATRIX objects ): the vibronic Hamiltonian for all data sets and all time-points,
+            see `run`
+        params ( dictionary ): the parameters that control the execution of the NA-MD-NBRA calculations,
+            same as in `run`, and also:
+
+            * **params["random_seed"]** ( int or None ): the seed of the NumPy random numbers generator,
+                None - to seed it from the system entropy [ default: None ]
+
+            * **params["cache_dir"]** ( string or None ): the directory where the per-timestep propagators 
+                and hop acceptance probabilities are stored for the reuse by the subsequent runs with the
+                same Hamiltonians, None - compute them for this run only [ default: None ]. See `cache.get_tables`
+
+            * **params["cache_files"]** ( list of strings or None ): the files the Hamiltonians were read from, used
+                to identify the stored tables instead of hashing all the Hamiltonians [ default: None ]. See `cache.fingerprint`
+
+    Returns: 
+        MATRIX(nsteps, 3*nstates+5): the trajectory (and initial-condition)-averaged observables for every timesteps,
+            same as in `run`
+
+    """
+
+    critical_params = [ "nsteps" ] 
+    default_params = { "T":300.0, "ntraj":1,
+                       "tdse_Ham":0, "sh_method":1, "decoherence_constants": 0, "decoherence_method":0, "dt":41.0, "Boltz_opt":3,
+                       "Hvib_type":1,
+                       "istate":0, "init_times":[0], "outfile":"_out.txt", "random_seed":None }
+    comn.check_input(params, default_params, critical_params)
+
+    rng = np.random.default_rng(params["random_seed"])
+
+    ndata = len(H_vib)
+    nsteps = params["nsteps"]
+    nstates = H_vib[0][0].num_of_cols  # number of states
+
+    ntraj = params["ntraj"]
+    init_times = params["init_times"]
+    nitimes = len(init_times)
+    ngroups = ndata * nitimes
+    Ntraj = ngroups * ntraj
+
+    T = params["T"]
+    bolt_opt = params["Boltz_opt"]
+    dt = params["dt"]
+    tdse_Ham = params["tdse_Ham"]
+    decoherence_method = params["decoherence_method"]
+
+    res = MATRIX(nsteps, 3*nstates+5)
+
+    #========== Compute PARAMETERS  ===============
+    dephasing_rates = get_decoherence_rates(H_vib, params)
+    rates = None
+    if dephasing_rates != None:
+        rates = data_conv.MATRIX2nparray(dephasing_rates)
+
+    #========== Initialize the DYNAMICAL VARIABLES  ===============
+    # The trajectory Tr = igroup * ntraj + tr, with igroup = idata * nitimes + it_indx - same ordering as in `run` 
+    grp = np.arange(Ntraj) // ntraj
+
+    C = np.zeros( (Ntraj, nstates), dtype=complex)
+    C[:, params["istate"]] = 1.0
+    istate = np.full(Ntraj, params["istate"], dtype=int)
+    t_m = np.zeros( (Ntraj, nstates) )
+
+    # Per-timestep propagators and acceptance probabilities - the same for all trajectories
+    tables = None
+    if tdse_Ham==0:
+        tables = cache.get_tables(H_vib, params, "step4", ["dt", "T", "Boltz_opt"], precompute_tables)
+
+    # Prepare the output file
+    f = open(params["outfile"],"w"); f.close()
+
+    #=============== Entering the DYNAMICS ========================
+    for i in range(0,nsteps):  # over all evolution times
+
+        # Hamiltonians of all data sets/initial times at this step
+        H = np.array( [ data_conv.nparray_view(H_vib[idata][it+i]) for idata in range(ndata) for it in init_times ] )
+
+        boltz_tab = None
+        if tables != None:
+            boltz_tab = np.array( [ tables["boltz"][idata][it+i] for idata in range(ndata) for it in init_times ] )
+
+        #============== Analysis of the Dynamics  =================
+        res_i = traj_statistics_batch(H, C, istate)
+
+        printout(i*dt, res_i, params["outfile"])
+
+        res.set(i,0, i*dt)
+        push_submatrix(res, res_i, Py2Cpp_int([i]), Py2Cpp_int( list(range(1,3*nstates+5)) ) )
+
+        #=============== Propagation ==============================
+        # Coherent evolution of amplitudes
+        if tdse_Ham==0:
+            Heff, hgrp = H, grp
+            U = np.array( [ tables["U"][idata][it+i] for idata in range(ndata) for it in init_times ] )
+            C = np.matmul( C.reshape(ngroups, ntraj, nstates), U.transpose(0, 2, 1) ).reshape(Ntraj, nstates)
+
+        elif tdse_Ham==1:
+            Heff, hgrp = Boltz_corr_Ham_batch(H[grp], C, T, params["Hvib_type"]), np.arange(Ntraj)
+            U = propagators_batch(Heff, dt)
+            C = np.matmul( U, C[:, :, None] )[:, :, 0]
+
+        # Surface hopping 
+        ksi  = rng.random(Ntraj)
+        ksi2 = rng.random(Ntraj)
+
+        if decoherence_method in [0, 1, 2]:
+
+            if decoherence_method==2:  # MSDM
+                sdm_batch(C, dt, istate, rates)
+
+            do_collapse = 1 if decoherence_method==1 else 0
+            istate = hopping_batch(C, Heff, hgrp, istate, params["sh_method"], do_collapse, ksi, ksi2, dt, T, bolt_opt, boltz_tab)
+
+        elif decoherence_method in [3]:  # DISH
+            E = np.real( np.diagonal(Heff, axis1=1, axis2=2) )[hgrp]
+            istate = dish_batch(C, istate, t_m, rates, E, T, bolt_opt, ksi, ksi2, boltz_tab, hgrp)
+            t_m += dt
+
+    return res
+
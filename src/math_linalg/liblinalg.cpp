@@ -31,6 +31,20 @@ namespace liblinalg{
 
 
 
+template <typename T1>
+boost::python::object base_matrix_buffer(base_matrix<T1>& x){
+/**
+  Returns a writable Python memoryview of the internal (row-major) storage of the matrix.
+  No data is copied, so the view can be wrapped into a numpy array via np.frombuffer.
+  The matrix is kept alive for as long as the view exists (see the call policy below),
+  but the view becomes invalid if the matrix is re-initialized (e.g. with Init)
+*/
+
+  PyObject* mv = PyMemoryView_FromMemory((char*)x.M, sizeof(T1)*x.n_elts, PyBUF_WRITE);
+  return boost::python::object(boost::python::handle<>(mv));
+}
+
+
 template <typename T1>
 void export_base_matrix(){
   
@@ -142,6 +156,7 @@ void export_base_matrix(){
 
 
       /// Generic IO operations
+      .def("buffer", &base_matrix_buffer<T1>, with_custodian_and_ward_postcall<0,1>() )
       .def("bin_dump", &base_matrix<T1>::bin_dump )
       .def("bin_load", &base_matrix<T1>::bin_load )
       .def("show_matrix", expt_show_matrix_v1)
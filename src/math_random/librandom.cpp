@@ -30,6 +30,10 @@ void export_Random_objects(){
 //  def("scale", expt_scale1);
 
   class_<Random>("Random",init<>())
+      .def(init<int>())
+      .def("set_seed",&Random::set_seed)
+      .def("get_state",&Random::get_state)
+      .def("set_state",&Random::set_state)
 //      .def("__copy__", &generic__copy__<Random>)
 //      .def("__deepcopy__", &generic__deepcopy__<Random>)
 
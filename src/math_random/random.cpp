@@ -51,12 +51,35 @@ void Random::bin(vector<double>& in,double minx,double maxx,double dx,vector< pa
   }
 }
 
+//============================================================
+//              State of the generator
+
+std::string Random::get_state(){
+/**
+  Returns the state of the generator as a string, which can be stored (e.g. in a checkpoint file)
+  and passed to set_state() to continue exactly the same sequence of random numbers
+*/
+
+  std::stringstream ss;
+  ss<<engine;
+  return ss.str();
+}
+
+void Random::set_state(std::string state){
+/**
+  Restores the state of the generator returned by get_state()
+*/
+
+  std::stringstream ss(state);
+  ss>>engine;
+}
+
 //============================================================
 //              Uniform distribution
 
 double Random::uniform(double a,double b){
 
-  double ksi = rand()/((double)RAND_MAX);
+  double ksi = engine()/((double)engine.max());
   return (a + (b-a)*ksi);
 }
 double Random::p_uniform(double a,double b){
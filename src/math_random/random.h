@@ -18,6 +18,9 @@
 #include <iostream>
 #include <iomanip>
 #include <vector>
+#include <random>
+#include <string>
+#include <sstream>
 #include <boost/python.hpp>
 #include <boost/python/suite/indexing/vector_indexing_suite.hpp>
 
@@ -32,15 +35,26 @@ namespace librandom{
 
 class Random{
 
+  std::mt19937 engine;    // the generator of this object, its state can be saved and restored
+
   int fact(int k);
   double Gamma(double a);
   void bin(vector<double>& in,double minx,double maxx,double dx,vector< pair<double,double> >& out);
 
   public:
 
-  Random(){   srand(time(0)); }
+  // The seeds are also passed to srand(), for the functions that use rand() directly
+  Random(){   srand(time(0)); std::random_device rd; engine.seed(rd()); }
+  Random(int seed){   srand(seed); engine.seed(seed); }
   ~Random(){ ;; }
 
+  // Reset the generator, to get a reproducible sequence of numbers
+  void set_seed(int seed){  srand(seed); engine.seed(seed); }
+
+  // The complete state of the generator, e.g. to continue the same sequence of numbers after a restart
+  std::string get_state();
+  void set_state(std::string state);
+
 
   // Uniform distribution
   double uniform(double a,double b);   // the random number of the disctribution below
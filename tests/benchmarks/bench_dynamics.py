@@ -0,0 +1,416 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 3 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#*
+#*********************************************************************************/
+"""
+  Performance benchmarks of the dynamics drivers:
+
+    * tsh.compute.generic_recipe - Holstein (per-trajectory and batched), Tully's chain and LVC models
+      (the batched models use `models.batched`), scanned over the number of trajectories and states
+    * heom.compute.run_dynamics - the C++ engine (engine = 0) and the active-ADM NumPy engine (engine = 1)
+      with the RK4 and RK45 integrators, scanned over the number of states and the hierarchy depth LL, KK
+    * exact.compute.run_relaxation (which calls exact.compute.run_dynamics) - the C++ Wfcgrid2 (engine = 0)
+      and the NumPy FFT engine (engine = 1), scanned over the number of states and the grid size
+    * workflows.nbra.step4.run - the per-trajectory (engine = 0) and the vectorized (engine = 1) NBRA
+      surface hopping, and workflows.nbra.lz.run, scanned over the number of trajectories and states
+
+  Each case is run in a separate process, and the wall time, steps per second, peak memory,
+  and the size of the output files are recorded in the JSON file (default: "bench_results.json").
+  The results are compared to the reference baseline, "bench_baseline.json" stored next to this script,
+  and the cases that became slower (or use more memory) by more than the tolerance are reported - the
+  script then exits with the code 1. The cases that fail to run, and those not in the baseline, are
+  reported too. The baseline timings are only meaningful on the machine where they were measured
+  (stored in the file), so a warning is printed when comparing to a baseline from another machine.
+  The baseline is not distributed with the code: create it on the machine of interest, with the full
+  build of Libra, using the "--update-baseline" option. The baseline is not updated if any of the cases
+  fails to run, so it never has the gaps of an incomplete build.
+
+  Usage:
+
+      python bench_dynamics.py                   # run all benchmarks, compare to the baseline
+      python bench_dynamics.py tsh heom          # run only the selected groups ( tsh, heom, exact, nbra )
+      python bench_dynamics.py --quick           # smaller set of cases, for a quick check
+      python bench_dynamics.py --update-baseline # store the current results in the baseline: the cases
+                                                 # that were run are replaced, the others are kept
+
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import multiprocessing as mp
+import concurrent.futures
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+import numpy as np
+import libra_py.units as units
+import libra_py.profiling as profiling
+import libra_py.data_conv as data_conv
+import libra_py.models.Holstein as Holstein
+import libra_py.models.Tully as Tully
+import libra_py.models.LVC as LVC
+import libra_py.models.batched as batched
+import libra_py.dynamics.tsh.compute as tsh_dynamics
+import libra_py.dynamics.heom.compute as heom_dynamics
+import libra_py.dynamics.exact.compute as exact_dynamics
+import libra_py.workflows.nbra.step4 as step4
+import libra_py.workflows.nbra.lz as lz
+
+
+RESULTS_FILE = "bench_results.json"
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+WORK_DIR = "bench_out"
+
+# The relative slow-down (and memory growth) w.r.t. the baseline considered to be a regression
+TOLERANCE = 0.2
+
+
+
+#================== Cases ========================
+
+def holstein_params(nstates):
+    return { "E_n":[0.001*i for i in range(nstates)], "x_n":[0.5*i for i in range(nstates)],
+             "k_n":[0.001]*nstates, "V":0.001 }
+
+
+def chain_params(nstates):
+    return { "E_n":[0.001*i for i in range(nstates)], "x_n":[0.5*i for i in range(nstates)],
+             "k_n":[0.001]*nstates, "V":[ [0.001]*nstates for i in range(nstates) ] }
+
+
+def LVC_model(q, params, full_id):
+    """ Per-trajectory LVC Hamiltonian with the `compute_model(q, params, full_id)` signature """
+    indx = Cpp2Py(full_id)[-1]
+    return LVC.LVC(q.col(indx), params)
+
+
+# model name: ( compute_model, model parameters as a function of nstates, ndof, allowed nstates )
+tsh_models = { "Holstein2":       ( Holstein.Holstein2, holstein_params, 1, None ),
+               "Holstein2_batch": ( batched.batched_model(Holstein.Holstein2_batch), holstein_params, 1, None ),
+               "chain_batch":     ( batched.batched_model(Tully.chain_potential_batch), chain_params, 2, [2, 3, 4] ),
+               "LVC":             ( LVC_model, lambda n: LVC.get_LVC_set1(), None, [2] ),
+               "LVC_batch":       ( batched.batched_model(LVC.LVC_batch), lambda n: LVC.get_LVC_set1(), None, [2] )
+             }
+
+
+def get_cases(groups, quick):
+    """
+    Returns:
+        list of dictionaries: the parameters of all the benchmark cases in the selected groups
+    """
+
+    cases = []
+
+    if "tsh" in groups:
+        ntrajs = [10, 100] if quick else [10, 100, 1000]
+        nstatess = [2, 4] if quick else [2, 4, 8]
+        for model in tsh_models:
+            for ntraj in ntrajs:
+                for nstates in nstatess:
+                    allowed = tsh_models[model][3]
+                    if allowed==None or nstates in allowed:
+                        cases.append( { "group":"tsh", "model":model, "ntraj":ntraj, "nstates":nstates, "nsteps":50 } )
+
+    if "heom" in groups:
+        # ( engine, integrator ): the C++ RK4, the NumPy RK4 and the NumPy RK45
+        for engine, integrator in [ (0, 0), (1, 0), (1, 1) ]:
+            for nstates in ([2] if quick else [2, 4]):
+                for LL in ([2, 4] if quick else [2, 4, 8]):
+                    for KK in ([0] if quick else [0, 1]):
+                        cases.append( { "group":"heom", "engine":engine, "integrator":integrator,
+                                        "nstates":nstates, "LL":LL, "KK":KK, "nsteps":100 } )
+
+    if "exact" in groups:
+        for engine in [0, 1]:
+            for nstates in [2] if quick else [2, 4]:
+                for npts in ([256, 1024] if quick else [256, 1024, 4096]):
+                    cases.append( { "group":"exact", "engine":engine, "nstates":nstates, "npts":npts, "nsteps":500 } )
+
+    if "nbra" in groups:
+        for method in ["step4_0", "step4_1", "lz"]:
+            for ntraj in ([100, 1000] if quick else [100, 1000, 10000]):
+                for nstates in ([4] if quick else [4, 8]):
+                    cases.append( { "group":"nbra", "method":method, "ntraj":ntraj, "nstates":nstates, "nsteps":1000 } )
+
+    return cases
+
+
+def case_name(case):
+    return "/".join( [ F"{key}={case[key]}" for key in sorted(case.keys()) ] )
+
+
+
+#================== Drivers ========================
+
+def run_tsh(case, prefix):
+
+    compute_model, get_params, ndof, allowed = tsh_models[case["model"]]
+    nstates, ntraj = case["nstates"], case["ntraj"]
+
+    model_params = dict(get_params(nstates))
+    model_params.update({"model":1, "model0":1})
+    if ndof==None:
+        ndof = len(model_params["omega"])
+
+    rnd = Random()
+    q, p, iM = MATRIX(ndof, ntraj), MATRIX(ndof, ntraj), MATRIX(ndof, 1)
+    for i in range(ndof):
+        iM.set(i, 0, 1.0/2000.0)
+        for traj in range(ntraj):
+            q.set(i, traj, 0.1 * rnd.normal())
+            p.set(i, traj, 10.0 + rnd.normal())
+
+    elec_params = { "init_type":3, "nstates":nstates, "istates":[1.0]+[0.0]*(nstates-1), "rep":1, "ntraj":ntraj }
+
+    dyn_params = { "nsteps":case["nsteps"], "dt":1.0*units.fs2au, "prefix":prefix, "progress_frequency":1.0,
+                   "rep_tdse":1, "ham_update_method":1, "ham_transform_method":1,
+                   "time_overlap_method":0, "nac_update_method":1, "ensemble_stat_method":1,
+                   "mem_output_level":3, "hdf5_output_level":0, "txt_output_level":0
+                 }
+
+    tsh_dynamics.generic_recipe(q, p, iM, dyn_params, compute_model, model_params, elec_params, rnd)
+
+
+def run_heom(case, prefix):
+
+    nstates = case["nstates"]
+
+    Ham = CMATRIX(nstates, nstates)
+    for i in range(nstates):
+        Ham.set(i, i, 0.001*i*(1.0+0.0j))
+        if i<nstates-1:
+            Ham.set(i, i+1, 0.0005*(1.0+0.0j))
+            Ham.set(i+1, i, 0.0005*(1.0+0.0j))
+
+    rho = CMATRIX(nstates, nstates)
+    rho.set(0, 0, 1.0+0.0j)
+
+    dyn_params = { "KK":case["KK"], "LL":case["LL"], "nsteps":case["nsteps"], "dt":0.1*units.fs2au,
+                   "engine":case["engine"], "integrator":case["integrator"],
+                   "prefix":prefix, "progress_frequency":1.0,
+                   "mem_output_level":3, "hdf5_output_level":0, "txt_output_level":0
+                 }
+
+    heom_dynamics.run_dynamics(dyn_params, Ham, rho)
+
+
+def run_exact(case, prefix):
+
+    nstates, npts = case["nstates"], case["npts"]
+
+    model_params = dict(holstein_params(nstates))
+    model_params.update({"model":1})
+
+    # The grid engines call the potential as py_funct(q, params), with q being MATRIX(ndof, 1)
+    def potential(q, params):
+        return Holstein.Holstein2(q, params, Py2Cpp_int([0, 0]))
+
+    params = { "nsteps":case["nsteps"], "dt":10.0, "progress_frequency":1.0, "prefix":prefix,
+               "rmin":[-15.0], "rmax":[15.0], "dx":[30.0/npts], "nstates":nstates,
+               "x0":[0.0], "p0":[0.0], "istate":[1, 0], "masses":[2000.0], "k":[0.001],
+               "integrator":"SOFT", "engine":case["engine"],
+               "mem_output_level":3, "hdf5_output_level":0, "txt_output_level":0,
+               "properties_to_save":[ "timestep", "time", "Ekin_dia", "Ekin_adi", "Epot_dia", "Epot_adi",
+                                      "Etot_dia", "Etot_adi", "norm_dia", "norm_adi", "pop_dia", "pop_adi",
+                                      "denmat_dia", "denmat_adi" ],
+               "use_compression":0, "compression_level":[0, 0, 0]
+             }
+
+    exact_dynamics.run_relaxation(params, potential, model_params)
+
+
+def nbra_hvib(nstates, nsteps):
+    """ A model NBRA vibronic Hamiltonian: fluctuating energies and the couplings of the neighboring states """
+
+    res = []
+    for i in range(nsteps):
+        e = 0.01 * np.arange(nstates) + 0.002 * np.sin(0.1 * i + np.arange(nstates))
+        nac = 0.001 * np.cos(0.05 * i) * ( np.eye(nstates, k=1) - np.eye(nstates, k=-1) )
+        res.append( data_conv.nparray2CMATRIX( np.diag(e) - 1.0j * nac ) )
+
+    return [ res ]
+
+
+def run_nbra(case, prefix):
+
+    nstates, nsteps = case["nstates"], case["nsteps"]
+    H_vib = nbra_hvib(nstates, nsteps)
+
+    params = { "nsteps":nsteps, "ntraj":case["ntraj"], "dt":41.0, "T":300.0, "istate":nstates-1,
+               "init_times":[0], "outfile":os.path.join(prefix, "_out.txt"), "random_seed":0 }
+
+    if case["method"]=="lz":
+        lz.run(H_vib, params)
+    else:
+        params.update({ "engine":int(case["method"][-1]) })
+        step4.run(H_vib, params)
+
+
+drivers = { "tsh":run_tsh, "heom":run_heom, "exact":run_exact, "nbra":run_nbra }
+
+
+
+#================== Measurements ========================
+
+def dir_size(path):
+    res = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            res += os.path.getsize(os.path.join(root, f))
+    return res
+
+
+def run_case(case):
+    """
+    Runs one benchmark case (in a separate process) and returns its measured costs
+    """
+
+    prefix = os.path.join(WORK_DIR, case_name(case).replace("/", "_").replace("=", ""))
+    if os.path.isdir(prefix):
+        shutil.rmtree(prefix)
+    os.makedirs(prefix)
+
+    mem0 = profiling.peak_memory()
+
+    t0 = time.perf_counter()
+    drivers[case["group"]](case, prefix)
+    wall = time.perf_counter() - t0
+
+    mem = profiling.peak_memory()
+
+    return { "case":case, "wall_time":wall, "steps_per_s":case["nsteps"]/max(wall, 1e-12),
+             "peak_memory":mem, "memory_increase":max(0, mem - mem0), "output_size":dir_size(prefix) }
+
+
+def run_all(cases):
+    """
+    Returns:
+        ( dictionary, list of strings ): the results of the cases, and the names of the cases that failed
+    """
+
+    results, failed = {}, []
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+
+    for case in cases:
+        name = case_name(case)
+        print(F"Running {name}")
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                res = pool.submit(run_case, case).result()
+        except Exception as e:
+            print(F"   FAILED: {e!r}")
+            failed.append(name)
+            continue
+
+        print(F"   wall time = {res['wall_time']:.3f} s  steps/s = {res['steps_per_s']:.2f}  "+\
+              F"memory = {res['peak_memory']/1024.0**2:.1f} MB  output = {res['output_size']/1024.0**2:.3f} MB")
+        results[name] = res
+
+    return results, failed
+
+
+
+#================== Baseline comparison ========================
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Returns:
+        list of strings: the description of all regressions w.r.t. the baseline
+    """
+
+    regressions = []
+
+    for name, res in results.items():
+        if name not in baseline:
+            print(F"No baseline for {name}")
+            continue
+        ref = baseline[name]
+
+        if res["steps_per_s"] < (1.0 - tolerance) * ref["steps_per_s"]:
+            regressions.append(F"{name}: steps/s {res['steps_per_s']:.2f} vs baseline {ref['steps_per_s']:.2f}")
+
+        if res["memory_increase"] > (1.0 + tolerance) * ref["memory_increase"] + 16*1024**2:
+            regressions.append(F"{name}: memory {res['memory_increase']/1024.0**2:.1f} MB vs baseline "+\
+                               F"{ref['memory_increase']/1024.0**2:.1f} MB")
+
+        if res["output_size"] > (1.0 + tolerance) * ref["output_size"]:
+            regressions.append(F"{name}: output size {res['output_size']} B vs baseline {ref['output_size']} B")
+
+    return regressions
+
+
+
+def main(argv):
+
+    groups = [ x for x in argv if x in drivers ]
+    if len(groups)==0:
+        groups = list(drivers.keys())
+
+    results, failed = run_all( get_cases(groups, "--quick" in argv) )
+    for name in failed:
+        print(F"FAILED  {name}")
+
+    machine = { "cpu":platform.processor() or platform.machine(), "ncpu":os.cpu_count() }
+
+    f = open(RESULTS_FILE, "w")
+    json.dump( { "machine":machine, "python":platform.python_version(),
+                 "time":time.strftime("%Y-%m-%d %H:%M:%S"), "results":results }, f, indent=2 )
+    f.close()
+    print(F"Results are written to {RESULTS_FILE}")
+
+    baseline = None
+    if os.path.isfile(BASELINE_FILE):
+        f = open(BASELINE_FILE, "r")
+        baseline = json.load(f)
+        f.close()
+
+    if "--update-baseline" in argv:
+        if len(failed)>0:
+            print(F"ERROR: {len(failed)} cases failed to run, the baseline {BASELINE_FILE} is not updated")
+            return 1
+
+        if baseline==None:
+            baseline = { "results":{} }
+        baseline["results"].update(results)
+        baseline.update({ "machine":machine, "python":platform.python_version(), "time":time.strftime("%Y-%m-%d %H:%M:%S") })
+
+        f = open(BASELINE_FILE, "w")
+        json.dump(baseline, f, indent=2)
+        f.close()
+        print(F"Baseline is updated: {BASELINE_FILE}")
+        return 0
+
+    if baseline==None:
+        print(F"No baseline file {BASELINE_FILE} found, run with --update-baseline to create it")
+        return 1 if len(failed)>0 else 0
+
+    if baseline.get("machine")!=machine:
+        print(F"WARNING: the baseline was measured on another machine ({baseline.get('machine')}), "+\
+              "the timings may not be comparable")
+
+    regressions = compare(results, baseline["results"])
+    for x in regressions:
+        print(F"REGRESSION  {x}")
+    print(F"{len(regressions)} regressions found w.r.t. {BASELINE_FILE}")
+
+    return 1 if len(regressions)>0 or len(failed)>0 else 0
+
+
+
+if __name__=="__main__":
+    sys.exit( main(sys.argv[1:]) )
+
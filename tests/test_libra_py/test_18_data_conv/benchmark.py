@@ -0,0 +1,75 @@
+#*********************************************************************************
+#* Copyright (C) 2020 Alexey V. Akimov
+#*
+#* This file is distributed under the terms of the GNU General Public License
+#* as published by the Free Software Foundation, either version 3 of
+#* the License, or (at your option) any later version.
+#* See the file LICENSE in the root directory of this distribution
+#* or <http://www.gnu.org/licenses/>.
+#*
+#*********************************************************************************/
+"""
+  Micro-benchmark of the per-step cost of saving the trajectory-resolved data
+  (such as `q`, `p`, `Cadi`) with the `mem_saver` as a function of ntraj x ndof.
+
+  Compares the element-by-element copy via `.get(i,j)` with the bulk copy from
+  the numpy view of the matrix storage (`data_conv.nparray_view`)
+
+  Usage:  python benchmark.py
+"""
+
+import sys
+import time
+import numpy as np
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+import libra_py.data_savers as data_savers
+
+
+def save_elementwise(saver, istep, data_name, data):
+    nx, ny = data.num_of_rows, data.num_of_cols
+    for i in range(nx):
+        for j in range(ny):
+            saver.np_data[data_name][istep, i, j] = data.get(i, j)
+
+
+def run_test(nsteps=10):
+
+    rnd = Random()
+
+    print("  ntraj   ndof     n_elts   elementwise, ms/step   view, ms/step   speedup")
+
+    for ntraj in [10, 100, 1000, 10000]:
+        for ndof in [1, 10, 100]:
+
+            q = MATRIX(ndof, ntraj)
+            for i in range(ndof):
+                for j in range(ntraj):
+                    q.set(i, j, rnd.normal())
+            qT = q.T()
+
+            saver = data_savers.mem_saver(["q"])
+            saver.add_dataset("q", (nsteps, ntraj, ndof), "R")
+
+            t0 = time.time()
+            for step in range(nsteps):
+                save_elementwise(saver, step, "q", qT)
+            t_elt = (time.time() - t0) / nsteps
+
+            ref = np.array(saver.np_data["q"])
+
+            t0 = time.time()
+            for step in range(nsteps):
+                saver.save_matrix(step, "q", qT)
+            t_view = (time.time() - t0) / nsteps
+
+            assert np.array_equal(ref, saver.np_data["q"])
+
+            print(F"{ntraj:7d} {ndof:6d} {ntraj*ndof:10d}   {1000*t_elt:20.4f}   {1000*t_view:13.4f}   {t_elt/max(t_view, 1e-12):7.1f}")
+
+
+run_test()
@@ -0,0 +1,59 @@
+"""
+Unit and regression test for the zero-copy NumPy views of the Libra matrices (libra_py.data_conv.nparray_view)
+"""
+
+from libra_py import data_conv
+import numpy as np
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+@pytest.mark.parametrize(('mat_type', 'dtype', 'x', 'y'),
+                         [ (MATRIX, float, 1.5, -2.5), (CMATRIX, complex, 1.5-0.5j, -2.5+3.0j), (IMATRIX, np.intc, 3, -7) ])
+def test_view_aliases_matrix(mat_type, dtype, x, y):
+    """Tests that the writes through the view change the matrix, and the writes to the matrix change the view"""
+    m = mat_type(3, 4)    # not square, so the transposed layout would be caught
+    view = data_conv.nparray_view(m)
+
+    assert view.shape == (3, 4)
+    assert view.dtype == dtype
+    assert np.all(view == 0)
+
+    # view -> matrix
+    view[1, 2] = x
+    view[2, 0] = y
+    for i in range(3):
+        for j in range(4):
+            expected = x if (i, j)==(1, 2) else (y if (i, j)==(2, 0) else 0)
+            assert m.get(i, j) == expected
+
+    # matrix -> view
+    m.set(0, 3, y)
+    m.set(1, 2, 0 * x)
+    assert view[0, 3] == y
+    assert view[1, 2] == 0
+
+    # Bulk NumPy operations on the view act on the matrix as well
+    view[:, 1] = x
+    assert all( m.get(i, 1) == x for i in range(3) )
+
+    # Views of the same matrix share the memory, the copies don't
+    assert np.shares_memory(view, data_conv.nparray_view(m))
+    assert not np.shares_memory(view, data_conv.MATRIX2nparray(m))
+
+
+
+
+def test_view_of_empty_matrix():
+    """Tests that the view of an empty matrix is an empty array of the right shape"""
+    view = data_conv.nparray_view(MATRIX(0, 5))
+    assert view.shape == (0, 5)
+
@@ -0,0 +1,83 @@
+"""
+Unit and regression test for the batched model Hamiltonians (libra_py.models.batched and the *_batch models)
+"""
+
+from libra_py import data_conv
+from libra_py.models import Holstein, batched
+import numpy as np
+import pytest
+import sys
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def compare(model, model_batch, params, x):
+    """Compares the batched model with the one-trajectory-at-a-time version for all trajectories"""
+    ntraj = len(x)
+    q = MATRIX(1, ntraj)
+    for itraj in range(ntraj):
+        q.set(0, itraj, x[itraj])
+
+    res = model_batch(data_conv.nparray_view(q), dict(params))
+
+    for itraj in range(ntraj):
+        obj = model(q, dict(params), Py2Cpp_int([0, itraj]))
+        assert np.allclose( res.ham_dia[itraj], data_conv.nparray_view(obj.ham_dia) )
+        assert np.allclose( res.d1ham_dia[itraj, 0], data_conv.nparray_view(obj.d1ham_dia[0]) )
+
+
+
+
+@pytest.mark.parametrize("nstates", [2, 3, 4])
+def test_Holstein4_5_batch(nstates):
+    """Tests the batched Holstein4 and Holstein5 with the default (4x4) couplings for any number of states"""
+    params = { "E_n":[0.001*i for i in range(nstates)], "x_n":[0.5*i for i in range(nstates)], "k_n":[0.001]*nstates }
+    x = [-1.0, 0.0, 0.3, 2.0]
+
+    compare(Holstein.Holstein4, Holstein.Holstein4_batch, params, x)
+    compare(Holstein.Holstein5, Holstein.Holstein5_batch, params, x)
+
+
+
+
+def test_batched_model_cache():
+    """Tests that the batched_model is re-evaluated if the requested trajectory moves, and only then"""
+    ncalls = [0]
+    def model_batch(q, params):
+        ncalls[0] += 1
+        return Holstein.Holstein2_batch(q, params)
+
+    params = { "E_n":[0.0, 0.001], "x_n":[0.0, 1.0], "k_n":[0.001, 0.001], "V":0.001 }
+    compute_model = batched.batched_model(model_batch)
+
+    q = MATRIX(1, 3)
+    for itraj in range(3):
+        q.set(0, itraj, 0.5 * itraj)
+    for itraj in range(3):
+        compute_model(q, params, Py2Cpp_int([0, itraj]))
+    assert ncalls[0] == 1
+
+    # Only the trajectory 2 moves: the Hamiltonian of the trajectory 1 is still valid
+    q.set(0, 2, 3.0)
+    obj = compute_model(q, params, Py2Cpp_int([0, 1]))
+    assert ncalls[0] == 1
+    assert np.allclose( data_conv.nparray_view(obj.ham_dia), data_conv.nparray_view(Holstein.Holstein2(q, params, Py2Cpp_int([0, 1])).ham_dia) )
+
+    # ... but not that of the trajectory 2
+    obj = compute_model(q, params, Py2Cpp_int([0, 2]))
+    assert ncalls[0] == 2
+    assert np.allclose( data_conv.nparray_view(obj.ham_dia), data_conv.nparray_view(Holstein.Holstein2(q, params, Py2Cpp_int([0, 2])).ham_dia) )
+
+
+    # All the trajectories move: one batched call for the whole update
+    for itraj in range(3):
+        q.set(0, itraj, 0.1 + 0.5 * itraj)
+    for itraj in range(3):
+        obj = compute_model(q, params, Py2Cpp_int([0, itraj]))
+        assert np.allclose( data_conv.nparray_view(obj.ham_dia), data_conv.nparray_view(Holstein.Holstein2(q, params, Py2Cpp_int([0, itraj])).ham_dia) )
+    assert ncalls[0] == 3
@@ -0,0 +1,72 @@
+"""
+Unit and regression test for merging the output of the TSH trajectory batches (libra_py.dynamics.tsh.save)
+"""
+
+from libra_py import profiling
+from libra_py.dynamics.tsh import save
+import numpy as np
+import h5py
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def make_batch(filename, ntraj, nsteps, nstates, seed):
+    """
+    Writes a file with the layout of the "data.hdf" of `tsh.compute.run_dynamics` run with the profiling level 2:
+    the datasets "<name>/data" and the per-step timings "timings/<phase>/data"
+    """
+    rnd = np.random.default_rng(seed)
+    data = { "timestep": np.arange(nsteps), "time": np.arange(nsteps) * 10.0,
+             "Ekin_ave": rnd.random(nsteps), "dEkin_ave": rnd.random(nsteps),
+             "se_pop_adi": rnd.random((nsteps, nstates)),
+             "states": rnd.integers(0, nstates, (nsteps, ntraj)) }
+
+    with h5py.File(filename, "w") as f:
+        for name, x in data.items():
+            f.create_dataset(F"{name}/data", data=x)
+
+    prof = profiling.profiler(2)
+    for step in range(nsteps):
+        prof.start("propagation"); prof.stop("propagation")
+        prof.start("saving"); prof.stop("saving")
+        prof.end_step()
+    prof.save_step_timings(filename)
+
+    return data, prof
+
+
+
+
+def test_merge_tsh_data_with_timings(tmp_path):
+    """Tests that the files with the profiling data (nested groups) are merged"""
+    ntrajs, nsteps, nstates = [3, 5], 6, 2
+    names = [ os.path.join(str(tmp_path), F"data_{i}.hdf") for i in range(2) ]
+    batches = [ make_batch(names[i], ntrajs[i], nsteps, nstates, i) for i in range(2) ]
+
+    merged = os.path.join(str(tmp_path), "data.hdf")
+    save.merge_tsh_data(names, ntrajs, merged)
+
+    w = np.array(ntrajs) / float(sum(ntrajs))
+    d0, d1 = batches[0][0], batches[1][0]
+
+    with h5py.File(merged, "r") as f:
+        assert np.allclose( f["time/data"][()], d0["time"] )
+        assert np.allclose( f["se_pop_adi/data"][()], w[0] * d0["se_pop_adi"] + w[1] * d1["se_pop_adi"] )
+        assert f["states/data"].shape == (nsteps, sum(ntrajs))
+
+        ave = w[0] * d0["Ekin_ave"] + w[1] * d1["Ekin_ave"]
+        var = w[0] * (d0["dEkin_ave"]**2 + (d0["Ekin_ave"] - ave)**2) + w[1] * (d1["dEkin_ave"]**2 + (d1["Ekin_ave"] - ave)**2)
+        assert np.allclose( f["dEkin_ave/data"][()], np.sqrt(var) )
+
+        for phase in ["propagation", "saving"]:
+            expected_result = np.array(batches[0][1].steps[phase]) + np.array(batches[1][1].steps[phase])
+            assert np.allclose( f[F"timings/{phase}/data"][()], expected_result )
+
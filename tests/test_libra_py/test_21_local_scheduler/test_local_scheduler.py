@@ -0,0 +1,203 @@
+"""
+Unit and regression test for the local_scheduler module in the Libra package
+"""
+
+from libra_py import local_scheduler
+import pytest
+import threading
+import signal
+import time
+import sys
+import os
+
+
+STUB = """
+import os, sys, time, subprocess
+
+mode, marker = sys.argv[1], sys.argv[2]
+
+if mode=="ok":
+    f = open("result.txt", "w"); f.write("ok"); f.close()
+    sys.exit(0)
+
+elif mode=="fail":
+    sys.exit(3)
+
+elif mode=="flaky":
+    # Fails on the first attempt and succeeds on the second one; the marker is kept outside
+    # of the scratch directory, which is cleaned before every attempt
+    if not os.path.exists(marker):
+        f = open(marker, "w"); f.close()
+        sys.exit(1)
+    f = open("result.txt", "w"); f.write("ok"); f.close()
+    sys.exit(0)
+
+elif mode=="hang":
+    # Starts a child process and waits forever; both must be killed on timeout
+    child = subprocess.Popen(["sleep", "60"])
+    f = open(marker, "w"); f.write(F"{os.getpid()} {child.pid}"); f.close()
+    time.sleep(60)
+"""
+
+
+
+
+def make_stub(path):
+    """Writes the stub executable, which behaves according to its first argument"""
+    filename = os.path.join(path, "stub.py")
+    f = open(filename, "w")
+    f.write(STUB)
+    f.close()
+    return filename
+
+
+
+
+def command(stub, mode, marker="none"):
+    return F"{sys.executable} {stub} {mode} {marker}"
+
+
+
+
+def alive(pid):
+    """Returns True if the process `pid` exists and is not a zombie"""
+    try:
+        f = open(F"/proc/{pid}/stat")
+        state = f.read().rsplit(")", 1)[1].split()[0]
+        f.close()
+        return state!="Z"
+    except FileNotFoundError:
+        return False
+
+
+
+
+def test_success(tmp_path):
+    """Tests that a successful task and the post-processing depending on it are done"""
+    stub = make_stub(str(tmp_path))
+    pool = local_scheduler.task_pool(str(tmp_path / "scratch"), nworkers=2, max_retries=0)
+
+    post = []
+    pool.add_task("a", command(stub, "ok"), check=lambda d: os.path.isfile(os.path.join(d, "result.txt")))
+    pool.add_task("b", command(stub, "ok"))
+    pool.add_post("ab", ["a", "b"], lambda key: post.append(key))
+
+    assert pool.run() == []
+    assert pool.done("a") and pool.done("b")
+    assert pool.status["tasks"]["a"]["attempts"] == 1
+    assert pool.status["tasks"]["a"]["returncode"] == 0
+    assert post == ["ab"]
+
+
+
+
+def test_failure(tmp_path):
+    """Tests that a failing task is retried `max_retries` times, reported as failed, and blocks its post-processing"""
+    stub = make_stub(str(tmp_path))
+    pool = local_scheduler.task_pool(str(tmp_path / "scratch"), max_retries=2)
+
+    post = []
+    pool.add_task("a", command(stub, "fail"))
+    pool.add_task("b", command(stub, "ok"))
+    pool.add_post("ab", ["a", "b"], lambda key: post.append(key))
+
+    assert pool.run() == ["a"]
+    assert pool.failed() == ["a"]
+    assert pool.status["tasks"]["a"]["attempts"] == 3
+    assert pool.status["tasks"]["a"]["returncode"] == 3
+    assert pool.done("b")
+    assert post == []
+
+
+
+
+def test_retry(tmp_path):
+    """Tests that a task failing on its first attempt is restarted and completed"""
+    stub = make_stub(str(tmp_path))
+    marker = str(tmp_path / "flaky.marker")
+    pool = local_scheduler.task_pool(str(tmp_path / "scratch"), max_retries=1)
+
+    pool.add_task("a", command(stub, "flaky", marker))
+
+    assert pool.run() == []
+    assert pool.done("a")
+    assert pool.status["tasks"]["a"]["attempts"] == 2
+
+    # The completed task is not repeated when the run is restarted from the manifest
+    pool = local_scheduler.task_pool(str(tmp_path / "scratch"), max_retries=1)
+    pool.add_task("a", command(stub, "fail"))
+    assert pool.run() == []
+    assert pool.status["tasks"]["a"]["attempts"] == 2
+
+
+
+
+def test_timeout(tmp_path):
+    """Tests that a task exceeding the time limit is killed together with the processes it started"""
+    stub = make_stub(str(tmp_path))
+    marker = str(tmp_path / "hang.pids")
+    pool = local_scheduler.task_pool(str(tmp_path / "scratch"), max_retries=0, timeout=1.0)
+
+    pool.add_task("a", command(stub, "hang", marker))
+
+    t0 = time.time()
+    assert pool.run() == ["a"]
+    assert time.time() - t0 < 30.0
+    assert pool.status["tasks"]["a"]["attempts"] == 1
+
+    f = open(marker)
+    pids = [ int(x) for x in f.read().split() ]
+    f.close()
+
+    # The processes may take a moment to disappear after SIGKILL
+    for i in range(50):
+        if not any( [ alive(pid) for pid in pids ] ):
+            break
+        time.sleep(0.1)
+    assert not any( [ alive(pid) for pid in pids ] )
+
+
+
+
+
+def test_interrupted(tmp_path):
+    """Tests that the running tasks are killed if the scheduler is interrupted (Ctrl-C), and are repeated by the next run"""
+    stub = make_stub(str(tmp_path))
+    marker = str(tmp_path / "hang.pids")
+    pool = local_scheduler.task_pool(str(tmp_path / "scratch"), max_retries=0)
+    pool.add_task("a", command(stub, "hang", marker))
+    pool.add_task("b", command(stub, "ok"))
+
+    def interrupt():
+        # The task runs in its own session, so only the scheduler gets the SIGINT
+        while not os.path.isfile(marker):
+            time.sleep(0.05)
+        time.sleep(0.2)
+        os.kill(os.getpid(), signal.SIGINT)
+    thread = threading.Thread(target=interrupt)
+    thread.start()
+
+    t0 = time.time()
+    with pytest.raises(KeyboardInterrupt):
+        pool.run()
+    thread.join()
+    assert time.time() - t0 < 30.0
+
+    f = open(marker)
+    pids = [ int(x) for x in f.read().split() ]
+    f.close()
+
+    for i in range(50):
+        if not any( [ alive(pid) for pid in pids ] ):
+            break
+        time.sleep(0.1)
+    assert not any( [ alive(pid) for pid in pids ] )
+
+    # The interrupted task is still pending in the manifest, and the next run completes all the tasks
+    pool = local_scheduler.task_pool(str(tmp_path / "scratch"), max_retries=0)
+    assert pool.status["tasks"]["a"]["status"] == "pending"
+    pool.add_task("a", command(stub, "ok"))
+    pool.add_task("b", command(stub, "ok"))
+
+    assert pool.run() == []
+    assert pool.done("a") and pool.done("b")
@@ -0,0 +1,64 @@
+"""
+Unit and regression test for the NumPy SOFT engine of the exact dynamics (libra_py.dynamics.exact.soft):
+the populations and energies must agree with those of the C++ Wfcgrid2 SOFT propagation
+"""
+
+from libra_py.dynamics.exact import compute
+from libra_py.models import Holstein
+import numpy as np
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def potential(q, params):
+    """The 2-state Holstein model in the `py_funct(q, params)` form used by the grid engines"""
+    return Holstein.Holstein2(q, params, Py2Cpp_int([0, 0]))
+
+
+
+
+PROPERTIES = [ "pop_dia", "pop_adi", "Ekin_dia", "Ekin_adi", "Epot_dia", "Epot_adi",
+               "Etot_dia", "Etot_adi", "norm_dia", "norm_adi" ]
+
+
+def run(engine, prefix):
+    """Runs the 1D 2-state dynamics with a given engine and returns the saved observables"""
+
+    model_params = { "model":1, "E_n":[0.0, -0.001], "x_n":[0.0, 1.0], "k_n":[0.001, 0.001], "V":0.001 }
+
+    params = { "nsteps":50, "dt":10.0, "progress_frequency":1.0, "prefix":prefix,
+               "rmin":[-15.0], "rmax":[15.0], "dx":[30.0/256], "nstates":2,
+               "x0":[-1.0], "p0":[2.0], "istate":[0, 0], "masses":[2000.0], "k":[0.001],
+               "integrator":"SOFT", "engine":engine,
+               "mem_output_level":3, "hdf5_output_level":0, "txt_output_level":0,
+               "properties_to_save":[ "timestep", "time" ] + PROPERTIES,
+               "use_compression":0, "compression_level":[0, 0, 0]
+             }
+
+    mem_saver = compute.run_relaxation(params, potential, model_params)
+
+    return { key:np.array(mem_saver.np_data[key]) for key in PROPERTIES }
+
+
+
+
+def test_soft_vs_wfcgrid2(tmp_path):
+    """Tests that the NumPy engine reproduces the populations and energies of Wfcgrid2 in 1D"""
+    res0 = run(0, str(tmp_path / "cpp"))
+    res1 = run(1, str(tmp_path / "numpy"))
+
+    # The populations evolve noticeably, so the comparison is not trivial
+    assert np.max(np.abs(res0["pop_dia"][-1] - res0["pop_dia"][0])) > 1e-3
+
+    for key in PROPERTIES:
+        assert res1[key].shape == res0[key].shape, key
+        assert np.allclose(res1[key], res0[key], rtol=1e-6, atol=1e-8), key
+
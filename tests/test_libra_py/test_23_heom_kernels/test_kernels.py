@@ -0,0 +1,274 @@
+"""
+Unit and regression test for the NumPy HEOM kernels (libra_py.dynamics.heom.kernels): the derivatives of
+the active ADMs and the RK4 step are compared to a small dense port of the C++ `compute_deriv_n`, and the
+error of the adaptive RK45 integrator is checked against the requested tolerance
+"""
+
+from libra_py.dynamics.heom import kernels
+from libra_py import data_conv
+import numpy as np
+import pytest
+import math
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+kB = 1.9872065E-3 / 627.5094709    # Boltzmann constant [ Ha/K ]
+
+
+
+
+def gen_hierarchy(d, max_tier):
+    """
+    Port of the C++ `gen_hierarchy`: the multi-index vectors of all the ADMs up to the tier `max_tier`,
+    and the indices of the ADMs with the k-th index increased (decreased) by 1, -1 if there is none
+    """
+
+    all_vectors, tiers = [], []
+    parents = [ [0]*d ]
+    for tier in range(max_tier+1):
+        all_vectors = all_vectors + parents
+        tiers = tiers + [tier] * len(parents)
+
+        children = []
+        for p in parents:
+            for k in range(d):
+                c = list(p);  c[k] += 1
+                if c not in children:
+                    children.append(c)
+        parents = children
+
+    N = len(all_vectors)
+    vplus = [ [-1]*d for n in range(N) ]
+    vminus = [ [-1]*d for n in range(N) ]
+    for n in range(N):
+        for k in range(d):
+            for sgn, res in [ (1, vplus), (-1, vminus) ]:
+                v = list(all_vectors[n]);  v[k] += sgn
+                if v in all_vectors and tiers[n] + sgn <= max_tier:
+                    res[n][k] = all_vectors.index(v)
+
+    return all_vectors, vplus, vminus
+
+
+
+
+def bath(KK, eta, gamma, T):
+    """ Port of the C++ `setup_bath`: the Matsubara frequencies and the expansion coefficients """
+
+    kT = kB * T
+    g = [ gamma ]
+    c = [ 0.5 * eta * gamma * (1.0 / math.tan(0.5 * gamma / kT) - 1.0j) ]
+    for k in range(1, KK+1):
+        gk = 2.0 * k * math.pi * kT
+        g.append(gk)
+        c.append( 2.0 * eta * kT * gamma * gk / (gk*gk - gamma*gamma) + 0.0j )
+
+    return g, c
+
+
+
+
+def compute_deriv_n_ref(rho, P):
+    """
+    Dense port of the C++ `compute_deriv_n` (with the Ihizaki-Tanimura truncation terms), applied to all the
+    ADMs on the `adm_list` in a loop; the ADMs off the list have zero derivatives
+    """
+
+    H, Q, g, c = P["H"], P["Q"], P["g"], P["c"]
+    nvec, vp, vm, nonzero = P["nvec"], P["vp"], P["vm"], P["nonzero"]
+    KK, nq = len(g) - 1, H.shape[0]
+
+    tp = 0.0
+    if P["scheme"] in [1, 2]:
+        tp = P["eta"] * kB * P["T"] / g[0]
+        msum = sum( [ c[k] / g[k] for k in range(KK+1) ] )
+        tp -= msum.real if P["scheme"]==1 else msum
+
+    def comm(A, B):
+        return A @ B - B @ A
+
+    drho = np.zeros(rho.shape, dtype=complex)
+    for n in P["adm_list"]:
+        d = np.zeros( (nq, nq), dtype=complex)
+
+        if nonzero[n]==1:
+            d = -1.0j * comm(H, rho[n])
+            d -= sum( [ nvec[n][m*(KK+1)+k] * g[k] for m in range(nq) for k in range(KK+1) ] ) * rho[n]
+            if P["scheme"] in [1, 2]:
+                for m in range(nq):
+                    d -= tp * comm(Q[m], comm(Q[m], rho[n]))
+
+        for m in range(nq):
+            s = np.zeros( (nq, nq), dtype=complex)
+            s1 = np.zeros( (nq, nq), dtype=complex)
+            s2 = np.zeros( (nq, nq), dtype=complex)
+
+            for k in range(KK+1):
+                nmk = nvec[n][m*(KK+1)+k]
+
+                n_plus = vp[n][m*(KK+1)+k]
+                if n_plus!=-1 and nonzero[n_plus]==1:
+                    sf = math.sqrt( (nmk + 1.0) * abs(c[k]) ) if P["do_scale"]==1 else 1.0
+                    s += sf * rho[n_plus]
+
+                n_minus = vm[n][m*(KK+1)+k]
+                if n_minus!=-1 and nonzero[n_minus]==1:
+                    sf = math.sqrt( nmk / abs(c[k]) ) if P["do_scale"]==1 else float(nmk)
+                    s1 += sf * c[k] * rho[n_minus]
+                    s2 += sf * np.conj(c[k]) * rho[n_minus]
+
+            d -= 1.0j * comm(Q[m], s)
+            d -= 1.0j * (Q[m] @ s1 - s2 @ Q[m])
+
+        drho[n] = d
+
+    return drho
+
+
+
+
+def make_problem(nq, KK, LL, do_scale, scheme, diagonal_Q, seed=1):
+    """
+    Returns the parameters of the reference and of the `kernels.hierarchy_tables`, and random ADMs
+    """
+
+    rnd = np.random.default_rng(seed)
+
+    all_vectors, vp, vm = gen_hierarchy(nq*(KK+1), LL)
+    nn = len(all_vectors)
+
+    eta, gamma, T = 0.01, 0.005, 300.0
+    g, c = bath(KK, eta, gamma, T)
+
+    H = rnd.normal(size=(nq, nq)) + 1.0j * rnd.normal(size=(nq, nq))
+    H = 0.01 * (H + H.conj().T)
+
+    if diagonal_Q:
+        Q = [ np.diag(np.identity(nq)[m]).astype(complex) for m in range(nq) ]
+    else:
+        Q = []
+        for m in range(nq):
+            A = rnd.normal(size=(nq, nq))
+            Q.append( (A + A.T).astype(complex) )
+
+    rho = rnd.normal(size=(nn, nq, nq)) + 1.0j * rnd.normal(size=(nn, nq, nq))
+    nonzero = [ int(x) for x in rnd.integers(0, 2, nn) ]
+    adm_list = [ n for n in range(nn) if rnd.random() < 0.6 ]
+
+    ref = { "H":H, "Q":Q, "g":g, "c":c, "nvec":all_vectors, "vp":vp, "vm":vm, "nonzero":nonzero,
+            "adm_list":adm_list, "scheme":scheme, "do_scale":do_scale, "eta":eta, "T":T }
+
+    params = { "Ham":data_conv.nparray2CMATRIX(H), "gamma_matsubara":g, "c_matsubara":c,
+               "nvec":all_vectors, "nvec_plus":vp, "nvec_minus":vm,
+               "el_phon_couplings":[ data_conv.nparray2CMATRIX(q) for q in Q ],
+               "do_scale":do_scale, "truncation_scheme":scheme, "eta":eta, "temperature":T, "gamma":gamma }
+
+    return ref, params, rho
+
+
+
+
+@pytest.mark.parametrize(('nq', 'KK', 'LL', 'do_scale', 'scheme', 'diagonal_Q'),
+                         [ (2, 0, 4, 0, 1, True), (2, 1, 3, 1, 1, True), (3, 1, 3, 1, 2, True),
+                           (2, 0, 5, 1, 0, False), (3, 0, 3, 0, 1, False) ])
+def test_derivatives(nq, KK, LL, do_scale, scheme, diagonal_Q):
+    """Tests the derivatives of the active ADMs against the dense reference"""
+    ref, params, rho = make_problem(nq, KK, LL, do_scale, scheme, diagonal_Q)
+
+    tables = kernels.hierarchy_tables(params)
+    act = np.array(ref["adm_list"], dtype=int)
+    prob = kernels.build_active(tables, act, np.array(ref["nonzero"], dtype=bool), rho)
+
+    expected_result = compute_deriv_n_ref(rho, ref)[act]
+    computed_result = kernels.derivatives(rho[act], prob)
+
+    assert np.allclose(computed_result, expected_result, rtol=1e-12, atol=1e-12 * np.max(np.abs(expected_result)))
+
+
+
+
+def spin_boson():
+    """ The 2-level system with the ADMs up to the tier 6, all of them active, starting from rho = |0><0| """
+
+    ref, params, rho = make_problem(2, 0, 6, 1, 1, True)
+
+    H = np.array([ [0.0, 100.0], [100.0, 400.0] ], dtype=complex) / 219474.6
+    eta, gamma = 2.0 * 50.0 / 219474.6, 1.0 / (0.1 * 41341.4)
+    g, c = bath(0, eta, gamma, 300.0)
+
+    nn = rho.shape[0]
+    ref.update({ "H":H, "g":g, "c":c, "eta":eta, "nonzero":[1]*nn, "adm_list":list(range(nn)) })
+    params.update({ "Ham":data_conv.nparray2CMATRIX(H), "gamma_matsubara":g, "c_matsubara":c, "eta":eta, "gamma":gamma })
+
+    rho = np.zeros(rho.shape, dtype=complex)
+    rho[0, 0, 0] = 1.0
+
+    tables = kernels.hierarchy_tables(params)
+    prob = kernels.build_active(tables, np.arange(nn), np.ones(nn, dtype=bool), rho)
+
+    return ref, prob, rho
+
+
+
+
+def rk4_ref(y, dt, nsteps, ref):
+    for step in range(nsteps):
+        k1 = compute_deriv_n_ref(y, ref)
+        k2 = compute_deriv_n_ref(y + 0.5*dt*k1, ref)
+        k3 = compute_deriv_n_ref(y + 0.5*dt*k2, ref)
+        k4 = compute_deriv_n_ref(y + dt*k3, ref)
+        y = y + (dt/6.0) * (k1 + 2.0*k2 + 2.0*k3 + k4)
+    return y
+
+
+
+
+def test_rk4():
+    """Tests the RK4 steps against those done with the dense reference derivatives"""
+    ref, prob, rho = spin_boson()
+    dt, nsteps = 2.0 * 41.34, 20
+
+    y = rho.copy()
+    for step in range(nsteps):
+        y = kernels.rk4(y, dt, prob)
+
+    expected_result = rk4_ref(rho.copy(), dt, nsteps, ref)
+
+    assert abs(expected_result[0, 0, 0] - 1.0) > 0.1    # the populations change
+    assert np.allclose(y, expected_result, rtol=1e-10, atol=1e-14)
+
+
+
+
+def test_rk45_tolerance():
+    """Tests that the error of the RK45 integrator follows the requested tolerance"""
+    ref, prob, rho = spin_boson()
+    dt, nsteps = 2.0 * 41.34, 20
+
+    # Practically exact solution: RK4 with a very small time step
+    exact = rho.copy()
+    for step in range(nsteps * 100):
+        exact = kernels.rk4(exact, dt/100.0, prob)
+
+    errors, naccs = [], []
+    for rtol in [1e-4, 1e-6, 1e-8]:
+        y, h, nacc_tot = rho.copy(), dt, 0
+        for step in range(nsteps):
+            y, h, nacc, nrej = kernels.rk45(y, dt, prob, h, rtol, 1e-12, 10000)
+            nacc_tot += nacc
+
+        errors.append( np.max(np.abs(y[0] - exact[0])) )
+        naccs.append(nacc_tot)
+
+        assert errors[-1] < rtol
+
+    # Tighter tolerances give smaller errors, at the cost of more steps
+    assert errors[0] > errors[1] > errors[2]
+    assert naccs[0] < naccs[1] < naccs[2]
+
@@ -0,0 +1,144 @@
+"""
+Unit and regression test for the HEOM parameter scans (libra_py.dynamics.heom.scan): the hierarchies
+stored in the .npz files, the grid of the parameters, and the layout of the "scan.hdf" file
+"""
+
+from libra_py.dynamics.heom import scan
+from libra_py import data_conv
+import numpy as np
+import h5py
+import pytest
+import types
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def as_lists(x):
+    return [ [ int(i) for i in v ] for v in x ]
+
+
+def model_run_dynamics(calls):
+    """
+    The model of `compute.run_dynamics`: checks the parameters given to it and returns the density
+    matrices that depend on the temperature, so the results of every point can be told apart
+    """
+
+    def run_dynamics(dyn_params, Ham, rho_init):
+        nquant = Ham.num_of_cols
+        assert len(dyn_params["hierarchy"][0][0]) == nquant * (dyn_params["KK"]+1)
+        assert dyn_params["mem_output_level"] >= 3
+        assert "time" in dyn_params["properties_to_save"] and "denmat" in dyn_params["properties_to_save"]
+        calls.append(dyn_params["prefix"])
+
+        nsteps = dyn_params["nsteps"]
+        x = np.exp( -dyn_params["temperature"] * np.arange(nsteps) / 1000.0 )
+        denmat = np.zeros( (nsteps, nquant, nquant), dtype=complex)
+        denmat[:, 0, 0] = x
+        denmat[:, 1, 1] = 1.0 - x
+        return types.SimpleNamespace( np_data={ "time": dyn_params["dt"] * np.arange(nsteps), "denmat": denmat } )
+
+    return run_dynamics
+
+
+
+
+@pytest.mark.parametrize(('nquant', 'KK', 'LL'), [ (2, 0, 3), (2, 1, 2), (3, 1, 3) ])
+def test_get_hierarchy_cache(tmp_path, monkeypatch, nquant, KK, LL):
+    """Tests that the stored hierarchies are the same as the generated ones, and are read instead of being generated"""
+    monkeypatch.setattr(scan, "_hierarchies", {})
+    cache_dir = str(tmp_path / "hierarchies")
+
+    expected_result = ( intList2(), intList2(), intList2() )
+    gen_hierarchy(nquant * (KK+1), LL, -1, *expected_result)
+
+    res = scan.get_hierarchy(nquant, KK, LL, cache_dir)
+    filename = scan.hierarchy_filename(cache_dir, nquant, KK, LL)
+    assert os.path.isfile(filename)
+    assert os.listdir(cache_dir) == [ os.path.basename(filename) ]    # no temporary files left
+
+    # The same process reuses the same objects
+    assert scan.get_hierarchy(nquant, KK, LL, cache_dir) is res
+
+    # A new process reads the file and doesn't call `gen_hierarchy`
+    def no_gen_hierarchy(*args):
+        raise AssertionError("the hierarchy should be read from the file")
+    monkeypatch.setattr(scan, "_hierarchies", {})
+    monkeypatch.setattr(scan, "gen_hierarchy", no_gen_hierarchy)
+    res_file = scan.get_hierarchy(nquant, KK, LL, cache_dir)
+
+    for x, y, z in zip(res, res_file, expected_result):
+        assert as_lists(x) == as_lists(z)
+        assert as_lists(y) == as_lists(z)
+
+    with np.load(filename) as data:
+        assert data["nvec"].shape == (len(expected_result[0]), nquant * (KK+1))
+        assert as_lists(data["nvec_minus"]) == as_lists(expected_result[2])
+
+
+
+
+def test_parameter_grid():
+    """Tests that all the combinations are generated, the last parameter changing the fastest"""
+    points = scan.parameter_grid({ "temperature":[100.0, 300.0], "eta":[0.1, 0.2, 0.3] })
+
+    assert len(points) == 6
+    assert points[0] == { "temperature":100.0, "eta":0.1 }
+    assert points[1] == { "temperature":100.0, "eta":0.2 }
+    assert points[5] == { "temperature":300.0, "eta":0.3 }
+    assert scan.parameter_grid({}) == [ {} ]
+
+
+
+
+@pytest.mark.parametrize("nprocs", [1, 3])
+def test_run_scan(tmp_path, monkeypatch, nprocs):
+    """Tests the layout of the "scan.hdf" file and the populations padded with NaN for the shorter runs"""
+    calls = []
+    monkeypatch.setattr(scan, "_hierarchies", {})
+    monkeypatch.setattr(scan.compute, "run_dynamics", model_run_dynamics(calls))
+
+    prefix = str(tmp_path / "out")
+    points = scan.parameter_grid({ "temperature":[100.0, 300.0], "eta":[0.1, 0.2], "nsteps":[5, 8] })
+    Ham0 = CMATRIX(2, 2)
+    Ham1 = CMATRIX(2, 2)
+    Ham1.set(0, 1, 0.01+0.0j)
+    Ham1.set(1, 0, 0.01+0.0j)
+    points[1]["Ham"] = Ham1
+
+    dyn_params = { "prefix":prefix, "Ham":Ham0, "KK":1, "LL":3, "dt":2.0 }
+    populations = scan.run_scan(dyn_params, points, CMATRIX(2, 2), nprocs)
+
+    assert populations.shape == (8, 8, 2)
+    if nprocs==1:
+        assert calls == [ os.path.join(prefix, F"point_{i}") for i in range(8) ]
+    assert os.path.isfile(scan.hierarchy_filename(os.path.join(prefix, "hierarchies"), 2, 1, 3))
+
+    with h5py.File(os.path.join(prefix, "scan.hdf"), "r") as f:
+        assert np.array_equal(f["populations"][()], populations, equal_nan=True)
+        assert f["time"].shape == (8, 8)
+        assert np.array_equal(f["parameters/temperature"][()], [ p["temperature"] for p in points ])
+        assert np.array_equal(f["parameters/nsteps"][()], [ p["nsteps"] for p in points ])
+        assert "Ham" not in f["parameters"]
+
+        for ipoint, point in enumerate(points):
+            g = f[F"point_{ipoint}"]
+            nsteps = point["nsteps"]
+            x = np.exp( -point["temperature"] * np.arange(nsteps) / 1000.0 )
+
+            assert g.attrs["temperature"] == point["temperature"] and g.attrs["eta"] == point["eta"]
+            assert g["denmat"].shape == (nsteps, 2, 2)
+            assert np.allclose(g["populations"][()], np.array([x, 1.0 - x]).T)
+            assert np.allclose(g["time"][()], 2.0 * np.arange(nsteps))
+            assert np.allclose(populations[ipoint, :nsteps], g["populations"][()])
+            assert np.all(np.isnan(populations[ipoint, nsteps:]))
+            assert np.all(np.isnan(f["time"][ipoint, nsteps:]))
+
+            Ham = Ham1 if ipoint==1 else Ham0
+            assert np.array_equal(g["Ham"][()], data_conv.nparray_view(Ham))
@@ -0,0 +1,187 @@
+"""
+Unit and regression test for the FFT-based ACFs, Fourier transforms and influence spectra
+(libra_py.acf, libra_py.ft, libra_py.influence_spectrum): the results are compared to the
+direct sums over the time steps and frequencies, as computed before the FFTs were used
+"""
+
+from libra_py import acf
+from libra_py import ft
+from libra_py import influence_spectrum
+from libra_py import data_conv
+from libra_py import units
+import numpy as np
+import pytest
+import math
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def acf_ref(X, opt):
+    """ Direct-sum ACF of the series X (nsteps, ndof): returns the normalized and the raw ACFs """
+    sz, ndof = X.shape
+    raw = np.zeros(sz)
+    for i in range(sz):
+        total = np.sum(X[:sz-i] * X[i:])
+        raw[i] = total / ((sz - i) * ndof) if opt==0 else total / (sz * ndof)
+    norm = 1.0 / raw[0] if abs(raw[0]) > 0.0 else 1.0
+    return norm * raw, raw
+
+
+def ft_ref(X, wspan, dw, dt):
+    """ Direct-sum cosine transform of `ft.ft`, with X[0] assumed to be 1 """
+    npoints = int(wspan/dw)
+    t = np.arange(1, len(X)) * dt
+    W = np.arange(npoints) * dw
+    J = np.array( [ dt * (1.0 + 2.0 * np.sum(np.cos(w * t) * X[1:])) for w in W ] )
+    return W, J
+
+
+def ft2_ref(X, wmin, wmax, dw, dt):
+    """ Direct-sum transform of `ft.ft2` """
+    npoints = int((wmax - wmin)/dw)
+    t = np.arange(len(X)) * dt
+    W = wmin + np.arange(npoints) * dw
+    J_re = np.array( [ dt * np.sum(np.cos(w * t) * X) for w in W ] )
+    J_im = np.array( [ dt * np.sum(np.sin(w * t) * X) for w in W ] )
+    J = J_re + 1j * J_im
+    return W, J, np.abs(J), np.abs(J)**2, J_re, J_im
+
+
+def py_cft_ref(X, dt):
+    """ Direct-sum transform of `ft.py_cft` """
+    N = len(X)
+    t = np.arange(N) * dt
+    W = np.arange(N) * 2.0 * math.pi / (N * dt)
+    C = np.array( [ np.sum(np.cos(w * t) * X) for w in W ] )
+    S = np.array( [ -np.sum(np.sin(w * t) * X) for w in W ] )
+    return W, C, S
+
+
+def spectrum_ref(X, params):
+    """ The ACF and spectrum of the series X (nsteps, ndof), as computed by `influence_spectrum.recipe1` """
+    dt = params["dt"] * units.fs2au
+    if params["do_center"]:
+        X = X - np.mean(X, axis=0)
+    norm_acf, raw_acf = acf_ref(X, params["acf_type"])
+    W, J = ft_ref(norm_acf, params["wspan"] * units.inv_cm2Ha, params["dw"] * units.inv_cm2Ha, dt)
+    T = np.arange(X.shape[0]) * dt / units.fs2au
+    return T, norm_acf, raw_acf, W / units.inv_cm2Ha, J, J*J / (2.0*math.pi)
+
+
+
+
+def model_series(nsteps, ndof, seed):
+    """ The sum of a few damped oscillations and noise """
+    rnd = np.random.default_rng(seed)
+    t = np.arange(nsteps)[:, None]
+    w = 0.02 + 0.3 * rnd.random( (1, ndof) )
+    return np.cos(w * t) * np.exp(-t / 300.0) + 0.1 * rnd.normal(size=(nsteps, ndof)) + 0.5
+
+
+
+
+@pytest.mark.parametrize("opt", [0, 1])
+def test_acf_mat(opt):
+    """Tests the FFT-based ACF of the MATRIX series against the direct sums"""
+    X = model_series(300, 3, 0)
+    data = [ data_conv.nparray2MATRIX(X[n].reshape(3, 1)) for n in range(X.shape[0]) ]
+
+    T, norm_acf, raw_acf = acf.acf_mat(data, 2.0, opt)
+    expected_norm, expected_raw = acf_ref(X, opt)
+
+    assert np.allclose(T, 2.0 * np.arange(300))
+    assert np.allclose(raw_acf, expected_raw, rtol=1e-10, atol=1e-12)
+    assert np.allclose(norm_acf, expected_norm, rtol=1e-10, atol=1e-12)
+
+
+
+
+@pytest.mark.parametrize("opt", [0, 1])
+def test_acf_vec(opt):
+    """Tests the FFT-based ACF of the VECTOR series against the direct sums"""
+    X = model_series(300, 3, 1)
+    data = [ VECTOR(X[n, 0], X[n, 1], X[n, 2]) for n in range(X.shape[0]) ]
+
+    T, norm_acf, raw_acf = acf.acf_vec(data, 1.0, opt)
+    expected_norm, expected_raw = acf_ref(X, opt)
+
+    assert np.allclose(raw_acf, expected_raw, rtol=1e-10, atol=1e-12)
+    assert np.allclose(norm_acf, expected_norm, rtol=1e-10, atol=1e-12)
+
+
+
+
+def test_ft():
+    """Tests `ft.ft`, `ft.ft2` and `ft.py_cft` against the direct sums"""
+    X = model_series(700, 1, 2)[:, 0]
+    X[0] = 1.0
+    dt, dw = 41.34, 4.556e-6
+
+    W, J = ft.ft(list(X), 3000*dw, dw, dt)
+    expected_W, expected_J = ft_ref(X, 3000*dw, dw, dt)
+    assert np.allclose(W, expected_W)
+    assert np.allclose(J, expected_J, rtol=1e-9, atol=1e-9 * np.max(np.abs(expected_J)))
+
+    computed_result = ft.ft2(list(X), 100*dw, 900*dw, dw, dt)
+    expected_result = ft2_ref(X, 100*dw, 900*dw, dw, dt)
+    for x, y in zip(computed_result, expected_result):
+        assert np.allclose(x, y, rtol=1e-9, atol=1e-9 * np.max(np.abs(y)))
+
+    computed_result = ft.py_cft(list(X[:200]), dt)
+    expected_result = py_cft_ref(X[:200], dt)
+    for x, y in zip(computed_result, expected_result):
+        assert np.allclose(x, y, rtol=1e-9, atol=1e-9 * np.max(np.abs(y)))
+
+
+
+
+def test_recipe1():
+    """Tests the ACF and spectrum of `influence_spectrum.recipe1` against the direct sums"""
+    X = model_series(500, 2, 3)
+    data = [ data_conv.nparray2MATRIX(X[n].reshape(2, 1)) for n in range(X.shape[0]) ]
+    params = { "dt":1.0, "wspan":3000.0, "dw":5.0, "do_center":True, "acf_type":0, "data_type":0, "do_output":False }
+
+    computed_result = influence_spectrum.recipe1(data, dict(params))
+    expected_result = spectrum_ref(X, params)
+
+    for x, y in zip(computed_result, expected_result):
+        assert np.allclose(x, y, rtol=1e-9, atol=1e-9 * np.max(np.abs(y)))
+
+
+
+
+def test_compute_all():
+    """Tests that the batched `compute_all` gives the same spectra and frequencies as `compute_mat_elt` for every element"""
+    nsteps, nstates = 400, 3
+    x = model_series(nsteps, nstates*nstates, 5).reshape(nsteps, nstates, nstates)
+    y = model_series(nsteps, nstates*nstates, 6).reshape(nsteps, nstates, nstates)
+    X = [ data_conv.nparray2CMATRIX(x[n] + 1j * y[n]) for n in range(nsteps) ]
+
+    params = { "dt":1.0, "wspan":3000.0, "dw":5.0, "nfreqs":3, "do_output":0 }
+    freqs, T, norm_acf, raw_acf, W, J, J2 = influence_spectrum.compute_all(X, dict(params))
+
+    X_re = [ data_conv.nparray2MATRIX(x[n]) for n in range(nsteps) ]
+    X_im = [ data_conv.nparray2MATRIX(y[n]) for n in range(nsteps) ]
+
+    for i in range(nstates):
+        for j in range(nstates):
+            expected_result = influence_spectrum.compute_mat_elt(X_re if i==j else X_im, i, j, dict(params))
+            computed_result = ( freqs[i][j], T[i][j], norm_acf[i][j], raw_acf[i][j], W[i][j], J[i][j], J2[i][j] )
+
+            assert np.allclose(np.array(computed_result[0]), np.array(expected_result[0]), rtol=1e-9)
+            for a, b in zip(computed_result[1:], expected_result[1:]):
+                assert np.allclose(a, b, rtol=1e-9, atol=1e-9 * np.max(np.abs(b)))
+
+            # And both agree with the direct sums
+            series = (x if i==j else y)[:, i, j].reshape(nsteps, 1)
+            expected_result = spectrum_ref(series, { "dt":1.0, "wspan":3000.0, "dw":5.0, "do_center":True, "acf_type":0 })
+            for a, b in zip(computed_result[1:], expected_result):
+                assert np.allclose(a, b, rtol=1e-9, atol=1e-9 * np.max(np.abs(b)))
+
@@ -0,0 +1,56 @@
+"""
+Unit and regression test for the buffered HDF5 saver (libra_py.data_savers.hdf5_buffered_saver)
+"""
+
+from libra_py import data_savers
+import numpy as np
+import h5py
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def test_buffer_is_capped(tmp_path):
+    """Tests that the buffer of a large dataset holds fewer steps than `buffer_size`, and is not larger than `chunk_bytes`"""
+    saver = data_savers.hdf5_buffered_saver(str(tmp_path / "data.hdf"), ["time", "q"], 1000)
+    saver.chunk_bytes = 64 * 1024
+
+    saver.add_dataset("time", (50,), "R")
+    saver.add_dataset("q", (50, 100, 30), "R")    # 24000 bytes per step
+
+    assert saver.buffers["time"].shape == (50,)
+    assert saver.buffers["q"].shape == (2, 100, 30)
+    assert saver.buffers["q"].nbytes <= saver.chunk_bytes
+    saver.close()
+
+
+
+
+def test_data_round_trip(tmp_path):
+    """Tests that all the steps are written correctly when the buffer window is moved many times"""
+    filename = str(tmp_path / "data.hdf")
+    saver = data_savers.hdf5_buffered_saver(filename, ["time", "q"], 10)
+    saver.chunk_bytes = 3 * 4 * 5 * 8    # 3 steps of q
+
+    saver.add_dataset("time", (20,), "R")
+    saver.add_dataset("q", (20, 4, 5), "R")
+    assert saver.buffers["q"].shape[0] == 3
+
+    q = np.random.default_rng(1).normal(size=(20, 4, 5))
+    for step in range(20):
+        saver.save_scalar(step, "time", 0.5 * step)
+        for i in range(4):
+            saver.save_multi_scalar(step, i, "q", q[step, i])
+    saver.close()
+
+    with h5py.File(filename, "r") as f:
+        assert np.allclose( f["time/data"][:], 0.5 * np.arange(20) )
+        assert np.allclose( f["q/data"][:], q )
+
@@ -0,0 +1,133 @@
+"""
+Unit and regression test for the TSH checkpoints (libra_py.dynamics.tsh.save) and the incremental
+writing of the memory saver data (libra_py.data_savers.mem_saver.save_new_data)
+"""
+
+from libra_py import data_savers
+from libra_py import data_conv
+from libra_py.dynamics.tsh import save
+import numpy as np
+import h5py
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def make_saver(nsteps):
+    saver = data_savers.mem_saver(["time", "pops", "q"])
+    saver.add_dataset("time", (nsteps,), "R")
+    saver.add_dataset("pops", (nsteps, 3), "R")
+    saver.add_dataset("q", (nsteps, 2, 4), "R")
+    return saver
+
+
+def save_step(saver, step, rnd):
+    saver.save_scalar(step, "time", 10.0 * step)
+    for i in range(3):
+        saver.save_multi_scalar(step, i, "pops", rnd.random())
+    saver.save_matrix(step, "q", data_conv.nparray2MATRIX(rnd.normal(size=(2, 4))))
+
+
+
+
+def test_save_new_data(tmp_path):
+    """Tests that only the new records are written, and the file matches the saver at every flush"""
+    filename = str(tmp_path / "mem_data.hdf")
+    names = ["time", "pops", "q"]
+    rnd = np.random.default_rng(0)
+
+    saver = make_saver(10)
+    saver.save_new_data(filename, names, "w")
+    with h5py.File(filename, "r") as f:
+        for name in names:
+            assert f[F"{name}/data"].shape == saver.np_data[name].shape
+            assert np.all(f[F"{name}/data"][()] == 0.0)
+
+    for step in range(4):
+        save_step(saver, step, rnd)
+    saver.save_new_data(filename, names)
+
+    with h5py.File(filename, "r") as f:
+        for name in names:
+            assert np.array_equal(f[F"{name}/data"][:4], saver.np_data[name][:4])
+            assert np.all(f[F"{name}/data"][4:] == 0.0)
+
+    # Mark the already written records in the file: they must not be rewritten
+    with h5py.File(filename, "a") as f:
+        f["time/data"][0] = -1.0
+
+    for step in range(4, 10):
+        save_step(saver, step, rnd)
+    saver.save_new_data(filename, names)
+
+    with h5py.File(filename, "r") as f:
+        assert f["time/data"][0] == -1.0
+        assert np.array_equal(f["time/data"][1:], saver.np_data["time"][1:])
+        for name in ["pops", "q"]:
+            assert np.array_equal(f[F"{name}/data"][()], saver.np_data[name])
+
+    assert saver.new_records == {}
+
+    # The same file is read back by a new saver, e.g. after a restart
+    saver2 = make_saver(10)
+    saver2.load_data(filename)
+    assert np.array_equal(saver2.np_data["q"], saver.np_data["q"])
+
+
+
+
+def test_save_new_data_vs_save_data(tmp_path):
+    """Tests that the periodic incremental writes give the same file as one `save_data` at the end"""
+    names = ["time", "pops", "q"]
+    rnd = np.random.default_rng(1)
+
+    saver = make_saver(12)
+    saver.save_new_data(str(tmp_path / "a.hdf"), names, "w")
+    for step in range(12):
+        save_step(saver, step, rnd)
+        if step % 5 == 4:
+            saver.save_new_data(str(tmp_path / "a.hdf"), names)
+    saver.save_new_data(str(tmp_path / "a.hdf"), names)
+    saver.save_data(str(tmp_path / "b.hdf"), names, "w")
+
+    with h5py.File(str(tmp_path / "a.hdf"), "r") as fa, h5py.File(str(tmp_path / "b.hdf"), "r") as fb:
+        for name in names:
+            assert np.array_equal(fa[F"{name}/data"][()], fb[F"{name}/data"][()])
+
+
+
+
+def test_checkpoint_round_trip(tmp_path):
+    """Tests that the checkpoint keeps the dynamical variables and the state of the random numbers generator"""
+    rnd = np.random.default_rng(2)
+    ntraj, nnucl, nadi = 3, 2, 2
+    q = data_conv.nparray2MATRIX(rnd.normal(size=(nnucl, ntraj)))
+    p = data_conv.nparray2MATRIX(rnd.normal(size=(nnucl, ntraj)))
+    Cdia = data_conv.nparray2CMATRIX(rnd.normal(size=(nadi, ntraj)) + 1j * rnd.normal(size=(nadi, ntraj)))
+    Cadi = data_conv.nparray2CMATRIX(rnd.normal(size=(nadi, ntraj)) + 1j * rnd.normal(size=(nadi, ntraj)))
+    projectors = [ data_conv.nparray2CMATRIX(np.eye(nadi, dtype=complex)) for tr in range(ntraj) ]
+    states = [0, 1, 1]
+    U = rnd.normal(size=(ntraj, nadi, nadi))
+    rng_state = "5489 " + " ".join( str(x) for x in rnd.integers(0, 2**32, 624) )
+
+    filename = str(tmp_path / "checkpoint.hdf")
+    save.save_tsh_checkpoint(filename, 7, q, p, Cdia, Cadi, projectors, states, U, [], {}, rng_state)
+    assert not os.path.isfile(filename + ".tmp")
+
+    res = save.load_tsh_checkpoint(filename, [], {})
+
+    assert res[0] == 7
+    for x, y in zip(res[1:5], [q, p, Cdia, Cadi]):
+        assert np.array_equal(data_conv.nparray_view(x), data_conv.nparray_view(y))
+    assert np.array_equal(data_conv.matrices2nparray(res[5]), data_conv.matrices2nparray(projectors))
+    assert res[6] == states
+    assert np.array_equal(res[7], U)
+    assert res[8] == rng_state
+
@@ -0,0 +1,166 @@
+"""
+Unit and regression test for the HDF5 storage of the matrix time series (libra_py.data_store) and
+its use by the readers of the data sets (libra_py.data_read)
+"""
+
+from libra_py import data_store
+from libra_py import data_read
+from libra_py import data_conv
+import numpy as np
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def random_matrices(nsteps, ndim, seed):
+    rnd = np.random.default_rng(seed)
+    return rnd.normal(size=(nsteps, ndim, ndim)) + 1.0j * rnd.normal(size=(nsteps, ndim, ndim))
+
+
+def write_text_files(path, prefix, data, istart):
+    """ Writes the matrices into the pairs of the text files "<path><prefix><step>_re" and "<path><prefix><step>_im" """
+    for i, x in enumerate(data):
+        np.savetxt(F"{path}{prefix}{istart + i}_re", np.real(x))
+        np.savetxt(F"{path}{prefix}{istart + i}_im", np.imag(x))
+
+
+
+
+def test_dataset_name():
+    """Tests the names of the datasets made of the prefixes of the text files"""
+    assert data_store.dataset_name("res/hvib_dia_") == "hvib_dia"
+    assert data_store.dataset_name("St_") == "St"
+    assert data_store.dataset_name("/a/b/Hvib__") == "Hvib"
+
+
+
+
+def test_append_and_read(tmp_path):
+    """Tests that the matrices written step by step are read back, with the skipped steps filled with zeros"""
+    filename = str(tmp_path / "data.h5")
+    X = random_matrices(10, 4, 0)
+
+    assert data_store.num_steps(filename, "hvib") == 0
+
+    data_store.append_matrix(filename, "hvib", 0, data_conv.nparray2CMATRIX(X[0]), chunk_size=4)
+    data_store.append_matrix(filename, "hvib", 1, X[1], chunk_size=4)
+    data_store.append_matrix(filename, "hvib", 3, data_conv.nparray2CMATRIX(X[3]), chunk_size=4)
+    assert data_store.num_steps(filename, "hvib") == 4
+
+    data_store.append_matrices(filename, "hvib", 4, [ data_conv.nparray2CMATRIX(x) for x in X[4:7] ], chunk_size=4)
+    data_store.append_matrices(filename, "hvib", 7, X[7:10], chunk_size=4)
+    assert data_store.num_steps(filename, "hvib") == 10
+
+    expected_result = np.array(X)
+    expected_result[2] = 0.0
+
+    assert np.array_equal(data_store.read_matrices(filename, "hvib"), expected_result)
+    assert np.array_equal(data_store.read_matrices(filename, "hvib", start=3, stop=8), expected_result[3:8])
+
+    act_sp = [0, 2, 3]
+    res = data_store.read_matrices(filename, "hvib", act_sp, 1, 9)
+    assert np.array_equal(res, expected_result[1:9][:, act_sp, :][:, :, act_sp])
+
+    res = data_store.get_matrices(filename, "hvib", act_sp, 1, 9)
+    assert len(res) == 8
+    for i in range(8):
+        assert np.array_equal(data_conv.nparray_view(res[i]), expected_result[1+i][np.ix_(act_sp, act_sp)])
+
+    # The real data are stored as complex
+    data_store.append_matrix(filename, "S", 0, data_conv.nparray2MATRIX(np.real(X[0])))
+    assert np.array_equal(data_store.read_matrices(filename, "S")[0], np.real(X[0]).astype(complex))
+
+    data_store.remove_matrices(filename, "hvib")
+    assert data_store.num_steps(filename, "hvib") == 0
+    assert data_store.num_steps(filename, "S") == 1
+
+
+
+
+@pytest.mark.parametrize("compression", ["gzip", None])
+def test_save_and_open(tmp_path, compression):
+    """Tests the whole time series written at once, and the memory-mapped access to the contiguous datasets"""
+    filename = str(tmp_path / "data.h5")
+    X = random_matrices(6, 3, 1)
+
+    data_store.save_matrices(filename, "hvib", X[:2], compression=compression)
+    data_store.save_matrices(filename, "hvib", X, 2, compression=compression)    # replaces the dataset
+
+    expected_result = np.concatenate( [ np.zeros((2, 3, 3)), X ] )
+    assert np.array_equal(data_store.read_matrices(filename, "hvib"), expected_result)
+
+    x = data_store.open_matrices(filename, "hvib")
+    assert isinstance(x, np.memmap) == (compression==None)
+    assert x.shape == (8, 3, 3)
+    assert np.array_equal(x[1:5], expected_result[1:5])
+
+
+
+
+@pytest.mark.parametrize("output_format", [0, 1, 2])
+def test_write_matrix(tmp_path, output_format):
+    """Tests the matrices written into the text files, the HDF5 file in the same directory, or both"""
+    prefix = str(tmp_path / "hvib_dia_")
+    X = random_matrices(3, 2, 2)
+
+    for i in range(3):
+        data_store.write_matrix(data_conv.nparray2CMATRIX(X[i]), prefix, i, output_format)
+
+    store = str(tmp_path / "data.h5")
+    assert os.path.isfile(store) == (output_format in [1, 2])
+    assert os.path.isfile(F"{prefix}2_re") == (output_format in [0, 2])
+
+    if output_format in [1, 2]:
+        assert np.array_equal(data_store.read_matrices(store, "hvib_dia"), X)
+
+    if output_format in [0, 2]:
+        for i in range(3):
+            assert np.allclose(np.loadtxt(F"{prefix}{i}_re"), np.real(X[i]))
+            assert np.allclose(np.loadtxt(F"{prefix}{i}_im"), np.imag(X[i]))
+
+
+
+
+def test_convert_text_data(tmp_path):
+    """Tests that the converted data sets are read by `data_read` in the same way as the text files"""
+    paths = [ str(tmp_path / "res0") + "/", str(tmp_path / "res1") + "/" ]
+    X = [ random_matrices(6, 4, 3), random_matrices(6, 4, 4) ]
+    for path, x in zip(paths, X):
+        os.mkdir(path)
+        write_text_files(path, "hvib_", x, 2)
+        write_text_files(path, "St_", np.real(x), 2)
+
+    params = { "data_set_paths":paths, "data_dim":4, "isnap":2, "fsnap":8,
+               "data_re_prefix":"hvib_", "data_im_prefix":"hvib_" }
+    res = data_store.convert_text_data(dict(params))
+    assert res == [ path + "data.h5" for path in paths ]
+
+    # The real data, into another dataset of the same files
+    data_store.convert_text_data({ "data_set_paths":paths, "data_dim":4, "isnap":2, "fsnap":8,
+                                   "data_re_prefix":"St_", "data_im_prefix":None, "dataset_name":"S" })
+
+    for path, x in zip(paths, X):
+        assert np.allclose(data_store.read_matrices(path + "data.h5", "hvib", start=2), x)
+        assert np.allclose(data_store.read_matrices(path + "data.h5", "S", start=2), np.real(x))
+
+    for act_sp in [ range(4), [1, 3] ]:
+        prms = dict(params, isnap=3, fsnap=7, active_space=act_sp)
+        expected_result = data_read.get_data_sets(dict(prms))
+        computed_result = data_read.get_data_sets(dict(prms, store_filename="data.h5"))
+
+        for idata in range(2):
+            assert len(computed_result[idata]) == 4
+            assert np.allclose(data_conv.matrices2nparray(computed_result[idata]),
+                               data_conv.matrices2nparray(expected_result[idata]), rtol=1e-12, atol=1e-14)
+
+        # A single data set, with the dataset name given explicitly
+        x = data_read.get_data(dict(prms, data_re_prefix=paths[1] + "hvib_", data_im_prefix=paths[1] + "hvib_",
+                                    store_filename=paths[1] + "data.h5", dataset_name="hvib"))
+        assert np.allclose(data_conv.matrices2nparray(x), data_conv.matrices2nparray(expected_result[1]), rtol=1e-12, atol=1e-14)
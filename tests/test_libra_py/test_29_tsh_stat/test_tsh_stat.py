@@ -0,0 +1,116 @@
+"""
+Unit and regression test for the vectorized ensemble statistics of libra_py.tsh_stat: the energies and
+SH populations computed for all trajectories at once are compared to the per-trajectory loops
+"""
+
+from libra_py import tsh_stat
+from libra_py import data_conv
+import numpy as np
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+class model_ham:
+    """
+    The model of `nHamiltonian` with the children Hamiltonians: returns the matrices of the trajectory
+    `id_[1]` and computes the Ehrenfest energies as `nHamiltonian::Ehrenfest_energy_dia/adi` do
+    """
+
+    def __init__(self, ham_dia, ovlp_dia, ham_adi):
+        self.ham_dia, self.ovlp_dia, self.ham_adi = ham_dia, ovlp_dia, ham_adi
+
+    def get_ham_dia(self, id_):
+        return data_conv.nparray2CMATRIX(self.ham_dia[id_[1]])
+
+    def get_ovlp_dia(self, id_):
+        return data_conv.nparray2CMATRIX(self.ovlp_dia[id_[1]])
+
+    def get_ham_adi(self, id_):
+        return data_conv.nparray2CMATRIX(self.ham_adi[id_[1]])
+
+    def Ehrenfest_energy_dia(self, C, id_):
+        c = data_conv.nparray_view(C)[:, 0]
+        return np.vdot(c, self.ham_dia[id_[1]] @ c) / np.vdot(c, self.ovlp_dia[id_[1]] @ c)
+
+    def Ehrenfest_energy_adi(self, C, id_):
+        c = data_conv.nparray_view(C)[:, 0]
+        return np.vdot(c, self.ham_adi[id_[1]] @ c) / np.vdot(c, c)
+
+
+def random_complex(rnd, shape):
+    return rnd.normal(size=shape) + 1.0j * rnd.normal(size=shape)
+
+
+def random_ensemble(ntraj, nst, ndof, seed):
+    """ The Hermitian Hamiltonians, positive-definite overlaps, amplitudes, projectors, and momenta """
+    rnd = np.random.default_rng(seed)
+
+    X = random_complex(rnd, (ntraj, nst, nst))
+    ham_dia = X + np.conj(np.transpose(X, (0, 2, 1)))
+    X = 0.1 * random_complex(rnd, (ntraj, nst, nst))
+    ovlp_dia = np.eye(nst) + np.matmul(X, np.conj(np.transpose(X, (0, 2, 1))))
+    X = random_complex(rnd, (ntraj, nst, nst))
+    ham_adi = X + np.conj(np.transpose(X, (0, 2, 1)))
+    ham = model_ham(ham_dia, ovlp_dia, ham_adi)
+
+    Cdia = data_conv.nparray2CMATRIX(random_complex(rnd, (nst, ntraj)))
+    Cadi = data_conv.nparray2CMATRIX(random_complex(rnd, (nst, ntraj)))
+    projectors = [ data_conv.nparray2CMATRIX(x) for x in random_complex(rnd, (ntraj, nst, nst)) ]
+    p = data_conv.nparray2MATRIX(rnd.normal(size=(ndof, ntraj)))
+    iM = data_conv.nparray2MATRIX(rnd.uniform(0.5, 2.0, size=(ndof, 1)))
+
+    return ham, p, Cdia, Cadi, projectors, iM
+
+
+
+
+@pytest.mark.parametrize("rep", [0, 1])
+def test_compute_etot_batch(rep):
+    """Tests the Ehrenfest energies of all trajectories at once against `compute_etot`"""
+    ham, p, Cdia, Cadi, projectors, iM = random_ensemble(25, 3, 4, rep)
+
+    expected_result = tsh_stat.compute_etot(ham, p, Cdia, Cadi, projectors, iM, rep)
+    res = tsh_stat.compute_etot_batch(ham, p, Cdia, Cadi, projectors, iM, rep)
+
+    assert np.allclose(res, expected_result, rtol=1e-12, atol=1e-14)
+
+
+
+
+@pytest.mark.parametrize("rep", [0, 1])
+def test_compute_etot_tsh_batch(rep):
+    """Tests the TSH energies of all trajectories at once against `compute_etot_tsh`"""
+    ham, p, Cdia, Cadi, projectors, iM = random_ensemble(25, 3, 4, 10+rep)
+    states = Py2Cpp_int( list(np.random.default_rng(rep).integers(0, 3, size=25)) )
+
+    expected_result = tsh_stat.compute_etot_tsh(ham, p, Cdia, Cadi, projectors, states, iM, rep)
+    res = tsh_stat.compute_etot_tsh_batch(ham, p, Cdia, Cadi, projectors, states, iM, rep)
+
+    assert np.allclose(res, expected_result, rtol=1e-12, atol=1e-14)
+
+
+
+
+def test_compute_sh_statistics_batch():
+    """Tests the SH populations of all trajectories at once against `compute_sh_statistics`,
+    including the state that no trajectory occupies"""
+    ntraj, nstates = 30, 4
+    rnd = np.random.default_rng(20)
+    states = Py2Cpp_int( [ int(x) for x in rnd.integers(0, nstates-1, size=ntraj) ] )
+    projectors = [ data_conv.nparray2CMATRIX(x) for x in random_complex(rnd, (ntraj, nstates, nstates)) ]
+
+    expected_result = tsh_stat.compute_sh_statistics(nstates, states, projectors)
+    res = tsh_stat.compute_sh_statistics_batch(nstates, states, projectors)
+
+    for x, y in zip(res, expected_result):
+        assert x.num_of_rows == nstates and x.num_of_cols == 1
+        assert np.allclose(data_conv.MATRIX2nparray(x), data_conv.MATRIX2nparray(y), rtol=1e-12, atol=1e-14)
+    assert data_conv.MATRIX2nparray(res[0])[nstates-1, 0] == 0.0
@@ -0,0 +1,94 @@
+"""
+Unit and regression test for the workflows/nbra/cache module in the Libra package
+"""
+
+from libra_py.workflows.nbra import cache
+from libra_py import data_conv
+import numpy as np
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def random_hvib(ndata, nsteps, nstates, seed):
+    rnd = np.random.default_rng(seed)
+    return [ [ data_conv.nparray2CMATRIX( rnd.normal(size=(nstates, nstates)).astype(complex) ) for n in range(nsteps) ]
+             for idata in range(ndata) ]
+
+
+
+
+def test_fingerprint_contents():
+    """Tests that the default fingerprint depends on the parameters and on all the Hamiltonians"""
+    H_vib = random_hvib(2, 5, 3, 0)
+    params = { "dt":41.0, "T":300.0 }
+    key = cache.fingerprint(H_vib, params, ["dt", "T"])
+
+    assert cache.fingerprint(random_hvib(2, 5, 3, 0), dict(params), ["dt", "T"]) == key
+    assert cache.fingerprint(H_vib, { "dt":41.0, "T":301.0 }, ["dt", "T"]) != key
+
+    H_vib[1][2].set(0, 1, 1.0+0.0j)
+    assert cache.fingerprint(H_vib, params, ["dt", "T"]) != key
+
+
+
+
+def test_fingerprint_files(tmp_path):
+    """Tests that with the files given, the fingerprint follows the files rather than all the Hamiltonians"""
+    files = [ str(tmp_path / "data_0.h5"), str(tmp_path / "data_1.h5") ]
+    for filename in files:
+        with open(filename, "w") as f:
+            f.write("data")
+
+    H_vib = random_hvib(2, 5, 3, 0)
+    params = { "dt":41.0 }
+    key = cache.fingerprint(H_vib, params, ["dt"], files)
+
+    # The intermediate steps are not hashed
+    H_vib[1][2].set(0, 1, 1.0+0.0j)
+    assert cache.fingerprint(H_vib, params, ["dt"], files) == key
+
+    # ... but the first steps (e.g. a different active space) and the number of steps are
+    H_vib[0][0].set(0, 1, 1.0+0.0j)
+    assert cache.fingerprint(H_vib, params, ["dt"], files) != key
+    H_vib[0][0] = random_hvib(2, 5, 3, 0)[0][0]
+    assert cache.fingerprint(H_vib, params, ["dt"], files) == key
+    assert cache.fingerprint([ H_vib[0], H_vib[1][:4] ], params, ["dt"], files) != key
+
+    # Modified files
+    os.utime(files[1], ns=(0, os.stat(files[1]).st_mtime_ns + 10**9))
+    assert cache.fingerprint(H_vib, params, ["dt"], files) != key
+
+
+
+
+def test_get_tables(tmp_path):
+    """Tests that the stored tables are reused by the runs with the same Hamiltonians and parameters"""
+    calls = []
+    def builder(H_vib, params):
+        calls.append(1)
+        return { "E": [ np.real( data_conv.matrices2nparray(H_vib[idata]) ) * params["dt"] for idata in range(len(H_vib)) ] }
+
+    H_vib = random_hvib(2, 5, 3, 1)
+    expected_result = builder(H_vib, { "dt":2.0 })["E"]
+
+    for cache_files in [ None, [ __file__ ] ]:
+        calls.clear()
+        params = { "dt":2.0, "cache_dir":str(tmp_path), "cache_mmap_size":0, "cache_files":cache_files }
+        for run in range(2):
+            tables = cache.get_tables(H_vib, dict(params), "test", ["dt"], builder)
+            for idata in range(2):
+                assert np.allclose(tables["E"][idata], expected_result[idata])
+        assert len(calls) == 1
+
+        params["dt"] = 3.0
+        cache.get_tables(H_vib, dict(params), "test", ["dt"], builder)
+        assert len(calls) == 2
+
@@ -0,0 +1,180 @@
+"""
+Unit and regression test for the streaming statistics of the vibronic Hamiltonians (workflows/nbra/hvib_stat
+and data_stat.running_stat): the results are compared to the element-by-element loops of `data_stat.mat_stat`
+and `decoherence_times` they replace
+"""
+
+from libra_py.workflows.nbra import hvib_stat
+from libra_py.workflows.nbra import decoherence_times
+from libra_py import data_conv
+from libra_py import data_stat
+import numpy as np
+import pytest
+import math
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def mat_stat_ref(X):
+    """ Port of the element-by-element `data_stat.mat_stat`: the average, std, and bounds of a list of np.arrays """
+    N = len(X)
+    nr, nc = X[0].shape
+    ave, std = np.zeros( (nr, nc) ), np.zeros( (nr, nc) )
+    dw, up = np.array(X[0]), np.array(X[0])
+    for a in range(nr):
+        for b in range(nc):
+            ave[a,b] = sum( X[i][a,b] for i in range(N) ) / float(N)
+            std[a,b] = math.sqrt( sum( (X[i][a,b] - ave[a,b])**2 for i in range(N) ) / float(N) )
+            for i in range(N):
+                up[a,b] = max(up[a,b], X[i][a,b])
+                dw[a,b] = min(dw[a,b], X[i][a,b])
+    return ave, std, dw, up
+
+
+def gaps_ref(H):
+    """ Port of the loop of the old `decoherence_times.energy_gaps`, for one time step """
+    nstates = H.shape[0]
+    dE = np.zeros( (nstates, nstates) )
+    for i in range(nstates):
+        for j in range(i+1, nstates):
+            dE[i,j] = dE[j,i] = math.fabs(H[i,i].real - H[j,j].real)
+    return dE
+
+
+def times_ref(dE_std):
+    """ Port of the loop that converts the gap std into the decoherence times in the old `decoherence_times` """
+    nstates = dE_std.shape[0]
+    tau = np.zeros( (nstates, nstates) )
+    for a in range(nstates):
+        for b in range(nstates):
+            if a==b:
+                tau[a,a] = 1.0e+10
+            elif dE_std[a,b] > 0.0:
+                tau[a,b] = math.sqrt(12.0/5.0) / dE_std[a,b]
+    return tau
+
+
+def decoherence_times_ave_ref(H, itimes, nsteps):
+    """ Port of the old `decoherence_times_ave`: the std of the gap fluctuations around each sub-trajectory average """
+    dE = []
+    for idata in range(len(H)):
+        for it in itimes:
+            de = [ gaps_ref(H[idata][it+step]) for step in range(nsteps) ]
+            ave = mat_stat_ref(de)[0]
+            dE = dE + [ x - ave for x in de ]
+    return times_ref( mat_stat_ref(dE)[1] )
+
+
+def model_hvib(ndata, nsteps, nstates, seed):
+    rnd = np.random.default_rng(seed)
+    H = 0.01 * (rnd.normal(size=(ndata, nsteps, nstates, nstates)) + 1.0j * rnd.normal(size=(ndata, nsteps, nstates, nstates)))
+    H += np.diag( 0.05 * np.arange(nstates) )
+    H[:, :, 1, 1] = H[:, :, 0, 0]     # degenerate states: zero gap and gap std
+    return H
+
+
+
+
+@pytest.mark.parametrize("dtype", [float, complex])
+def test_running_stat(dtype):
+    """Tests that the samples added one by one and in chunks of any size give the statistics of the whole data"""
+    rnd = np.random.default_rng(0)
+    X = rnd.normal(size=(57, 2, 3)).astype(dtype)
+    if dtype==complex:
+        X += 1.0j * rnd.normal(size=X.shape)
+
+    x1 = data_stat.running_stat((2, 3), dtype)
+    for x in X:
+        x1.add(x)
+
+    x2 = data_stat.running_stat((2, 3), dtype)
+    for i, n in [ (0, 1), (1, 0), (1, 20), (21, 36) ]:
+        x2.add_chunk(X[i:i+n])
+
+    x3 = data_stat.running_stat()    # the shape is taken from the data
+    x3.add_chunk(X)
+
+    var = np.mean( np.abs(X - np.mean(X, axis=0))**2, axis=0 )
+    for x in [x1, x2, x3]:
+        assert x.count == 57
+        assert np.allclose(x.mean, np.mean(X, axis=0), rtol=1e-12, atol=1e-14)
+        assert np.allclose(x.variance(), var, rtol=1e-12, atol=1e-14)
+        assert np.allclose(x.std(), np.sqrt(var), rtol=1e-12, atol=1e-14)
+        if dtype==float:
+            assert np.array_equal(x.min, np.min(X, axis=0)) and np.array_equal(x.max, np.max(X, axis=0))
+
+
+
+
+def test_mat_stat():
+    """Tests the stacked `data_stat.mat_stat` against the element-by-element loops"""
+    X = [ np.real(x) for x in model_hvib(1, 20, 3, 1)[0] ]
+    res = data_stat.mat_stat([ data_conv.nparray2MATRIX(x) for x in X ])
+
+    for x, y in zip(res, mat_stat_ref(X)):
+        assert np.allclose(data_conv.MATRIX2nparray(x), y, rtol=1e-12, atol=1e-14)
+
+
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_hvib_stat(chunk_size):
+    """Tests the chunked statistics of the real and imaginary parts of Hvib, for the CMATRIX and the array data sets"""
+    H = model_hvib(1, 30, 3, 2)[0]
+
+    for data_set in [ [ data_conv.nparray2CMATRIX(x) for x in H ], H ]:
+        re, im = hvib_stat.hvib_stat(data_set, chunk_size)
+
+        for x, part in [ (re, np.real(H)), (im, np.imag(H)) ]:
+            ave, std, dw, up = mat_stat_ref(list(part))
+            assert np.allclose(x.mean, ave, rtol=1e-12, atol=1e-14)
+            assert np.allclose(x.std(), std, rtol=1e-12, atol=1e-14)
+            assert np.array_equal(x.min, dw) and np.array_equal(x.max, up)
+
+
+
+
+def test_energy_gaps():
+    """Tests the energy gaps and their averages over the data sets and initial times against the loops"""
+    H = model_hvib(2, 25, 3, 3)
+    Hvib = [ [ data_conv.nparray2CMATRIX(x) for x in H[idata] ] for idata in range(2) ]
+    itimes, nsteps = [0, 4, 10], 12
+
+    dE = decoherence_times.energy_gaps(Hvib[0])
+    for step in range(25):
+        assert np.allclose(data_conv.MATRIX2nparray(dE[step]), gaps_ref(H[0, step]), rtol=1e-12, atol=1e-14)
+
+    dE = decoherence_times.energy_gaps_ave(Hvib, itimes, nsteps)
+    assert len(dE) == nsteps
+    for step in range(nsteps):
+        expected_result = sum( gaps_ref(H[idata, it+step]) for idata in range(2) for it in itimes ) / 6.0
+        assert np.allclose(data_conv.MATRIX2nparray(dE[step]), expected_result, rtol=1e-12, atol=1e-14)
+
+
+
+
+def test_decoherence_times():
+    """Tests the decoherence times and rates against the loops, including the zero gap std of degenerate states"""
+    H = model_hvib(2, 40, 4, 4)
+    Hvib = [ [ data_conv.nparray2CMATRIX(x) for x in H[idata] ] for idata in range(2) ]
+
+    tau, rates = decoherence_times.decoherence_times(Hvib[0])
+    expected_result = times_ref( mat_stat_ref([ gaps_ref(x) for x in H[0] ])[1] )
+    assert expected_result[0, 1] == 0.0
+    assert np.allclose(data_conv.MATRIX2nparray(tau), expected_result, rtol=1e-10, atol=0.0)
+    assert np.allclose(data_conv.MATRIX2nparray(rates),
+                       data_conv.MATRIX2nparray(decoherence_times.decoherence_times2rates(tau)), rtol=1e-12, atol=0.0)
+
+    itimes, nsteps = [0, 5, 20], 15
+    tau, rates = decoherence_times.decoherence_times_ave(Hvib, itimes, nsteps)
+    expected_result = decoherence_times_ave_ref(H, itimes, nsteps)
+    assert np.allclose(data_conv.MATRIX2nparray(tau), expected_result, rtol=1e-10, atol=0.0)
+    assert np.allclose(data_conv.MATRIX2nparray(rates),
+                       data_conv.MATRIX2nparray(decoherence_times.decoherence_times2rates(tau)), rtol=1e-12, atol=0.0)
@@ -4,6 +4,9 @@ Unit and regression test for the workflows/nbra module in the Libra package
 
 from libra_py.workflows.nbra import lz
 from libra_py import units
+from libra_py import tsh
+from libra_py import data_conv
+import numpy as np
 import pytest
 import math
 import sys
@@ -84,14 +87,14 @@ def test_Belyaev_Lebedev(hvib, params, expected_result):
 @pytest.mark.parametrize("Hvib, params, expected_result", [
     ( [generate_hvib_data(1)], generate_params(1), 0.9942 ),
 ])
-def test_lz(Hvib, params, expected_result):
+def test_lz(Hvib, params, expected_result, tmp_path):
     """Tests that the LZ probabilities are computed correctly according to the NBRA BLSH scheme"""
     params["istate"]             = 1                  # From 0
     params["T"]                  = 300.0              # Temperature, K
     params["target_space"]       = 1
     params["gap_min_exception"]  = 0
     params["Boltz_opt_BL"]       = 1                  # Option to incorporate hte frustrated hops into BL probabilities
-    params["outfile"]            = "_out_Markov_.txt" # output file
+    params["outfile"]            = str(tmp_path / "_out_Markov_.txt") # output file
     params["evolve_Markov"]      = True               # Rely on the Markov approach
     params["evolve_TSH"]         = False              # don't care about TSH
     params["ntraj"]              = 1                  # how many stochastic trajectories
@@ -131,3 +134,97 @@ def test_adjust_SD_probabilities(P, params, expected_result):
 
 
 
+
+def random_hvib(nsteps, nstates, seed):
+    """The diagonal vibronic Hamiltonians with the randomly fluctuating energies, with many avoided crossings"""
+    rnd = np.random.default_rng(seed)
+    E = np.cumsum(0.004 * rnd.normal(size=(nsteps, nstates)), axis=0) + 0.003 * np.arange(nstates)
+    return [ data_conv.nparray2CMATRIX( np.diag(E[n]).astype(complex) ) for n in range(nsteps) ]
+
+
+
+
+def Belyaev_Lebedev_ref(Hvib, params):
+    """The step-by-step calculation of the Belyaev-Lebedev probabilities, as done before the vectorization"""
+    dt, T = params["dt"], params["T"]
+    nsteps, nstates = len(Hvib), Hvib[0].num_of_cols
+
+    E = np.array( [ [ Hvib[n].get(i,i).real for i in range(nstates) ] for n in range(nsteps) ] )
+    dE = np.abs( E[:, :, None] - E[:, None, :] )
+
+    P = [ np.identity(nstates) ]
+    for n in range(1, nsteps-1):
+        P.append( np.zeros( (nstates, nstates) ) )
+        for j in range(nstates):
+            if params["target_space"] == 0:
+                targets = [1] if j == 0 else [nstates-2] if j == nstates-1 else [j-1, j+1]
+            else:
+                targets = range(nstates)
+
+            normalization = 0.0
+            for i in targets:
+                a, b, c = dE[n-1, i, j], dE[n, i, j], dE[n+1, i, j]
+                if a > b and b < c and a - 2.0*b + c > 0.0:
+                    denom = a - 2.0*b + c
+                    t_min = 0.5 * (a - c) * dt / denom
+                    gap_min = 0.5 * (t_min*(t_min - dt)*a - 2.0*(t_min + dt)*(t_min - dt)*b + t_min*(t_min + dt)*c) / (dt*dt)
+                    if gap_min < 0.0:
+                        gap_min = 0.0 if params["gap_min_exception"] == 0 else b
+
+                    p = math.exp( -0.5 * math.pi * math.sqrt( gap_min**3 / (denom/(dt*dt)) ) )
+                    if i != j:
+                        bf = 1.0
+                        if E[n, i] > E[n, j]:
+                            bf = tsh.boltz_factor(gap_min, 0.0, T, params["Boltz_opt_BL"])
+                        P[n][i, j] = p * bf
+                        normalization += p * bf
+
+            if normalization < 1.0:
+                P[n][j, j] = 1.0 - normalization
+            else:
+                P[n][:, j] /= normalization
+
+    P.append( np.identity(nstates) )
+    return np.array(P)
+
+
+
+
+@pytest.mark.parametrize("target_space, Boltz_opt_BL, gap_min_exception", [
+    ( 1, 0, 0 ), ( 1, 1, 0 ), ( 1, 2, 0 ), ( 1, 3, 0 ), ( 1, 1, 1 ),
+    ( 0, 0, 0 ), ( 0, 1, 0 ), ( 0, 3, 1 ),
+])
+def test_Belyaev_Lebedev_batch(target_space, Boltz_opt_BL, gap_min_exception):
+    """Tests the vectorized Belyaev-Lebedev probabilities against the step-by-step calculation"""
+    Hvib = random_hvib(200, 5, 0)
+    params = { "dt":41.0, "T":300.0, "target_space":target_space, "Boltz_opt_BL":Boltz_opt_BL,
+               "gap_min_exception":gap_min_exception }
+
+    expected_result = Belyaev_Lebedev_ref(Hvib, params)
+    computed_result = data_conv.matrices2nparray( lz.Belyaev_Lebedev(Hvib, dict(params)) )
+
+    assert np.any( (expected_result > 0.0) & (expected_result < 1.0) )    # there are hops
+    assert np.allclose(computed_result, expected_result, rtol=1e-10, atol=1e-12)
+    assert np.allclose(np.sum(computed_result, axis=1), 1.0)
+
+
+
+
+def test_lz_tsh_vs_markov(tmp_path):
+    """Tests that the SH populations of the vectorized hops follow the Markov populations"""
+    nstates, nsteps, ntraj = 4, 250, 20000
+    Hvib = [ random_hvib(nsteps+1, nstates, 1) ]
+
+    params = { "dt":41.0, "T":300.0, "nsteps":nsteps, "ntraj":ntraj, "istate":0, "init_times":[0],
+               "target_space":1, "Boltz_opt_BL":1, "Boltz_opt":0, "gap_min_exception":0,
+               "evolve_Markov":True, "evolve_TSH":True, "do_output":False, "do_return":True,
+               "outfile":str(tmp_path / "_out.txt"), "random_seed":10 }
+
+    res, P = lz.run(Hvib, params)
+    res = data_conv.MATRIX2nparray(res)
+    pop_se = res[:, 2:3*nstates+1:3]
+    pop_sh = res[:, 3:3*nstates+1:3]
+
+    assert np.max(np.abs(pop_se[-1] - pop_se[0])) > 0.1    # the populations change
+    assert np.allclose(pop_sh, pop_se, atol=0.02)
+
@@ -3,6 +3,9 @@ Unit and regression test for the workflows/nbra module in the Libra package
 """
 
 from libra_py.workflows.nbra import mapping
+from libra_py import data_conv
+import numpy as np
+import itertools
 import pytest
 import sys
 import os
@@ -78,3 +81,52 @@ def test_energy_arb(SD1, Hvib_re, expected_result):
 
 
 
+def random_sd_basis(norbs, nel, nsd, rnd):
+    """The reference SD (the lowest orbitals) and a random subset of the other SDs, with alternating spins"""
+    basis = [ [ x if i%2==0 else -x for i, x in enumerate(c) ] for c in itertools.combinations(range(1, norbs+1), nel) ]
+    ref = basis[0]
+    rest = [ basis[i] for i in rnd.permutation(range(1, len(basis)))[:nsd] ]
+    return [ ref ] + rest
+
+
+def random_ovlp(norbs, rnd):
+    """The orbital overlaps close to (but not exactly) the identity"""
+    Q, R = np.linalg.qr( rnd.normal(size=(norbs, norbs)) + 1j * rnd.normal(size=(norbs, norbs)) )
+    return data_conv.nparray2CMATRIX( 0.9 * np.identity(norbs) + 0.1 * Q )
+
+
+
+
+@pytest.mark.parametrize("norbs, nel, nsd, use_minimal", [
+    ( 6, 2, 12, True ), ( 6, 2, 12, False ),
+    ( 8, 3, 20, True ), ( 8, 3, 20, False ),
+    ( 10, 4, 30, True ), ( 10, 4, 30, False ),
+])
+def test_ovlp_mat_arb(norbs, nel, nsd, use_minimal):
+    """Tests that the batched ovlp_mat_arb gives the same overlaps as ovlp_arb for every pair of SDs"""
+    rnd = np.random.default_rng(norbs)
+    S = random_ovlp(norbs, rnd)
+    SD1 = random_sd_basis(norbs, nel, nsd, rnd)
+    SD2 = SD1[:1] + SD1[:0:-1]    # the same reference, the other SDs in the reverse order
+
+    computed_result = data_conv.nparray_view( mapping.ovlp_mat_arb(SD1, SD2, S, use_minimal) )
+    expected_result = np.array( [ [ mapping.ovlp_arb(sd1, sd2, S, use_minimal) for sd2 in SD2 ] for sd1 in SD1 ] )
+
+    assert np.allclose(computed_result, expected_result, rtol=1e-10, atol=1e-12)
+
+
+
+
+def test_ovlp_mat_arb_singular_reference():
+    """Tests the use_minimal=False overlaps when the overlap block of the reference SDs is singular"""
+    rnd = np.random.default_rng(3)
+    S = np.array( data_conv.nparray_view(random_ovlp(8, rnd)) )
+    S[:, 0] = 0.0    # the first orbital doesn't overlap with anything
+    S = data_conv.nparray2CMATRIX(S)
+    SD = random_sd_basis(8, 3, 20, rnd)
+
+    computed_result = data_conv.nparray_view( mapping.ovlp_mat_arb(SD, SD, S, False) )
+    expected_result = np.array( [ [ mapping.ovlp_arb(sd1, sd2, S, False) for sd2 in SD ] for sd1 in SD ] )
+
+    assert np.allclose(computed_result, expected_result, rtol=1e-10, atol=1e-12)
+
@@ -0,0 +1,154 @@
+"""
+Unit and regression test for the workflows/nbra/qsh module in the Libra package: the closed-form
+deviations and the batched QSH Hamiltonians are compared to the loops they replace
+"""
+
+from libra_py.workflows.nbra import qsh
+from libra_py import data_conv
+from libra_py import data_read
+from libra_py import data_stat
+from libra_py import units
+import numpy as np
+import pytest
+import math
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def sines_deviation_ref(A, theta, N):
+    """ The deviation of Sum_k A_k * sin(theta_k * r) over r = 0, ... , N-1, as in the loop of `compute_freqs` """
+    r = np.arange(N)
+    fu = np.sum( A[..., None] * np.sin( theta[..., None] * r ), axis=-2 )
+    fu_ave, fu2_ave = np.sum(fu, axis=-1), np.sum(fu*fu, axis=-1)
+    return np.sqrt( np.maximum( (fu2_ave - fu_ave**2) / N, 0.0) )
+
+
+def compute_qs_Hvib_ref(Nfreqs, freqs, t, re_ave, re_std, dw_re, up_re, im_ave, im_std, dw_im, up_im, dev):
+    """ Port of the element-by-element `compute_qs_Hvib`, on the np.arrays """
+    nstates = re_ave.shape[0]
+    H = np.zeros( (nstates, nstates), dtype=complex)
+
+    for i in range(nstates):
+        for j in range(nstates):
+            fu = 0.0
+            for k in range(min(Nfreqs, len(freqs[i][j]))):
+                fu += freqs[i][j][k][2] * math.sin(units.wavn2au * freqs[i][j][k][0] * t)
+
+            if i==j:
+                H[i,j] += min(max(re_ave[i,j] + re_std[i,j] * fu / dev[i][j], dw_re[i,j]), up_re[i,j])
+            elif i<j:
+                xab = min(max(im_ave[i,j] + im_std[i,j] * fu / dev[i][j], dw_im[i,j]), up_im[i,j])
+                H[i,j] += -1.0j * xab
+                H[j,i] += 1.0j * xab
+    return H
+
+
+
+
+def model_hvib(nsteps, nstates, seed):
+    """ The vibronic Hamiltonian with a few oscillating energies and couplings, and some noise """
+    rnd = np.random.default_rng(seed)
+    t = np.arange(nsteps)[:, None, None]
+    w = 0.05 + 0.3 * rnd.random( (1, nstates, nstates) )
+    x = 0.01 * np.cos(w * t) + 0.002 * rnd.normal(size=(nsteps, nstates, nstates))
+    e = 0.05 * np.arange(nstates)
+    H = np.zeros( (nsteps, nstates, nstates), dtype=complex)
+    H += np.diag(e) + np.eye(nstates) * x
+    up = np.triu(x, 1)
+    H += 1.0j * (up - np.swapaxes(up, 1, 2))
+    return [ data_conv.nparray2CMATRIX(H[n]) for n in range(nsteps) ]
+
+
+
+
+@pytest.mark.parametrize("N", [1, 7, 5000])
+def test_sines_deviation(N):
+    """Tests the closed-form deviation of the sums of sines against the point-by-point sums"""
+    rnd = np.random.default_rng(0)
+    A = rnd.random( (2, 2, 3) )
+    theta = 2.0 * rnd.random( (2, 2, 3) )
+    theta[0, 1, 0] = 0.0           # zero frequency
+    theta[1, 0, 2] = 2.0*math.pi   # aliased to zero
+
+    computed_result = qsh.sines_deviation(A, theta, N)
+    expected_result = sines_deviation_ref(A, theta, N)
+
+    assert computed_result.shape == (2, 2)
+    assert np.allclose(computed_result, expected_result, rtol=1e-8, atol=1e-10)
+
+
+
+
+def test_compute_qs_Hvib_batch():
+    """Tests the batched QSH Hamiltonians against the element-by-element ones"""
+    rnd = np.random.default_rng(1)
+    nstates, nfreqs = 3, 2
+    freqs = [ [ [ [ 1000.0 * rnd.random(), 0.0, rnd.random() ] for k in range(rnd.integers(1, 4)) ]
+                for j in range(nstates) ] for i in range(nstates) ]
+    re_ave, im_ave = rnd.normal(size=(nstates, nstates)), rnd.normal(size=(nstates, nstates))
+    re_std, im_std = rnd.random( (nstates, nstates) ), rnd.random( (nstates, nstates) )
+    dw_re, up_re = re_ave - 0.05, re_ave + 0.05    # some of the values are clipped
+    dw_im, up_im = im_ave - 0.05, im_ave + 0.05
+    dev = 0.5 + rnd.random( (nstates, nstates) )
+    stat = [ re_ave, re_std, dw_re, up_re, im_ave, im_std, dw_im, up_im ]
+
+    t = 41.0 * np.arange(50)
+    W, A = qsh.freqs2arrays(freqs, nfreqs)
+    computed_result = qsh.compute_qs_Hvib_batch(t, W, A, *stat, dev)
+    expected_result = np.array( [ compute_qs_Hvib_ref(nfreqs, freqs, x, *stat, dev) for x in t ] )
+
+    diag = computed_result[:, range(nstates), range(nstates)].real
+    assert np.any(diag == np.diag(up_re)) and np.any(diag == np.diag(dw_re))    # the clipping is covered
+    assert np.allclose(computed_result, expected_result, rtol=1e-12, atol=1e-14)
+
+    # The one-time wrapper
+    H = qsh.compute_qs_Hvib(nfreqs, freqs, t[7], *[ data_conv.nparray2MATRIX(x) for x in stat ], dev.tolist())
+    assert np.allclose(data_conv.MATRIX2nparray(H), expected_result[7], rtol=1e-12, atol=1e-14)
+
+
+
+
+def test_run(tmp_path):
+    """Tests the QSH trajectories generated in chunks against the step-by-step reference, and their HDF5 storage"""
+    nstates, nsteps, nfreqs, dt = 3, 23, 2, 41.0
+    H_vib = [ model_hvib(200, nstates, 2), model_hvib(200, nstates, 3) ]
+    paths = [ str(tmp_path / "QSH_0") + "/", str(tmp_path / "QSH_1") + "/" ]
+    for path in paths:
+        os.mkdir(path)
+
+    params = { "dt":dt, "nfreqs":nfreqs, "nsteps":nsteps, "wspan":3000.0, "dw":5.0, "do_output":False,
+               "output_set_paths":paths, "qsh_store_filename":"qsh.h5", "chunk_size":10 }
+    qsh_H_vib = qsh.run(H_vib, dict(params))
+
+    for idata in range(2):
+        # Reference: the statistics of the real and imaginary parts and the step-by-step QSH Hamiltonians
+        x = data_conv.matrices2nparray(H_vib[idata])
+        re = [ data_conv.MATRIX2nparray(m) for m in data_stat.mat_stat([ data_conv.nparray2MATRIX(y) for y in np.real(x) ]) ]
+        im = [ data_conv.MATRIX2nparray(m) for m in data_stat.mat_stat([ data_conv.nparray2MATRIX(y) for y in np.imag(x) ]) ]
+
+        params1 = dict(params)
+        params1["dt"] = dt * units.au2fs
+        freqs, dev = qsh.compute_freqs(H_vib[idata], params1)
+        assert np.all(np.array(dev) > 0.0)
+
+        expected_result = np.array( [ compute_qs_Hvib_ref(nfreqs, freqs, i*dt, *re, *im, dev) for i in range(nsteps) ] )
+
+        assert len(qsh_H_vib[idata]) == nsteps
+        computed_result = data_conv.matrices2nparray(qsh_H_vib[idata])
+        assert np.allclose(computed_result, expected_result, rtol=1e-10, atol=1e-14)
+
+    # The stored Hamiltonians are read back by the usual readers
+    stored = data_read.get_data_sets({ "data_set_paths":paths, "data_dim":nstates, "isnap":0, "fsnap":nsteps,
+                                       "data_re_prefix":"qsh_Hvib_", "data_im_prefix":"qsh_Hvib_",
+                                       "store_filename":"qsh.h5" })
+    for idata in range(2):
+        assert np.allclose(data_conv.matrices2nparray(stored[idata]), data_conv.matrices2nparray(qsh_H_vib[idata]),
+                           rtol=1e-14, atol=0.0)
+
@@ -0,0 +1,155 @@
+"""
+Unit and regression test for the concurrent step2 calculations (workflows/nbra/step2.run_pool and
+step2_dftb.run_step2_pool): the QE and DFTB+ executables are replaced by the small scripts that make
+the files the real programs would make
+"""
+
+from libra_py.workflows.nbra import step2
+from libra_py.workflows.nbra import step2_dftb
+from libra_py import data_conv
+import numpy as np
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+STUB = """
+import os
+import sys
+
+prog = sys.argv[1]
+
+if prog == "pw":
+    inp = sys.stdin.read()
+    if "fail" in inp:
+        sys.exit(1)
+    os.makedirs("x0.save", exist_ok=True)
+    with open("x0.save/data-file-schema.xml", "w") as f:
+        f.write(inp)
+    print("JOB DONE", inp)
+
+elif prog == "export":
+    os.makedirs("x0.export", exist_ok=True)
+    with open("x0.export/index.xml", "w") as f:
+        f.write(open("x0.save/data-file-schema.xml").read())
+
+elif prog == "dftb":
+    task = open("dftb_in.hsd").read().strip()
+    if task == "hs":
+        snap = open("x1.gen").read()
+        open("hamsqr1.dat", "w").write(snap)
+        open("oversqr.dat", "w").write(snap)
+    elif task == "ovlp":
+        open("oversqr.dat", "w").write(open("x2.gen").read())
+"""
+
+
+def write_stub(path):
+    filename = os.path.join(path, "stub.py")
+    with open(filename, "w") as f:
+        f.write(STUB)
+    return F"{sys.executable} {filename}"
+
+
+
+
+def qe_params(exe):
+    return { "EXE":F"{exe} pw", "EXE_EXPORT":F"{exe} export", "BATCH_SYSTEM":None, "NP":1,
+             "start_indx":0, "stop_indx":5, "nac_method":0, "pdos_flg":0, "rd":"res",
+             "nprocs":2, "threads_per_job":1, "scratch_dir":"scratch", "max_retries":1,
+             "keep_scratch":False, "verbosity":0, "pool_inputs":[] }
+
+
+def test_run_pool(tmp_path, monkeypatch):
+    """Tests that the pairs of snapshots are processed once both QE calculations are done, and that the
+    restarted calculation repeats only the failed snapshot and the pairs that need it"""
+    monkeypatch.chdir(tmp_path)
+    exe = write_stub(str(tmp_path))
+    os.mkdir("res")
+    for t in range(6):
+        with open(F"x0.scf.{t}.in", "w") as f:
+            f.write("fail" if t==3 else F"snapshot {t}")
+    with open("x0.exp.in", "w") as f:
+        f.write("export")
+
+    pairs = []
+    def model_process_pair(params, curr_index):
+        for name, t in [ ("curr0", curr_index), ("next0", curr_index+1) ]:
+            with open(os.path.join(params["wd"], name, "x0.export", "index.xml")) as f:
+                assert f.read() == F"snapshot {t}"
+        pairs.append(curr_index)
+    monkeypatch.setattr(step2, "process_pair", model_process_pair)
+
+    res = step2.run_pool(qe_params(exe))
+    assert res == [ "snap_3" ]
+    assert sorted(pairs) == [0, 1, 4]
+    for t in range(6):
+        assert os.path.isfile(F"res/x0_index_{t}.xml") == (t!=3)
+        assert os.path.isfile(F"res/x0.scf.{t}.out") == (t!=3)
+
+    # The fixed input: only the snapshot 3 is computed again
+    with open("x0.scf.3.in", "w") as f:
+        f.write("snapshot 3")
+    pairs.clear()
+
+    res = step2.run_pool(qe_params(exe))
+    assert res == []
+    assert sorted(pairs) == [2, 3]
+    assert os.path.isfile("res/x0_index_3.xml")
+    assert not os.path.isdir("scratch/snap_0")    # the processed calculations are removed
+
+
+
+
+def model_read_step(params, dirname):
+    """ The MOs, energies, and AO matrices that depend on the snapshot written by the stub DFTB+ """
+    snap = int(open(os.path.join(dirname, "hamsqr1.dat")).read())
+    c, s = np.cos(0.1*snap), np.sin(0.1*snap)
+    E = data_conv.nparray2CMATRIX(np.diag([ -0.1 + 0.01*snap, 0.2, 0.3 - 0.02*snap ]).astype(complex))
+    U = data_conv.nparray2CMATRIX(np.array([ [c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0] ], dtype=complex))
+    S = data_conv.nparray2CMATRIX(np.eye(3, dtype=complex) + 0.01*snap)
+    return E, U, [ S ], [ S ]
+
+
+def model_read_ovlp(dirname):
+    snap = int(open(os.path.join(dirname, "oversqr.dat")).read())
+    return data_conv.nparray2CMATRIX(np.eye(3, dtype=complex) * (1.0 - 0.01*snap) + 0.001j)
+
+
+def test_run_step2_pool(tmp_path, monkeypatch):
+    """Tests that the concurrent DFTB+ calculations give the same S, St, and hvib files as `run_step2`"""
+    monkeypatch.chdir(tmp_path)
+    exe = write_stub(str(tmp_path))
+    for name, task in [ ("dftb_in_ham1.hsd", "scf"), ("dftb_in_ham2.hsd", "hs"), ("dftb_in_overlaps.hsd", "ovlp") ]:
+        with open(name, "w") as f:
+            f.write(task)
+
+    def model_xyz_traj2gen_sp(md_file, gen_file, snap, syst_spec):
+        with open(gen_file, "w") as f:
+            f.write(str(snap))
+    def model_xyz_traj2gen_ovlp(md_file, gen_file, snap1, snap2, syst_spec):
+        with open(gen_file, "w") as f:
+            f.write(str(snap1))
+
+    monkeypatch.setattr(step2_dftb.DFTB_methods, "xyz_traj2gen_sp", model_xyz_traj2gen_sp)
+    monkeypatch.setattr(step2_dftb.DFTB_methods, "xyz_traj2gen_ovlp", model_xyz_traj2gen_ovlp)
+    monkeypatch.setattr(step2_dftb, "read_step", model_read_step)
+    monkeypatch.setattr(step2_dftb, "read_ovlp", model_read_ovlp)
+
+    params = { "EXE":F"{exe} dftb", "isnap":0, "fsnap":6, "dt":41.0 }
+    step2_dftb.run_step2(dict(params, out_dir="res_serial"))
+    step2_dftb.run_step2(dict(params, out_dir="res_pool", use_scheduler=True, nprocs=2))
+
+    for prefix in [ "S_", "St_", "hvib_" ]:
+        for i in range(4):
+            for part in [ "re", "im" ]:
+                expected_result = np.loadtxt(F"res_serial/{prefix}{i}_{part}")
+                assert np.array_equal(np.loadtxt(F"res_pool/{prefix}{i}_{part}"), expected_result)
+        assert not os.path.isfile(F"res_pool/{prefix}4_re")
@@ -0,0 +1,101 @@
+"""
+Unit and regression test for the workflows/nbra/step3 module in the Libra package
+"""
+
+from libra_py.workflows.nbra import step3
+from libra_py import data_conv
+import numpy as np
+import pytest
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def generate_data(ndata, nsteps, norbs=2):
+    """
+    This function generates the model KS data: the overlaps, the time-overlaps close to the identity,
+    and the diagonal orbital energies, all in the spin-orbital (2*norbs x 2*norbs) form
+    """
+    rnd = np.random.default_rng(7)
+    n = 2 * norbs
+
+    S, St, E = [], [], []
+    for idata in range(ndata):
+        S.append([]); St.append([]); E.append([])
+        for istep in range(nsteps):
+            a = 0.05 * (rnd.normal(size=(n, n)) + 1j * rnd.normal(size=(n, n)))
+            u, s, vh = np.linalg.svd(np.identity(n) + a)
+
+            e = np.diag( np.array([ -0.2, 0.1 ] * 2) + 0.01 * np.sin(0.3 * istep + idata) )
+
+            S[idata].append( data_conv.nparray2CMATRIX( np.identity(n, dtype=complex) ) )
+            St[idata].append( data_conv.nparray2CMATRIX( u @ vh ) )
+            E[idata].append( data_conv.nparray2CMATRIX( e.astype(complex) ) )
+
+    return S, St, E
+
+
+
+
+def generate_params(path):
+    """
+    The parameters of `step3.run` as used before the parallel version - no "nprocs", "chunk_size", and "restart"
+    """
+    params = { "SD_basis": [ [ 1,-3 ], [ 1,-4 ], [ 2,-3 ] ],
+               "SD_energy_corr": [ 0.0, 0.0, 0.0 ],
+               "CI_basis": [ [1.0, 0.0, 0.0], [0.0, 1.0, 1.0], [0.0, 1.0, -1.0] ],
+               "output_set_paths": [ os.path.join(path, "") ],
+               "dt": 41.0,
+               "do_orthogonalization": 0, "do_state_reordering": 0, "do_phase_correction": 0
+             }
+    return params
+
+
+
+
+def reference_hvib(S, St, E, params):
+    """The Hvib matrices computed step by step, with the same functions `step3.run` uses"""
+    res = []
+    for i in range(len(St)):
+        hvib_sd = step3.compute_Hvib(params["SD_basis"], St[i], E[i], params["SD_energy_corr"], params["dt"])
+        SD2CI = step3.sac_matrices(params["CI_basis"], params["SD_basis"], S[i])
+        res.append( data_conv.nparray_view(SD2CI.H() * hvib_sd * SD2CI).copy() )
+    return np.array(res)
+
+
+
+
+def test_run_default_params(tmp_path):
+    """Tests that `step3.run` works with the parameters that don't define the parallelization options"""
+    S, St, E = generate_data(1, 7)
+    params = generate_params(str(tmp_path))
+
+    expected_result = reference_hvib(S[0], St[0], E[0], params)
+    computed_result = step3.run(S, St, E, params)
+
+    assert len(computed_result) == 1 and len(computed_result[0]) == 7
+    assert np.allclose( data_conv.matrices2nparray(computed_result[0]), expected_result, atol=1e-12 )
+
+
+
+
+def test_run_chunks_restart(tmp_path):
+    """Tests that the chunked and restarted `step3.run` gives the same Hvib as the serial one"""
+    S, St, E = generate_data(1, 7)
+    params = generate_params(str(tmp_path))
+    expected_result = reference_hvib(S[0], St[0], E[0], params)
+
+    params.update({ "nprocs": 2, "chunk_size": 3, "do_output": 2 })
+    computed_result = step3.run(S, St, E, dict(params))
+    assert np.allclose( data_conv.matrices2nparray(computed_result[0]), expected_result, atol=1e-12 )
+
+    params["restart"] = True
+    computed_result = step3.run(S, St, E, dict(params))
+    assert np.allclose( data_conv.matrices2nparray(computed_result[0]), expected_result, atol=1e-12 )
+
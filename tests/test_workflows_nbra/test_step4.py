@@ -0,0 +1,130 @@
+"""
+Unit and regression test for the workflows/nbra/step4 module in the Libra package
+"""
+
+from libra_py.workflows.nbra import step4
+from libra_py import data_conv
+from libra_py import units
+import libra_py.tsh as tsh
+import numpy as np
+import pytest
+import math
+import sys
+import os
+
+if sys.platform=="cygwin":
+    from cyglibra_core import *
+elif sys.platform=="linux" or sys.platform=="linux2":
+    from liblibra_core import *
+
+
+
+
+def random_hvib(ndata, nsteps, nstates, rnd):
+    """The diagonal vibronic Hamiltonians with random energies"""
+    return [ [ data_conv.nparray2CMATRIX( np.diag(0.01 * rnd.normal(size=nstates)).astype(complex) ) for n in range(nsteps) ]
+             for idata in range(ndata) ]
+
+
+
+
+def test_traj_statistics2_batch():
+    """Tests that the vectorized ensemble averages are the same as those of `traj_statistics2`"""
+    rnd = np.random.default_rng(0)
+    ndata, nstates, ntraj, i = 2, 3, 5, 2
+    itimes = [0, 3]
+    Hvib = random_hvib(ndata, 10, nstates, rnd)
+
+    Ntraj = ndata * len(itimes) * ntraj
+    pop = rnd.random( (Ntraj, nstates) )
+    pop = pop / np.sum(pop, axis=1)[:, None]
+    istate = rnd.integers(0, nstates, Ntraj)
+
+    E = np.array( [ [ Hvib[idata][it+i].get(j,j).real for j in range(nstates) ] for idata in range(ndata) for it in itimes ] )
+
+    Pop = [ data_conv.nparray2CMATRIX( pop[Tr].reshape(nstates, 1).astype(complex) ) for Tr in range(Ntraj) ]
+    expected_result = data_conv.MATRIX2nparray( step4.traj_statistics2(i, Pop, list(istate), Hvib, itimes) )
+    computed_result = data_conv.MATRIX2nparray( step4.traj_statistics2_batch(E, pop, istate) )
+
+    assert np.allclose(computed_result, expected_result, rtol=1e-12, atol=1e-14)
+
+
+
+
+
+def hopping_ref(c, H, istate, sh_method, do_collapse, ksi, ksi2, dt, T, boltz_opt):
+    """
+    One-trajectory port of `tsh.hopping`: the `hopping_probabilities_mssh` or `hopping_probabilities_fssh`
+    row of the active state, `hop`, and `tsh.ida_py`
+    """
+    nstates = len(c)
+    E = np.real(np.diag(H))
+
+    if sh_method==0:
+        g = np.abs(c)**2 / np.sum(np.abs(c)**2)
+    else:
+        dm = np.outer(c, np.conj(c))
+        a_ii = dm[istate, istate].real
+        g = np.zeros(nstates)
+        for j in range(nstates):
+            if j!=istate and a_ii >= 1e-8:
+                g[j] = dt * np.imag( dm[istate, j] * H[j, istate] - H[istate, j] * dm[j, istate] ) / a_ii
+
+    # Only the FSSH probabilities are scaled: the Boltzmann block of `hopping_probabilities_mssh` never
+    # changes g, so the MSSH hops up in energy are only subject to the `ida_py` acceptance
+    if sh_method==1:
+        for j in range(nstates):
+            if boltz_opt and E[j] > E[istate]:
+                g[j] *= math.exp( -(E[j] - E[istate]) / (units.kB * T) )
+
+        g = np.maximum(g, 0.0)
+        g[istate] = 1.0 - (np.sum(g) - g[istate])
+
+    new_st, right = istate, 0.0
+    nrm = np.sum(g)
+    if nrm > 0.0:
+        for j in range(nstates):
+            left, right = right, right + g[j] / nrm
+            if left <= ksi <= right:
+                new_st = j
+
+    res = new_st
+    if new_st != istate and E[new_st] > E[istate]:
+        res = new_st if ksi2 < tsh.boltz_factor(E[new_st], E[istate], T, boltz_opt) else istate
+        if do_collapse:
+            c = np.zeros(nstates, dtype=complex)
+            c[res] = 1.0
+    return res, c
+
+
+
+
+@pytest.mark.parametrize("sh_method", [0, 1])
+@pytest.mark.parametrize("boltz_opt", [0, 1, 2, 3])
+@pytest.mark.parametrize("do_collapse", [0, 1])
+def test_hopping_batch(sh_method, boltz_opt, do_collapse):
+    """Tests the vectorized hops against the one-trajectory-at-a-time reference, for both TSH methods and all acceptance criteria"""
+    rnd = np.random.default_rng(10 + boltz_opt)
+    nham, nstates, ntraj, dt, T = 3, 4, 400, 41.0, 300.0
+
+    H = np.zeros( (nham, nstates, nstates), dtype=complex)
+    for n in range(nham):
+        H[n] = np.diag( 0.002 * rnd.random(nstates) )
+        nac = 0.005 * rnd.normal(size=(nstates, nstates))
+        H[n] += -1.0j * (nac - nac.T)
+
+    C = rnd.normal(size=(ntraj, nstates)) + 1.0j * rnd.normal(size=(ntraj, nstates))
+    C = C / np.linalg.norm(C, axis=1)[:, None]
+    grp = rnd.integers(0, nham, ntraj)
+    istate = rnd.integers(0, nstates, ntraj)
+    ksi, ksi2 = rnd.random(ntraj), rnd.random(ntraj)
+
+    expected = [ hopping_ref(C[Tr], H[grp[Tr]], istate[Tr], sh_method, do_collapse, ksi[Tr], ksi2[Tr], dt, T, boltz_opt) for Tr in range(ntraj) ]
+
+    C1 = np.array(C)
+    computed_result = step4.hopping_batch(C1, H, grp, istate, sh_method, do_collapse, ksi, ksi2, dt, T, boltz_opt)
+
+    assert np.array_equal(computed_result, np.array([ x[0] for x in expected ]))
+    assert np.allclose(C1, np.array([ x[1] for x in expected ]), rtol=1e-12, atol=1e-14)
+    assert np.sum(computed_result != istate) > 10    # enough hops to make the comparison meaningful
+